@@ -3,6 +3,7 @@ Citas Microservice
 """
 import sys
 import os
+import threading
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from flask import Flask
@@ -13,6 +14,9 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from routes import citas_bp
+from schedule_index import schedule_index
+from calendar_outbox import calendar_sync, CALENDAR_SYNC_INTERVAL
+from calendar_pull import calendar_pull, CALENDAR_PULL_INTERVAL
 
 # Create Flask app
 app = Flask(__name__)
@@ -23,6 +27,22 @@ CORS(app, origins=os.getenv('CORS_ORIGINS', '*').split(','))
 # Register blueprints
 app.register_blueprint(citas_bp, url_prefix='/api/citas')
 
+# Schedule index: drop doctors changed by other workers (LISTEN appointments_changed)
+if schedule_index.enabled:
+    threading.Thread(target=schedule_index.listen, name='schedule-index', daemon=True).start()
+
+# Google Calendar: drain calendar_sync_outbox (0 disables it)
+if CALENDAR_SYNC_INTERVAL > 0:
+    threading.Thread(
+        target=calendar_sync.run, args=(CALENDAR_SYNC_INTERVAL,), name='calendar-sync', daemon=True
+    ).start()
+
+# Google Calendar: bring the doctors' calendar changes back to appointments (0 disables it)
+if CALENDAR_PULL_INTERVAL > 0:
+    threading.Thread(
+        target=calendar_pull.run, args=(CALENDAR_PULL_INTERVAL,), name='calendar-pull', daemon=True
+    ).start()
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
@@ -0,0 +1,185 @@
+"""
+Doctor availability (pure validation logic)
+Working hours, slot sizes and free-slot search parameters; the interval queries live
+in AppointmentModel (appointments.time_range, see add_appointment_availability.sql)
+"""
+import os
+from datetime import date, datetime, time, timedelta
+
+# Default slot grid and allowed appointment lengths (minutes)
+SLOT_MINUTES = int(os.getenv('CITAS_SLOT_MINUTES', 30))
+MIN_DURATION_MINUTES = int(os.getenv('CITAS_MIN_DURATION_MINUTES', 15))
+MAX_DURATION_MINUTES = int(os.getenv('CITAS_MAX_DURATION_MINUTES', 120))
+
+# Longest date range and most slots returned by one free-slot search
+MAX_SEARCH_DAYS = int(os.getenv('CITAS_SLOT_SEARCH_DAYS', 31))
+SLOT_SEARCH_LIMIT = int(os.getenv('CITAS_SLOT_SEARCH_LIMIT', 500))
+
+# Most appointments created by one bulk/recurring booking
+BULK_BOOKING_LIMIT = int(os.getenv('CITAS_BULK_BOOKING_LIMIT', 52))
+
+# Opening hours per ISO weekday (1 = Monday): "days=HH:MM-HH:MM,...;days=..."
+DEFAULT_WORKING_HOURS = '1-5=09:00-13:00,15:00-19:00;6=09:00-13:00'
+
+
+def parse_working_hours(spec):
+    """
+    Parse an opening-hours spec such as "1-5=09:00-13:00,15:00-19:00;6=09:00-13:00"
+
+    Returns:
+        Sorted list of (isodow, opens, closes) tuples
+    """
+    windows = set()
+    for part in filter(None, (chunk.strip() for chunk in spec.split(';'))):
+        try:
+            days, ranges = part.split('=')
+            first, _, last = days.partition('-')
+            weekdays = range(int(first), int(last or first) + 1)
+            for hours in ranges.split(','):
+                opens, closes = (time.fromisoformat(value.strip()) for value in hours.split('-'))
+                if opens >= closes:
+                    raise ValueError
+                windows.update((weekday, opens, closes) for weekday in weekdays)
+        except ValueError:
+            raise ValueError(f'Invalid working hours: {part}') from None
+        if not weekdays or weekdays[0] < 1 or weekdays[-1] > 7:
+            raise ValueError(f'Invalid working hours: {part}')
+    return sorted(windows)
+
+
+WORKING_HOURS = parse_working_hours(os.getenv('CITAS_WORKING_HOURS', DEFAULT_WORKING_HOURS))
+
+
+def parse_datetime(value, field):
+    """ISO 8601 datetime (a trailing Z is accepted)"""
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f'{field} must be an ISO 8601 datetime') from None
+
+
+def parse_date(value, field):
+    try:
+        return date.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError(f'{field} must be a date (YYYY-MM-DD)') from None
+
+
+def _bounded_int(value, field, minimum, maximum):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} must be an integer') from None
+    if not minimum <= number <= maximum:
+        raise ValueError(f'{field} must be between {minimum} and {maximum}')
+    return number
+
+
+def parse_doctor_ids(value):
+    """Comma separated doctor ids ("2,5,7"); None when not given (all active doctors)"""
+    if value is None or str(value).strip() == '':
+        return None
+    try:
+        doctor_ids = sorted({int(item) for item in str(value).split(',') if item.strip()})
+    except ValueError:
+        raise ValueError('doctor_ids must be a comma separated list of integers') from None
+    if not doctor_ids or doctor_ids[0] <= 0:
+        raise ValueError('doctor_ids must be a comma separated list of integers')
+    return doctor_ids
+
+
+def validate_time_range(start_time, end_time):
+    """An appointment must end after it starts and last between the allowed minutes"""
+    if start_time >= end_time:
+        raise ValueError('end_time must be after start_time')
+    minutes = (end_time - start_time).total_seconds() / 60
+    if not MIN_DURATION_MINUTES <= minutes <= MAX_DURATION_MINUTES:
+        raise ValueError(
+            f'Appointments must last between {MIN_DURATION_MINUTES} and {MAX_DURATION_MINUTES} minutes'
+        )
+
+
+def slot_search(args, today=None):
+    """
+    Validate free-slot search parameters (query string values)
+
+    Accepts doctor_ids, date_from, date_to (default: date_from), duration and step
+    (minutes, default: SLOT_MINUTES) and limit.
+
+    Returns:
+        Dict with doctor_ids, date_from, date_to, duration, step and limit
+    """
+    today = today or date.today()
+    date_from = parse_date(args['date_from'], 'date_from') if args.get('date_from') else today
+    date_to = parse_date(args['date_to'], 'date_to') if args.get('date_to') else date_from
+    if date_to < date_from:
+        raise ValueError('date_to must not be before date_from')
+    if (date_to - date_from).days >= MAX_SEARCH_DAYS:
+        raise ValueError(f'The date range cannot exceed {MAX_SEARCH_DAYS} days')
+
+    duration = _bounded_int(args.get('duration', SLOT_MINUTES), 'duration',
+                            MIN_DURATION_MINUTES, MAX_DURATION_MINUTES)
+    step = _bounded_int(args.get('step', SLOT_MINUTES), 'step', 5, MAX_DURATION_MINUTES)
+
+    return {
+        'doctor_ids': parse_doctor_ids(args.get('doctor_ids')),
+        'date_from': date_from,
+        'date_to': date_to,
+        'duration': timedelta(minutes=duration),
+        'step': timedelta(minutes=step),
+        'limit': _bounded_int(args.get('limit', SLOT_SEARCH_LIMIT), 'limit', 1, SLOT_SEARCH_LIMIT),
+    }
+
+
+def booking_slots(data, sessions=None):
+    """
+    Expand a bulk booking request into its [start, end) slots
+
+    Either "slots": [{"start_time", "end_time"}, ...] or "recurrence": {"start_time",
+    "end_time" (first session), "count", "every_days" (default 7)}. `sessions` is the
+    count used when the recurrence has none (number_of_sessions of a treatment plan).
+
+    Returns:
+        List of (start_time, end_time) tuples, in request order
+
+    Raises:
+        ValueError: Invalid slot, too many slots or slots overlapping each other
+    """
+    if data.get('slots') is not None:
+        if not isinstance(data['slots'], list) or not data['slots']:
+            raise ValueError('slots must be a non-empty list')
+        slots = []
+        for index, slot in enumerate(data['slots']):
+            if not isinstance(slot, dict) or 'start_time' not in slot or 'end_time' not in slot:
+                raise ValueError(f'slots[{index}] needs start_time and end_time')
+            slots.append((parse_datetime(slot['start_time'], f'slots[{index}].start_time'),
+                          parse_datetime(slot['end_time'], f'slots[{index}].end_time')))
+    elif isinstance(data.get('recurrence'), dict):
+        recurrence = data['recurrence']
+        if 'start_time' not in recurrence or 'end_time' not in recurrence:
+            raise ValueError('recurrence needs start_time and end_time')
+        start_time = parse_datetime(recurrence['start_time'], 'recurrence.start_time')
+        end_time = parse_datetime(recurrence['end_time'], 'recurrence.end_time')
+        count = _bounded_int(recurrence.get('count', sessions), 'recurrence.count', 1, BULK_BOOKING_LIMIT)
+        every = timedelta(days=_bounded_int(recurrence.get('every_days', 7), 'recurrence.every_days', 1, 365))
+        slots = [(start_time + every * n, end_time + every * n) for n in range(count)]
+    else:
+        raise ValueError('slots or recurrence is required')
+
+    if len(slots) > BULK_BOOKING_LIMIT:
+        raise ValueError(f'A bulk booking cannot exceed {BULK_BOOKING_LIMIT} appointments')
+
+    for index, (start_time, end_time) in enumerate(slots):
+        try:
+            validate_time_range(start_time, end_time)
+        except ValueError as e:
+            raise ValueError(f'slots[{index}]: {str(e)}') from None
+
+    try:
+        ordered = sorted(range(len(slots)), key=lambda index: slots[index])
+    except TypeError:
+        raise ValueError('slots cannot mix datetimes with and without time zone') from None
+    for previous, index in zip(ordered, ordered[1:], strict=False):
+        if slots[index][0] < slots[previous][1]:
+            raise ValueError(f'slots[{min(previous, index)}] and slots[{max(previous, index)}] overlap')
+    return slots
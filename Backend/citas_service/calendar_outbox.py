@@ -0,0 +1,351 @@
+"""
+Google Calendar sync worker (Citas Service)
+Drains calendar_sync_outbox, filled in the same transaction as every appointment write
+(see add_calendar_sync_outbox.sql), so requests never wait on Google.
+
+Each batch reads its appointments in one query, syncs the doctors' calendars in parallel
+over keep-alive connections and stores every result in one transaction. Access tokens
+are cached per doctor until shortly before they expire; failed calls are retried with
+exponential backoff and an appointment's changes always reach the calendar in order.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote
+
+import requests
+from models import CalendarSyncOutboxModel
+
+GOOGLE_CALENDAR_API_URL = os.getenv('GOOGLE_CALENDAR_API_URL', 'https://www.googleapis.com/calendar/v3')
+GOOGLE_CALENDAR_TIMEZONE = os.getenv('GOOGLE_CALENDAR_TIMEZONE', 'America/Guayaquil')
+
+# Seconds between drains (0 disables the worker), rows per batch and doctors synced in parallel
+CALENDAR_SYNC_INTERVAL = int(os.getenv('CITAS_CALENDAR_SYNC_INTERVAL', 5))
+CALENDAR_SYNC_BATCH_SIZE = int(os.getenv('CITAS_CALENDAR_SYNC_BATCH_SIZE', 100))
+CALENDAR_SYNC_WORKERS = int(os.getenv('CITAS_CALENDAR_SYNC_WORKERS', 4))
+# Attempts before a row is FAILED; retry n waits BACKOFF * 2^(n - 1) seconds, at most an hour
+CALENDAR_SYNC_MAX_ATTEMPTS = int(os.getenv('CITAS_CALENDAR_SYNC_MAX_ATTEMPTS', 8))
+CALENDAR_SYNC_BACKOFF = int(os.getenv('CITAS_CALENDAR_SYNC_BACKOFF', 30))
+MAX_BACKOFF_SECONDS = 3600
+# Claimed rows stay invisible to other drains for this long (a crashed worker)
+CALENDAR_SYNC_LEASE = int(os.getenv('CITAS_CALENDAR_SYNC_LEASE', 120))
+
+# Seconds a token without expiry is kept, and a "not connected" answer
+TOKEN_TTL = 3000
+NOT_CONNECTED_TTL = 300
+
+# Outcome of each row -> calendar_sync_outbox.status
+OUTCOME_STATUS = {
+    'synced': 'DONE',
+    'deleted': 'DONE',
+    'superseded': 'DONE',
+    'skipped': 'SKIPPED',
+    'retried': 'PENDING',
+    'failed': 'FAILED',
+}
+
+
+class CalendarAPIError(Exception):
+    """Error response (or no response: status None) from the Calendar API"""
+
+    def __init__(self, status, message):
+        super().__init__(f"{status or 'Connection error'}: {message}")
+        self.status = status
+
+    @property
+    def retryable(self):
+        return self.status is None or self.status in (401, 408, 429) or self.status >= 500
+
+    @property
+    def gone(self):
+        return self.status in (404, 410)
+
+
+class GoogleCalendarClient:
+    """Events of the doctors' primary calendars (REST, one keep-alive session per thread)"""
+
+    def __init__(self, base_url=GOOGLE_CALENDAR_API_URL, timeout=10):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _request(self, method, path, token, **kwargs):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        try:
+            response = session.request(
+                method, f"{self.base_url}{path}", timeout=self.timeout,
+                headers={'Authorization': f'Bearer {token}'}, **kwargs
+            )
+        except requests.exceptions.RequestException as e:
+            raise CalendarAPIError(None, str(e)) from e
+        if response.status_code >= 400:
+            raise CalendarAPIError(response.status_code, response.text[:300])
+        return response.json() if response.content else None
+
+    def insert_event(self, token, event):
+        return self._request('POST', '/calendars/primary/events', token,
+                             params={'sendUpdates': 'all'}, json=event)
+
+    def patch_event(self, token, event_id, event):
+        return self._request('PATCH', f'/calendars/primary/events/{quote(event_id, safe="")}', token,
+                             params={'sendUpdates': 'all'}, json=event)
+
+    def delete_event(self, token, event_id):
+        self._request('DELETE', f'/calendars/primary/events/{quote(event_id, safe="")}', token,
+                      params={'sendUpdates': 'all'})
+
+    def list_events(self, token, sync_token=None, page_token=None, max_results=250):
+        """
+        One page of events, deleted ones included: those changed since `sync_token`, or
+        the whole calendar without it. The last page carries nextSyncToken.
+        """
+        params = {'showDeleted': 'true', 'maxResults': max_results}
+        if sync_token:
+            params['syncToken'] = sync_token
+        if page_token:
+            params['pageToken'] = page_token
+        return self._request('GET', '/calendars/primary/events', token, params=params)
+
+
+def google_token_provider(doctor_id):
+    """(token, expiry) from the doctor's stored Google credentials, or None if not connected"""
+    from common.google_calendar import GoogleCalendarService
+    return GoogleCalendarService(doctor_id).get_access_token()
+
+
+class TokenCache:
+    """
+    Access token per doctor, kept until a minute before it expires (None: not connected)
+
+    A provider error (unreadable credentials) is raised as a retryable CalendarAPIError.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def get(self, doctor_id):
+        entry = self._tokens.get(doctor_id)
+        if entry and time.monotonic() < entry[1]:
+            return entry[0]
+
+        try:
+            result = self.provider(doctor_id)
+        except Exception as e:
+            raise CalendarAPIError(None, f"Cannot load credentials: {str(e)}") from e
+        with self._lock:
+            self.loads += 1
+        if result is None:
+            token, ttl = None, NOT_CONNECTED_TTL
+        else:
+            token, expiry = result
+            ttl = (expiry - datetime.utcnow()).total_seconds() - 60 if expiry else TOKEN_TTL
+        self._tokens[doctor_id] = (token, time.monotonic() + ttl)
+        return token
+
+    def invalidate(self, doctor_id):
+        self._tokens.pop(doctor_id, None)
+
+
+def appointment_event(appointment):
+    """Calendar event of an appointment (same content as sync_appointment_to_calendar)"""
+    patient_name = appointment.get('patient_name') or 'Sin paciente'
+    event = {
+        'summary': f"Cita: {patient_name}",
+        'description': (
+            f"Paciente: {patient_name}\n"
+            f"Doctor: {appointment.get('doctor_name')}\n"
+            f"Motivo: {appointment.get('reason') or 'No especificado'}\n"
+            f"ID de Cita: #{appointment['appointment_id']}"
+        ),
+        'start': {'dateTime': appointment['start_time'].isoformat(), 'timeZone': GOOGLE_CALENDAR_TIMEZONE},
+        'end': {'dateTime': appointment['end_time'].isoformat(), 'timeZone': GOOGLE_CALENDAR_TIMEZONE},
+        'reminders': {
+            'useDefault': False,
+            'overrides': [
+                {'method': 'email', 'minutes': 24 * 60},
+                {'method': 'popup', 'minutes': 60},
+                {'method': 'popup', 'minutes': 10},
+            ],
+        },
+        # Lets calendar changes be traced back to the appointment
+        'extendedProperties': {'private': {'appointment_id': str(appointment['appointment_id'])}},
+    }
+    if appointment.get('patient_email'):
+        event['attendees'] = [{'email': appointment['patient_email']}]
+    return event
+
+
+class CalendarSyncWorker:
+    """Drains calendar_sync_outbox (one per process, see `calendar_sync`)"""
+
+    def __init__(self, client=None, token_provider=None, batch_size=CALENDAR_SYNC_BATCH_SIZE,
+                 workers=CALENDAR_SYNC_WORKERS, max_attempts=CALENDAR_SYNC_MAX_ATTEMPTS,
+                 backoff=CALENDAR_SYNC_BACKOFF, lease_seconds=CALENDAR_SYNC_LEASE):
+        self.client = client or GoogleCalendarClient()
+        self.tokens = TokenCache(token_provider or google_token_provider)
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease_seconds = lease_seconds
+        self.last_drain = None
+        self._wake = threading.Event()
+        self._pool = None
+
+    def wake(self):
+        """Drain now instead of at the next interval (called after appointment writes)"""
+        self._wake.set()
+
+    def run(self, interval=CALENDAR_SYNC_INTERVAL, stop=None):
+        """Drain every `interval` seconds or when woken, until `stop` (threading.Event) is set"""
+        while not (stop and stop.is_set()):
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                metrics = self.drain()
+                if metrics['batches']:
+                    print(f"Calendar sync: {metrics}")
+            except Exception as e:
+                print(f"Calendar sync error: {str(e)}")
+
+    def drain(self, max_batches=None):
+        """
+        Sync due outbox rows in batches until none is left
+
+        Returns:
+            Dict with batches, the rows per outcome (synced, deleted, superseded, skipped,
+            retried, failed) and seconds
+        """
+        started = time.monotonic()
+        metrics = dict.fromkeys(['batches', *OUTCOME_STATUS], 0)
+        while max_batches is None or metrics['batches'] < max_batches:
+            rows = CalendarSyncOutboxModel.claim(self.batch_size, self.lease_seconds)
+            if not rows:
+                break
+            metrics['batches'] += 1
+
+            results, event_ids = self._process(rows)
+            CalendarSyncOutboxModel.complete(results, event_ids)
+            for result in results:
+                metrics[result['outcome']] += 1
+
+        metrics['seconds'] = round(time.monotonic() - started, 3)
+        self.last_drain = dict(metrics, finished_at=datetime.now().isoformat(timespec='seconds'))
+        return metrics
+
+    def _process(self, rows):
+        """Sync one claimed batch; returns (results, event id changes for complete())"""
+        appointments = CalendarSyncOutboxModel.get_appointments({row['appointment_id'] for row in rows})
+        # Only the last UPSERT of an appointment is sent: it carries its current data
+        latest = {row['appointment_id']: row['outbox_id'] for row in rows if row['operation'] == 'UPSERT'}
+
+        by_doctor = {}
+        for row in rows:
+            by_doctor.setdefault(row['doctor_id'], []).append(row)
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='calendar-sync')
+        outcomes = self._pool.map(
+            lambda item: self._sync_doctor(item[0], item[1], appointments, latest), by_doctor.items()
+        )
+
+        results, event_ids = [], {}
+        for doctor_results, doctor_events in outcomes:
+            results.extend(doctor_results)
+            event_ids.update(doctor_events)
+        changes = [
+            (appointment_id, appointments[appointment_id]['google_event_id'], event_id)
+            for appointment_id, event_id in event_ids.items()
+            if event_id != appointments[appointment_id]['google_event_id']
+        ]
+        return results, changes
+
+    def _sync_doctor(self, doctor_id, rows, appointments, latest):
+        """Rows of one doctor, in order; stops at the first error worth retrying"""
+        results = []
+        events = {}     # appointment_id -> event in this doctor's calendar after each row
+        token, loaded = None, False
+        for position, row in enumerate(rows):
+            result = {'outbox_id': row['outbox_id']}
+            results.append(result)
+            appointment = appointments.get(row['appointment_id'])
+            try:
+                if not loaded:
+                    token, loaded = self.tokens.get(doctor_id), True
+                if token is None:
+                    result.update(outcome='skipped', last_error='Google Calendar not connected')
+                    continue
+                try:
+                    result['outcome'] = self._sync_row(row, appointment, token, events, latest)
+                except CalendarAPIError as e:
+                    if e.status != 401:
+                        raise
+                    # Revoked or expired early: once more with fresh credentials
+                    self.tokens.invalidate(doctor_id)
+                    token = self.tokens.get(doctor_id)
+                    if token is None:
+                        raise
+                    result['outcome'] = self._sync_row(row, appointment, token, events, latest)
+            except CalendarAPIError as e:
+                if not e.retryable or row['attempts'] >= self.max_attempts:
+                    result.update(outcome='failed', last_error=str(e))
+                    continue
+                # The calendar is down or throttling: the doctor's other rows wait too
+                retry_in = min(MAX_BACKOFF_SECONDS, self.backoff * 2 ** (row['attempts'] - 1))
+                result.update(outcome='retried', last_error=str(e), retry_in=retry_in)
+                results.extend(
+                    {'outbox_id': deferred['outbox_id'], 'outcome': 'retried', 'retry_in': retry_in,
+                     'attempted': False, 'last_error': f"Deferred: {e}"}
+                    for deferred in rows[position + 1:]
+                )
+                break
+
+        for result in results:
+            result['status'] = OUTCOME_STATUS[result['outcome']]
+        return results, {
+            appointment_id: event_id for appointment_id, event_id in events.items()
+            if appointment_id in appointments
+        }
+
+    def _sync_row(self, row, appointment, token, events, latest):
+        appointment_id = row['appointment_id']
+        # The appointment still belongs to this doctor (not moved or deleted since)
+        owned = appointment is not None and appointment['doctor_id'] == row['doctor_id']
+        current = events.get(appointment_id, appointment['google_event_id'] if owned else None)
+
+        if row['operation'] == 'DELETE':
+            event_id = row['google_event_id'] or current
+            if event_id:
+                try:
+                    self.client.delete_event(token, event_id)
+                except CalendarAPIError as e:
+                    if not e.gone:
+                        raise
+                if owned and event_id == current:
+                    events[appointment_id] = None
+            return 'deleted'
+
+        if latest.get(appointment_id) != row['outbox_id'] or not owned or appointment['status'] == 'CANCELLED':
+            return 'superseded'
+
+        event = appointment_event(appointment)
+        if current:
+            try:
+                self.client.patch_event(token, current, event)
+                return 'synced'
+            except CalendarAPIError as e:
+                # Deleted in Google Calendar: create it again
+                if not e.gone:
+                    raise
+        events[appointment_id] = self.client.insert_event(token, event)['id']
+        return 'synced'
+
+
+calendar_sync = CalendarSyncWorker()
@@ -0,0 +1,182 @@
+"""
+Google Calendar incremental pull (Citas Service)
+Brings changes made in the doctors' calendars back to their appointments.
+
+Each doctor's calendar is read with Google's sync tokens: after one full read, a pull
+only lists the events changed since the previous one, so its cost follows the number of
+changes, not the size of the calendar. Every page is applied to appointments in a few
+set-based statements, in the same transaction that stores the cursor
+(calendar_sync_state), so an interrupted pull resumes at the page where it stopped.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from calendar_outbox import GOOGLE_CALENDAR_TIMEZONE, CalendarAPIError, calendar_sync
+from models import CalendarSyncStateModel
+
+# Seconds between pulls (0 disables them), events per page and doctors pulled in parallel
+CALENDAR_PULL_INTERVAL = int(os.getenv('CITAS_CALENDAR_PULL_INTERVAL', 60))
+CALENDAR_PULL_PAGE_SIZE = int(os.getenv('CITAS_CALENDAR_PULL_PAGE_SIZE', 250))
+CALENDAR_PULL_WORKERS = int(os.getenv('CITAS_CALENDAR_PULL_WORKERS', 4))
+# A doctor's cursor stays invisible to other pulls for this long (a crashed worker)
+CALENDAR_PULL_LEASE = int(os.getenv('CITAS_CALENDAR_PULL_LEASE', 300))
+
+LOCAL_TIMEZONE = ZoneInfo(GOOGLE_CALENDAR_TIMEZONE)
+
+
+def _local_time(moment):
+    """Event start or end as a naive local datetime (how appointments store it)"""
+    value = datetime.fromisoformat(moment['dateTime'].replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        zone = moment.get('timeZone') or GOOGLE_CALENDAR_TIMEZONE
+        if zone == GOOGLE_CALENDAR_TIMEZONE:
+            return value
+        value = value.replace(tzinfo=ZoneInfo(zone))
+    return value.astimezone(LOCAL_TIMEZONE).replace(tzinfo=None)
+
+
+def event_change(event):
+    """
+    What a listed event means for its appointment, or None if nothing
+
+    Returns:
+        Dict with event_id and cancelled, plus start_time and end_time if it was not
+        cancelled; None for all-day events, which no appointment has
+    """
+    if event.get('status') == 'cancelled':
+        return {'event_id': event['id'], 'cancelled': True}
+    start, end = event.get('start') or {}, event.get('end') or {}
+    if 'dateTime' not in start or 'dateTime' not in end:
+        return None
+    return {
+        'event_id': event['id'],
+        'cancelled': False,
+        'start_time': _local_time(start),
+        'end_time': _local_time(end),
+    }
+
+
+class CalendarPullSync:
+    """
+    Pulls calendar changes into appointments (one per process, see `calendar_pull`)
+
+    Shares the push worker's HTTP client and token cache.
+    """
+
+    def __init__(self, worker=None, page_size=CALENDAR_PULL_PAGE_SIZE, workers=CALENDAR_PULL_WORKERS,
+                 lease_seconds=CALENDAR_PULL_LEASE):
+        worker = worker or calendar_sync
+        self.client = worker.client
+        self.tokens = worker.tokens
+        self.page_size = page_size
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.last_pull = None
+        self._pool = None
+
+    def run(self, interval=CALENDAR_PULL_INTERVAL, stop=None):
+        """Pull every `interval` seconds until `stop` (threading.Event) is set"""
+        stop = stop or threading.Event()
+        while not stop.wait(interval):
+            try:
+                metrics = self.pull()
+                if metrics['events']:
+                    print(f"Calendar pull: {metrics}")
+            except Exception as e:
+                print(f"Calendar pull error: {str(e)}")
+
+    def pull(self, doctor_ids=None):
+        """
+        Pull the changes of every active doctor's calendar (or only `doctor_ids`)
+
+        Returns:
+            Dict with doctors, pages, events, rescheduled, cancelled, conflicts,
+            full_syncs, skipped (not connected), errors and seconds
+        """
+        started = time.monotonic()
+        metrics = dict.fromkeys(['doctors', 'pages', 'events', 'rescheduled', 'cancelled', 'conflicts',
+                                 'full_syncs', 'skipped', 'errors'], 0)
+        if doctor_ids is None:
+            doctor_ids = CalendarSyncStateModel.get_doctor_ids()
+        states = CalendarSyncStateModel.claim(doctor_ids, self.lease_seconds) if doctor_ids else []
+
+        if states:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='calendar-pull')
+            for doctor_metrics in self._pool.map(self._pull_doctor, states):
+                metrics['doctors'] += 1
+                for key, value in doctor_metrics.items():
+                    metrics[key] += value
+
+        metrics['seconds'] = round(time.monotonic() - started, 3)
+        self.last_pull = dict(metrics, finished_at=datetime.now().isoformat(timespec='seconds'))
+        return metrics
+
+    def _pull_doctor(self, state):
+        """All pages changed in one doctor's calendar since its cursor; releases the cursor"""
+        doctor_id = state['doctor_id']
+        metrics = {'pages': 0, 'events': 0, 'rescheduled': 0, 'cancelled': 0, 'conflicts': 0, 'full_syncs': 0}
+        sync_token, page_token = state['sync_token'], state['page_token']
+        error, reset = None, False
+        try:
+            if self.tokens.get(doctor_id) is None:
+                CalendarSyncStateModel.release(doctor_id, 'Google Calendar not connected')
+                return {'skipped': 1}
+
+            while True:
+                try:
+                    page = self._list(doctor_id, sync_token, page_token)
+                except CalendarAPIError as e:
+                    # Sync token too old: read the whole calendar again, once
+                    if e.status != 410 or reset:
+                        raise
+                    CalendarSyncStateModel.reset(doctor_id)
+                    sync_token = page_token = None
+                    reset = True
+                    continue
+
+                items = page.get('items', [])
+                changes = [change for change in map(event_change, items) if change]
+                applied = CalendarSyncStateModel.apply_page(
+                    doctor_id, changes, page.get('nextPageToken'), page.get('nextSyncToken'), len(items)
+                )
+                metrics['pages'] += 1
+                metrics['events'] += len(items)
+                for key, value in applied.items():
+                    metrics[key] += value
+
+                page_token = page.get('nextPageToken')
+                if not page_token:
+                    metrics['full_syncs'] = int(sync_token is None)
+                    break
+        except CalendarAPIError as e:
+            error = str(e)
+            metrics['errors'] = 1
+        except Exception as e:
+            print(f"Calendar pull error (doctor {doctor_id}): {str(e)}")
+            error = str(e)
+            metrics['errors'] = 1
+
+        CalendarSyncStateModel.release(doctor_id, error)
+        return metrics
+
+    def _list(self, doctor_id, sync_token, page_token):
+        """One page; a 401 is retried once with fresh credentials"""
+        token = self.tokens.get(doctor_id)
+        try:
+            return self.client.list_events(token, sync_token, page_token, self.page_size)
+        except CalendarAPIError as e:
+            if e.status != 401:
+                raise
+            self.tokens.invalidate(doctor_id)
+            token = self.tokens.get(doctor_id)
+            if token is None:
+                raise
+            return self.client.list_events(token, sync_token, page_token, self.page_size)
+
+
+calendar_pull = CalendarPullSync()
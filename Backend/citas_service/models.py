@@ -3,14 +3,26 @@ Models for Citas Service
 """
 import sys
 import os
+import uuid
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import psycopg2.errors
+from psycopg2.extras import execute_values
 from common.database import db
 
+# Tags this process's appointment writes in the appointments_changed NOTIFY, so its own
+# schedule index (which applies them directly) can skip them
+WORKER_ID = uuid.uuid4().hex
+
 
 class AppointmentModel:
     """Appointment database operations"""
 
+    @staticmethod
+    def _tag_write(cursor):
+        """Mark the writes of this transaction as coming from this worker"""
+        cursor.execute("SELECT set_config('citas.schedule_origin', %s, true)", (WORKER_ID,))
+
     @staticmethod
     def get_by_id(appointment_id):
         """Get appointment by ID"""
@@ -106,6 +118,7 @@ class AppointmentModel:
     def create(patient_id, doctor_id, start_time, end_time, reason, status='PENDING'):
         """Create a new appointment"""
         with db.get_cursor(commit=True) as cursor:
+            AppointmentModel._tag_write(cursor)
             cursor.execute("""
                 INSERT INTO appointments (patient_id, doctor_id, start_time, end_time, reason, status)
                 VALUES (%s, %s, %s, %s, %s, %s)
@@ -114,6 +127,71 @@ class AppointmentModel:
             """, (patient_id, doctor_id, start_time, end_time, reason, status))
             return cursor.fetchone()
 
+    @staticmethod
+    def _find_conflicts(cursor, doctor_id, slots):
+        """
+        Existing non-cancelled appointments overlapping each slot, in one query
+
+        Returns:
+            Rows with slot (index in `slots`), appointment_id, start_time and end_time
+        """
+        cursor.execute("""
+            SELECT s.slot - 1 as slot, a.appointment_id, a.start_time, a.end_time
+            FROM unnest(%s::timestamp[], %s::timestamp[]) WITH ORDINALITY as s(start_time, end_time, slot)
+            JOIN appointments a ON a.doctor_id = %s
+                AND a.time_range && tsrange(s.start_time, s.end_time, '[)')
+                AND a.status IS DISTINCT FROM 'CANCELLED'
+            ORDER BY s.slot, a.start_time
+        """, ([start for start, _ in slots], [end for _, end in slots], doctor_id))
+        return cursor.fetchall()
+
+    @staticmethod
+    def create_many(patient_id, doctor_id, slots, reason=None, status='PENDING'):
+        """
+        Create a series of appointments in one transaction: all of them or none
+
+        Every slot is checked in one query and inserted with one multi-row INSERT. A slot
+        taken between the check and the insert fails on appointments_no_overlap, rolls
+        back the whole series and is reported like the others.
+
+        Args:
+            slots: List of (start_time, end_time) tuples
+
+        Returns:
+            Dict with 'appointments' (created rows, by start_time) and 'conflicts' (slot,
+            appointment_id, start_time, end_time; nothing is created when there are any)
+        """
+        try:
+            with db.get_cursor(commit=True) as cursor:
+                conflicts = AppointmentModel._find_conflicts(cursor, doctor_id, slots)
+                if conflicts:
+                    return {'appointments': [], 'conflicts': conflicts}
+
+                AppointmentModel._tag_write(cursor)
+                appointments = execute_values(cursor, """
+                    INSERT INTO appointments (patient_id, doctor_id, start_time, end_time, reason, status)
+                    VALUES %s
+                    RETURNING appointment_id, patient_id, doctor_id, start_time, end_time,
+                              reason, status, created_at
+                """, [(patient_id, doctor_id, start, end, reason, status) for start, end in slots], fetch=True)
+                return {'appointments': sorted(appointments, key=lambda row: row['start_time']), 'conflicts': []}
+        except psycopg2.errors.ExclusionViolation:
+            with db.get_cursor() as cursor:
+                conflicts = AppointmentModel._find_conflicts(cursor, doctor_id, slots)
+            if not conflicts:
+                raise
+            return {'appointments': [], 'conflicts': conflicts}
+
+    @staticmethod
+    def get_treatment_plan_sessions(hair_treatment_id):
+        """number_of_sessions of a hair treatment plan, or None if it does not exist"""
+        with db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT number_of_sessions FROM hair_treatments WHERE hair_treatment_id = %s
+            """, (hair_treatment_id,))
+            result = cursor.fetchone()
+            return result['number_of_sessions'] if result else None
+
     @staticmethod
     def update(appointment_id, **kwargs):
         """Update appointment"""
@@ -140,45 +218,66 @@ class AppointmentModel:
         """
 
         with db.get_cursor(commit=True) as cursor:
+            AppointmentModel._tag_write(cursor)
             cursor.execute(query, params)
             return cursor.fetchone()
 
     @staticmethod
-    def update_status(appointment_id, status):
-        """Update appointment status"""
-        with db.get_cursor(commit=True) as cursor:
-            cursor.execute("""
-                UPDATE appointments
-                SET status = %s
+    def update_status(appointment_id, status, expected_status=None):
+        """
+        Update appointment status
+
+        Args:
+            appointment_id: Appointment ID
+            status: New status
+            expected_status: Only update if the appointment still has this status
+
+        Returns:
+            Updated row with previous_status (the status it had under the row lock), or None
+        """
+        query = """
+            UPDATE appointments a
+            SET status = %s
+            FROM (
+                SELECT appointment_id, status
+                FROM appointments
                 WHERE appointment_id = %s
-                RETURNING appointment_id, status
-            """, (status, appointment_id))
+                FOR UPDATE
+            ) previous
+            WHERE a.appointment_id = previous.appointment_id
+        """
+        params = [status, appointment_id]
+
+        if expected_status is not None:
+            query += " AND previous.status = %s"
+            params.append(expected_status)
+
+        query += " RETURNING a.appointment_id, a.doctor_id, a.start_time, a.end_time, a.status, previous.status as previous_status"
+
+        with db.get_cursor(commit=True) as cursor:
+            AppointmentModel._tag_write(cursor)
+            cursor.execute(query, params)
             return cursor.fetchone()
 
     @staticmethod
     def check_availability(doctor_id, start_time, end_time, exclude_appointment_id=None):
-        """Check if doctor is available for the given time slot"""
-        query = """
-            SELECT COUNT(*) as count
-            FROM appointments
-            WHERE doctor_id = %s
-            AND status NOT IN ('CANCELLED')
-            AND (
-                (start_time <= %s AND end_time > %s) OR
-                (start_time < %s AND end_time >= %s) OR
-                (start_time >= %s AND end_time <= %s)
-            )
         """
-        params = [doctor_id, start_time, start_time, end_time, end_time, start_time, end_time]
-
-        if exclude_appointment_id:
-            query += " AND appointment_id != %s"
-            params.append(exclude_appointment_id)
+        Check if doctor is available for the given time slot
 
+        Uses the GiST index of appointments_no_overlap; [start, end) ranges, so
+        back-to-back appointments do not conflict
+        """
         with db.get_cursor() as cursor:
-            cursor.execute(query, params)
-            result = cursor.fetchone()
-            return result['count'] == 0 if result else False
+            cursor.execute("""
+                SELECT NOT EXISTS (
+                    SELECT 1 FROM appointments
+                    WHERE doctor_id = %s
+                    AND time_range && tsrange(%s, %s, '[)')
+                    AND status IS DISTINCT FROM 'CANCELLED'
+                    AND appointment_id IS DISTINCT FROM %s
+                ) as available
+            """, (doctor_id, start_time, end_time, exclude_appointment_id))
+            return cursor.fetchone()['available']
 
     @staticmethod
     def get_doctor_schedule(doctor_id, date):
@@ -186,15 +285,102 @@ class AppointmentModel:
         with db.get_cursor() as cursor:
             cursor.execute("""
                 SELECT a.appointment_id, a.start_time, a.end_time, a.status, a.reason,
-                       p.full_name as patient_name,
+                       CONCAT_WS(' ', p.first_name, p.last_name) as patient_name,
                        p.phone
                 FROM appointments a
                 LEFT JOIN patients p ON a.patient_id = p.patient_id
                 WHERE a.doctor_id = %s
-                AND DATE(a.start_time) = %s
-                AND a.status NOT IN ('CANCELLED')
+                AND a.time_range && tsrange(%s::date, %s::date + 1, '[)')
+                AND a.status IS DISTINCT FROM 'CANCELLED'
                 ORDER BY a.start_time
-            """, (doctor_id, date))
+            """, (doctor_id, date, date))
+            return cursor.fetchall()
+
+    @staticmethod
+    def get_schedules(doctor_ids, range_from, range_to):
+        """
+        Non-cancelled appointments of several doctors overlapping [range_from, range_to)
+
+        Returns:
+            Rows with appointment_id, doctor_id, start_time and end_time
+        """
+        with db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT appointment_id, doctor_id, start_time, end_time
+                FROM appointments
+                WHERE doctor_id = ANY(%s)
+                AND time_range && tsrange(%s, %s, '[)')
+                AND status IS DISTINCT FROM 'CANCELLED'
+                ORDER BY doctor_id, start_time
+            """, (list(doctor_ids), range_from, range_to))
+            return cursor.fetchall()
+
+    @staticmethod
+    def get_active_doctors():
+        """Active doctors (role_id = 2): user_id and full_name"""
+        with db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT user_id, full_name
+                FROM users
+                WHERE role_id = 2 AND is_active = TRUE
+                ORDER BY user_id
+            """)
+            return cursor.fetchall()
+
+    @staticmethod
+    def find_free_slots(doctor_ids, date_from, date_to, duration, step, working_hours,
+                        not_before=None, limit=500):
+        """
+        Free slots of one or more doctors over a date range, in one query
+
+        Each doctor's opening windows (working_hours: (isodow, opens, closes) tuples) are
+        checked against the union of their non-cancelled appointments in that window;
+        candidate starts are taken every `step` from the window opening.
+
+        Args:
+            doctor_ids: List of doctor ids, or None for every active doctor (role_id = 2)
+            duration, step: timedelta
+            not_before: Skip slots starting before this datetime
+
+        Returns:
+            Rows with doctor_id, doctor_name, start_time and end_time, by start_time
+        """
+        isodows, opens, closes = (list(column) for column in zip(*working_hours, strict=False)) if working_hours else ([], [], [])
+        with db.get_cursor() as cursor:
+            cursor.execute("""
+                WITH doctors AS (
+                    SELECT user_id as doctor_id, full_name as doctor_name
+                    FROM users
+                    WHERE role_id = 2 AND is_active = TRUE
+                    AND (%s::int[] IS NULL OR user_id = ANY(%s::int[]))
+                ),
+                windows AS (
+                    SELECT d.doctor_id, d.doctor_name,
+                           tsrange(day + h.opens, day + h.closes, '[)') as opening
+                    FROM doctors d
+                    CROSS JOIN generate_series(%s::timestamp, %s::timestamp, INTERVAL '1 day') as day
+                    JOIN unnest(%s::int[], %s::time[], %s::time[]) as h(isodow, opens, closes)
+                        ON h.isodow = EXTRACT(ISODOW FROM day)
+                )
+                SELECT w.doctor_id, w.doctor_name,
+                       s.slot_start as start_time, s.slot_start + %s::interval as end_time
+                FROM windows w
+                CROSS JOIN LATERAL (
+                    SELECT range_agg(a.time_range) as busy
+                    FROM appointments a
+                    WHERE a.doctor_id = w.doctor_id
+                    AND a.time_range && w.opening
+                    AND a.status IS DISTINCT FROM 'CANCELLED'
+                ) b
+                CROSS JOIN LATERAL generate_series(
+                    lower(w.opening), upper(w.opening) - %s::interval, %s::interval
+                ) as s(slot_start)
+                WHERE (b.busy IS NULL OR NOT b.busy && tsrange(s.slot_start, s.slot_start + %s::interval, '[)'))
+                AND (%s::timestamp IS NULL OR s.slot_start >= %s::timestamp)
+                ORDER BY s.slot_start, w.doctor_id
+                LIMIT %s
+            """, (doctor_ids, doctor_ids, date_from, date_to, isodows, opens, closes,
+                  duration, duration, step, duration, not_before, not_before, limit))
             return cursor.fetchall()
 
 
@@ -358,3 +544,343 @@ class AppointmentExtraModel:
             """, (appointment_id,))
             result = cursor.fetchone()
             return float(result['total']) if result else 0.0
+
+
+class CalendarSyncOutboxModel:
+    """Google Calendar sync queue (calendar_sync_outbox, see add_calendar_sync_outbox.sql)"""
+
+    # Any constant: serializes claims so two drains never split one appointment's rows
+    CLAIM_LOCK = 4301
+
+    @staticmethod
+    def claim(limit=100, lease_seconds=120):
+        """
+        Lease up to `limit` due rows, oldest first
+
+        A row is not handed out while an earlier row of the same appointment is leased or
+        waiting for a retry, so each appointment's changes reach the calendar in order.
+        Leased rows stay invisible to other drains until they are completed or the lease
+        expires (a crashed worker).
+
+        Returns:
+            Claimed rows (attempts already counts this one), by outbox_id
+        """
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (CalendarSyncOutboxModel.CLAIM_LOCK,))
+            cursor.execute("""
+                UPDATE calendar_sync_outbox o
+                SET locked_until = NOW() + make_interval(secs => %s),
+                    attempts = o.attempts + 1
+                WHERE o.outbox_id IN (
+                    SELECT q.outbox_id
+                    FROM calendar_sync_outbox q
+                    WHERE q.status = 'PENDING'
+                      AND q.available_at <= NOW()
+                      AND (q.locked_until IS NULL OR q.locked_until < NOW())
+                      AND NOT EXISTS (
+                          SELECT 1 FROM calendar_sync_outbox e
+                          WHERE e.appointment_id = q.appointment_id
+                            AND e.outbox_id < q.outbox_id
+                            AND e.status = 'PENDING'
+                            AND (e.locked_until >= NOW() OR e.available_at > NOW())
+                      )
+                    ORDER BY q.available_at, q.outbox_id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING o.outbox_id, o.appointment_id, o.doctor_id, o.operation,
+                          o.google_event_id, o.attempts
+            """, (lease_seconds, limit))
+            return sorted(cursor.fetchall(), key=lambda row: row['outbox_id'])
+
+    @staticmethod
+    def get_appointments(appointment_ids):
+        """Current data of the appointments in a batch, with what the calendar event shows"""
+        with db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT
+                    a.appointment_id,
+                    a.doctor_id,
+                    a.start_time,
+                    a.end_time,
+                    a.reason,
+                    a.status,
+                    a.google_event_id,
+                    p.first_name || ' ' || p.last_name as patient_name,
+                    p.email as patient_email,
+                    u.full_name as doctor_name
+                FROM appointments a
+                LEFT JOIN patients p ON a.patient_id = p.patient_id
+                LEFT JOIN users u ON a.doctor_id = u.user_id
+                WHERE a.appointment_id = ANY(%s)
+            """, (list(appointment_ids),))
+            return {row['appointment_id']: row for row in cursor.fetchall()}
+
+    @staticmethod
+    def complete(results, event_ids=()):
+        """
+        Store the outcome of a batch in one transaction
+
+        Args:
+            results: Dicts with outbox_id, status (DONE, SKIPPED, FAILED or PENDING to
+                     retry), last_error, retry_in (seconds, PENDING only) and attempted
+                     (False: deferred without calling the calendar, the attempt is not counted)
+            event_ids: (appointment_id, expected google_event_id, new google_event_id);
+                       skipped if the appointment's event changed meanwhile
+        """
+        with db.get_cursor(commit=True) as cursor:
+            if results:
+                execute_values(cursor, """
+                    UPDATE calendar_sync_outbox o
+                    SET status = v.status,
+                        last_error = v.last_error,
+                        attempts = o.attempts - CASE WHEN v.attempted THEN 0 ELSE 1 END,
+                        locked_until = NULL,
+                        available_at = CASE WHEN v.status = 'PENDING'
+                                            THEN NOW() + make_interval(secs => v.retry_in)
+                                            ELSE o.available_at END,
+                        processed_at = CASE WHEN v.status = 'PENDING' THEN NULL ELSE NOW() END
+                    FROM (VALUES %s) AS v(outbox_id, status, last_error, retry_in, attempted)
+                    WHERE o.outbox_id = v.outbox_id
+                """, [
+                    (result['outbox_id'], result['status'], result.get('last_error'),
+                     result.get('retry_in', 0), result.get('attempted', True))
+                    for result in results
+                ], template='(%s::bigint, %s::varchar, %s::text, %s::float8, %s::boolean)')
+
+            if event_ids:
+                execute_values(cursor, """
+                    UPDATE appointments a
+                    SET google_event_id = v.new_event_id
+                    FROM (VALUES %s) AS v(appointment_id, expected_event_id, new_event_id)
+                    WHERE a.appointment_id = v.appointment_id
+                      AND a.google_event_id IS NOT DISTINCT FROM v.expected_event_id
+                """, list(event_ids), template='(%s::int, %s::varchar, %s::varchar)')
+
+    @staticmethod
+    def backlog():
+        """Rows by status, due now and age of the oldest pending one"""
+        with db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT
+                    COUNT(*) FILTER (WHERE status = 'PENDING') as pending,
+                    COUNT(*) FILTER (WHERE status = 'PENDING' AND available_at <= NOW()) as due,
+                    COUNT(*) FILTER (WHERE status = 'FAILED') as failed,
+                    COALESCE(EXTRACT(EPOCH FROM NOW() - MIN(created_at) FILTER (WHERE status = 'PENDING')), 0)
+                        as oldest_pending_seconds
+                FROM calendar_sync_outbox
+            """)
+            result = cursor.fetchone()
+            return dict(result, oldest_pending_seconds=round(float(result['oldest_pending_seconds']), 1))
+
+    @staticmethod
+    def purge(older_than_days=30):
+        """Delete processed rows older than `older_than_days` (FAILED rows are kept)"""
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("""
+                DELETE FROM calendar_sync_outbox
+                WHERE status IN ('DONE', 'SKIPPED')
+                  AND processed_at < NOW() - make_interval(days => %s)
+            """, (older_than_days,))
+            return cursor.rowcount
+
+
+class CalendarSyncStateModel:
+    """Incremental pull cursors per doctor (calendar_sync_state, see add_calendar_sync_state.sql)"""
+
+    # Appointments a calendar change may still move or cancel
+    PULLABLE_STATUSES = ('PENDING', 'CONFIRMED')
+
+    # Unpushed database changes win: the outbox will overwrite the calendar event
+    _NO_PENDING_PUSH = """
+        NOT EXISTS (
+            SELECT 1 FROM calendar_sync_outbox o
+            WHERE o.appointment_id = a.appointment_id AND o.status = 'PENDING'
+        )
+    """
+
+    @staticmethod
+    def get_doctor_ids():
+        """Active doctors (role_id = 2), whose calendars are pulled"""
+        with db.get_cursor() as cursor:
+            cursor.execute("SELECT user_id FROM users WHERE role_id = 2 AND is_active ORDER BY user_id")
+            return [row['user_id'] for row in cursor.fetchall()]
+
+    @staticmethod
+    def claim(doctor_ids, lease_seconds=300):
+        """
+        Lease the cursors of the given doctors (created on first use)
+
+        A cursor being pulled by another worker is left out until its lease expires.
+
+        Returns:
+            Claimed states (doctor_id, sync_token, page_token)
+        """
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("""
+                INSERT INTO calendar_sync_state (doctor_id)
+                SELECT unnest(%s::int[])
+                ON CONFLICT (doctor_id) DO NOTHING
+            """, (list(doctor_ids),))
+            cursor.execute("""
+                UPDATE calendar_sync_state s
+                SET locked_until = NOW() + make_interval(secs => %s)
+                WHERE s.doctor_id IN (
+                    SELECT doctor_id FROM calendar_sync_state
+                    WHERE doctor_id = ANY(%s)
+                      AND (locked_until IS NULL OR locked_until < NOW())
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING s.doctor_id, s.sync_token, s.page_token
+            """, (lease_seconds, list(doctor_ids)))
+            return sorted(cursor.fetchall(), key=lambda row: row['doctor_id'])
+
+    @staticmethod
+    def _move(cursor, doctor_id, moves):
+        """Reschedule appointments to their events' times; returns the rows changed"""
+        cursor.execute(f"""
+            UPDATE appointments a
+            SET start_time = v.start_time,
+                end_time = v.end_time
+            FROM unnest(%s::varchar[], %s::timestamp[], %s::timestamp[]) AS v(event_id, start_time, end_time)
+            WHERE a.doctor_id = %s
+              AND a.google_event_id = v.event_id
+              AND a.status = ANY(%s)
+              AND (a.start_time, a.end_time) IS DISTINCT FROM (v.start_time, v.end_time)
+              AND {CalendarSyncStateModel._NO_PENDING_PUSH}
+        """, (
+            [move['event_id'] for move in moves],
+            [move['start_time'] for move in moves],
+            [move['end_time'] for move in moves],
+            doctor_id, list(CalendarSyncStateModel.PULLABLE_STATUSES)
+        ))
+        return cursor.rowcount
+
+    @staticmethod
+    def apply_page(doctor_id, changes, page_token=None, sync_token=None, pulled=0):
+        """
+        Apply one page of calendar changes and advance the cursor, in one transaction
+
+        Events are matched to the doctor's appointments by google_event_id; other events
+        are ignored. A cancelled event cancels its appointment, a moved one reschedules
+        it. A new time that overlaps another appointment is not applied: the appointment
+        is queued (UPSERT) so the calendar gets its database time back. None of these
+        writes is queued for the calendar otherwise (citas.calendar_pull).
+
+        Args:
+            changes: Dicts with event_id, cancelled and, if not cancelled, start_time and end_time
+            page_token: Next page of this pull, None on the last one
+            sync_token: nextSyncToken of the last page
+
+        Returns:
+            Dict with rescheduled, cancelled and conflicts
+        """
+        cancelled = list({change['event_id'] for change in changes if change['cancelled']})
+        # Latest change per event
+        moves = list({change['event_id']: change for change in changes if not change['cancelled']}.values())
+        result = {'rescheduled': 0, 'cancelled': 0, 'conflicts': 0}
+
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("SELECT set_config('citas.calendar_pull', 'on', true)")
+
+            if cancelled:
+                cursor.execute(f"""
+                    UPDATE appointments a
+                    SET status = 'CANCELLED',
+                        google_event_id = NULL
+                    WHERE a.doctor_id = %s
+                      AND a.google_event_id = ANY(%s)
+                      AND a.status = ANY(%s)
+                      AND {CalendarSyncStateModel._NO_PENDING_PUSH}
+                """, (doctor_id, cancelled, list(CalendarSyncStateModel.PULLABLE_STATUSES)))
+                result['cancelled'] = cursor.rowcount
+
+            conflicts = []
+            if moves:
+                cursor.execute("SAVEPOINT calendar_pull_moves")
+                try:
+                    result['rescheduled'] = CalendarSyncStateModel._move(cursor, doctor_id, moves)
+                    cursor.execute("RELEASE SAVEPOINT calendar_pull_moves")
+                except (psycopg2.errors.ExclusionViolation, psycopg2.errors.CheckViolation):
+                    cursor.execute("ROLLBACK TO SAVEPOINT calendar_pull_moves")
+                    # One by one, again while any succeeds (two appointments swapping slots)
+                    conflicts = moves
+                    while conflicts:
+                        pending, conflicts = conflicts, []
+                        for move in pending:
+                            cursor.execute("SAVEPOINT calendar_pull_move")
+                            try:
+                                result['rescheduled'] += CalendarSyncStateModel._move(cursor, doctor_id, [move])
+                                cursor.execute("RELEASE SAVEPOINT calendar_pull_move")
+                            except (psycopg2.errors.ExclusionViolation, psycopg2.errors.CheckViolation):
+                                cursor.execute("ROLLBACK TO SAVEPOINT calendar_pull_move")
+                                conflicts.append(move)
+                        if len(conflicts) == len(pending):
+                            break
+
+            if conflicts:
+                cursor.execute(f"""
+                    INSERT INTO calendar_sync_outbox (appointment_id, doctor_id, operation)
+                    SELECT a.appointment_id, a.doctor_id, 'UPSERT'
+                    FROM appointments a
+                    WHERE a.doctor_id = %s
+                      AND a.google_event_id = ANY(%s)
+                      AND a.status = ANY(%s)
+                      AND {CalendarSyncStateModel._NO_PENDING_PUSH}
+                    ORDER BY a.appointment_id
+                """, (doctor_id, [move['event_id'] for move in conflicts],
+                      list(CalendarSyncStateModel.PULLABLE_STATUSES)))
+                result['conflicts'] = cursor.rowcount
+
+            cursor.execute("""
+                UPDATE calendar_sync_state
+                SET page_token = %s,
+                    sync_token = COALESCE(%s, sync_token),
+                    full_syncs = full_syncs + CASE WHEN %s IS NOT NULL AND sync_token IS NULL THEN 1 ELSE 0 END,
+                    events_pulled = events_pulled + %s,
+                    appointments_updated = appointments_updated + %s,
+                    conflicts = conflicts + %s,
+                    last_pulled_at = CASE WHEN %s IS NOT NULL THEN NOW() ELSE last_pulled_at END
+                WHERE doctor_id = %s
+            """, (page_token, sync_token, sync_token, pulled,
+                  result['rescheduled'] + result['cancelled'], result['conflicts'],
+                  sync_token, doctor_id))
+
+        return result
+
+    @staticmethod
+    def reset(doctor_id):
+        """Forget the cursor (Google expired the sync token): the next pull reads everything"""
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("""
+                UPDATE calendar_sync_state
+                SET sync_token = NULL, page_token = NULL
+                WHERE doctor_id = %s
+            """, (doctor_id,))
+
+    @staticmethod
+    def release(doctor_id, error=None):
+        """End a pull: drop the lease and keep its error, if any"""
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("""
+                UPDATE calendar_sync_state
+                SET locked_until = NULL, last_error = %s
+                WHERE doctor_id = %s
+            """, (error, doctor_id))
+
+    @staticmethod
+    def summary():
+        """Cursors by state and totals pulled"""
+        with db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT
+                    COUNT(*) as doctors,
+                    COUNT(*) FILTER (WHERE sync_token IS NULL) as awaiting_full_sync,
+                    COUNT(*) FILTER (WHERE last_error IS NOT NULL) as with_errors,
+                    COALESCE(SUM(events_pulled), 0)::bigint as events_pulled,
+                    COALESCE(SUM(appointments_updated), 0)::bigint as appointments_updated,
+                    COALESCE(SUM(conflicts), 0)::bigint as conflicts,
+                    MIN(last_pulled_at) as oldest_pull
+                FROM calendar_sync_state
+            """)
+            return cursor.fetchone()
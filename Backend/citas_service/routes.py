@@ -3,16 +3,91 @@ Routes for Citas Service
 """
 from flask import Blueprint, request
 from datetime import datetime
+import psycopg2.errors
+import requests
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from common.auth_middleware import token_required
 from common.utils import success_response, error_response, get_pagination_params
-from models import AppointmentModel, AppointmentTreatmentModel, AppointmentExtraModel
+from common.service_client import InventarioServiceClient
+from models import (
+    AppointmentModel, AppointmentTreatmentModel, AppointmentExtraModel, CalendarSyncOutboxModel,
+    CalendarSyncStateModel
+)
+from availability import (
+    WORKING_HOURS, booking_slots, parse_date, parse_datetime, slot_search, validate_time_range
+)
+from schedule_index import schedule_index
+from calendar_outbox import calendar_sync
+from calendar_pull import calendar_pull
 
 citas_bp = Blueprint('citas', __name__)
 
+inventario_client = InventarioServiceClient()
+
+# Reserve recipe stock on CONFIRMED, consume it on COMPLETED, release it on PENDING/CANCELLED
+# (opt-in: status changes then depend on inventario being up and the recipe in stock)
+STOCK_RESERVATIONS_ENABLED = os.getenv('CITAS_STOCK_RESERVATIONS', 'False') == 'True'
+
+
+def _sync_stock_reservation(appointment_id, status):
+    """
+    Keep the inventory reservation of an appointment in step with its status (one call)
+
+    Called after the status is written, so a failure leaves nothing to undo in
+    inventario: a consume is retried safely (a committed reference is not consumed
+    again) and a release that fails leaves a reservation that expires on its own.
+
+    Returns:
+        Error response if the stock cannot be reserved or consumed, otherwise None
+    """
+    if not STOCK_RESERVATIONS_ENABLED:
+        return None
+
+    token = request.headers.get('Authorization', '').split(' ')[-1]
+    reference = f'appointment:{appointment_id}'
+    treatments = []
+    if status in ('CONFIRMED', 'COMPLETED'):
+        treatments = [
+            {'treatment_id': item['treatment_id'], 'quantity': item['quantity'] or 1}
+            for item in AppointmentTreatmentModel.get_by_appointment_id(appointment_id)
+        ]
+
+    if not treatments:
+        try:
+            inventario_client.release_reservations([reference], token)
+        except requests.exceptions.RequestException as e:
+            # An unreleased reservation expires on its own
+            print(f"Release stock reservation error ({reference}): {str(e)}")
+        return None
+
+    consume = status == 'COMPLETED'
+    try:
+        inventario_client.reserve_stock(reference, treatments, token, consume=consume)
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 409:
+            errors = e.response.json().get('errors')
+            return error_response('Insufficient stock for the appointment treatments', 409, errors)
+        return error_response('Inventory service error', 502)
+    except requests.exceptions.RequestException:
+        # The reservation may have been made before the connection failed
+        if not consume:
+            try:
+                inventario_client.release_reservations([reference], token)
+            except requests.exceptions.RequestException:
+                pass
+        return error_response('Inventory service unavailable', 503)
+
+    return None
+
+
+def _revert_status(appointment_id, status, previous_status):
+    """Put back the previous status of an appointment (unless it changed again meanwhile)"""
+    reverted = AppointmentModel.update_status(appointment_id, previous_status, expected_status=status)
+    schedule_index.apply(reverted)
+
 
 # ============= APPOINTMENTS ENDPOINTS =============
 
@@ -108,52 +183,101 @@ def create_appointment(current_user):
             if field not in data:
                 return error_response(f'{field} is required', 400)
 
-        # Parse datetime
+        # Parse and validate the time range
         try:
-            start_time = datetime.fromisoformat(data['start_time'].replace('Z', '+00:00'))
-            end_time = datetime.fromisoformat(data['end_time'].replace('Z', '+00:00'))
-        except ValueError:
-            return error_response('Invalid datetime format', 400)
+            start_time = parse_datetime(data['start_time'], 'start_time')
+            end_time = parse_datetime(data['end_time'], 'end_time')
+            validate_time_range(start_time, end_time)
+        except ValueError as e:
+            return error_response(str(e), 400)
 
-        # Validate time range
-        if start_time >= end_time:
-            return error_response('end_time must be after start_time', 400)
+        # Double booking is rejected by the appointments_no_overlap constraint
+        try:
+            appointment = AppointmentModel.create(
+                patient_id=data['patient_id'],
+                doctor_id=data['doctor_id'],
+                start_time=start_time,
+                end_time=end_time,
+                reason=data.get('reason'),
+                status=data.get('status', 'PENDING')
+            )
+        except psycopg2.errors.ExclusionViolation:
+            return error_response('Doctor is not available at this time', 409)
 
-        # Check doctor availability
-        is_available = AppointmentModel.check_availability(
-            data['doctor_id'],
-            start_time,
-            end_time
-        )
+        schedule_index.apply(appointment)
+        # Queued in calendar_sync_outbox by the insert itself
+        calendar_sync.wake()
 
-        if not is_available:
-            return error_response('Doctor is not available at this time', 409)
+        return success_response({'appointment': appointment}, 'Appointment created successfully', 201)
+
+    except Exception as e:
+        print(f"Create appointment error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+@citas_bp.route('/appointments/bulk', methods=['POST'])
+@token_required
+def create_appointments_bulk(current_user):
+    """
+    Book a series of appointments for one patient and doctor: all of them or none
+
+    Body: patient_id, doctor_id, reason, status and either "slots" (list of start_time /
+    end_time) or "recurrence" (first start_time / end_time, count, every_days). With a
+    hair_treatment_id the recurrence count defaults to its number_of_sessions.
+    """
+    try:
+        data = request.get_json() or {}
 
-        # Create appointment
-        appointment = AppointmentModel.create(
+        for field in ['patient_id', 'doctor_id']:
+            if field not in data:
+                return error_response(f'{field} is required', 400)
+
+        sessions = None
+        if data.get('hair_treatment_id'):
+            sessions = AppointmentModel.get_treatment_plan_sessions(data['hair_treatment_id'])
+            if sessions is None:
+                return error_response('Treatment plan not found', 404)
+
+        try:
+            slots = booking_slots(data, sessions)
+        except ValueError as e:
+            return error_response(str(e), 400)
+
+        result = AppointmentModel.create_many(
             patient_id=data['patient_id'],
             doctor_id=data['doctor_id'],
-            start_time=start_time,
-            end_time=end_time,
+            slots=slots,
             reason=data.get('reason'),
             status=data.get('status', 'PENDING')
         )
 
-        # Sync to Google Calendar if enabled (background task, don't block response)
-        try:
-            from common.google_calendar import CalendarSyncManager
-            CalendarSyncManager.sync_appointment_create(
-                appointment['appointment_id'],
-                data['doctor_id']
-            )
-        except Exception as e:
-            print(f"Google Calendar sync warning: {str(e)}")
-            # Don't fail the request if calendar sync fails
-
-        return success_response({'appointment': appointment}, 'Appointment created successfully', 201)
+        if result['conflicts']:
+            conflicts = [
+                {
+                    'slot': conflict['slot'],
+                    'start_time': slots[conflict['slot']][0].isoformat(),
+                    'end_time': slots[conflict['slot']][1].isoformat(),
+                    'appointment_id': conflict['appointment_id'],
+                    'appointment_start_time': conflict['start_time'].isoformat(),
+                    'appointment_end_time': conflict['end_time'].isoformat(),
+                }
+                for conflict in result['conflicts']
+            ]
+            return error_response('Doctor is not available for some of the slots', 409, conflicts)
+
+        appointments = result['appointments']
+        for appointment in appointments:
+            schedule_index.apply(appointment)
+        calendar_sync.wake()
+
+        return success_response(
+            {'appointments': appointments, 'count': len(appointments)},
+            'Appointments created successfully',
+            201
+        )
 
     except Exception as e:
-        print(f"Create appointment error: {str(e)}")
+        print(f"Create appointments bulk error: {str(e)}")
         return error_response('An error occurred', 500)
 
 
@@ -167,43 +291,20 @@ def update_appointment(current_user, appointment_id):
         if not data:
             return error_response('No data to update', 400)
 
-        # If updating time, check availability
-        if 'start_time' in data or 'end_time' in data or 'doctor_id' in data:
-            current_appointment = AppointmentModel.get_by_id(appointment_id)
-            if not current_appointment:
-                return error_response('Appointment not found', 404)
-
-            # Parse new times
-            start_time = data.get('start_time')
-            end_time = data.get('end_time')
-            doctor_id = data.get('doctor_id', current_appointment['doctor_id'])
-
-            if start_time:
-                start_time = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-            else:
-                start_time = current_appointment['start_time']
-
-            if end_time:
-                end_time = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-            else:
-                end_time = current_appointment['end_time']
-
-            # Check availability
-            is_available = AppointmentModel.check_availability(
-                doctor_id,
-                start_time,
-                end_time,
-                exclude_appointment_id=appointment_id
-            )
-
-            if not is_available:
-                return error_response('Doctor is not available at this time', 409)
-
-        appointment = AppointmentModel.update(appointment_id, **data)
+        # Moving an appointment onto another one fails on appointments_no_overlap
+        try:
+            appointment = AppointmentModel.update(appointment_id, **data)
+        except psycopg2.errors.ExclusionViolation:
+            return error_response('Doctor is not available at this time', 409)
+        except psycopg2.errors.CheckViolation:
+            return error_response('end_time must be after start_time', 400)
 
         if not appointment:
             return error_response('Appointment not found', 404)
 
+        schedule_index.apply(appointment)
+        calendar_sync.wake()
+
         return success_response({'appointment': appointment}, 'Appointment updated successfully')
 
     except Exception as e:
@@ -225,11 +326,30 @@ def update_appointment_status(current_user, appointment_id):
         if data['status'] not in valid_statuses:
             return error_response(f'Invalid status. Must be one of: {", ".join(valid_statuses)}', 400)
 
-        result = AppointmentModel.update_status(appointment_id, data['status'])
+        try:
+            result = AppointmentModel.update_status(appointment_id, data['status'])
+        except psycopg2.errors.ExclusionViolation:
+            # Reopening a cancelled appointment whose slot was taken meanwhile
+            return error_response('Doctor is not available at this time', 409)
 
         if not result:
             return error_response('Appointment not found', 404)
 
+        # Stock follows the status change; if it cannot, the status goes back
+        previous_status = result.pop('previous_status')
+        if previous_status != data['status']:
+            try:
+                stock_error = _sync_stock_reservation(appointment_id, data['status'])
+            except Exception:
+                _revert_status(appointment_id, data['status'], previous_status)
+                raise
+            if stock_error:
+                _revert_status(appointment_id, data['status'], previous_status)
+                return stock_error
+
+        schedule_index.apply(result)
+        calendar_sync.wake()
+
         return success_response({'appointment': result}, 'Appointment status updated successfully')
 
     except Exception as e:
@@ -249,10 +369,16 @@ def check_availability(current_user):
             if field not in data:
                 return error_response(f'{field} is required', 400)
 
-        start_time = datetime.fromisoformat(data['start_time'].replace('Z', '+00:00'))
-        end_time = datetime.fromisoformat(data['end_time'].replace('Z', '+00:00'))
+        try:
+            start_time = parse_datetime(data['start_time'], 'start_time')
+            end_time = parse_datetime(data['end_time'], 'end_time')
+        except ValueError as e:
+            return error_response(str(e), 400)
+
+        if start_time >= end_time:
+            return error_response('end_time must be after start_time', 400)
 
-        is_available = AppointmentModel.check_availability(
+        is_available = schedule_index.check_availability(
             data['doctor_id'],
             start_time,
             end_time,
@@ -276,6 +402,11 @@ def get_doctor_schedule(current_user, doctor_id):
         if not date:
             return error_response('date parameter is required', 400)
 
+        try:
+            parse_date(date, 'date')
+        except ValueError as e:
+            return error_response(str(e), 400)
+
         schedule = AppointmentModel.get_doctor_schedule(doctor_id, date)
 
         return success_response({'schedule': schedule, 'date': date, 'doctor_id': doctor_id})
@@ -285,6 +416,134 @@ def get_doctor_schedule(current_user, doctor_id):
         return error_response('An error occurred', 500)
 
 
+# ============= AVAILABILITY ENDPOINTS =============
+
+def _free_slots(search):
+    """Run a validated slot search; past slots are never offered"""
+    return schedule_index.find_free_slots(
+        search['doctor_ids'], search['date_from'], search['date_to'],
+        search['duration'], search['step'], WORKING_HOURS,
+        not_before=datetime.now(), limit=search['limit']
+    )
+
+
+@citas_bp.route('/availability/slots', methods=['GET'])
+@token_required
+def search_free_slots(current_user):
+    """
+    Free slots for one or more doctors over a date range
+
+    Query params: doctor_ids (comma separated, default: all active doctors), date_from,
+    date_to, duration and step (minutes), limit
+    """
+    try:
+        try:
+            search = slot_search(request.args)
+        except ValueError as e:
+            return error_response(str(e), 400)
+
+        slots = _free_slots(search)
+
+        return success_response({
+            'slots': slots,
+            'count': len(slots),
+            'date_from': search['date_from'].isoformat(),
+            'date_to': search['date_to'].isoformat(),
+            'duration': int(search['duration'].total_seconds() // 60)
+        })
+
+    except Exception as e:
+        print(f"Search free slots error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+@citas_bp.route('/availability/doctor/<int:doctor_id>', methods=['GET'])
+@token_required
+def get_doctor_availability(current_user, doctor_id):
+    """Free slots of a doctor on one date (?date=YYYY-MM-DD, default: today)"""
+    try:
+        args = {key: request.args[key] for key in ('duration', 'step') if key in request.args}
+        try:
+            search = slot_search({**args, 'doctor_ids': str(doctor_id), 'date_from': request.args.get('date')})
+        except ValueError as e:
+            return error_response(str(e), 400)
+
+        slots = _free_slots(search)
+
+        return success_response({
+            'doctor_id': doctor_id,
+            'date': search['date_from'].isoformat(),
+            'available_slots': [{'start': slot['start_time'], 'end': slot['end_time']} for slot in slots]
+        })
+
+    except Exception as e:
+        print(f"Get doctor availability error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+# ============= CALENDAR SYNC ENDPOINTS =============
+
+@citas_bp.route('/calendar-sync/status', methods=['GET'])
+@token_required
+def get_calendar_sync_status(current_user):
+    """Google Calendar outbox backlog, pull cursors and this worker's last drain and pull"""
+    try:
+        return success_response({
+            'backlog': CalendarSyncOutboxModel.backlog(),
+            'last_drain': calendar_sync.last_drain,
+            'pull': CalendarSyncStateModel.summary(),
+            'last_pull': calendar_pull.last_pull
+        })
+
+    except Exception as e:
+        print(f"Get calendar sync status error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+@citas_bp.route('/calendar-sync/drain', methods=['POST'])
+@token_required
+def drain_calendar_sync(current_user):
+    """
+    Sync the due Google Calendar backlog now (administrators)
+
+    Request body (optional): {"max_batches": 5}
+    """
+    try:
+        if current_user['role_id'] != 1:
+            return error_response('Insufficient permissions', 403)
+
+        data = request.get_json(silent=True) or {}
+        metrics = calendar_sync.drain(max_batches=data.get('max_batches'))
+
+        return success_response({'metrics': metrics}, 'Calendar outbox drained')
+
+    except Exception as e:
+        print(f"Drain calendar sync error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+@citas_bp.route('/calendar-sync/pull', methods=['POST'])
+@token_required
+def pull_calendar_sync(current_user):
+    """
+    Bring the doctors' Google Calendar changes now (administrators)
+
+    Request body (optional): {"doctor_ids": [3, 4]}
+    """
+    try:
+        if current_user['role_id'] != 1:
+            return error_response('Insufficient permissions', 403)
+
+        data = request.get_json(silent=True) or {}
+        metrics = calendar_pull.pull(doctor_ids=data.get('doctor_ids'))
+
+        return success_response({'metrics': metrics}, 'Calendar changes pulled')
+
+    except Exception as e:
+        print(f"Pull calendar sync error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
 # ============= APPOINTMENT TREATMENTS ENDPOINTS =============
 
 @citas_bp.route('/appointments/<int:appointment_id>/treatments', methods=['GET'])
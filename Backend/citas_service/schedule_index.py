@@ -0,0 +1,289 @@
+"""
+In-process schedule index (Citas Service)
+Per doctor, the non-cancelled appointments of the next CITAS_SCHEDULE_INDEX_WEEKS weeks as
+sorted intervals, so availability checks and free-slot searches skip PostgreSQL.
+
+Doctors are loaded lazily (one query for all the missing ones), updated in place by this
+worker's writes and dropped when another worker changes their appointments (LISTEN
+appointments_changed, see add_appointment_change_notify.sql). The index may briefly lag
+behind other workers; the appointments_no_overlap constraint decides at commit.
+"""
+import json
+import os
+import select
+import threading
+import time
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+
+import psycopg2
+from models import WORKER_ID, AppointmentModel
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+# Weeks ahead kept per doctor (0 disables the index) and seconds before a doctor is reloaded
+SCHEDULE_INDEX_WEEKS = int(os.getenv('CITAS_SCHEDULE_INDEX_WEEKS', 8))
+SCHEDULE_INDEX_TTL = int(os.getenv('CITAS_SCHEDULE_INDEX_TTL', 300))
+
+
+class DoctorSchedule:
+    """
+    Sorted, non-overlapping [start, end) intervals of one doctor
+
+    The index never changes a schedule it has handed out: writes replace it with a copy,
+    so queries run without the lock.
+    """
+
+    def __init__(self, appointments=()):
+        self.starts = []
+        self.items = []
+        for appointment_id, start_time, end_time in sorted(appointments, key=lambda item: (item[1], item[0])):
+            self.starts.append(start_time)
+            self.items.append((start_time, end_time, appointment_id))
+
+    def __len__(self):
+        return len(self.items)
+
+    def copy(self):
+        schedule = DoctorSchedule()
+        schedule.starts, schedule.items = list(self.starts), list(self.items)
+        return schedule
+
+    def add(self, appointment_id, start_time, end_time):
+        position = bisect_left(self.items, (start_time, end_time, appointment_id))
+        self.starts.insert(position, start_time)
+        self.items.insert(position, (start_time, end_time, appointment_id))
+
+    def remove(self, appointment_id):
+        for position, item in enumerate(self.items):
+            if item[2] == appointment_id:
+                del self.starts[position], self.items[position]
+                return True
+        return False
+
+    def conflicts(self, start_time, end_time, exclude_appointment_id=None):
+        """True if any interval overlaps [start_time, end_time)"""
+        # Intervals starting before end_time, latest first: ends decrease going back
+        position = bisect_left(self.starts, end_time) - 1
+        while position >= 0 and self.items[position][1] > start_time:
+            if self.items[position][2] != exclude_appointment_id:
+                return True
+            position -= 1
+        return False
+
+
+class ScheduleIndex:
+    """Schedule index of this worker (one per process, see `schedule_index`)"""
+
+    def __init__(self, weeks=SCHEDULE_INDEX_WEEKS, ttl=SCHEDULE_INDEX_TTL, worker_id=WORKER_ID):
+        self.weeks = weeks
+        self.ttl = ttl
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._schedules = {}      # doctor_id -> (DoctorSchedule, window start, loaded at)
+        self._owners = {}         # appointment_id -> doctor_id, for indexed appointments
+        self._versions = {}       # doctor_id -> writes seen; a load racing a write is not kept
+        self._epoch = 0           # full invalidations seen, same purpose
+        self._doctors = None      # (active doctors {user_id: full_name}, loaded at)
+        self.stats = {'hits': 0, 'fallbacks': 0, 'loads': 0, 'invalidations': 0}
+
+    @property
+    def enabled(self):
+        return self.weeks > 0
+
+    def _window(self):
+        window_start = datetime.combine(date.today(), datetime.min.time())
+        return window_start, window_start + timedelta(weeks=self.weeks)
+
+    def _covers(self, range_from, range_to):
+        # Aware datetimes are converted by PostgreSQL's session time zone: let it answer
+        if not self.enabled or range_from.tzinfo is not None or range_to.tzinfo is not None:
+            return False
+        window_start, window_end = self._window()
+        return window_start <= range_from and range_to <= window_end
+
+    def _get(self, doctor_ids):
+        """Schedules of the given doctors, loading missing or expired ones in one query"""
+        window_start, window_end = self._window()
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for doctor_id in doctor_ids:
+                entry = self._schedules.get(doctor_id)
+                if entry and entry[1] == window_start and now - entry[2] < self.ttl:
+                    found[doctor_id] = entry[0]
+                else:
+                    missing.append(doctor_id)
+            versions = {doctor_id: self._versions.get(doctor_id, 0) for doctor_id in missing}
+            epoch = self._epoch
+
+        if not missing:
+            return found
+
+        loaded = {doctor_id: [] for doctor_id in missing}
+        for row in AppointmentModel.get_schedules(missing, window_start, window_end):
+            loaded[row['doctor_id']].append((row['appointment_id'], row['start_time'], row['end_time']))
+        self.stats['loads'] += 1
+
+        with self._lock:
+            for doctor_id, appointments in loaded.items():
+                schedule = DoctorSchedule(appointments)
+                found[doctor_id] = schedule
+                # A write applied while loading may be missing from the rows: use them once
+                if self._epoch == epoch and self._versions.get(doctor_id, 0) == versions[doctor_id]:
+                    self._drop(doctor_id)
+                    self._schedules[doctor_id] = (schedule, window_start, now)
+                    self._owners.update((appointment_id, doctor_id) for appointment_id, _, _ in appointments)
+        return found
+
+    def _drop(self, doctor_id):
+        entry = self._schedules.pop(doctor_id, None)
+        if entry:
+            for _, _, appointment_id in entry[0].items:
+                self._owners.pop(appointment_id, None)
+
+    def _active_doctors(self, doctor_ids=None):
+        """Active doctors {user_id: full_name}; reloaded when a requested id is unknown"""
+        cached = self._doctors
+        stale = cached is None or time.monotonic() - cached[1] >= self.ttl
+        if not stale and doctor_ids and not set(doctor_ids) <= cached[0].keys():
+            stale = True
+        if stale:
+            doctors = {row['user_id']: row['full_name'] for row in AppointmentModel.get_active_doctors()}
+            self._doctors = cached = (doctors, time.monotonic())
+        return cached[0]
+
+    def check_availability(self, doctor_id, start_time, end_time, exclude_appointment_id=None):
+        """Same answer as AppointmentModel.check_availability, from memory when covered"""
+        if not self._covers(start_time, end_time):
+            self.stats['fallbacks'] += 1
+            return AppointmentModel.check_availability(doctor_id, start_time, end_time, exclude_appointment_id)
+
+        doctor_id = int(doctor_id)
+        schedule = self._get([doctor_id])[doctor_id]
+        self.stats['hits'] += 1
+        return not schedule.conflicts(start_time, end_time, exclude_appointment_id)
+
+    def find_free_slots(self, doctor_ids, date_from, date_to, duration, step, working_hours,
+                        not_before=None, limit=500):
+        """Same rows as AppointmentModel.find_free_slots, from memory when covered"""
+        range_from = datetime.combine(date_from, datetime.min.time())
+        range_to = datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+        if not self._covers(range_from, range_to) or (not_before is not None and not_before.tzinfo is not None):
+            self.stats['fallbacks'] += 1
+            return AppointmentModel.find_free_slots(doctor_ids, date_from, date_to, duration, step,
+                                                    working_hours, not_before=not_before, limit=limit)
+
+        doctors = self._active_doctors(doctor_ids)
+        selected = sorted(doctors) if doctor_ids is None else sorted(set(doctor_ids) & doctors.keys())
+        schedules = self._get(selected)
+        self.stats['hits'] += 1
+
+        slots = []
+        day = date_from
+        while day <= date_to:
+            for isodow, opens, closes in working_hours:
+                if isodow != day.isoweekday():
+                    continue
+                first = datetime.combine(day, opens)
+                last = datetime.combine(day, closes) - duration
+                for doctor_id in selected:
+                    schedule = schedules[doctor_id]
+                    slot_start = first
+                    while slot_start <= last:
+                        if (not_before is None or slot_start >= not_before) and \
+                                not schedule.conflicts(slot_start, slot_start + duration):
+                            slots.append((slot_start, doctor_id))
+                        slot_start += step
+            day += timedelta(days=1)
+
+        slots.sort()
+        return [
+            {'doctor_id': doctor_id, 'doctor_name': doctors[doctor_id],
+             'start_time': slot_start, 'end_time': slot_start + duration}
+            for slot_start, doctor_id in slots[:limit]
+        ]
+
+    def apply(self, appointment):
+        """
+        Apply an appointment row written by this worker (create, update or status change)
+
+        Args:
+            appointment: Row with appointment_id, doctor_id, start_time, end_time and status
+        """
+        if not self.enabled or not appointment:
+            return
+        appointment_id = appointment['appointment_id']
+        doctor_id = appointment.get('doctor_id')
+        with self._lock:
+            previous = self._owners.pop(appointment_id, None)
+            if previous in self._schedules:
+                schedule, window_start, loaded_at = self._schedules[previous]
+                schedule = schedule.copy()
+                schedule.remove(appointment_id)
+                self._schedules[previous] = (schedule, window_start, loaded_at)
+            for affected in {previous, doctor_id} - {None}:
+                self._versions[affected] = self._versions.get(affected, 0) + 1
+
+            if doctor_id not in self._schedules or appointment.get('status') == 'CANCELLED':
+                return
+            schedule, window_start, loaded_at = self._schedules[doctor_id]
+            window_end = window_start + timedelta(weeks=self.weeks)
+            if appointment['start_time'] < window_end and appointment['end_time'] > window_start:
+                schedule = schedule.copy()
+                schedule.add(appointment_id, appointment['start_time'], appointment['end_time'])
+                self._schedules[doctor_id] = (schedule, window_start, loaded_at)
+                self._owners[appointment_id] = doctor_id
+
+    def invalidate(self, doctor_ids=None):
+        """Drop the given doctors (all of them if None); they reload on the next query"""
+        with self._lock:
+            targets = list(self._schedules) if doctor_ids is None else doctor_ids
+            for doctor_id in targets:
+                self._drop(doctor_id)
+                self._versions[doctor_id] = self._versions.get(doctor_id, 0) + 1
+            if doctor_ids is None:
+                self._epoch += 1
+                self._doctors = None
+            self.stats['invalidations'] += 1
+
+    def handle_notification(self, payload):
+        """Apply an appointments_changed payload; writes of this worker are already applied"""
+        try:
+            change = json.loads(payload)
+        except ValueError:
+            change = {}
+        if change.get('origin') and change.get('origin') == self.worker_id:
+            return
+        self.invalidate(change.get('doctors'))
+
+    def listen(self, timeout=60, stop=None):
+        """
+        Keep the index in step with other workers (LISTEN appointments_changed)
+
+        Blocks until `stop` (threading.Event) is set, reconnecting on errors; the whole
+        index is dropped after (re)connecting, since notifications may have been missed.
+        """
+        while not (stop and stop.is_set()):
+            connection = None
+            try:
+                connection = psycopg2.connect(os.getenv('DATABASE_URL'))
+                connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with connection.cursor() as cursor:
+                    cursor.execute("LISTEN appointments_changed")
+                self.invalidate()
+
+                while not (stop and stop.is_set()):
+                    if select.select([connection], [], [], timeout) != ([], [], []):
+                        connection.poll()
+                        while connection.notifies:
+                            self.handle_notification(connection.notifies.pop(0).payload)
+
+            except Exception as e:
+                print(f"Schedule index listener error: {str(e)}")
+                time.sleep(5)
+            finally:
+                if connection:
+                    connection.close()
+
+
+schedule_index = ScheduleIndex()
@@ -0,0 +1,218 @@
+"""
+Servidor HTTP local que simula la API REST de Google Calendar (v3, calendario primary)
+Usado por los tests para no depender de googleapis.com
+
+Cada token de acceso ("token-<medico>") es un calendario distinto. Cada cambio de un
+evento sube la version del calendario; el syncToken ("<epoca>.<version>") lista los
+eventos cambiados despues de esa version y el pageToken sigue una lectura paginada.
+"""
+import json
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+EVENTS_PATH = '/calendars/primary/events'
+
+
+class _CalendarStubHandler(BaseHTTPRequestHandler):
+    """Atiende list (GET), insert (POST), patch (PATCH) y delete (DELETE) de eventos"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.stub._lock:
+            self.server.stub.conexiones += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _responder(self, status, body=None):
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _atender(self):
+        stub = self.server.stub
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'null')
+        token = self.headers.get('Authorization', '').replace('Bearer ', '')
+        url = urlparse(self.path)
+        path = url.path
+
+        with stub._lock:
+            stub.llamadas.append((self.command, token))
+            status = stub.fallos.pop(0) if stub.fallos else None
+            if status:
+                self._responder(status, {'error': {'code': status, 'message': 'Simulated error'}})
+                return
+            if not token.startswith('token-') or token in stub.tokens_revocados:
+                self._responder(401, {'error': {'code': 401, 'message': 'Invalid Credentials'}})
+                return
+
+            calendario = stub.calendarios.setdefault(token, {})
+            event_id = unquote(path[len(EVENTS_PATH) + 1:]) if path.startswith(EVENTS_PATH + '/') else None
+            evento = calendario.get(event_id)
+
+            if self.command == 'GET' and path == EVENTS_PATH:
+                self._listar(stub, token, parse_qs(url.query))
+            elif self.command == 'POST' and path == EVENTS_PATH:
+                stub._secuencia += 1
+                evento = dict(body, id=f"evt{stub._secuencia}", status='confirmed',
+                              htmlLink=f"https://calendar.local/evt{stub._secuencia}")
+                calendario[evento['id']] = evento
+                stub._tocar(token, evento['id'])
+                self._responder(200, evento)
+            elif evento is None:
+                self._responder(404, {'error': {'code': 404, 'message': 'Not Found'}})
+            elif evento['status'] == 'cancelled':
+                self._responder(410, {'error': {'code': 410, 'message': 'Resource has been deleted'}})
+            elif self.command == 'PATCH':
+                evento.update(body)
+                stub._tocar(token, event_id)
+                self._responder(200, evento)
+            elif self.command == 'DELETE':
+                evento['status'] = 'cancelled'
+                stub._tocar(token, event_id)
+                self._responder(204)
+            else:
+                self._responder(405)
+
+    def _listar(self, stub, token, query):
+        """Eventos cambiados entre dos versiones, por orden de cambio, en paginas de maxResults"""
+        tamano = int(query.get('maxResults', ['250'])[0])
+        if 'pageToken' in query:
+            desde, hasta, inicio = map(int, query['pageToken'][0].split(':'))
+        else:
+            desde, hasta, inicio = 0, stub._version.get(token, 0), 0
+            if 'syncToken' in query:
+                epoca, version = map(int, query['syncToken'][0].split('.'))
+                if epoca != stub._epoca:
+                    self._responder(410, {'error': {'code': 410, 'message': 'Sync token is no longer valid'}})
+                    return
+                desde = version
+
+        versiones = stub._versiones.get(token, {})
+        cambiados = sorted(
+            (version, event_id) for event_id, version in versiones.items() if desde < version <= hasta
+        )
+        pagina = [stub.calendarios[token][event_id] for _, event_id in cambiados[inicio:inicio + tamano]]
+        stub.eventos_listados += len(pagina)
+
+        respuesta = {'kind': 'calendar#events', 'items': pagina}
+        if inicio + tamano < len(cambiados):
+            respuesta['nextPageToken'] = f"{desde}:{hasta}:{inicio + tamano}"
+        else:
+            respuesta['nextSyncToken'] = f"{stub._epoca}.{hasta}"
+        self._responder(200, respuesta)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _atender
+
+
+class CalendarStubServer:
+    """
+    Stand-in local de la API de eventos de Google Calendar
+
+    - calendarios: {token: {event_id: evento}}; los borrados quedan con status cancelled
+    - fallos: codigos HTTP devueltos, en orden, a las siguientes llamadas (None: se atiende)
+    - tokens_revocados: tokens que reciben 401
+    - Registra conexiones TCP, llamadas (metodo, token) y eventos_listados
+    """
+
+    def __init__(self):
+        self.calendarios = {}
+        self.fallos = []
+        self.tokens_revocados = set()
+        self.conexiones = 0
+        self.llamadas = []
+        self.eventos_listados = 0
+        self._secuencia = 0
+        self._epoca = 0
+        self._version = {}
+        self._versiones = {}
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _CalendarStubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def eventos(self, doctor_id, incluir_borrados=False):
+        """Eventos del calendario de un medico"""
+        return [
+            evento for evento in self.calendarios.get(f"token-{doctor_id}", {}).values()
+            if incluir_borrados or evento['status'] != 'cancelled'
+        ]
+
+    def _tocar(self, token, event_id):
+        """Nueva version del calendario para un evento cambiado (con el lock tomado)"""
+        self._version[token] = self._version.get(token, 0) + 1
+        self._versiones.setdefault(token, {})[event_id] = self._version[token]
+
+    def mover_evento(self, doctor_id, event_id, inicio, fin, offset='-05:00'):
+        """El medico cambia la hora del evento en Google Calendar (hora con desfase, como la API)"""
+        token = f"token-{doctor_id}"
+        with self._lock:
+            evento = self.calendarios[token][event_id]
+            evento['start'] = {'dateTime': inicio.isoformat() + offset}
+            evento['end'] = {'dateTime': fin.isoformat() + offset}
+            self._tocar(token, event_id)
+
+    def borrar_evento(self, doctor_id, event_id):
+        """El medico borra el evento en Google Calendar"""
+        token = f"token-{doctor_id}"
+        with self._lock:
+            self.calendarios[token][event_id]['status'] = 'cancelled'
+            self._tocar(token, event_id)
+
+    def crear_evento(self, doctor_id, inicio, fin):
+        """Evento propio del medico, sin cita"""
+        token = f"token-{doctor_id}"
+        with self._lock:
+            self._secuencia += 1
+            evento = {'id': f"evt{self._secuencia}", 'status': 'confirmed', 'summary': 'Personal',
+                      'start': {'dateTime': inicio.isoformat() + '-05:00'},
+                      'end': {'dateTime': fin.isoformat() + '-05:00'}}
+            self.calendarios.setdefault(token, {})[evento['id']] = evento
+            self._tocar(token, evento['id'])
+            return evento['id']
+
+    def expirar_sync_tokens(self):
+        """Google invalida todos los syncToken emitidos (responden 410)"""
+        with self._lock:
+            self._epoca += 1
+
+    @contextmanager
+    def simular_caida(self, status=503):
+        """Toda llamada dentro del bloque responde `status`"""
+        with self._lock:
+            self.fallos = [status] * 10000
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self.fallos = []
@@ -0,0 +1,75 @@
+"""
+Fixtures compartidas: base PostgreSQL de pruebas (TEST_DATABASE_URL con el esquema de
+init_database.sql) y medicos temporales con sus citas
+"""
+import os
+import sys
+import uuid
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+# Los tests drenan y leen Google Calendar ellos mismos: sin hilos en segundo plano
+os.environ.setdefault('CITAS_CALENDAR_SYNC_INTERVAL', '0')
+os.environ.setdefault('CITAS_CALENDAR_PULL_INTERVAL', '0')
+
+# Scripts de esquema del servicio, en orden (todos son idempotentes)
+MIGRACIONES = ['add_appointment_availability.sql', 'add_appointment_change_notify.sql',
+               'add_calendar_sync_outbox.sql', 'add_calendar_sync_state.sql']
+
+
+@pytest.fixture(scope='session')
+def base_de_datos():
+    if not TEST_DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL no configurada')
+
+    # El pool se crea al importar common.database: si otro test ya lo abrio, se reabre
+    ya_importado = 'common.database' in sys.modules
+    anterior = os.environ.get('DATABASE_URL')
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+    sys.path.append(BACKEND_DIR)
+    from common.database import db
+    if ya_importado and anterior != TEST_DATABASE_URL:
+        db.close_all_connections()
+        db._initialize_pool()
+
+    for script in MIGRACIONES:
+        with open(os.path.join(BACKEND_DIR, 'scripts', script), encoding='utf-8') as f:
+            with db.get_cursor(commit=True) as cursor:
+                cursor.execute(f.read())
+
+    return db
+
+
+@pytest.fixture
+def agenda(base_de_datos):
+    """Medicos (role_id = 2) propios de cada test; se borran al terminar con sus citas y su cola de calendario"""
+    db = base_de_datos
+    prefijo = f"test-{uuid.uuid4().hex[:8]}"
+    medicos = []
+
+    def medico():
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("""
+                INSERT INTO users (role_id, full_name, email, password_hash)
+                VALUES (2, %s, %s, 'x') RETURNING user_id
+            """, (prefijo, f"{prefijo}-{len(medicos)}@test.local"))
+            medicos.append(cursor.fetchone()['user_id'])
+            return medicos[-1]
+
+    def cita(doctor_id, inicio, fin, estado='PENDING'):
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("""
+                INSERT INTO appointments (doctor_id, start_time, end_time, status)
+                VALUES (%s, %s, %s, %s) RETURNING appointment_id
+            """, (doctor_id, inicio, fin, estado))
+            return cursor.fetchone()['appointment_id']
+
+    yield medico, cita
+
+    with db.get_cursor(commit=True) as cursor:
+        cursor.execute("DELETE FROM appointments WHERE doctor_id = ANY(%s)", (medicos,))
+        cursor.execute("DELETE FROM calendar_sync_outbox WHERE doctor_id = ANY(%s)", (medicos,))
+        cursor.execute("DELETE FROM users WHERE user_id = ANY(%s)", (medicos,))
@@ -0,0 +1,186 @@
+"""
+Tests de disponibilidad de medicos (rango indexado, exclusion de doble agendamiento y
+busqueda de horarios libres)
+
+Las pruebas de validacion no usan base de datos; el resto necesita PostgreSQL con
+btree_gist (TEST_DATABASE_URL, ver conftest.py) y se omite si no existe.
+"""
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from availability import parse_working_hours, slot_search, validate_time_range
+
+# 2030-06-03 es lunes, 2030-06-08 sabado y 2030-06-09 domingo
+LUNES = date(2030, 6, 3)
+
+
+def _h(dia, hora):
+    return datetime.combine(dia, time.fromisoformat(hora))
+
+
+# ============= VALIDACION (sin base de datos) =============
+
+def test_horario_de_atencion():
+    assert parse_working_hours('1-2=09:00-13:00,15:00-19:00;6=09:00-12:00') == [
+        (1, time(9), time(13)), (1, time(15), time(19)),
+        (2, time(9), time(13)), (2, time(15), time(19)),
+        (6, time(9), time(12)),
+    ]
+    for invalido in ('1-5=13:00-09:00', '0=09:00-13:00', '5-8=09:00-13:00', 'lunes=09:00-13:00', '1=9-13'):
+        with pytest.raises(ValueError):
+            parse_working_hours(invalido)
+
+
+def test_parametros_de_busqueda():
+    busqueda = slot_search({'doctor_ids': '7,2,7', 'date_from': '2030-06-03', 'duration': '45'})
+    assert busqueda['doctor_ids'] == [2, 7]
+    assert busqueda['date_to'] == busqueda['date_from'] == LUNES
+    assert (busqueda['duration'], busqueda['step']) == (timedelta(minutes=45), timedelta(minutes=30))
+    assert slot_search({}, today=LUNES)['doctor_ids'] is None
+
+    invalidos = [
+        {'date_from': '2030-06-03', 'date_to': '2030-06-01'},
+        {'date_from': '2030-06-01', 'date_to': '2030-12-31'},
+        {'date_from': '03/06/2030'},
+        {'duration': '5'},
+        {'duration': '121'},
+        {'step': 'x'},
+        {'doctor_ids': '2,a'},
+        {'doctor_ids': '0'},
+        {'limit': '0'},
+    ]
+    for args in invalidos:
+        with pytest.raises(ValueError):
+            slot_search(args, today=LUNES)
+
+
+def test_duracion_de_la_cita():
+    validate_time_range(_h(LUNES, '09:00'), _h(LUNES, '09:15'))
+    for inicio, fin in (('09:00', '09:00'), ('10:00', '09:00'), ('09:00', '09:10'), ('09:00', '11:30')):
+        with pytest.raises(ValueError):
+            validate_time_range(_h(LUNES, inicio), _h(LUNES, fin))
+
+
+# ============= POSTGRESQL =============
+
+@pytest.fixture(scope='module')
+def modelos(base_de_datos):
+    import models
+    return models
+
+
+def test_exclusion_impide_doble_agendamiento_concurrente(modelos, agenda):
+    import psycopg2.errors
+    medico, _ = agenda
+    doctor = medico()
+
+    # 12 intentos simultaneos que se solapan en distintos grados: solo uno entra
+    def reservar(minuto):
+        try:
+            return modelos.AppointmentModel.create(
+                None, doctor, _h(LUNES, '10:00') + timedelta(minutes=minuto),
+                _h(LUNES, '10:30') + timedelta(minutes=minuto), 'Consulta'
+            )
+        except psycopg2.errors.ExclusionViolation:
+            return None
+
+    with ThreadPoolExecutor(max_workers=12) as executor:
+        creadas = [cita for cita in executor.map(reservar, range(0, 24, 2)) if cita]
+    assert len(creadas) == 1
+
+
+def test_citas_seguidas_y_canceladas(modelos, agenda):
+    import psycopg2.errors
+    medico, cita = agenda
+    doctor, otro = medico(), medico()
+    primera = cita(doctor, _h(LUNES, '10:00'), _h(LUNES, '10:30'))
+
+    # [inicio, fin): la siguiente puede empezar justo cuando termina la anterior
+    cita(doctor, _h(LUNES, '10:30'), _h(LUNES, '11:00'))
+    cita(otro, _h(LUNES, '10:00'), _h(LUNES, '10:30'))
+    with pytest.raises(psycopg2.errors.ExclusionViolation):
+        cita(doctor, _h(LUNES, '10:15'), _h(LUNES, '10:45'))
+
+    disponible = modelos.AppointmentModel.check_availability
+    assert not disponible(doctor, _h(LUNES, '10:29'), _h(LUNES, '10:31'))
+    assert disponible(doctor, _h(LUNES, '11:00'), _h(LUNES, '11:30'))
+    assert disponible(doctor, _h(LUNES, '09:30'), _h(LUNES, '10:15'), exclude_appointment_id=primera)
+
+    # Una cita cancelada libera el horario; reabrirla con el horario ocupado falla
+    modelos.AppointmentModel.update_status(primera, 'CANCELLED')
+    assert disponible(doctor, _h(LUNES, '10:00'), _h(LUNES, '10:30'))
+    cita(doctor, _h(LUNES, '10:00'), _h(LUNES, '10:30'))
+    with pytest.raises(psycopg2.errors.ExclusionViolation):
+        modelos.AppointmentModel.update_status(primera, 'PENDING')
+    with pytest.raises(psycopg2.errors.ExclusionViolation):
+        modelos.AppointmentModel.update(primera, status='CONFIRMED')
+
+
+def test_cambio_de_estado_devuelve_el_anterior(modelos, agenda):
+    medico, cita = agenda
+    primera = cita(medico(), _h(LUNES, '10:00'), _h(LUNES, '10:30'), 'CONFIRMED')
+    actualizar = modelos.AppointmentModel.update_status
+
+    completada = actualizar(primera, 'COMPLETED')
+    assert (completada['status'], completada['previous_status']) == ('COMPLETED', 'CONFIRMED')
+    # Completarla otra vez se ve como repetida (no vuelve a consumir stock)
+    assert actualizar(primera, 'COMPLETED')['previous_status'] == 'COMPLETED'
+
+    # Deshacer solo si nadie la cambio mientras tanto
+    assert actualizar(primera, 'CONFIRMED', expected_status='CANCELLED') is None
+    assert actualizar(primera, 'CONFIRMED', expected_status='COMPLETED')['status'] == 'CONFIRMED'
+    assert actualizar(-1, 'CONFIRMED') is None
+
+
+def test_agenda_del_dia_por_rango(modelos, agenda):
+    medico, cita = agenda
+    doctor = medico()
+    martes = LUNES + timedelta(days=1)
+    cita(doctor, _h(LUNES, '09:00'), _h(LUNES, '09:30'))
+    cita(doctor, _h(LUNES, '23:30'), _h(martes, '00:30'))
+    cita(doctor, _h(martes, '09:00'), _h(martes, '09:30'), 'CANCELLED')
+    cita(doctor, _h(martes, '10:00'), _h(martes, '10:30'))
+
+    dia = modelos.AppointmentModel.get_doctor_schedule
+    assert [fila['start_time'].hour for fila in dia(doctor, LUNES.isoformat())] == [9, 23]
+    assert [fila['start_time'].hour for fila in dia(doctor, martes.isoformat())] == [23, 10]
+
+
+def test_horarios_libres_de_varios_medicos(modelos, agenda, base_de_datos):
+    from availability import parse_working_hours
+    medico, cita = agenda
+    ana, luis = medico(), medico()
+    horario = parse_working_hours('1-6=09:00-11:00')
+
+    cita(ana, _h(LUNES, '09:00'), _h(LUNES, '09:45'))
+    cita(ana, _h(LUNES, '10:30'), _h(LUNES, '12:00'))
+    cita(ana, _h(LUNES, '10:00'), _h(LUNES, '10:30'), 'CANCELLED')
+    cita(luis, _h(LUNES, '09:30'), _h(LUNES, '10:30'))
+
+    def libres(**kwargs):
+        parametros = {'date_from': LUNES, 'date_to': LUNES, 'duration': timedelta(minutes=30),
+                      'step': timedelta(minutes=30), 'working_hours': horario, **kwargs}
+        return [(fila['doctor_id'], fila['start_time'].strftime('%H:%M'), fila['end_time'].strftime('%H:%M'))
+                for fila in modelos.AppointmentModel.find_free_slots([ana, luis], **parametros)]
+
+    assert libres() == [(luis, '09:00', '09:30'), (ana, '10:00', '10:30'), (luis, '10:30', '11:00')]
+    assert libres(step=timedelta(minutes=15)) == [
+        (luis, '09:00', '09:30'), (ana, '09:45', '10:15'), (ana, '10:00', '10:30'), (luis, '10:30', '11:00')
+    ]
+    assert libres(duration=timedelta(minutes=60)) == []
+    assert libres(not_before=_h(LUNES, '09:50'), limit=1) == [(ana, '10:00', '10:30')]
+
+    # Sabado abierto, domingo cerrado: cuatro horarios por medico
+    domingo = LUNES + timedelta(days=6)
+    assert len(libres(date_from=domingo - timedelta(days=1), date_to=domingo)) == 8
+
+    # Solo medicos activos (role_id = 2)
+    with base_de_datos.get_cursor(commit=True) as cursor:
+        cursor.execute("UPDATE users SET is_active = FALSE WHERE user_id = %s", (luis,))
+    assert {doctor for doctor, _, _ in libres()} == {ana}
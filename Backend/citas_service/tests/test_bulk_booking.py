@@ -0,0 +1,137 @@
+"""
+Tests de reservas en lote y recurrentes (POST /appointments/bulk): expansion y validacion
+de los horarios, todo o nada ante conflictos y reporte por horario
+
+La expansion no usa base de datos; el resto necesita PostgreSQL (TEST_DATABASE_URL, ver
+conftest.py) y se omite si no existe.
+"""
+import os
+import sys
+import threading
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from availability import BULK_BOOKING_LIMIT, booking_slots
+
+LUNES = datetime.combine(date.today() + timedelta(days=7 - date.today().weekday() + 7), time(10))
+
+
+def _serie(semanas, inicio=LUNES, minutos=30):
+    return [(inicio + timedelta(weeks=n), inicio + timedelta(weeks=n, minutes=minutos)) for n in range(semanas)]
+
+
+# ============= EXPANSION (sin base de datos) =============
+
+def test_recurrencia_semanal_y_numero_de_sesiones():
+    fin = LUNES + timedelta(minutes=45)
+    recurrencia = {'start_time': LUNES.isoformat(), 'end_time': fin.isoformat()}
+
+    horarios = booking_slots({'recurrence': dict(recurrencia, count=4)})
+    assert horarios == _serie(4, minutos=45)
+
+    # Sin count se usan las sesiones del plan de tratamiento
+    assert len(booking_slots({'recurrence': recurrencia}, sessions=6)) == 6
+    cada_dos_dias = booking_slots({'recurrence': dict(recurrencia, count=3, every_days=2)})
+    assert [inicio.day for inicio, _ in cada_dos_dias] == \
+        [(LUNES + timedelta(days=n)).day for n in (0, 2, 4)]
+
+    with pytest.raises(ValueError, match='recurrence.count'):
+        booking_slots({'recurrence': recurrencia})
+    with pytest.raises(ValueError, match='recurrence.count'):
+        booking_slots({'recurrence': dict(recurrencia, count=BULK_BOOKING_LIMIT + 1)})
+
+
+def test_horarios_invalidos_se_reportan_por_posicion():
+    def horario(inicio, minutos=30):
+        return {'start_time': inicio.isoformat(), 'end_time': (inicio + timedelta(minutes=minutos)).isoformat()}
+
+    assert booking_slots({'slots': [horario(LUNES + timedelta(days=1)), horario(LUNES)]}) == [
+        (LUNES + timedelta(days=1), LUNES + timedelta(days=1, minutes=30)),
+        (LUNES, LUNES + timedelta(minutes=30)),
+    ]
+
+    with pytest.raises(ValueError, match=r'slots\[1\]: end_time must be after start_time'):
+        booking_slots({'slots': [horario(LUNES), horario(LUNES, -30)]})
+    with pytest.raises(ValueError, match=r'slots\[1\]\.start_time'):
+        booking_slots({'slots': [horario(LUNES), {'start_time': 'manana', 'end_time': 'x'}]})
+    with pytest.raises(ValueError, match=r'slots\[0\] and slots\[2\] overlap'):
+        booking_slots({'slots': [horario(LUNES), horario(LUNES + timedelta(days=1)),
+                                 horario(LUNES + timedelta(minutes=15))]})
+    with pytest.raises(ValueError, match='time zone'):
+        booking_slots({'slots': [horario(LUNES), {'start_time': '2030-01-01T10:00:00Z',
+                                                  'end_time': '2030-01-01T10:30:00Z'}]})
+    with pytest.raises(ValueError, match='slots or recurrence'):
+        booking_slots({})
+    with pytest.raises(ValueError, match='cannot exceed'):
+        booking_slots({'slots': [horario(LUNES + timedelta(hours=n)) for n in range(BULK_BOOKING_LIMIT + 1)]})
+
+
+# ============= POSTGRESQL =============
+
+@pytest.fixture(scope='module')
+def modelos(base_de_datos):
+    import models
+    return models
+
+
+def _citas(base_de_datos, doctor_id):
+    with base_de_datos.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT start_time, status FROM appointments WHERE doctor_id = %s ORDER BY start_time
+        """, (doctor_id,))
+        return cursor.fetchall()
+
+
+def test_serie_se_crea_en_una_transaccion(modelos, agenda, base_de_datos):
+    medico, _ = agenda
+    doctor = medico()
+
+    resultado = modelos.AppointmentModel.create_many(None, doctor, _serie(8)[::-1], 'Sesion')
+    assert resultado['conflicts'] == []
+    assert [cita['start_time'] for cita in resultado['appointments']] == [inicio for inicio, _ in _serie(8)]
+    assert all(cita['doctor_id'] == doctor and cita['reason'] == 'Sesion' for cita in resultado['appointments'])
+    assert len(_citas(base_de_datos, doctor)) == 8
+
+
+def test_conflictos_por_horario_sin_escrituras_parciales(modelos, agenda, base_de_datos):
+    medico, cita = agenda
+    doctor = medico()
+    ocupada = cita(doctor, LUNES + timedelta(weeks=2, minutes=15), LUNES + timedelta(weeks=2, minutes=45))
+    cita(doctor, LUNES + timedelta(weeks=4), LUNES + timedelta(weeks=4, minutes=30), 'CANCELLED')
+    cita(doctor, LUNES + timedelta(weeks=5, minutes=30), LUNES + timedelta(weeks=5, hours=1))   # contigua
+
+    resultado = modelos.AppointmentModel.create_many(None, doctor, _serie(6))
+    assert resultado['appointments'] == []
+    assert [(c['slot'], c['appointment_id']) for c in resultado['conflicts']] == [(2, ocupada)]
+    assert len(_citas(base_de_datos, doctor)) == 3
+
+    # Sin la cita ocupada la misma serie entra completa (la cancelada no cuenta)
+    with base_de_datos.get_cursor(commit=True) as cursor:
+        cursor.execute("DELETE FROM appointments WHERE appointment_id = %s", (ocupada,))
+    assert len(modelos.AppointmentModel.create_many(None, doctor, _serie(6))['appointments']) == 6
+
+
+def test_series_concurrentes_solo_una_gana(modelos, agenda, base_de_datos):
+    medico, _ = agenda
+    doctor = medico()
+    barrera = threading.Barrier(4)
+    resultados = []
+
+    def reservar(desplazamiento):
+        barrera.wait()
+        serie = _serie(10, LUNES + timedelta(minutes=desplazamiento))
+        resultados.append(modelos.AppointmentModel.create_many(None, doctor, serie))
+
+    hilos = [threading.Thread(target=reservar, args=(n * 5,)) for n in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join(10)
+
+    ganadoras = [r for r in resultados if r['appointments']]
+    assert len(resultados) == 4 and len(ganadoras) == 1
+    assert all(r['conflicts'] for r in resultados if not r['appointments'])
+    assert len(_citas(base_de_datos, doctor)) == 10
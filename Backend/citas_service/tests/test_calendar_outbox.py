@@ -0,0 +1,298 @@
+"""
+Tests de la sincronizacion con Google Calendar por outbox: encolado transaccional por
+triggers, drenado en lotes contra una API de calendario local, reintentos y cache de
+tokens por medico
+
+El evento y la cache de tokens no usan base de datos; el resto necesita PostgreSQL
+(TEST_DATABASE_URL, ver conftest.py) y se omite si no existe.
+"""
+import os
+import sys
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from calendar_stub import CalendarStubServer
+
+DIA = datetime.combine(date.today() + timedelta(days=10), time())
+
+
+def _h(hora):
+    return datetime.combine(DIA.date(), time.fromisoformat(hora))
+
+
+# ============= EVENTO Y TOKENS (sin base de datos) =============
+
+def test_evento_de_una_cita():
+    from calendar_outbox import appointment_event
+    evento = appointment_event({
+        'appointment_id': 7, 'patient_name': 'Ana Perez', 'patient_email': 'ana@test.local',
+        'doctor_name': 'Dr. Luis', 'reason': None, 'start_time': _h('10:00'), 'end_time': _h('10:30'),
+    })
+    assert evento['summary'] == 'Cita: Ana Perez'
+    assert 'Motivo: No especificado' in evento['description']
+    assert evento['start'] == {'dateTime': _h('10:00').isoformat(), 'timeZone': 'America/Guayaquil'}
+    assert evento['attendees'] == [{'email': 'ana@test.local'}]
+    assert evento['extendedProperties']['private']['appointment_id'] == '7'
+
+    sin_paciente = appointment_event({'appointment_id': 8, 'start_time': _h('11:00'), 'end_time': _h('11:30')})
+    assert sin_paciente['summary'] == 'Cita: Sin paciente' and 'attendees' not in sin_paciente
+
+
+def test_tokens_se_cachean_por_medico_hasta_expirar():
+    from calendar_outbox import TokenCache
+    cargas = []
+
+    def proveedor(doctor_id):
+        cargas.append(doctor_id)
+        if doctor_id == 3:
+            return None
+        expira = datetime.utcnow() + (timedelta(seconds=30) if doctor_id == 2 else timedelta(hours=1))
+        return f"token-{doctor_id}", expira
+
+    tokens = TokenCache(proveedor)
+    assert [tokens.get(1) for _ in range(3)] == ['token-1'] * 3
+    assert tokens.get(3) is None and tokens.get(3) is None
+    # Vence en menos de un minuto: se pide de nuevo cada vez
+    assert tokens.get(2) == tokens.get(2) == 'token-2'
+    assert cargas == [1, 3, 2, 2]
+
+    tokens.invalidate(1)
+    tokens.get(1)
+    assert cargas[-1] == 1 and tokens.loads == 5
+
+
+# ============= POSTGRESQL =============
+
+@pytest.fixture(scope='module')
+def modelos(base_de_datos):
+    import models
+    return models
+
+
+@pytest.fixture
+def calendario():
+    with CalendarStubServer() as server:
+        yield server
+
+
+@pytest.fixture
+def conectados():
+    """Medicos con Google Calendar conectado (el resto no tiene token)"""
+    return set()
+
+
+@pytest.fixture
+def worker(base_de_datos, calendario, conectados):
+    from calendar_outbox import CalendarSyncWorker, GoogleCalendarClient
+    cargas = []
+
+    def proveedor(doctor_id):
+        cargas.append(doctor_id)
+        return (f"token-{doctor_id}", None) if doctor_id in conectados else None
+
+    worker = CalendarSyncWorker(client=GoogleCalendarClient(calendario.base_url), token_provider=proveedor,
+                                batch_size=10, workers=4, max_attempts=3, backoff=30)
+    worker.cargas = cargas
+    return worker
+
+
+def _cola(base_de_datos, doctores):
+    with base_de_datos.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT appointment_id, doctor_id, operation, google_event_id, status, attempts,
+                   available_at > NOW() as waiting
+            FROM calendar_sync_outbox
+            WHERE doctor_id = ANY(%s)
+            ORDER BY outbox_id
+        """, (list(doctores),))
+        return cursor.fetchall()
+
+
+def _evento_de(base_de_datos, appointment_id):
+    with base_de_datos.get_cursor() as cursor:
+        cursor.execute("SELECT google_event_id FROM appointments WHERE appointment_id = %s", (appointment_id,))
+        return cursor.fetchone()['google_event_id']
+
+
+def test_cada_escritura_encola_en_su_transaccion(modelos, agenda, base_de_datos):
+    medico, _ = agenda
+    ana, luis = medico(), medico()
+
+    cita = modelos.AppointmentModel.create(None, ana, _h('09:00'), _h('09:30'), 'Control')['appointment_id']
+    modelos.AppointmentModel.update(cita, reason='Control anual')
+    # Solo el evento: no encola
+    with base_de_datos.get_cursor(commit=True) as cursor:
+        cursor.execute("UPDATE appointments SET google_event_id = 'evt-x' WHERE appointment_id = %s", (cita,))
+    modelos.AppointmentModel.update(cita, doctor_id=luis)
+    modelos.AppointmentModel.update_status(cita, 'CANCELLED')
+    modelos.AppointmentModel.update_status(cita, 'PENDING')
+    with base_de_datos.get_cursor(commit=True) as cursor:
+        cursor.execute("DELETE FROM appointments WHERE appointment_id = %s", (cita,))
+
+    # Una transaccion revertida no deja nada
+    with pytest.raises(RuntimeError):
+        with base_de_datos.get_cursor(commit=True) as cursor:
+            cursor.execute("INSERT INTO appointments (doctor_id, start_time, end_time) VALUES (%s, %s, %s)",
+                           (ana, _h('12:00'), _h('12:30')))
+            raise RuntimeError('rollback')
+
+    assert [(fila['doctor_id'], fila['operation'], fila['google_event_id']) for fila in _cola(base_de_datos, [ana, luis])] == [
+        (ana, 'UPSERT', None),
+        (ana, 'UPSERT', None),
+        (ana, 'DELETE', 'evt-x'),      # movida a otro medico
+        (luis, 'UPSERT', None),
+        (luis, 'DELETE', 'evt-x'),     # cancelada
+        (luis, 'UPSERT', None),        # reabierta
+        (luis, 'DELETE', 'evt-x'),     # borrada
+    ]
+
+
+def test_drenado_crea_actualiza_y_borra_eventos(modelos, agenda, base_de_datos, worker, calendario, conectados):
+    medico, _ = agenda
+    ana, luis, sin_calendario = medico(), medico(), medico()
+    conectados.update({ana, luis})
+
+    citas = [
+        modelos.AppointmentModel.create(None, doctor, _h(hora), _h(hora) + timedelta(minutes=30), 'Control')
+        for doctor, hora in ((ana, '09:00'), (ana, '10:00'), (luis, '09:00'), (sin_calendario, '09:00'))
+    ]
+    # Dos cambios antes del drenado: se envia solo el ultimo estado
+    modelos.AppointmentModel.update(citas[0]['appointment_id'], reason='Primera sesion')
+
+    metricas = worker.drain()
+    assert metricas['synced'] == 3 and metricas['superseded'] == 1 and metricas['skipped'] >= 1
+    assert sorted(e['description'].split('\n')[2] for e in calendario.eventos(ana)) == \
+        ['Motivo: Control', 'Motivo: Primera sesion']
+    assert len(calendario.eventos(luis)) == 1
+    assert {fila['status'] for fila in _cola(base_de_datos, [sin_calendario])} == {'SKIPPED'}
+
+    evento = _evento_de(base_de_datos, citas[0]['appointment_id'])
+    assert evento in calendario.calendarios[f"token-{ana}"]
+    assert {fila['status'] for fila in _cola(base_de_datos, [ana, luis])} == {'DONE'}
+
+    # Editar actualiza el mismo evento; cancelar lo borra
+    modelos.AppointmentModel.update(citas[0]['appointment_id'], start_time=_h('11:00'), end_time=_h('11:45'))
+    modelos.AppointmentModel.update_status(citas[1]['appointment_id'], 'CANCELLED')
+    worker.drain()
+    assert calendario.calendarios[f"token-{ana}"][evento]['start']['dateTime'] == _h('11:00').isoformat()
+    assert len(calendario.eventos(ana)) == 1
+    assert _evento_de(base_de_datos, citas[1]['appointment_id']) is None
+    assert _evento_de(base_de_datos, citas[0]['appointment_id']) == evento
+
+    # Mover la cita a otro medico: sale de un calendario y entra al otro
+    modelos.AppointmentModel.update(citas[0]['appointment_id'], doctor_id=luis)
+    worker.drain()
+    assert calendario.eventos(ana) == [] and len(calendario.eventos(luis)) == 2
+    assert _evento_de(base_de_datos, citas[0]['appointment_id']) != evento
+
+    # Un token por medico en todo el proceso, sobre conexiones reutilizadas
+    assert sorted(d for d in worker.cargas if d in (ana, luis)) == sorted([ana, luis])
+    assert calendario.conexiones < len(calendario.llamadas)
+
+
+def test_evento_borrado_en_google_se_recrea(modelos, agenda, base_de_datos, worker, calendario, conectados):
+    medico, _ = agenda
+    ana = medico()
+    conectados.add(ana)
+    cita = modelos.AppointmentModel.create(None, ana, _h('09:00'), _h('09:30'), 'Control')['appointment_id']
+    worker.drain()
+    anterior = _evento_de(base_de_datos, cita)
+    calendario.calendarios[f"token-{ana}"][anterior]['status'] = 'cancelled'
+
+    modelos.AppointmentModel.update(cita, reason='Control anual')
+    worker.drain()
+    nuevo = _evento_de(base_de_datos, cita)
+    assert nuevo != anterior and [e['id'] for e in calendario.eventos(ana)] == [nuevo]
+
+
+def test_reintentos_con_espera_y_fallo_definitivo(modelos, agenda, base_de_datos, worker, calendario, conectados):
+    medico, _ = agenda
+    ana, luis = medico(), medico()
+    conectados.update({ana, luis})
+    for hora in ('09:00', '10:00', '11:00'):
+        modelos.AppointmentModel.create(None, ana, _h(hora), _h(hora) + timedelta(minutes=30), 'Control')
+    modelos.AppointmentModel.create(None, luis, _h('09:00'), _h('09:30'), 'Control')
+
+    # Google no responde: la primera fila espera su reintento y las demas del medico no gastan intentos
+    with calendario.simular_caida():
+        metricas = worker.drain()
+    assert metricas['retried'] >= 4 and metricas['synced'] == 0
+    cola = _cola(base_de_datos, [ana])
+    assert [(fila['status'], fila['attempts'], fila['waiting']) for fila in cola] == \
+        [('PENDING', 1, True), ('PENDING', 0, True), ('PENDING', 0, True)]
+
+    # Cumplida la espera se reintenta; el orden por cita se respeta
+    with base_de_datos.get_cursor(commit=True) as cursor:
+        cursor.execute("UPDATE calendar_sync_outbox SET available_at = NOW() WHERE doctor_id = ANY(%s)", ([ana, luis],))
+    worker.drain()
+    assert len(calendario.eventos(ana)) == 3 and len(calendario.eventos(luis)) == 1
+
+    # Error permanente (400): FAILED sin reintentos; un 401 pide el token de nuevo y reintenta
+    cita = modelos.AppointmentModel.create(None, luis, _h('12:00'), _h('12:30'), None)['appointment_id']
+    calendario.fallos = [400]
+    worker.drain()
+    assert _cola(base_de_datos, [luis])[-1]['status'] == 'FAILED'
+
+    cargas = len(worker.cargas)
+    modelos.AppointmentModel.update(cita, reason='Reintento')
+    calendario.fallos = [401]
+    worker.drain()
+    assert len(worker.cargas) == cargas + 1
+    assert _cola(base_de_datos, [luis])[-1]['status'] == 'DONE'
+
+
+def test_limite_de_intentos(modelos, agenda, base_de_datos, worker, calendario, conectados):
+    medico, _ = agenda
+    ana = medico()
+    conectados.add(ana)
+    modelos.AppointmentModel.create(None, ana, _h('09:00'), _h('09:30'), None)
+    worker.backoff = 0
+
+    with calendario.simular_caida(500):
+        metricas = worker.drain()
+    fila = _cola(base_de_datos, [ana])[0]
+    assert (fila['status'], fila['attempts']) == ('FAILED', 3)
+    assert metricas['retried'] >= 2 and metricas['failed'] >= 1
+
+
+def test_claim_no_entrega_dos_veces_ni_desordena_una_cita(modelos, agenda, base_de_datos):
+    medico, _ = agenda
+    ana = medico()
+    cita = modelos.AppointmentModel.create(None, ana, _h('09:00'), _h('09:30'), None)['appointment_id']
+    modelos.AppointmentModel.update(cita, reason='Cambio')
+    modelos.AppointmentModel.create(None, ana, _h('10:00'), _h('10:30'), None)
+
+    Outbox = modelos.CalendarSyncOutboxModel
+    mias = lambda filas: [f for f in filas if f['doctor_id'] == ana]
+    primero = mias(Outbox.claim(limit=1000))
+    # Arrendadas: otro drenado no las ve
+    assert len(primero) == 3 and mias(Outbox.claim(limit=1000)) == []
+
+    # Solo la primera fila de la cita sigue pendiente: la segunda espera detras de ella
+    Outbox.complete([{'outbox_id': f['outbox_id'], 'status': 'DONE'} for f in primero[1:]] +
+                    [{'outbox_id': primero[0]['outbox_id'], 'status': 'PENDING', 'retry_in': 3600}])
+    modelos.AppointmentModel.update(cita, reason='Otro cambio')
+    assert mias(Outbox.claim(limit=1000)) == []
+
+
+def test_credenciales_ilegibles_se_reintentan(modelos, agenda, base_de_datos, calendario):
+    from calendar_outbox import CalendarSyncWorker, GoogleCalendarClient
+    medico, _ = agenda
+    ana = medico()
+    for hora in ('09:00', '10:00'):
+        modelos.AppointmentModel.create(None, ana, _h(hora), _h(hora) + timedelta(minutes=30), None)
+
+    def proveedor(doctor_id):
+        if doctor_id == ana:
+            raise EOFError('token corrupto')
+        return None
+
+    worker = CalendarSyncWorker(client=GoogleCalendarClient(calendario.base_url), token_provider=proveedor)
+    worker.drain()
+    assert [(fila['status'], fila['attempts']) for fila in _cola(base_de_datos, [ana])] == \
+        [('PENDING', 1), ('PENDING', 0)]
+    assert calendario.llamadas == []
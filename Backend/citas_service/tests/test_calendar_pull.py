@@ -0,0 +1,243 @@
+"""
+Tests de la lectura incremental de Google Calendar: syncToken por medico, cambios
+aplicados a las citas por paginas, conflictos devueltos al calendario y relectura
+completa cuando Google invalida el token
+
+La conversion de eventos no usa base de datos; el resto necesita PostgreSQL
+(TEST_DATABASE_URL, ver conftest.py) y se omite si no existe.
+"""
+import os
+import sys
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from calendar_stub import CalendarStubServer
+
+DIA = datetime.combine(date.today() + timedelta(days=12), time())
+
+
+def _h(hora):
+    return datetime.combine(DIA.date(), time.fromisoformat(hora))
+
+
+# ============= EVENTOS (sin base de datos) =============
+
+def test_cambio_de_un_evento():
+    from calendar_pull import event_change
+    # Hora con desfase (como responde la API): se pasa a la hora local de las citas
+    assert event_change({
+        'id': 'e1', 'status': 'confirmed',
+        'start': {'dateTime': '2026-03-02T15:00:00Z'}, 'end': {'dateTime': '2026-03-02T10:30:00-05:00'},
+    }) == {'event_id': 'e1', 'cancelled': False,
+           'start_time': datetime(2026, 3, 2, 10, 0), 'end_time': datetime(2026, 3, 2, 10, 30)}
+    # Sin desfase vale su zona horaria
+    cambio = event_change({
+        'id': 'e2', 'start': {'dateTime': '2026-03-02T10:00:00', 'timeZone': 'America/Guayaquil'},
+        'end': {'dateTime': '2026-03-02T11:00:00', 'timeZone': 'America/Bogota'},
+    })
+    assert (cambio['start_time'], cambio['end_time']) == (datetime(2026, 3, 2, 10), datetime(2026, 3, 2, 11))
+
+    assert event_change({'id': 'e3', 'status': 'cancelled'}) == {'event_id': 'e3', 'cancelled': True}
+    # Todo el dia: ninguna cita lo es
+    assert event_change({'id': 'e4', 'start': {'date': '2026-03-02'}, 'end': {'date': '2026-03-03'}}) is None
+
+
+# ============= POSTGRESQL =============
+
+@pytest.fixture(scope='module')
+def modelos(base_de_datos):
+    import models
+    return models
+
+
+@pytest.fixture
+def calendario():
+    with CalendarStubServer() as server:
+        yield server
+
+
+@pytest.fixture
+def sincronizacion(base_de_datos, calendario):
+    """Envio (outbox) y lectura sobre el calendario local; todos los medicos conectados"""
+    from calendar_outbox import CalendarSyncWorker, GoogleCalendarClient
+    from calendar_pull import CalendarPullSync
+
+    worker = CalendarSyncWorker(client=GoogleCalendarClient(calendario.base_url),
+                                token_provider=lambda doctor_id: (f"token-{doctor_id}", None))
+    return worker, CalendarPullSync(worker, page_size=2)
+
+
+def _citas(base_de_datos, doctor_id):
+    with base_de_datos.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT appointment_id, start_time, end_time, status, google_event_id
+            FROM appointments WHERE doctor_id = %s ORDER BY appointment_id
+        """, (doctor_id,))
+        return cursor.fetchall()
+
+
+def _pendientes(base_de_datos, doctor_id):
+    with base_de_datos.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT appointment_id, operation FROM calendar_sync_outbox
+            WHERE doctor_id = %s AND status = 'PENDING' ORDER BY outbox_id
+        """, (doctor_id,))
+        return [(fila['appointment_id'], fila['operation']) for fila in cursor.fetchall()]
+
+
+def _estado(base_de_datos, doctor_id):
+    with base_de_datos.get_cursor() as cursor:
+        cursor.execute("SELECT * FROM calendar_sync_state WHERE doctor_id = %s", (doctor_id,))
+        return cursor.fetchone()
+
+
+def _agenda_sincronizada(modelos, medico, worker, horas):
+    """Un medico con una cita por hora, ya enviadas a su calendario"""
+    ana = medico()
+    citas = [
+        modelos.AppointmentModel.create(None, ana, _h(hora), _h(hora) + timedelta(minutes=30), None)['appointment_id']
+        for hora in horas
+    ]
+    worker.drain()
+    return ana, citas
+
+
+def test_solo_se_leen_los_cambios(modelos, agenda, base_de_datos, sincronizacion, calendario):
+    medico, _ = agenda
+    worker, lector = sincronizacion
+    ana, citas = _agenda_sincronizada(modelos, medico, worker, ['09:00', '10:00', '11:00', '12:00', '13:00'])
+
+    # Primera lectura completa: los eventos coinciden con las citas, nada cambia
+    metricas = lector.pull([ana])
+    assert (metricas['events'], metricas['pages'], metricas['full_syncs']) == (5, 3, 1)
+    assert metricas['rescheduled'] == metricas['cancelled'] == 0
+    estado = _estado(base_de_datos, ana)
+    assert estado['sync_token'] and estado['page_token'] is None and estado['locked_until'] is None
+
+    # El medico mueve una cita, borra otra y anota un evento propio en Google Calendar
+    eventos = {fila['appointment_id']: fila['google_event_id'] for fila in _citas(base_de_datos, ana)}
+    calendario.mover_evento(ana, eventos[citas[0]], _h('15:00'), _h('15:45'))
+    calendario.borrar_evento(ana, eventos[citas[1]])
+    calendario.crear_evento(ana, _h('18:00'), _h('19:00'))
+
+    listados = calendario.eventos_listados
+    metricas = lector.pull([ana])
+    assert calendario.eventos_listados - listados == 3
+    assert (metricas['rescheduled'], metricas['cancelled'], metricas['full_syncs']) == (1, 1, 0)
+
+    filas = {fila['appointment_id']: fila for fila in _citas(base_de_datos, ana)}
+    assert (filas[citas[0]]['start_time'], filas[citas[0]]['end_time']) == (_h('15:00'), _h('15:45'))
+    assert (filas[citas[1]]['status'], filas[citas[1]]['google_event_id']) == ('CANCELLED', None)
+    # Cambios que vienen del calendario no vuelven a el
+    assert _pendientes(base_de_datos, ana) == []
+
+    # Sin cambios nuevos no se lista nada
+    listados = calendario.eventos_listados
+    assert lector.pull([ana])['events'] == 0 and calendario.eventos_listados == listados
+
+
+def test_ecos_y_cambios_sin_enviar(modelos, agenda, base_de_datos, sincronizacion, calendario):
+    medico, _ = agenda
+    worker, lector = sincronizacion
+    ana, citas = _agenda_sincronizada(modelos, medico, worker, ['09:00', '10:00'])
+    lector.pull([ana])
+
+    # Lo que el outbox envio vuelve en la lectura siguiente sin cambiar nada
+    modelos.AppointmentModel.update(citas[0], start_time=_h('16:00'), end_time=_h('16:30'))
+    worker.drain()
+    metricas = lector.pull([ana])
+    assert metricas['events'] == 1 and metricas['rescheduled'] == 0
+
+    # Un cambio en la base aun sin enviar gana al del calendario
+    evento = _citas(base_de_datos, ana)[1]['google_event_id']
+    modelos.AppointmentModel.update(citas[1], start_time=_h('17:00'), end_time=_h('17:30'))
+    calendario.mover_evento(ana, evento, _h('08:00'), _h('08:30'))
+    assert lector.pull([ana])['rescheduled'] == 0
+    assert _citas(base_de_datos, ana)[1]['start_time'] == _h('17:00')
+
+    worker.drain()
+    assert calendario.calendarios[f"token-{ana}"][evento]['start']['dateTime'] == _h('17:00').isoformat()
+
+
+def test_conflicto_devuelve_la_hora_de_la_base(modelos, agenda, base_de_datos, sincronizacion, calendario):
+    medico, _ = agenda
+    worker, lector = sincronizacion
+    ana, citas = _agenda_sincronizada(modelos, medico, worker, ['09:00', '10:00', '11:00'])
+    lector.pull([ana])
+    eventos = [fila['google_event_id'] for fila in _citas(base_de_datos, ana)]
+
+    # Una cita cae sobre otra: se queda en su hora y el calendario la recibe de vuelta
+    calendario.mover_evento(ana, eventos[0], _h('11:15'), _h('11:45'))
+    lector.page_size = 10
+    metricas = lector.pull([ana])
+    assert (metricas['rescheduled'], metricas['conflicts']) == (0, 1)
+    assert _citas(base_de_datos, ana)[0]['start_time'] == _h('09:00')
+    assert _pendientes(base_de_datos, ana) == [(citas[0], 'UPSERT')]
+
+    worker.drain()
+    assert calendario.calendarios[f"token-{ana}"][eventos[0]]['start']['dateTime'] == _h('09:00').isoformat()
+    # El evento restaurado vuelve como eco: sin cambios
+    assert lector.pull([ana])['rescheduled'] == 0
+    assert _estado(base_de_datos, ana)['conflicts'] == 1
+
+    # En la misma pagina una cita ocupa la hora que otra deja libre despues
+    calendario.mover_evento(ana, eventos[0], _h('10:00'), _h('10:30'))
+    calendario.mover_evento(ana, eventos[1], _h('14:00'), _h('14:30'))
+    metricas = lector.pull([ana])
+    assert (metricas['rescheduled'], metricas['conflicts']) == (2, 0)
+    assert [fila['start_time'] for fila in _citas(base_de_datos, ana)] == [_h('10:00'), _h('14:00'), _h('11:00')]
+
+
+def test_token_invalidado_relee_todo(modelos, agenda, base_de_datos, sincronizacion, calendario):
+    medico, _ = agenda
+    worker, lector = sincronizacion
+    ana, citas = _agenda_sincronizada(modelos, medico, worker, ['09:00', '10:00', '11:00'])
+    lector.pull([ana])
+    evento = _citas(base_de_datos, ana)[2]['google_event_id']
+
+    calendario.expirar_sync_tokens()
+    calendario.borrar_evento(ana, evento)
+    metricas = lector.pull([ana])
+    assert (metricas['full_syncs'], metricas['events'], metricas['cancelled']) == (1, 3, 1)
+    assert _estado(base_de_datos, ana)['full_syncs'] == 2
+    assert lector.pull([ana])['events'] == 0
+
+
+def test_lectura_interrumpida_sigue_en_su_pagina(modelos, agenda, base_de_datos, sincronizacion, calendario):
+    medico, _ = agenda
+    worker, lector = sincronizacion
+    ana, citas = _agenda_sincronizada(modelos, medico, worker, ['09:00', '10:00', '11:00', '12:00', '13:00'])
+
+    # La segunda pagina falla: la primera queda aplicada y el cursor apunta a la siguiente
+    calendario.fallos = [None, 503]
+    metricas = lector.pull([ana])
+    assert (metricas['pages'], metricas['events'], metricas['errors']) == (1, 2, 1)
+    estado = _estado(base_de_datos, ana)
+    assert estado['sync_token'] is None and estado['page_token'] and '503' in estado['last_error']
+    assert estado['locked_until'] is None
+
+    metricas = lector.pull([ana])
+    assert (metricas['events'], metricas['full_syncs'], metricas['errors']) == (3, 1, 0)
+    assert calendario.eventos_listados == 5
+    assert _estado(base_de_datos, ana)['last_error'] is None
+
+
+def test_cursor_arrendado_y_medico_sin_calendario(modelos, agenda, base_de_datos, calendario):
+    from calendar_outbox import CalendarSyncWorker, GoogleCalendarClient
+    from calendar_pull import CalendarPullSync
+    medico, _ = agenda
+    ana, luis = medico(), medico()
+
+    # Otro worker lo esta leyendo
+    assert [estado['doctor_id'] for estado in modelos.CalendarSyncStateModel.claim([ana])] == [ana]
+
+    worker = CalendarSyncWorker(client=GoogleCalendarClient(calendario.base_url),
+                                token_provider=lambda doctor_id: None)
+    metricas = CalendarPullSync(worker).pull([ana, luis])
+    assert (metricas['doctors'], metricas['skipped']) == (1, 1)
+    assert _estado(base_de_datos, luis)['last_error'] == 'Google Calendar not connected'
+    assert calendario.llamadas == []
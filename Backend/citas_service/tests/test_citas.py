@@ -46,3 +46,12 @@ def test_actualizar_estado_sin_token(client):
         'status': 'completed'
     })
     assert response.status_code == 401
+
+def test_reserva_en_lote_sin_token(client):
+    """Test reservar serie de citas sin autenticación"""
+    response = client.post('/api/citas/appointments/bulk', json={
+        'patient_id': 1,
+        'doctor_id': 1,
+        'recurrence': {'start_time': '2025-12-30T10:00:00', 'end_time': '2025-12-30T10:30:00', 'count': 4}
+    })
+    assert response.status_code == 401
@@ -0,0 +1,161 @@
+"""
+Tests del indice de agenda en memoria (intervalos por medico, escrituras incrementales e
+invalidacion entre procesos con LISTEN appointments_changed)
+
+Las pruebas de intervalos no usan base de datos; el resto necesita PostgreSQL
+(TEST_DATABASE_URL, ver conftest.py) y se omite si no existe.
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time as reloj
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from availability import parse_working_hours
+
+# Dentro de la ventana del indice (hoy + CITAS_SCHEDULE_INDEX_WEEKS semanas)
+DIA = datetime.combine(date.today() + timedelta(days=7), time())
+
+
+def _h(hora):
+    return datetime.combine(DIA.date(), time.fromisoformat(hora))
+
+
+# ============= INTERVALOS (sin base de datos) =============
+
+def test_intervalos_de_un_medico():
+    from schedule_index import DoctorSchedule
+    agenda = DoctorSchedule([(3, _h('11:00'), _h('11:30')), (1, _h('09:00'), _h('10:00'))])
+    agenda.add(2, _h('10:00'), _h('10:30'))
+
+    assert [item[2] for item in agenda.items] == [1, 2, 3]
+    assert agenda.conflicts(_h('09:59'), _h('10:01'))
+    assert not agenda.conflicts(_h('10:30'), _h('11:00'))     # entre dos citas seguidas
+    assert not agenda.conflicts(_h('08:00'), _h('09:00'))
+    assert agenda.conflicts(_h('08:00'), _h('12:00'))
+    assert agenda.conflicts(_h('09:30'), _h('10:30'), exclude_appointment_id=1)
+    assert agenda.conflicts(_h('09:30'), _h('10:15'), exclude_appointment_id=2)
+    assert not agenda.conflicts(_h('10:00'), _h('10:30'), exclude_appointment_id=2)
+
+    copia = agenda.copy()
+    assert copia.remove(2) and not copia.remove(2)
+    assert not copia.conflicts(_h('10:00'), _h('10:30'))
+    assert agenda.conflicts(_h('10:00'), _h('10:30')) and len(agenda) == 3
+
+
+# ============= POSTGRESQL =============
+
+@pytest.fixture(scope='module')
+def modelos(base_de_datos):
+    import models
+    return models
+
+
+@pytest.fixture
+def indice(base_de_datos):
+    from schedule_index import ScheduleIndex
+    return ScheduleIndex(weeks=8, ttl=300, worker_id='este-proceso')
+
+
+def test_indice_responde_igual_que_postgres(modelos, agenda, indice):
+    medico, cita = agenda
+    doctores = [medico() for _ in range(3)]
+    aleatorio = random.Random(11)
+    for doctor in doctores:
+        inicio = _h('08:00')
+        for _ in range(60):
+            inicio += timedelta(minutes=aleatorio.choice([15, 30, 45, 60, 90, 600]))
+            fin = inicio + timedelta(minutes=aleatorio.choice([15, 30, 45]))
+            cita(doctor, inicio, fin, aleatorio.choice(['PENDING', 'CONFIRMED', 'CANCELLED']))
+            inicio = fin
+
+    for _ in range(300):
+        doctor = aleatorio.choice(doctores)
+        inicio = _h('08:00') + timedelta(minutes=aleatorio.randrange(0, 6 * 24 * 60, 5))
+        fin = inicio + timedelta(minutes=aleatorio.choice([15, 30, 60]))
+        assert indice.check_availability(doctor, inicio, fin) == \
+            modelos.AppointmentModel.check_availability(doctor, inicio, fin)
+
+    horario = parse_working_hours('1-5=08:00-12:00,14:00-20:00;6=09:00-13:00')
+    for duracion, paso in ((30, 30), (45, 15)):
+        parametros = (doctores, DIA.date(), DIA.date() + timedelta(days=6),
+                      timedelta(minutes=duracion), timedelta(minutes=paso), horario)
+        assert indice.find_free_slots(*parametros, limit=5000) == \
+            modelos.AppointmentModel.find_free_slots(*parametros, limit=5000)
+    assert indice.stats['loads'] == len(doctores) and indice.stats['fallbacks'] == 0
+
+    # Fuera de la ventana responde PostgreSQL
+    lejos = DIA + timedelta(weeks=10)
+    assert indice.check_availability(doctores[0], lejos, lejos + timedelta(minutes=30))
+    assert indice.stats['fallbacks'] == 1
+
+
+def test_escrituras_actualizan_el_indice_sin_recargar(modelos, agenda, indice):
+    medico, _ = agenda
+    ana, luis = medico(), medico()
+    assert indice.check_availability(ana, _h('10:00'), _h('10:30'))
+    assert indice.check_availability(luis, _h('10:00'), _h('10:30'))
+    cargas = indice.stats['loads']
+
+    cita = modelos.AppointmentModel.create(None, ana, _h('10:00'), _h('10:30'), 'Control')
+    indice.apply(cita)
+    assert not indice.check_availability(ana, _h('10:15'), _h('10:45'))
+
+    # Mover la cita a otro medico y otro horario
+    indice.apply(modelos.AppointmentModel.update(cita['appointment_id'], doctor_id=luis,
+                                                 start_time=_h('11:00'), end_time=_h('11:30')))
+    assert indice.check_availability(ana, _h('10:00'), _h('10:30'))
+    assert not indice.check_availability(luis, _h('11:00'), _h('11:30'))
+    assert indice.check_availability(luis, _h('11:00'), _h('11:30'), exclude_appointment_id=cita['appointment_id'])
+
+    indice.apply(modelos.AppointmentModel.update_status(cita['appointment_id'], 'CANCELLED'))
+    assert indice.check_availability(luis, _h('11:00'), _h('11:30'))
+    indice.apply(modelos.AppointmentModel.update_status(cita['appointment_id'], 'CONFIRMED'))
+    assert not indice.check_availability(luis, _h('11:00'), _h('11:30'))
+
+    assert indice.stats['loads'] == cargas
+
+
+def test_escrituras_de_otro_proceso_invalidan(modelos, agenda, indice, base_de_datos):
+    medico, cita = agenda
+    doctor = medico()
+    detener = threading.Event()
+    oyente = threading.Thread(target=indice.listen, kwargs={'timeout': 0.1, 'stop': detener}, daemon=True)
+    oyente.start()
+
+    def esperar(condicion):
+        limite = reloj.monotonic() + 5
+        while not condicion() and reloj.monotonic() < limite:
+            reloj.sleep(0.05)
+        return condicion()
+
+    try:
+        assert esperar(lambda: indice.stats['invalidations'] >= 1)     # conectado
+        assert indice.check_availability(doctor, _h('09:00'), _h('09:30'))
+
+        # Otro proceso (u otra herramienta) agenda: el indice descarta al medico y recarga
+        cita(doctor, _h('09:00'), _h('09:30'))
+        assert esperar(lambda: not indice.check_availability(doctor, _h('09:00'), _h('09:30')))
+
+        # Cambios que no tocan la agenda no avisan
+        invalidaciones = indice.stats['invalidations']
+        with base_de_datos.get_cursor(commit=True) as cursor:
+            cursor.execute("UPDATE appointments SET reason = 'Nota' WHERE doctor_id = %s", (doctor,))
+        reloj.sleep(0.5)
+        assert indice.stats['invalidations'] == invalidaciones
+    finally:
+        detener.set()
+        oyente.join(5)
+
+    # Las escrituras propias ya estan aplicadas: el aviso se ignora
+    indice.check_availability(doctor, _h('12:00'), _h('12:30'))
+    indice.handle_notification(json.dumps({'origin': 'este-proceso', 'doctors': [doctor]}))
+    assert doctor in indice._schedules
+    indice.handle_notification(json.dumps({'origin': 'otro-proceso', 'doctors': None}))
+    assert indice._schedules == {}
@@ -3,12 +3,159 @@ Email Service
 Handles email sending with HTML templates for appointment reminders
 """
 import smtplib
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.image import MIMEImage
-from datetime import datetime
 import os
 
+from common.rate_limiting import TokenBucket
+from common.reminder_templates import reminder_templates
+
+# Persistent SMTP connections per account, and messages per second sent through them (0 = no limit)
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', 4))
+SMTP_RATE_LIMIT = float(os.getenv('SMTP_RATE_LIMIT', 10))
+# A connection is replaced after this many messages, or if idle longer than SMTP_IDLE_TIMEOUT seconds
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv('SMTP_MAX_MESSAGES_PER_CONNECTION', 100))
+SMTP_IDLE_TIMEOUT = int(os.getenv('SMTP_IDLE_TIMEOUT', 60))
+SMTP_TIMEOUT = int(os.getenv('SMTP_TIMEOUT', 30))
+# Errors kept in a send_many summary
+SUMMARY_MAX_ERRORS = 20
+
+
+def _is_timeout(error):
+    """A read or write timed out (smtplib reports it as SMTPServerDisconnected)"""
+    return isinstance(error, socket.timeout) or isinstance(error.__context__, socket.timeout)
+
+
+def _is_disconnect(error):
+    """
+    The connection is gone (the message was not accepted): reconnect and send again
+
+    A timeout is not a disconnect: it may come after DATA, once the server has the
+    message, and sending it again would deliver it twice.
+    """
+    if _is_timeout(error):
+        return False
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code == 421
+    return isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError))
+
+
+class _PooledConnection:
+    """One SMTP session of a pool, opened on first use and reopened when it breaks"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.server = None
+        self.messages = 0
+        self.last_used = 0.0
+
+    def close(self, quit=True):
+        if self.server is not None:
+            try:
+                if quit:
+                    self.server.quit()
+                else:
+                    self.server.close()
+            except Exception:
+                self.server.close()
+        self.server = None
+        self.messages = 0
+
+    def sendmail(self, from_addr, to_addrs, message):
+        """Send over this session; a dropped connection is reopened and the message sent once more"""
+        if self.server is not None and time.monotonic() - self.last_used > self.pool.idle_timeout:
+            self.close()
+
+        for attempt in (1, 2):
+            if self.server is None:
+                self.server = self.pool.open()
+            try:
+                self.server.sendmail(from_addr, to_addrs, message)
+                break
+            except Exception as e:
+                if _is_timeout(e):
+                    # The session is in an unknown state: drop it (no QUIT, it would wait again)
+                    self.close(quit=False)
+                    raise
+                if not _is_disconnect(e):
+                    raise
+                self.close()
+                if attempt == 2:
+                    raise
+                self.pool.count('reconnects')
+
+        self.messages += 1
+        self.last_used = time.monotonic()
+        if self.messages >= self.pool.max_messages:
+            self.close()
+
+
+class SMTPConnectionPool:
+    """
+    Authenticated SMTP connections of one account, kept open between messages
+
+    At most `size` sessions; a sender waits for a free one. Shared by every EmailService
+    of the process with the same account (see get_smtp_pool).
+    """
+
+    def __init__(self, connect, size=SMTP_POOL_SIZE, rate_limit=SMTP_RATE_LIMIT,
+                 max_messages=SMTP_MAX_MESSAGES_PER_CONNECTION, idle_timeout=SMTP_IDLE_TIMEOUT):
+        self._connect = connect
+        self.size = size
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self.limiter = TokenBucket(rate_limit)
+        self.stats = {'connections': 0, 'reconnects': 0}
+        self._lock = threading.Lock()
+        # LIFO: the most recently used (already open) sessions first
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(_PooledConnection(self))
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def open(self):
+        server = self._connect()
+        self.count('connections')
+        return server
+
+    def sendmail(self, from_addr, to_addrs, message):
+        """Send one message at the pool's rate over a free session"""
+        self.limiter.acquire()
+        connection = self._idle.get()
+        try:
+            connection.sendmail(from_addr, to_addrs, message)
+        finally:
+            self._idle.put(connection)
+
+    def close_all(self):
+        """QUIT every open session (they reopen on the next message)"""
+        connections = [self._idle.get() for _ in range(self.size)]
+        for connection in connections:
+            connection.close()
+            self._idle.put(connection)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_smtp_pool(service):
+    """The process-wide pool of an EmailService's SMTP account, created on first use"""
+    key = (service.smtp_host, service.smtp_port, service.smtp_user, service.use_starttls)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = SMTPConnectionPool(service._connect, service.pool_size, service.rate_limit)
+        return _pools[key]
+
 
 class EmailService:
     """Service for sending emails with templates"""
@@ -21,23 +168,57 @@ class EmailService:
         self.smtp_password = os.getenv('SMTP_PASSWORD', '')
         self.from_email = os.getenv('FROM_EMAIL', self.smtp_user)
         self.from_name = os.getenv('FROM_NAME', 'Clínica Bienestar')
+        self.use_starttls = os.getenv('SMTP_STARTTLS', 'True') == 'True'
+        self.pool_size = SMTP_POOL_SIZE
+        self.rate_limit = SMTP_RATE_LIMIT
 
-    def _get_smtp_connection(self):
-        """Get SMTP connection"""
+    def _connect(self):
+        """Open an authenticated SMTP session (raises on failure)"""
+        server = smtplib.SMTP(self.smtp_host, self.smtp_port, timeout=SMTP_TIMEOUT)
         try:
-            server = smtplib.SMTP(self.smtp_host, self.smtp_port)
-            server.starttls()
+            if self.use_starttls:
+                server.starttls()
             if self.smtp_user and self.smtp_password:
                 server.login(self.smtp_user, self.smtp_password)
-            return server
-        except Exception as e:
-            print(f"Error connecting to SMTP server: {str(e)}")
-            return None
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    @property
+    def pool(self):
+        """Persistent connections of this account (shared across instances)"""
+        return get_smtp_pool(self)
+
+    def _build_message(self, to_email, subject, html_content, text_content=None):
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = subject
+        msg['From'] = f"{self.from_name} <{self.from_email}>"
+        msg['To'] = to_email
+
+        # Plain text version (fallback)
+        if text_content:
+            part1 = MIMEText(text_content, 'plain')
+            msg.attach(part1)
+
+        # HTML version
+        part2 = MIMEText(html_content, 'html')
+        msg.attach(part2)
+
+        return msg.as_string()
+
+    def _send(self, to_email, subject, html_content, text_content=None):
+        """Send one email over the pool (raises on failure)"""
+        message = self._build_message(to_email, subject, html_content, text_content)
+        self.pool.sendmail(self.from_email, to_email, message)
 
     def send_email(self, to_email, subject, html_content, text_content=None):
         """
         Send email with HTML content
 
+        Uses the account's persistent connections and rate limit; safe to call from
+        several threads.
+
         Args:
             to_email: Recipient email address
             subject: Email subject
@@ -48,27 +229,7 @@ class EmailService:
             bool: True if sent successfully, False otherwise
         """
         try:
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = f"{self.from_name} <{self.from_email}>"
-            msg['To'] = to_email
-
-            # Plain text version (fallback)
-            if text_content:
-                part1 = MIMEText(text_content, 'plain')
-                msg.attach(part1)
-
-            # HTML version
-            part2 = MIMEText(html_content, 'html')
-            msg.attach(part2)
-
-            # Send email
-            server = self._get_smtp_connection()
-            if not server:
-                return False
-
-            server.sendmail(self.from_email, to_email, msg.as_string())
-            server.quit()
+            self._send(to_email, subject, html_content, text_content)
 
             print(f"✅ Email sent successfully to {to_email}")
             return True
@@ -77,211 +238,67 @@ class EmailService:
             print(f"❌ Error sending email: {str(e)}")
             return False
 
-    def get_appointment_reminder_template(self, appointment_data, hours_before=24):
+    def send_many(self, messages, workers=None):
         """
-        Get HTML template for appointment reminder
+        Send many emails concurrently over the persistent connections
 
         Args:
-            appointment_data: Dictionary with appointment information
-            hours_before: Hours before appointment for reminder timing
+            messages: Dicts with to_email, subject, html_content and optionally text_content
+            workers: Parallel senders (default: the pool size)
 
         Returns:
-            tuple: (html_content, text_content)
+            dict: Run summary with total, sent, failed, results (True/False per message,
+                  in order), connections opened and reconnects during the run, seconds,
+                  per_second and the first errors (to_email, error)
         """
-        patient_name = appointment_data.get('patient_name', 'Paciente')
-        doctor_name = appointment_data.get('doctor_name', 'Doctor')
-        appointment_date = appointment_data.get('appointment_date')
-        appointment_time = appointment_data.get('appointment_time')
-        reason = appointment_data.get('reason', 'Consulta médica')
-        clinic_address = appointment_data.get('clinic_address', 'Av. Principal 123, Quito')
-        clinic_phone = appointment_data.get('clinic_phone', '02-123-4567')
-
-        # Parse datetime if string
-        if isinstance(appointment_date, str):
-            try:
-                dt = datetime.fromisoformat(appointment_date.replace('Z', '+00:00'))
-                appointment_date = dt.strftime('%d de %B de %Y')
-                appointment_time = dt.strftime('%H:%M')
-            except:
-                pass
-
-        # Determine reminder timing text
-        timing_text = "mañana" if hours_before == 24 else f"en {hours_before} horas"
-
-        html_content = f"""
-<!DOCTYPE html>
-<html lang="es">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Recordatorio de Cita Médica</title>
-</head>
-<body style="margin: 0; padding: 0; font-family: Arial, sans-serif; background-color: #f4f4f4;">
-    <table role="presentation" style="width: 100%; border-collapse: collapse;">
-        <tr>
-            <td align="center" style="padding: 40px 0;">
-                <table role="presentation" style="width: 600px; border-collapse: collapse; background-color: #ffffff; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1);">
-
-                    <!-- Header -->
-                    <tr>
-                        <td style="padding: 40px 40px 20px 40px; background: linear-gradient(135deg, #197fe6 0%, #1565c0 100%); border-radius: 8px 8px 0 0;">
-                            <h1 style="margin: 0; color: #ffffff; font-size: 28px; font-weight: 600; text-align: center;">
-                                🏥 Clínica Bienestar
-                            </h1>
-                            <p style="margin: 10px 0 0 0; color: #e3f2fd; font-size: 14px; text-align: center;">
-                                Sistema de Gestión Médica
-                            </p>
-                        </td>
-                    </tr>
-
-                    <!-- Main Content -->
-                    <tr>
-                        <td style="padding: 40px;">
-                            <h2 style="margin: 0 0 20px 0; color: #197fe6; font-size: 24px; font-weight: 600;">
-                                📅 Recordatorio de Cita
-                            </h2>
-
-                            <p style="margin: 0 0 20px 0; color: #333333; font-size: 16px; line-height: 1.6;">
-                                Hola <strong>{patient_name}</strong>,
-                            </p>
-
-                            <p style="margin: 0 0 30px 0; color: #555555; font-size: 16px; line-height: 1.6;">
-                                Le recordamos que tiene una cita médica programada <strong>{timing_text}</strong>.
-                            </p>
-
-                            <!-- Appointment Details Card -->
-                            <table role="presentation" style="width: 100%; border-collapse: collapse; background-color: #f8f9fa; border-radius: 8px; margin-bottom: 30px;">
-                                <tr>
-                                    <td style="padding: 25px;">
-                                        <table role="presentation" style="width: 100%; border-collapse: collapse;">
-                                            <tr>
-                                                <td style="padding: 8px 0; color: #666666; font-size: 14px;">
-                                                    <strong>📆 Fecha:</strong>
-                                                </td>
-                                                <td style="padding: 8px 0; color: #333333; font-size: 14px; text-align: right;">
-                                                    {appointment_date}
-                                                </td>
-                                            </tr>
-                                            <tr>
-                                                <td style="padding: 8px 0; color: #666666; font-size: 14px;">
-                                                    <strong>⏰ Hora:</strong>
-                                                </td>
-                                                <td style="padding: 8px 0; color: #333333; font-size: 14px; text-align: right;">
-                                                    {appointment_time}
-                                                </td>
-                                            </tr>
-                                            <tr>
-                                                <td style="padding: 8px 0; color: #666666; font-size: 14px;">
-                                                    <strong>👨‍⚕️ Doctor:</strong>
-                                                </td>
-                                                <td style="padding: 8px 0; color: #333333; font-size: 14px; text-align: right;">
-                                                    Dr. {doctor_name}
-                                                </td>
-                                            </tr>
-                                            <tr>
-                                                <td style="padding: 8px 0; color: #666666; font-size: 14px;">
-                                                    <strong>📋 Motivo:</strong>
-                                                </td>
-                                                <td style="padding: 8px 0; color: #333333; font-size: 14px; text-align: right;">
-                                                    {reason}
-                                                </td>
-                                            </tr>
-                                        </table>
-                                    </td>
-                                </tr>
-                            </table>
-
-                            <!-- Important Notes -->
-                            <div style="background-color: #fff3cd; border-left: 4px solid #ffc107; padding: 15px; margin-bottom: 30px; border-radius: 4px;">
-                                <p style="margin: 0; color: #856404; font-size: 14px; line-height: 1.6;">
-                                    <strong>⚠️ Importante:</strong><br>
-                                    • Por favor, llegue 10 minutos antes de su cita<br>
-                                    • Traiga su cédula de identidad<br>
-                                    • Si no puede asistir, avísenos con anticipación
-                                </p>
-                            </div>
-
-                            <!-- Contact Information -->
-                            <table role="presentation" style="width: 100%; border-collapse: collapse; margin-bottom: 20px;">
-                                <tr>
-                                    <td style="padding: 15px; background-color: #e3f2fd; border-radius: 8px;">
-                                        <p style="margin: 0 0 10px 0; color: #1976d2; font-size: 16px; font-weight: 600;">
-                                            📍 Ubicación
-                                        </p>
-                                        <p style="margin: 0 0 8px 0; color: #555555; font-size: 14px;">
-                                            {clinic_address}
-                                        </p>
-                                        <p style="margin: 0; color: #555555; font-size: 14px;">
-                                            📞 {clinic_phone}
-                                        </p>
-                                    </td>
-                                </tr>
-                            </table>
-
-                            <!-- Action Button -->
-                            <table role="presentation" style="width: 100%; border-collapse: collapse; margin: 30px 0;">
-                                <tr>
-                                    <td align="center">
-                                        <a href="tel:{clinic_phone.replace('-', '')}" style="display: inline-block; padding: 14px 40px; background-color: #197fe6; color: #ffffff; text-decoration: none; border-radius: 6px; font-size: 16px; font-weight: 600;">
-                                            📞 Llamar para Confirmar
-                                        </a>
-                                    </td>
-                                </tr>
-                            </table>
-                        </td>
-                    </tr>
-
-                    <!-- Footer -->
-                    <tr>
-                        <td style="padding: 30px 40px; background-color: #f8f9fa; border-radius: 0 0 8px 8px; border-top: 1px solid #e0e0e0;">
-                            <p style="margin: 0 0 10px 0; color: #666666; font-size: 14px; text-align: center;">
-                                Gracias por confiar en <strong>Clínica Bienestar</strong>
-                            </p>
-                            <p style="margin: 0; color: #999999; font-size: 12px; text-align: center;">
-                                Este es un recordatorio automático. Por favor, no responda a este correo.
-                            </p>
-                            <p style="margin: 10px 0 0 0; color: #999999; font-size: 12px; text-align: center;">
-                                © 2025 Clínica Bienestar. Todos los derechos reservados.
-                            </p>
-                        </td>
-                    </tr>
-                </table>
-            </td>
-        </tr>
-    </table>
-</body>
-</html>
-        """
-
-        text_content = f"""
-RECORDATORIO DE CITA MÉDICA - Clínica Bienestar
-
-Hola {patient_name},
-
-Le recordamos que tiene una cita médica programada {timing_text}.
-
-DETALLES DE LA CITA:
-📆 Fecha: {appointment_date}
-⏰ Hora: {appointment_time}
-👨‍⚕️ Doctor: Dr. {doctor_name}
-📋 Motivo: {reason}
+        pool = self.pool
+        started = time.monotonic()
+        before = dict(pool.stats)
 
-IMPORTANTE:
-• Por favor, llegue 10 minutos antes de su cita
-• Traiga su cédula de identidad
-• Si no puede asistir, avísenos con anticipación
+        def send(message):
+            try:
+                self._send(message['to_email'], message['subject'], message['html_content'],
+                           message.get('text_content'))
+                return None
+            except Exception as e:
+                return str(e) or e.__class__.__name__
+
+        errors = []
+        if messages:
+            with ThreadPoolExecutor(max_workers=workers or pool.size, thread_name_prefix='smtp') as executor:
+                errors = list(executor.map(send, messages))
+
+        seconds = time.monotonic() - started
+        sent = errors.count(None)
+        summary = {
+            'total': len(messages),
+            'sent': sent,
+            'failed': len(messages) - sent,
+            'results': [error is None for error in errors],
+            'connections': pool.stats['connections'] - before['connections'],
+            'reconnects': pool.stats['reconnects'] - before['reconnects'],
+            'seconds': round(seconds, 3),
+            'per_second': round(sent / seconds, 1) if seconds else None,
+            'errors': [
+                (message['to_email'], error) for message, error in zip(messages, errors, strict=False) if error
+            ][:SUMMARY_MAX_ERRORS],
+        }
+        print(f"📧 Email run: {summary['sent']}/{summary['total']} sent, "
+              f"{summary['connections']} connections, {summary['seconds']}s")
+        return summary
 
-UBICACIÓN:
-📍 {clinic_address}
-📞 {clinic_phone}
+    def get_appointment_reminder_template(self, appointment_data, hours_before=24):
+        """
+        Get HTML template for appointment reminder (compiled once, see common/reminder_templates.py)
 
-Gracias por confiar en Clínica Bienestar.
+        Args:
+            appointment_data: Dictionary with appointment information
+            hours_before: Hours before appointment for reminder timing
 
----
-Este es un recordatorio automático. Por favor, no responda a este correo.
-© 2025 Clínica Bienestar. Todos los derechos reservados.
+        Returns:
+            tuple: (html_content, text_content)
         """
-
+        _, html_content, text_content = reminder_templates.email(appointment_data, hours_before)
         return html_content, text_content
 
     def send_appointment_reminder(self, to_email, appointment_data, hours_before=24):
@@ -296,11 +313,5 @@ Este es un recordatorio automático. Por favor, no responda a este correo.
         Returns:
             bool: True if sent successfully
         """
-        html_content, text_content = self.get_appointment_reminder_template(
-            appointment_data,
-            hours_before
-        )
-
-        subject = f"🔔 Recordatorio: Cita Médica - {appointment_data.get('appointment_date', 'Próximamente')}"
-
+        subject, html_content, text_content = reminder_templates.email(appointment_data, hours_before)
         return self.send_email(to_email, subject, html_content, text_content)
@@ -79,6 +79,34 @@ class GoogleCalendarService:
             print(f"Error building calendar service: {str(e)}")
             return False
 
+    def get_access_token(self):
+        """
+        Access token from the stored credentials, refreshed if expired (never starts the
+        interactive OAuth flow; used by the calendar sync worker)
+
+        Returns:
+            tuple: (token, expiry as naive UTC datetime or None), or None if the user has
+            not connected Google Calendar or the token cannot be refreshed
+        """
+        if not os.path.exists(self.token_path):
+            return None
+
+        with open(self.token_path, 'rb') as token:
+            self.creds = pickle.load(token)
+
+        if not self.creds.valid:
+            if not (self.creds.expired and self.creds.refresh_token):
+                return None
+            try:
+                self.creds.refresh(Request())
+            except Exception as e:
+                print(f"Error refreshing token: {str(e)}")
+                return None
+            with open(self.token_path, 'wb') as token:
+                pickle.dump(self.creds, token)
+
+        return self.creds.token, self.creds.expiry
+
     def create_event(self, summary, start_time, end_time, description=None, attendees=None):
         """
         Create a new event in Google Calendar
@@ -0,0 +1,143 @@
+"""
+Notification Inbox
+Per-user notification inbox: latest notifications, delta polling and read state
+
+Every notification gets a per-user sequence number (inbox_seq) and the unread counter
+of notification_inbox is kept by triggers (scripts/add_notification_inbox.sql). A
+user's notifications commit in sequence order, so a poll with `since` (the cursor of
+the previous answer) is an index range read that never misses one, and a poll with
+nothing new reads a single row.
+"""
+from common.database import db
+
+# Notifications returned per call at most
+INBOX_MAX_LIMIT = 200
+
+
+class NotificationInbox:
+    """Reads and read state of a user's notifications"""
+
+    @staticmethod
+    def get_unread_count(user_id):
+        """
+        Unread notifications of a user (maintained counter, no rows counted)
+
+        Returns:
+            int: Unread count
+        """
+        with db.get_cursor() as cursor:
+            cursor.execute("SELECT unread_count FROM notification_inbox WHERE user_id = %s", (user_id,))
+            row = cursor.fetchone()
+            return row['unread_count'] if row else 0
+
+    @staticmethod
+    def get_notifications(user_id, since=None, limit=50, unread_only=False):
+        """
+        Notifications of a user
+
+        Without `since`, the latest `limit`, newest first. With `since`, the ones after
+        that cursor, oldest first: if there are more than `limit`, has_more is set and the
+        returned cursor continues from the last one.
+
+        Args:
+            user_id: User ID
+            since: Cursor of a previous call (inbox_seq of the last notification seen)
+            limit: Maximum notifications to return (at most INBOX_MAX_LIMIT)
+            unread_only: If True, only unread notifications
+
+        Returns:
+            dict: notifications, unread_count, cursor (pass it as `since` next time) and has_more
+        """
+        limit = max(1, min(limit, INBOX_MAX_LIMIT))
+
+        with db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT unread_count, last_seq FROM notification_inbox WHERE user_id = %s
+            """, (user_id,))
+            inbox = cursor.fetchone() or {'unread_count': 0, 'last_seq': 0}
+
+            # Nothing new: a single row read
+            if since is not None and since >= inbox['last_seq']:
+                return {'notifications': [], 'unread_count': inbox['unread_count'],
+                        'cursor': since, 'has_more': False}
+
+            query = """
+                SELECT
+                    log_id,
+                    inbox_seq,
+                    notification_type,
+                    title,
+                    message,
+                    sent_at,
+                    read_at,
+                    metadata
+                FROM notification_logs
+                WHERE user_id = %s
+            """
+            params = [user_id]
+
+            if since is not None:
+                query += " AND inbox_seq > %s"
+                params.append(since)
+
+            if unread_only:
+                query += " AND read_at IS NULL"
+
+            query += " ORDER BY inbox_seq " + ("ASC" if since is not None else "DESC") + " LIMIT %s"
+            params.append(limit + 1)
+
+            cursor.execute(query, params)
+            notifications = cursor.fetchall()
+
+        has_more = len(notifications) > limit
+        notifications = notifications[:limit]
+
+        if since is not None:
+            next_cursor = notifications[-1]['inbox_seq'] if notifications else since
+        else:
+            next_cursor = notifications[0]['inbox_seq'] if notifications else inbox['last_seq']
+
+        return {
+            'notifications': notifications,
+            'unread_count': inbox['unread_count'],
+            'cursor': next_cursor,
+            'has_more': has_more
+        }
+
+    @staticmethod
+    def mark_as_read(user_id, log_ids=None, up_to=None):
+        """
+        Mark many notifications of a user as read in one statement
+
+        Args:
+            user_id: User ID (only their notifications are touched)
+            log_ids: Notifications to mark
+            up_to: Mark every notification up to this cursor (inbox_seq)
+            Without log_ids nor up_to, all of the user's notifications are marked
+
+        Returns:
+            dict: marked (notifications that were unread) and unread_count after the update
+        """
+        query = """
+            UPDATE notification_logs
+            SET read_at = CURRENT_TIMESTAMP
+            WHERE user_id = %s AND read_at IS NULL
+        """
+        params = [user_id]
+
+        if log_ids is not None:
+            query += " AND log_id = ANY(%s)"
+            params.append(list(log_ids))
+
+        if up_to is not None:
+            query += " AND inbox_seq <= %s"
+            params.append(up_to)
+
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute(query, params)
+            marked = cursor.rowcount
+
+            cursor.execute("SELECT unread_count FROM notification_inbox WHERE user_id = %s", (user_id,))
+            row = cursor.fetchone()
+
+        return {'marked': marked, 'unread_count': row['unread_count'] if row else 0}
@@ -2,9 +2,22 @@
 Notification Service
 Handles low stock alerts and appointment reminders
 """
+import os
+import json
+import time
+import select
 from datetime import datetime, date, timedelta
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.extras import execute_values
+
 from common.database import db
 
+# Pending low stock alerts sent per call, and seconds the listener waits for a NOTIFY
+LOW_STOCK_ALERT_BATCH_LIMIT = int(os.getenv('LOW_STOCK_ALERT_BATCH_LIMIT', 500))
+LOW_STOCK_LISTEN_TIMEOUT = int(os.getenv('LOW_STOCK_LISTEN_TIMEOUT', 60))
+
 
 class NotificationService:
     """Service for managing notifications"""
@@ -15,67 +28,126 @@ class NotificationService:
         Get products with low stock
 
         Args:
-            minimum_threshold: Optional threshold override
+            minimum_threshold: Optional cap, only products with stock at or below it
 
         Returns:
-            list: Products with current_stock <= minimum_stock
+            list: Active products with stock_quantity <= min_stock_alert
+        """
+        # Same predicate as idx_products_low_stock, so only low products are read
+        query = """
+            SELECT
+                product_id,
+                sku,
+                name,
+                stock_quantity as current_stock,
+                min_stock_alert as minimum_stock,
+                (min_stock_alert - stock_quantity) as units_needed
+            FROM products
+            WHERE is_active = TRUE AND stock_quantity <= min_stock_alert
         """
+        params = []
+
+        if minimum_threshold is not None:
+            query += " AND stock_quantity <= %s"
+            params.append(minimum_threshold)
+
+        query += " ORDER BY (min_stock_alert - stock_quantity) DESC"
+
         with db.get_cursor() as cursor:
-            query = """
-                SELECT
-                    product_id,
-                    sku,
-                    name,
-                    current_stock,
-                    minimum_stock,
-                    (minimum_stock - current_stock) as units_needed,
-                    category,
-                    type
-                FROM products
-                WHERE current_stock <= minimum_stock
-                ORDER BY (minimum_stock - current_stock) DESC
-            """
-
-            cursor.execute(query)
+            cursor.execute(query, params)
             return cursor.fetchall()
 
     @staticmethod
-    def get_today_appointments_for_doctor(doctor_id):
+    def get_low_stock_alerts(open_only=True, limit=100):
         """
-        Get all appointments for a doctor today
+        Get low stock alerts (one per threshold crossing)
 
         Args:
-            doctor_id: Doctor's user ID
+            open_only: Only alerts of products still below their minimum
+            limit: Maximum alerts to return
 
         Returns:
-            dict: Summary with count, appointments list, and time ranges
+            list: Alerts, newest first
         """
-        today = date.today()
-        date_from = today.strftime('%Y-%m-%d 00:00:00')
-        date_to = today.strftime('%Y-%m-%d 23:59:59')
+        query = """
+            SELECT
+                a.alert_id,
+                a.product_id,
+                p.sku,
+                p.name,
+                a.stock_quantity,
+                a.min_stock_alert,
+                a.opened_at,
+                a.resolved_at,
+                a.notified_at,
+                a.recipients
+            FROM low_stock_alerts a
+            JOIN products p ON a.product_id = p.product_id
+        """
+
+        if open_only:
+            query += " WHERE a.resolved_at IS NULL"
+
+        query += " ORDER BY a.alert_id DESC LIMIT %s"
+
+        with db.get_cursor() as cursor:
+            cursor.execute(query, (limit,))
+            return cursor.fetchall()
+
+    @staticmethod
+    def get_today_appointments_by_doctor(doctor_ids, day=None):
+        """
+        Pending and confirmed appointments of many doctors on one day, in one query
+
+        Args:
+            doctor_ids: Doctors' user IDs
+            day: Date to read (default: today)
+
+        Returns:
+            dict: doctor_id -> appointments in start order (doctors without any are left out)
+        """
+        day = day or date.today()
 
         with db.get_cursor() as cursor:
             cursor.execute("""
                 SELECT
+                    a.doctor_id,
                     a.appointment_id,
                     a.start_time,
                     a.end_time,
                     a.status,
                     a.reason,
-                    p.full_name as patient_name,
+                    p.first_name || ' ' || p.last_name as patient_name,
                     p.phone as patient_phone,
                     p.email as patient_email,
-                    p.identification as doc_number
+                    p.doc_number
                 FROM appointments a
                 LEFT JOIN patients p ON a.patient_id = p.patient_id
-                WHERE a.doctor_id = %s
-                AND a.start_time >= %s::timestamp
-                AND a.start_time <= %s::timestamp
+                WHERE a.doctor_id = ANY(%s)
+                AND a.start_time >= %s
+                AND a.start_time < %s
                 AND a.status IN ('PENDING', 'CONFIRMED')
-                ORDER BY a.start_time ASC
-            """, (doctor_id, date_from, date_to))
+                ORDER BY a.doctor_id, a.start_time ASC
+            """, (list(doctor_ids), day, day + timedelta(days=1)))
+
+            appointments = {}
+            for row in cursor.fetchall():
+                appointments.setdefault(row.pop('doctor_id'), []).append(row)
+            return appointments
+
+    @staticmethod
+    def get_today_appointments_for_doctor(doctor_id):
+        """
+        Get all appointments for a doctor today
 
-            appointments = cursor.fetchall()
+        Args:
+            doctor_id: Doctor's user ID
+
+        Returns:
+            dict: Summary with count, appointments list, and time ranges
+        """
+        today = date.today()
+        appointments = NotificationService.get_today_appointments_by_doctor([doctor_id], today).get(doctor_id, [])
 
         return {
             'count': len(appointments),
@@ -135,8 +207,6 @@ class NotificationService:
         Returns:
             int: Notification log ID
         """
-        import json
-
         with db.get_cursor(commit=True) as cursor:
             cursor.execute("""
                 INSERT INTO notification_logs (user_id, notification_type, title, message, metadata)
@@ -271,28 +341,22 @@ class NotificationService:
             return cursor.fetchone()
 
     @staticmethod
-    def generate_daily_summary_for_doctor(doctor_id):
+    def build_daily_summary(appointments, low_stock):
         """
-        Generate a daily summary for a doctor
+        Build a doctor's daily summary from already loaded data
 
         Args:
-            doctor_id: Doctor's user ID
+            appointments: The doctor's appointments today, in start order
+            low_stock: Low stock products (get_low_stock_products), shared by every doctor
 
         Returns:
             dict: Summary data
         """
-        # Get today's appointments
-        appointments_data = NotificationService.get_today_appointments_for_doctor(doctor_id)
-
-        # Get low stock products (for admins/doctors with inventory access)
-        low_stock = NotificationService.get_low_stock_products()
-
-        # Build summary message
         summary_parts = []
 
-        if appointments_data['count'] > 0:
-            summary_parts.append(f"📅 Tiene {appointments_data['count']} cita(s) programada(s) hoy:")
-            for appt in appointments_data['appointments']:
+        if appointments:
+            summary_parts.append(f"📅 Tiene {len(appointments)} cita(s) programada(s) hoy:")
+            for appt in appointments:
                 start_time = appt['start_time'].strftime('%H:%M')
                 summary_parts.append(f"  • {start_time} - {appt['patient_name']}")
                 if appt['reason']:
@@ -305,104 +369,216 @@ class NotificationService:
             for product in low_stock[:5]:  # Show top 5
                 summary_parts.append(f"  • {product['name']}: {product['current_stock']} unidades (mínimo: {product['minimum_stock']})")
 
-        message = "\n".join(summary_parts)
-
         return {
-            'appointments_count': appointments_data['count'],
-            'appointments': appointments_data['appointments'],
+            'appointments_count': len(appointments),
+            'appointments': appointments,
             'low_stock_count': len(low_stock),
             'low_stock_items': low_stock[:10],  # Limit to top 10
-            'summary_message': message
+            'summary_message': "\n".join(summary_parts)
         }
 
     @staticmethod
-    def send_low_stock_alerts():
+    def generate_daily_summary_for_doctor(doctor_id):
         """
-        Send low stock alerts to admins and doctors with notification preferences enabled
+        Generate a daily summary for a doctor
+
+        Args:
+            doctor_id: Doctor's user ID
 
         Returns:
-            int: Number of notifications sent
+            dict: Summary data
+        """
+        appointments_data = NotificationService.get_today_appointments_for_doctor(doctor_id)
+
+        # Get low stock products (for admins/doctors with inventory access)
+        low_stock = NotificationService.get_low_stock_products()
+
+        return NotificationService.build_daily_summary(appointments_data['appointments'], low_stock)
+
+    @staticmethod
+    def build_low_stock_message(products):
         """
-        # Get low stock products
-        low_stock_products = NotificationService.get_low_stock_products()
+        Build the low stock notification once for every recipient
 
-        if not low_stock_products:
-            return 0
+        Args:
+            products: Rows with name, current_stock and units_needed
 
-        # Get users with low_stock_notifications enabled
-        with db.get_cursor() as cursor:
+        Returns:
+            tuple: (title, message)
+        """
+        products_list = "\n".join([
+            f"• {p['name']}: {p['current_stock']} unidades (necesita {p['units_needed']} más)"
+            for p in products[:10]
+        ])
+        if len(products) > 10:
+            products_list += f"\n• ... y {len(products) - 10} más"
+
+        title = f'⚠️ Alerta de Stock Bajo ({len(products)} productos)'
+        message = f"Hay {len(products)} producto(s) con stock bajo:\n\n{products_list}"
+        return title, message
+
+    @staticmethod
+    def send_low_stock_alerts(limit=LOW_STOCK_ALERT_BATCH_LIMIT):
+        """
+        Fan out the pending low stock alerts to admins and doctors with
+        low_stock_notifications enabled (users without preferences get them too)
+
+        Alerts are opened by the products trigger (scripts/add_low_stock_alerts.sql)
+        when a product crosses its minimum, so each crossing is sent once. Pending
+        alerts are claimed with SKIP LOCKED: concurrent workers never send the same one.
+
+        Args:
+            limit: Maximum alerts handled per call
+
+        Returns:
+            int: Number of notifications sent
+        """
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("""
+                SELECT a.alert_id
+                FROM low_stock_alerts a
+                WHERE a.notified_at IS NULL AND a.resolved_at IS NULL
+                ORDER BY a.alert_id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (limit,))
+            alert_ids = [row['alert_id'] for row in cursor.fetchall()]
+
+            if not alert_ids:
+                return 0
+
+            cursor.execute("""
+                SELECT
+                    a.alert_id,
+                    p.product_id,
+                    p.name,
+                    p.stock_quantity as current_stock,
+                    p.min_stock_alert as minimum_stock,
+                    (p.min_stock_alert - p.stock_quantity) as units_needed
+                FROM low_stock_alerts a
+                JOIN products p ON a.product_id = p.product_id
+                WHERE a.alert_id = ANY(%s)
+                ORDER BY (p.min_stock_alert - p.stock_quantity) DESC
+            """, (alert_ids,))
+            products = cursor.fetchall()
+
+            # Inserted in user_id order: each row locks the user's inbox row until commit
+            # (scripts/add_notification_inbox.sql), so concurrent batches do not deadlock
             cursor.execute("""
-                SELECT u.user_id, u.email, u.full_name
+                SELECT u.user_id
                 FROM users u
-                JOIN notification_preferences np ON u.user_id = np.user_id
-                WHERE np.low_stock_notifications = TRUE
-                AND u.role IN ('admin', 'doctor')
+                JOIN roles r ON u.role_id = r.role_id
+                LEFT JOIN notification_preferences np ON u.user_id = np.user_id
+                WHERE COALESCE(np.low_stock_notifications, TRUE) = TRUE
+                AND u.is_active = TRUE
+                AND LOWER(r.name) IN ('admin', 'doctor')
+                ORDER BY u.user_id
             """)
-
             users = cursor.fetchall()
 
-        notifications_sent = 0
+            if users:
+                title, message = NotificationService.build_low_stock_message(products)
+                metadata = json.dumps({
+                    'product_count': len(products),
+                    'product_ids': [p['product_id'] for p in products],
+                    'alert_ids': alert_ids
+                })
+                execute_values(cursor, """
+                    INSERT INTO notification_logs (user_id, notification_type, title, message, metadata)
+                    VALUES %s
+                """, [(user['user_id'], 'low_stock', title, message, metadata) for user in users])
 
-        for user in users:
-            # Build notification message
-            products_list = "\n".join([
-                f"• {p['name']}: {p['current_stock']} unidades (necesita {p['units_needed']} más)"
-                for p in low_stock_products[:10]
-            ])
+            cursor.execute("""
+                UPDATE low_stock_alerts
+                SET notified_at = CURRENT_TIMESTAMP, recipients = %s
+                WHERE alert_id = ANY(%s)
+            """, (len(users), alert_ids))
 
-            message = f"Hay {len(low_stock_products)} producto(s) con stock bajo:\n\n{products_list}"
+            return len(users)
 
-            # Create notification
-            NotificationService.create_notification(
-                user_id=user['user_id'],
-                notification_type='low_stock',
-                title=f'⚠️ Alerta de Stock Bajo ({len(low_stock_products)} productos)',
-                message=message,
-                metadata={'product_count': len(low_stock_products)}
-            )
+    @staticmethod
+    def listen_for_low_stock_alerts(timeout=LOW_STOCK_LISTEN_TIMEOUT):
+        """
+        Send low stock alerts as soon as the products trigger raises them
 
-            notifications_sent += 1
+        Blocks forever on LISTEN low_stock with a dedicated connection. Pending alerts
+        are also checked every `timeout` seconds (and after reconnecting), so alerts
+        raised while no listener was running still go out.
 
-        return notifications_sent
+        Args:
+            timeout: Seconds between checks without a NOTIFY
+        """
+        while True:
+            connection = None
+            try:
+                connection = psycopg2.connect(os.getenv('DATABASE_URL'))
+                connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with connection.cursor() as cursor:
+                    cursor.execute("LISTEN low_stock")
+
+                while True:
+                    sent = NotificationService.send_low_stock_alerts()
+                    if sent:
+                        print(f"Low stock alerts sent: {sent} notifications")
+
+                    if select.select([connection], [], [], timeout) != ([], [], []):
+                        connection.poll()
+                        connection.notifies.clear()
+
+            except Exception as e:
+                print(f"Low stock listener error: {str(e)}")
+                time.sleep(5)
+            finally:
+                if connection:
+                    connection.close()
 
     @staticmethod
     def send_daily_summaries():
         """
-        Send daily summaries to all doctors with daily_summary_enabled=True
+        Send daily summaries to all active doctors with daily_summary_enabled
+        (doctors without preferences get them too, as the preferences default says)
+
+        Reads every doctor's appointments in one query and the low stock products once,
+        then writes all the notifications with one multi-row insert, so the number of
+        queries does not grow with the number of doctors.
 
         Returns:
             int: Number of summaries sent
         """
-        # Get doctors with daily summaries enabled
+        today = date.today()
+
         with db.get_cursor() as cursor:
             cursor.execute("""
-                SELECT u.user_id, u.email, u.full_name
+                SELECT u.user_id
                 FROM users u
-                JOIN notification_preferences np ON u.user_id = np.user_id
-                WHERE np.daily_summary_enabled = TRUE
-                AND u.role = 'doctor'
+                JOIN roles r ON u.role_id = r.role_id
+                LEFT JOIN notification_preferences np ON u.user_id = np.user_id
+                WHERE COALESCE(np.daily_summary_enabled, TRUE) = TRUE
+                AND u.is_active = TRUE
+                AND LOWER(r.name) = 'doctor'
+                ORDER BY u.user_id
             """)
+            doctor_ids = [row['user_id'] for row in cursor.fetchall()]
 
-            doctors = cursor.fetchall()
-
-        summaries_sent = 0
+        if not doctor_ids:
+            return 0
 
-        for doctor in doctors:
-            # Generate summary
-            summary = NotificationService.generate_daily_summary_for_doctor(doctor['user_id'])
+        appointments = NotificationService.get_today_appointments_by_doctor(doctor_ids, today)
+        low_stock = NotificationService.get_low_stock_products()
 
-            # Create notification
-            NotificationService.create_notification(
-                user_id=doctor['user_id'],
-                notification_type='daily_summary',
-                title=f'📋 Resumen del Día - {date.today().strftime("%d/%m/%Y")}',
-                message=summary['summary_message'],
-                metadata={
-                    'appointments_count': summary['appointments_count'],
-                    'low_stock_count': summary['low_stock_count']
-                }
-            )
+        title = f'📋 Resumen del Día - {today.strftime("%d/%m/%Y")}'
+        notifications = []
+        for doctor_id in doctor_ids:
+            summary = NotificationService.build_daily_summary(appointments.get(doctor_id, []), low_stock)
+            notifications.append((doctor_id, 'daily_summary', title, summary['summary_message'], json.dumps({
+                'appointments_count': summary['appointments_count'],
+                'low_stock_count': summary['low_stock_count']
+            })))
 
-            summaries_sent += 1
+        with db.get_cursor(commit=True) as cursor:
+            execute_values(cursor, """
+                INSERT INTO notification_logs (user_id, notification_type, title, message, metadata)
+                VALUES %s
+            """, notifications, page_size=len(notifications))
 
-        return summaries_sent
+        return len(notifications)
@@ -3,6 +3,8 @@ Rate Limiting Configuration
 Sistema Médico Integral - Sprint 3
 """
 import os
+import threading
+import time
 from typing import Any, Optional
 from flask import Flask, request, jsonify
 
@@ -197,6 +199,44 @@ def limit_by_user(limit_string: str):
     return decorator
 
 
+class TokenBucket:
+    """
+    Pacing of outbound calls (SMTP, WhatsApp): at most `rate` per second on average,
+    with bursts of up to `capacity`.
+
+    Thread-safe. Each acquire() reserves its token and sleeps outside the lock until it
+    is due, so concurrent callers are served in order. A rate of 0 disables it.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Take one token, waiting until it is available.
+
+        Returns:
+            float: Seconds waited
+        """
+        if not self.rate:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
 # Ejemplo de uso:
 # from common.rate_limiting import init_rate_limiter, RateLimits, exempt_from_rate_limit
 #
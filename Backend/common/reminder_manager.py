@@ -2,12 +2,21 @@
 Reminder Manager
 Handles scheduling and sending of appointment reminders via email and WhatsApp
 """
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from psycopg2.extras import execute_values
 from common.database import db
 from common.email_service import EmailService
 from common.whatsapp_service import WhatsAppService
 import json
 
+# Reminders sent in parallel by process_scheduled_reminders
+REMINDER_DISPATCH_WORKERS = int(os.getenv('REMINDER_DISPATCH_WORKERS', 16))
+# A reminder is due while the appointment starts within this many minutes of its hours_before
+REMINDER_WINDOW_MINUTES = 30
+
 
 class ReminderManager:
     """Manages appointment reminders"""
@@ -121,8 +130,8 @@ class ReminderManager:
         """
         # Calculate time window
         now = datetime.now()
-        target_time_start = now + timedelta(hours=hours_before - 0.5)  # 30min before target
-        target_time_end = now + timedelta(hours=hours_before + 0.5)    # 30min after target
+        target_time_start = now + timedelta(hours=hours_before, minutes=-REMINDER_WINDOW_MINUTES)
+        target_time_end = now + timedelta(hours=hours_before, minutes=REMINDER_WINDOW_MINUTES)
 
         with db.get_cursor() as cursor:
             cursor.execute("""
@@ -151,56 +160,138 @@ class ReminderManager:
 
             return cursor.fetchall()
 
-    def send_email_reminder(self, appointment, hours_before):
+    @staticmethod
+    def plan_reminders(now=None):
         """
-        Send email reminder for an appointment
+        Every reminder due now, in one query
+
+        Joins the doctors' reminder settings (each enabled channel and hours_before) with
+        their active appointments starting within REMINDER_WINDOW_MINUTES of that many hours
+        from now, leaving out the reminders already sent.
 
         Args:
-            appointment: Appointment data dictionary
-            hours_before: Hours before appointment
+            now: Reference time (default: now)
 
         Returns:
-            bool: True if sent successfully
+            list: One row per reminder to send, with channel, hours_before and the
+                  appointment fields used by the templates
         """
-        if not appointment.get('patient_email'):
-            print(f"⚠️ No email for patient {appointment['patient_name']}")
-            return False
+        with db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT
+                    r.channel,
+                    r.hours_before,
+                    a.appointment_id,
+                    a.start_time,
+                    a.doctor_id,
+                    a.reason,
+                    p.patient_id,
+                    p.first_name || ' ' || p.last_name as patient_name,
+                    p.email as patient_email,
+                    p.phone as patient_phone,
+                    u.full_name as doctor_name
+                FROM reminder_settings rs
+                CROSS JOIN LATERAL (
+                    SELECT 'email' as channel, h::int as hours_before
+                    FROM jsonb_array_elements_text(rs.email_hours_before) h
+                    WHERE rs.email_enabled
+                    UNION
+                    SELECT 'whatsapp', h::int
+                    FROM jsonb_array_elements_text(rs.whatsapp_hours_before) h
+                    WHERE rs.whatsapp_enabled
+                ) r
+                JOIN appointments a
+                    ON a.doctor_id = rs.user_id
+                    AND a.status IN ('PENDING', 'CONFIRMED')
+                    AND a.start_time BETWEEN %(now)s + make_interval(hours => r.hours_before, mins => -%(window)s)
+                                         AND %(now)s + make_interval(hours => r.hours_before, mins => %(window)s)
+                LEFT JOIN patients p ON a.patient_id = p.patient_id
+                LEFT JOIN users u ON a.doctor_id = u.user_id
+                WHERE rs.auto_send_enabled = TRUE
+                AND NOT EXISTS (
+                    SELECT 1 FROM reminder_logs rl
+                    WHERE rl.appointment_id = a.appointment_id
+                    AND rl.reminder_type = r.channel
+                    AND rl.hours_before = r.hours_before
+                    AND rl.status = 'sent'
+                )
+                ORDER BY a.start_time, a.appointment_id, r.channel
+            """, {'now': now or datetime.now(), 'window': REMINDER_WINDOW_MINUTES})
+
+            return cursor.fetchall()
 
-        # Prepare appointment data for template
-        appointment_data = {
+    @staticmethod
+    def _appointment_data(appointment, clinic_address):
+        """Template data of an appointment reminder"""
+        return {
             'patient_name': appointment['patient_name'],
             'doctor_name': appointment['doctor_name'],
             'appointment_date': appointment['start_time'],
             'appointment_time': appointment['start_time'].strftime('%H:%M') if isinstance(appointment['start_time'], datetime) else '',
             'reason': appointment.get('reason', 'Consulta médica'),
-            'clinic_address': 'Av. Principal 123, Quito, Ecuador',
+            'clinic_address': clinic_address,
             'clinic_phone': '02-123-4567'
         }
 
-        # Send email
+    @staticmethod
+    def _format_phone(phone):
+        """Phone number with country code (Ecuador, +593, if it has none)"""
+        if not phone.startswith('+'):
+            # Assume Ecuador number, remove leading 0 and add +593
+            phone = phone.lstrip('0')
+            phone = f"+593{phone}"
+        return phone
+
+    def _deliver_email(self, appointment, hours_before):
+        """
+        Send one email reminder
+
+        Returns:
+            tuple: reminder_logs row for _log_reminders, or None if the patient has no email
+        """
+        if not appointment.get('patient_email'):
+            print(f"⚠️ No email for patient {appointment['patient_name']}")
+            return None
+
         success = self.email_service.send_appointment_reminder(
             appointment['patient_email'],
-            appointment_data,
+            self._appointment_data(appointment, 'Av. Principal 123, Quito, Ecuador'),
             hours_before
         )
 
-        # Log result
-        self._log_reminder(
-            appointment['appointment_id'],
-            appointment['patient_id'],
-            'email',
-            hours_before,
-            'sent' if success else 'failed',
-            appointment['patient_email'],
-            None,
-            None if success else 'Email sending failed'
+        return (
+            appointment['appointment_id'], appointment['patient_id'], 'email', hours_before,
+            'sent' if success else 'failed', datetime.now() if success else None,
+            None if success else 'Email sending failed', appointment['patient_email'], None
         )
 
-        return success
+    def _deliver_whatsapp(self, appointment, hours_before):
+        """
+        Send one WhatsApp reminder
 
-    def send_whatsapp_reminder(self, appointment, hours_before):
+        Returns:
+            tuple: reminder_logs row for _log_reminders, or None if the patient has no phone
         """
-        Send WhatsApp reminder for an appointment
+        if not appointment.get('patient_phone'):
+            print(f"⚠️ No phone for patient {appointment['patient_name']}")
+            return None
+
+        phone = self._format_phone(appointment['patient_phone'])
+        success = self.whatsapp_service.send_appointment_reminder(
+            phone,
+            self._appointment_data(appointment, 'Av. Principal 123, Quito'),
+            hours_before
+        )
+
+        return (
+            appointment['appointment_id'], appointment['patient_id'], 'whatsapp', hours_before,
+            'sent' if success else 'failed', datetime.now() if success else None,
+            None if success else 'WhatsApp sending failed', None, phone
+        )
+
+    def send_email_reminder(self, appointment, hours_before):
+        """
+        Send email reminder for an appointment
 
         Args:
             appointment: Appointment data dictionary
@@ -209,126 +300,119 @@ class ReminderManager:
         Returns:
             bool: True if sent successfully
         """
-        if not appointment.get('patient_phone'):
-            print(f"⚠️ No phone for patient {appointment['patient_name']}")
+        log = self._deliver_email(appointment, hours_before)
+        if log is None:
             return False
 
-        # Format phone number for Ecuador (+593)
-        phone = appointment['patient_phone']
-        if not phone.startswith('+'):
-            # Assume Ecuador number, remove leading 0 and add +593
-            phone = phone.lstrip('0')
-            phone = f"+593{phone}"
+        self._log_reminders([log])
+        return log[4] == 'sent'
 
-        # Prepare appointment data for template
-        appointment_data = {
-            'patient_name': appointment['patient_name'],
-            'doctor_name': appointment['doctor_name'],
-            'appointment_date': appointment['start_time'],
-            'appointment_time': appointment['start_time'].strftime('%H:%M') if isinstance(appointment['start_time'], datetime) else '',
-            'reason': appointment.get('reason', 'Consulta médica'),
-            'clinic_address': 'Av. Principal 123, Quito',
-            'clinic_phone': '02-123-4567'
-        }
+    def send_whatsapp_reminder(self, appointment, hours_before):
+        """
+        Send WhatsApp reminder for an appointment
 
-        # Send WhatsApp
-        success = self.whatsapp_service.send_appointment_reminder(
-            phone,
-            appointment_data,
-            hours_before
-        )
+        Args:
+            appointment: Appointment data dictionary
+            hours_before: Hours before appointment
 
-        # Log result
-        self._log_reminder(
-            appointment['appointment_id'],
-            appointment['patient_id'],
-            'whatsapp',
-            hours_before,
-            'sent' if success else 'failed',
-            None,
-            phone,
-            None if success else 'WhatsApp sending failed'
-        )
+        Returns:
+            bool: True if sent successfully
+        """
+        log = self._deliver_whatsapp(appointment, hours_before)
+        if log is None:
+            return False
 
-        return success
+        self._log_reminders([log])
+        return log[4] == 'sent'
+
+    @staticmethod
+    def _log_reminders(logs):
+        """
+        Log reminder sending attempts in one insert
+
+        Args:
+            logs: Tuples (appointment_id, patient_id, reminder_type, hours_before, status,
+                  sent_at, error_message, recipient_email, recipient_phone)
+        """
+        if not logs:
+            return
 
-    def _log_reminder(self, appointment_id, patient_id, reminder_type, hours_before,
-                     status, recipient_email, recipient_phone, error_message):
-        """Log reminder sending attempt"""
         with db.get_cursor(commit=True) as cursor:
-            cursor.execute("""
+            execute_values(cursor, """
                 INSERT INTO reminder_logs (
                     appointment_id, patient_id, reminder_type, hours_before,
                     status, sent_at, error_message, recipient_email, recipient_phone
                 )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                appointment_id, patient_id, reminder_type, hours_before,
-                status, datetime.now() if status == 'sent' else None,
-                error_message, recipient_email, recipient_phone
-            ))
-
-    def process_scheduled_reminders(self):
+                VALUES %s
+            """, logs, page_size=1000)
+
+    def _log_reminder(self, appointment_id, patient_id, reminder_type, hours_before,
+                     status, recipient_email, recipient_phone, error_message):
+        """Log reminder sending attempt"""
+        self._log_reminders([(
+            appointment_id, patient_id, reminder_type, hours_before,
+            status, datetime.now() if status == 'sent' else None,
+            error_message, recipient_email, recipient_phone
+        )])
+
+    def _dispatch(self, reminder):
+        """Send one planned reminder; never raises (a failure is logged as failed)"""
+        deliver = self._deliver_email if reminder['channel'] == 'email' else self._deliver_whatsapp
+        try:
+            return deliver(reminder, reminder['hours_before'])
+        except Exception as e:
+            print(f"❌ Error sending {reminder['channel']} reminder: {str(e)}")
+            return (
+                reminder['appointment_id'], reminder['patient_id'], reminder['channel'],
+                reminder['hours_before'], 'failed', None, str(e)[:500],
+                reminder['patient_email'] if reminder['channel'] == 'email' else None,
+                reminder['patient_phone'] if reminder['channel'] == 'whatsapp' else None
+            )
+
+    def process_scheduled_reminders(self, now=None, workers=None):
         """
         Process all scheduled reminders based on user settings
 
-        This should be run periodically (every 30 minutes) via cron job
+        This should be run periodically (every 30 minutes) via cron job. The whole run is
+        planned in one query (plan_reminders), sent by a pool of REMINDER_DISPATCH_WORKERS
+        threads and logged in one insert.
+
+        Args:
+            now: Reference time (default: now)
+            workers: Parallel sends (default: REMINDER_DISPATCH_WORKERS)
 
         Returns:
             dict: Statistics of processed reminders
         """
+        started = time.monotonic()
         stats = {
             'total_processed': 0,
             'email_sent': 0,
             'whatsapp_sent': 0,
-            'failed': 0
+            'failed': 0,
+            'skipped': 0
         }
 
-        # Get all unique hours_before values from all users' settings
-        with db.get_cursor() as cursor:
-            cursor.execute("""
-                SELECT DISTINCT jsonb_array_elements_text(email_hours_before)::int as hours
-                FROM reminder_settings
-                WHERE email_enabled = TRUE AND auto_send_enabled = TRUE
-                UNION
-                SELECT DISTINCT jsonb_array_elements_text(whatsapp_hours_before)::int as hours
-                FROM reminder_settings
-                WHERE whatsapp_enabled = TRUE AND auto_send_enabled = TRUE
-            """)
-
-            hours_list = [row['hours'] for row in cursor.fetchall()]
-
-        # Process each time window
-        for hours_before in hours_list:
-            appointments = self.get_appointments_needing_reminders(hours_before)
-
-            for appointment in appointments:
-                stats['total_processed'] += 1
-
-                # Get doctor's settings
-                settings = self.get_user_settings(appointment['doctor_id'])
-
-                if not settings or not settings.get('auto_send_enabled'):
-                    continue
-
-                # Send email if enabled
-                if settings.get('email_enabled'):
-                    email_hours = json.loads(settings['email_hours_before']) if isinstance(settings['email_hours_before'], str) else settings['email_hours_before']
-                    if hours_before in email_hours:
-                        if self.send_email_reminder(appointment, hours_before):
-                            stats['email_sent'] += 1
-                        else:
-                            stats['failed'] += 1
-
-                # Send WhatsApp if enabled
-                if settings.get('whatsapp_enabled'):
-                    whatsapp_hours = json.loads(settings['whatsapp_hours_before']) if isinstance(settings['whatsapp_hours_before'], str) else settings['whatsapp_hours_before']
-                    if hours_before in whatsapp_hours:
-                        if self.send_whatsapp_reminder(appointment, hours_before):
-                            stats['whatsapp_sent'] += 1
-                        else:
-                            stats['failed'] += 1
-
+        plan = self.plan_reminders(now)
+        stats['total_processed'] = len({(r['appointment_id'], r['hours_before']) for r in plan})
+
+        logs = []
+        if plan:
+            with ThreadPoolExecutor(max_workers=workers or REMINDER_DISPATCH_WORKERS,
+                                    thread_name_prefix='reminders') as pool:
+                for reminder, log in zip(plan, pool.map(self._dispatch, plan), strict=False):
+                    if log is None:
+                        stats['skipped'] += 1
+                    elif log[4] == 'sent':
+                        stats[f"{reminder['channel']}_sent"] += 1
+                        logs.append(log)
+                    else:
+                        stats['failed'] += 1
+                        logs.append(log)
+
+        self._log_reminders(logs)
+
+        stats['seconds'] = round(time.monotonic() - started, 3)
         print(f"📊 Reminder processing complete: {stats}")
         return stats
 
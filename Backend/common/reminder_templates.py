@@ -0,0 +1,376 @@
+"""
+Reminder Templates
+Appointment reminder messages (email HTML and text, WhatsApp) compiled once per process
+
+The templates are parsed when this module is imported: the clinic constants are
+substituted then, and rendering a reminder is one str.format_map per template.
+Values that repeat across a batch (dates, timing text, escaped names) are cached,
+so thousands of reminders render in a tight loop.
+"""
+import html
+import os
+import string
+from datetime import date, datetime
+from functools import lru_cache
+
+CLINIC_NAME = 'Clínica Bienestar'
+DEFAULT_CLINIC_ADDRESS = 'Av. Principal 123, Quito'
+DEFAULT_CLINIC_PHONE = '02-123-4567'
+# Distinct values (dates, names, reasons) remembered per cache
+TEMPLATE_CACHE_SIZE = int(os.getenv('TEMPLATE_CACHE_SIZE', 4096))
+
+MONTHS = ('enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 'julio',
+          'agosto', 'septiembre', 'octubre', 'noviembre', 'diciembre')
+
+def _braces(text):
+    return text.replace('{', '{{').replace('}', '}}')
+
+
+class CompiledTemplate:
+    """
+    A str.format template parsed once
+
+    Fields found in `constants` are substituted at compile time (passed through
+    `escape` if given); the rest stay as fields of `source` for render().
+    """
+
+    def __init__(self, source, constants=None, escape=None):
+        constants = constants or {}
+        parts, fields = [], []
+        for literal, field, spec, conversion in string.Formatter().parse(source):
+            parts.append(_braces(literal))
+            if field is None:
+                continue
+            if field in constants:
+                value = format(constants[field], spec or '')
+                parts.append(_braces(escape(value) if escape else value))
+                continue
+            parts.append('{' + field + (f"!{conversion}" if conversion else '') + (f":{spec}" if spec else '') + '}')
+            if field not in fields:
+                fields.append(field)
+        self.source = ''.join(parts)
+        self.fields = tuple(fields)
+
+    def render(self, values):
+        return self.source.format_map(values)
+
+
+def _when(appointment_date, appointment_time):
+    """(long date, short date, time) of an appointment; a date that does not parse is shown as given"""
+    when = appointment_date
+    if isinstance(when, str):
+        try:
+            when = datetime.fromisoformat(when.replace('Z', '+00:00'))
+        except ValueError:
+            return when, when, appointment_time
+    if not isinstance(when, date):
+        return when, when, appointment_time
+    if isinstance(when, datetime):
+        appointment_time = when.strftime('%H:%M')
+    return f"{when.day:02d} de {MONTHS[when.month - 1]} de {when.year}", when.strftime('%d/%m/%Y'), appointment_time
+
+
+def _email_timing(hours_before):
+    return "mañana" if hours_before == 24 else f"en {hours_before} horas"
+
+
+def _whatsapp_timing(hours_before):
+    if hours_before == 24:
+        return "mañana"
+    if hours_before < 24:
+        return f"en {hours_before} horas"
+    days = hours_before // 24
+    return f"en {days} día{'s' if days > 1 else ''}"
+
+
+def _escape(value):
+    return html.escape(str(value))
+
+
+EMAIL_SUBJECT = "🔔 Recordatorio: Cita Médica - {appointment_date}"
+
+EMAIL_HTML = """\
+<!DOCTYPE html>
+<html lang="es">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Recordatorio de Cita Médica</title>
+</head>
+<body style="margin: 0; padding: 0; font-family: Arial, sans-serif; background-color: #f4f4f4;">
+    <table role="presentation" style="width: 100%; border-collapse: collapse;">
+        <tr>
+            <td align="center" style="padding: 40px 0;">
+                <table role="presentation" style="width: 600px; border-collapse: collapse; background-color: #ffffff; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1);">
+
+                    <!-- Header -->
+                    <tr>
+                        <td style="padding: 40px 40px 20px 40px; background: linear-gradient(135deg, #197fe6 0%, #1565c0 100%); border-radius: 8px 8px 0 0;">
+                            <h1 style="margin: 0; color: #ffffff; font-size: 28px; font-weight: 600; text-align: center;">
+                                🏥 {clinic_name}
+                            </h1>
+                            <p style="margin: 10px 0 0 0; color: #e3f2fd; font-size: 14px; text-align: center;">
+                                Sistema de Gestión Médica
+                            </p>
+                        </td>
+                    </tr>
+
+                    <!-- Main Content -->
+                    <tr>
+                        <td style="padding: 40px;">
+                            <h2 style="margin: 0 0 20px 0; color: #197fe6; font-size: 24px; font-weight: 600;">
+                                📅 Recordatorio de Cita
+                            </h2>
+
+                            <p style="margin: 0 0 20px 0; color: #333333; font-size: 16px; line-height: 1.6;">
+                                Hola <strong>{patient_name}</strong>,
+                            </p>
+
+                            <p style="margin: 0 0 30px 0; color: #555555; font-size: 16px; line-height: 1.6;">
+                                Le recordamos que tiene una cita médica programada <strong>{timing_text}</strong>.
+                            </p>
+
+                            <!-- Appointment Details Card -->
+                            <table role="presentation" style="width: 100%; border-collapse: collapse; background-color: #f8f9fa; border-radius: 8px; margin-bottom: 30px;">
+                                <tr>
+                                    <td style="padding: 25px;">
+                                        <table role="presentation" style="width: 100%; border-collapse: collapse;">
+                                            <tr>
+                                                <td style="padding: 8px 0; color: #666666; font-size: 14px;">
+                                                    <strong>📆 Fecha:</strong>
+                                                </td>
+                                                <td style="padding: 8px 0; color: #333333; font-size: 14px; text-align: right;">
+                                                    {appointment_date}
+                                                </td>
+                                            </tr>
+                                            <tr>
+                                                <td style="padding: 8px 0; color: #666666; font-size: 14px;">
+                                                    <strong>⏰ Hora:</strong>
+                                                </td>
+                                                <td style="padding: 8px 0; color: #333333; font-size: 14px; text-align: right;">
+                                                    {appointment_time}
+                                                </td>
+                                            </tr>
+                                            <tr>
+                                                <td style="padding: 8px 0; color: #666666; font-size: 14px;">
+                                                    <strong>👨‍⚕️ Doctor:</strong>
+                                                </td>
+                                                <td style="padding: 8px 0; color: #333333; font-size: 14px; text-align: right;">
+                                                    Dr. {doctor_name}
+                                                </td>
+                                            </tr>
+                                            <tr>
+                                                <td style="padding: 8px 0; color: #666666; font-size: 14px;">
+                                                    <strong>📋 Motivo:</strong>
+                                                </td>
+                                                <td style="padding: 8px 0; color: #333333; font-size: 14px; text-align: right;">
+                                                    {reason}
+                                                </td>
+                                            </tr>
+                                        </table>
+                                    </td>
+                                </tr>
+                            </table>
+
+                            <!-- Important Notes -->
+                            <div style="background-color: #fff3cd; border-left: 4px solid #ffc107; padding: 15px; margin-bottom: 30px; border-radius: 4px;">
+                                <p style="margin: 0; color: #856404; font-size: 14px; line-height: 1.6;">
+                                    <strong>⚠️ Importante:</strong><br>
+                                    • Por favor, llegue 10 minutos antes de su cita<br>
+                                    • Traiga su cédula de identidad<br>
+                                    • Si no puede asistir, avísenos con anticipación
+                                </p>
+                            </div>
+
+                            <!-- Contact Information -->
+                            <table role="presentation" style="width: 100%; border-collapse: collapse; margin-bottom: 20px;">
+                                <tr>
+                                    <td style="padding: 15px; background-color: #e3f2fd; border-radius: 8px;">
+                                        <p style="margin: 0 0 10px 0; color: #1976d2; font-size: 16px; font-weight: 600;">
+                                            📍 Ubicación
+                                        </p>
+                                        <p style="margin: 0 0 8px 0; color: #555555; font-size: 14px;">
+                                            {clinic_address}
+                                        </p>
+                                        <p style="margin: 0; color: #555555; font-size: 14px;">
+                                            📞 {clinic_phone}
+                                        </p>
+                                    </td>
+                                </tr>
+                            </table>
+
+                            <!-- Action Button -->
+                            <table role="presentation" style="width: 100%; border-collapse: collapse; margin: 30px 0;">
+                                <tr>
+                                    <td align="center">
+                                        <a href="tel:{clinic_phone_digits}" style="display: inline-block; padding: 14px 40px; background-color: #197fe6; color: #ffffff; text-decoration: none; border-radius: 6px; font-size: 16px; font-weight: 600;">
+                                            📞 Llamar para Confirmar
+                                        </a>
+                                    </td>
+                                </tr>
+                            </table>
+                        </td>
+                    </tr>
+
+                    <!-- Footer -->
+                    <tr>
+                        <td style="padding: 30px 40px; background-color: #f8f9fa; border-radius: 0 0 8px 8px; border-top: 1px solid #e0e0e0;">
+                            <p style="margin: 0 0 10px 0; color: #666666; font-size: 14px; text-align: center;">
+                                Gracias por confiar en <strong>{clinic_name}</strong>
+                            </p>
+                            <p style="margin: 0; color: #999999; font-size: 12px; text-align: center;">
+                                Este es un recordatorio automático. Por favor, no responda a este correo.
+                            </p>
+                            <p style="margin: 10px 0 0 0; color: #999999; font-size: 12px; text-align: center;">
+                                © {year} {clinic_name}. Todos los derechos reservados.
+                            </p>
+                        </td>
+                    </tr>
+                </table>
+            </td>
+        </tr>
+    </table>
+</body>
+</html>
+"""
+
+EMAIL_TEXT = """\
+RECORDATORIO DE CITA MÉDICA - {clinic_name}
+
+Hola {patient_name},
+
+Le recordamos que tiene una cita médica programada {timing_text}.
+
+DETALLES DE LA CITA:
+📆 Fecha: {appointment_date}
+⏰ Hora: {appointment_time}
+👨‍⚕️ Doctor: Dr. {doctor_name}
+📋 Motivo: {reason}
+
+IMPORTANTE:
+• Por favor, llegue 10 minutos antes de su cita
+• Traiga su cédula de identidad
+• Si no puede asistir, avísenos con anticipación
+
+UBICACIÓN:
+📍 {clinic_address}
+📞 {clinic_phone}
+
+Gracias por confiar en {clinic_name}.
+
+---
+Este es un recordatorio automático. Por favor, no responda a este correo.
+© {year} {clinic_name}. Todos los derechos reservados.
+"""
+
+WHATSAPP_TEXT = """\
+🏥 *{clinic_name}*
+_Recordatorio de Cita Médica_
+
+Hola *{patient_name}*,
+
+Le recordamos que tiene una cita médica programada *{timing_text}*.
+
+📅 *Fecha:* {appointment_date}
+⏰ *Hora:* {appointment_time}
+👨‍⚕️ *Doctor:* Dr. {doctor_name}
+📋 *Motivo:* {reason}
+
+⚠️ *Importante:*
+• Llegue 10 minutos antes
+• Traiga su cédula de identidad
+• Si no puede asistir, avísenos
+
+📍 *Ubicación:* {clinic_address}
+📞 *Teléfono:* {clinic_phone}
+
+_Gracias por confiar en {clinic_name}_
+
+---
+_Este es un recordatorio automático_
+"""
+
+
+_CONSTANTS = {'clinic_name': CLINIC_NAME, 'year': datetime.now().year}
+
+# Compiled at import and shared by every renderer
+EMAIL_SUBJECT_TEMPLATE = CompiledTemplate(EMAIL_SUBJECT, _CONSTANTS)
+EMAIL_HTML_TEMPLATE = CompiledTemplate(EMAIL_HTML, _CONSTANTS, escape=html.escape)
+EMAIL_TEXT_TEMPLATE = CompiledTemplate(EMAIL_TEXT, _CONSTANTS)
+WHATSAPP_TEMPLATE = CompiledTemplate(WHATSAPP_TEXT, _CONSTANTS)
+
+
+class ReminderTemplates:
+    """
+    Renders appointment reminders over the compiled templates
+
+    cache_size bounds each value cache (0 disables them).
+    """
+
+    def __init__(self, cache_size=TEMPLATE_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._when = lru_cache(maxsize=cache_size)(_when)
+        self._escape = lru_cache(maxsize=cache_size)(_escape)
+        self._email_timing = lru_cache(maxsize=cache_size and 64)(_email_timing)
+        self._whatsapp_timing = lru_cache(maxsize=cache_size and 64)(_whatsapp_timing)
+
+    def _values(self, appointment_data):
+        """Template values of an appointment (without date and timing, which depend on the channel)"""
+        get = appointment_data.get
+        clinic_phone = get('clinic_phone') or DEFAULT_CLINIC_PHONE
+        long_date, short_date, appointment_time = self._when(get('appointment_date'), get('appointment_time'))
+        values = {
+            'patient_name': get('patient_name') or 'Paciente',
+            'doctor_name': get('doctor_name') or 'Doctor',
+            'appointment_time': appointment_time or '',
+            'reason': get('reason') or 'Consulta médica',
+            'clinic_address': get('clinic_address') or DEFAULT_CLINIC_ADDRESS,
+            'clinic_phone': clinic_phone,
+            'clinic_phone_digits': clinic_phone.replace('-', ''),
+        }
+        return values, long_date or 'Próximamente', short_date or 'Próximamente'
+
+    def email(self, appointment_data, hours_before=24):
+        """
+        Email of an appointment reminder
+
+        Returns:
+            tuple: (subject, html_content, text_content)
+        """
+        values, long_date, _ = self._values(appointment_data)
+        values['appointment_date'] = long_date
+        values['timing_text'] = self._email_timing(hours_before)
+
+        escape = self._escape
+        html_content = EMAIL_HTML_TEMPLATE.render({field: escape(value) for field, value in values.items()})
+        return (EMAIL_SUBJECT_TEMPLATE.render(values), html_content, EMAIL_TEXT_TEMPLATE.render(values))
+
+    def whatsapp(self, appointment_data, hours_before=24):
+        """WhatsApp message of an appointment reminder"""
+        values, _, short_date = self._values(appointment_data)
+        values['appointment_date'] = short_date
+        values['timing_text'] = self._whatsapp_timing(hours_before)
+        return WHATSAPP_TEMPLATE.render(values)
+
+    def render_batch(self, reminders, channel='email'):
+        """
+        Messages of many reminders, in order
+
+        Args:
+            reminders: Dictionaries with 'appointment_data' and optional 'hours_before' (24)
+            channel: 'email' for (subject, html, text) tuples, 'whatsapp' for message texts
+
+        Returns:
+            list: One message per reminder
+        """
+        if channel not in ('email', 'whatsapp'):
+            raise ValueError(f"Unknown reminder channel: {channel}")
+        render = self.email if channel == 'email' else self.whatsapp
+        return [render(reminder['appointment_data'], reminder.get('hours_before', 24)) for reminder in reminders]
+
+    def cache_info(self):
+        """Hits and misses of the date and HTML escape caches"""
+        return {name: getattr(self, f"_{name}").cache_info()._asdict() for name in ('when', 'escape')}
+
+
+reminder_templates = ReminderTemplates()
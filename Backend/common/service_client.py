@@ -3,7 +3,7 @@ Cliente HTTP para comunicación entre microservicios
 """
 import requests
 import os
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 
 
 class ServiceClient:
@@ -124,7 +124,30 @@ class InventarioServiceClient(ServiceClient):
 
     def update_stock(self, product_id: int, quantity_change: int, token: str) -> Dict[str, Any]:
         """Update product stock"""
-        return self.post(f'/products/{product_id}/stock', {'quantity_change': quantity_change}, token=token)
+        return self.apply_stock_movements({product_id: quantity_change}, token)
+
+    def apply_stock_movements(self, changes: Dict[int, int], token: str, movement_type: str = 'AJUSTE',
+                              reference: Optional[str] = None) -> Dict[str, Any]:
+        """Apply many stock deltas ({product_id: quantity_change}) in one transaction"""
+        data = {
+            'movement_type': movement_type,
+            'reference': reference,
+            'movements': [
+                {'product_id': product_id, 'quantity_change': quantity_change}
+                for product_id, quantity_change in changes.items()
+            ]
+        }
+        return self.post('/stock/movements', data, token=token)
+
+    def reserve_stock(self, reference: str, treatments: List[Dict[str, int]], token: str,
+                      consume: bool = False) -> Dict[str, Any]:
+        """Reserve (or consume right away) the recipes of several treatments in one transaction"""
+        data = {'reference': reference, 'treatments': treatments, 'consume': consume}
+        return self.post('/reservations', data, token=token)
+
+    def release_reservations(self, references: List[str], token: str) -> Dict[str, Any]:
+        """Return the stock held by reservations"""
+        return self.post('/reservations/release', {'references': references}, token=token)
 
 
 class HistoriaClinicaServiceClient(ServiceClient):
@@ -1,9 +1,103 @@
 """
 WhatsApp Service
 Handles WhatsApp message sending via Twilio API for appointment reminders
+
+Messages go through the Twilio REST API over keep-alive connections. Every sender of
+the process shares one token bucket per WhatsApp number, so bulk runs and single
+reminders together stay under the provider's messages-per-second limit; 429 and 5xx
+answers and failed connections are retried with jittered exponential backoff. A timeout
+waiting for the answer is not retried: Twilio may have queued the message already.
 """
 import os
-from datetime import datetime
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from common.rate_limiting import TokenBucket
+from common.reminder_templates import reminder_templates
+
+TWILIO_API_URL = os.getenv('TWILIO_API_URL', 'https://api.twilio.com')
+# Messages sent in parallel by send_bulk_reminders, and messages per second per sender number (0 = no limit)
+WHATSAPP_BULK_WORKERS = int(os.getenv('WHATSAPP_BULK_WORKERS', 8))
+WHATSAPP_RATE_LIMIT = float(os.getenv('WHATSAPP_RATE_LIMIT', 10))
+# Attempts per message on 429, 5xx or failed connections; retry n waits a random time of up to
+# WHATSAPP_RETRY_BACKOFF * 2^(n - 1) seconds (at least the Retry-After of a 429)
+WHATSAPP_MAX_ATTEMPTS = int(os.getenv('WHATSAPP_MAX_ATTEMPTS', 4))
+WHATSAPP_RETRY_BACKOFF = float(os.getenv('WHATSAPP_RETRY_BACKOFF', 0.5))
+MAX_RETRY_WAIT = 30
+WHATSAPP_TIMEOUT = int(os.getenv('WHATSAPP_TIMEOUT', 10))
+# Errors kept in a send_bulk_reminders summary
+SUMMARY_MAX_ERRORS = 20
+
+
+class TwilioAPIError(Exception):
+    """
+    Error response (or no response: status None) from the Twilio API
+
+    maybe_sent: the request reached Twilio but no answer came back (read timeout), so
+    the message may exist; sending it again could deliver it twice.
+    """
+
+    def __init__(self, status, message, retry_after=None, maybe_sent=False):
+        super().__init__(f"{status or ('No response' if maybe_sent else 'Connection error')}: {message}")
+        self.status = status
+        self.retry_after = retry_after
+        self.maybe_sent = maybe_sent
+
+    @property
+    def retryable(self):
+        if self.status is None:
+            return not self.maybe_sent
+        return self.status == 429 or self.status >= 500
+
+
+class TwilioMessagesClient:
+    """Messages resource of the Twilio REST API (one keep-alive session per thread)"""
+
+    def __init__(self, account_sid, auth_token, base_url=TWILIO_API_URL, timeout=WHATSAPP_TIMEOUT):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def create_message(self, to, from_, body):
+        """Queue one message; returns the created message resource (sid, status...)"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        try:
+            response = session.post(
+                f"{self.base_url}/2010-04-01/Accounts/{self.account_sid}/Messages.json",
+                data={'To': to, 'From': from_, 'Body': body},
+                auth=(self.account_sid, self.auth_token), timeout=self.timeout
+            )
+        except requests.exceptions.ConnectionError as e:
+            # Includes ConnectTimeout: the message was not sent
+            raise TwilioAPIError(None, str(e)) from e
+        except requests.exceptions.RequestException as e:
+            raise TwilioAPIError(None, str(e), maybe_sent=True) from e
+        if response.status_code >= 400:
+            retry_after = response.headers.get('Retry-After')
+            raise TwilioAPIError(response.status_code, response.text[:300],
+                                 float(retry_after) if retry_after and retry_after.isdigit() else None)
+        return response.json()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(service):
+    """The process-wide token bucket of a WhatsAppService's sender number, created on first use"""
+    key = (service.account_sid, service.from_number)
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = TokenBucket(service.rate_limit)
+        return _limiters[key]
 
 
 class WhatsAppService:
@@ -15,6 +109,12 @@ class WhatsAppService:
         self.auth_token = os.getenv('TWILIO_AUTH_TOKEN', '')
         self.from_number = os.getenv('TWILIO_WHATSAPP_NUMBER', 'whatsapp:+14155238886')  # Twilio Sandbox
         self.enabled = bool(self.account_sid and self.auth_token)
+        self.api_url = TWILIO_API_URL
+        self.workers = WHATSAPP_BULK_WORKERS
+        self.rate_limit = WHATSAPP_RATE_LIMIT
+        self.max_attempts = WHATSAPP_MAX_ATTEMPTS
+        self.retry_backoff = WHATSAPP_RETRY_BACKOFF
+        self._client = None
 
     def _get_twilio_client(self):
         """Get Twilio client"""
@@ -22,15 +122,45 @@ class WhatsAppService:
             print("⚠️ Twilio not configured. Set TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN")
             return None
 
-        try:
-            from twilio.rest import Client
-            return Client(self.account_sid, self.auth_token)
-        except ImportError:
-            print("⚠️ Twilio library not installed. Run: pip install twilio")
-            return None
-        except Exception as e:
-            print(f"⚠️ Error creating Twilio client: {str(e)}")
-            return None
+        if self._client is None:
+            self._client = TwilioMessagesClient(self.account_sid, self.auth_token, self.api_url)
+        return self._client
+
+    @property
+    def limiter(self):
+        """Pacing of this sender number (shared across instances)"""
+        return get_rate_limiter(self)
+
+    def _retry_wait(self, attempt, error):
+        """Full jitter over the exponential backoff, never sooner than the API asks"""
+        wait = random.uniform(0, min(MAX_RETRY_WAIT, self.retry_backoff * 2 ** (attempt - 1)))
+        return max(wait, min(MAX_RETRY_WAIT, error.retry_after or 0))
+
+    def _send(self, client, to_number, message):
+        """
+        Send one message at the sender's rate, retrying 429, 5xx and failed connections
+
+        Returns:
+            dict: sid (None if it failed), error, attempts, rate_limited (429 answers)
+                  and waited (seconds paced by the token bucket)
+        """
+        if not to_number.startswith('whatsapp:'):
+            to_number = f"whatsapp:{to_number}"
+
+        result = {'sid': None, 'error': None, 'attempts': 0, 'rate_limited': 0, 'waited': 0.0}
+        limiter = self.limiter
+        while True:
+            result['waited'] += limiter.acquire()
+            result['attempts'] += 1
+            try:
+                result['sid'] = client.create_message(to_number, self.from_number, message)['sid']
+                return result
+            except TwilioAPIError as e:
+                result['rate_limited'] += e.status == 429
+                if not e.retryable or result['attempts'] >= self.max_attempts:
+                    result['error'] = str(e)
+                    return result
+                time.sleep(self._retry_wait(result['attempts'], e))
 
     def send_whatsapp_message(self, to_number, message):
         """
@@ -50,28 +180,20 @@ class WhatsAppService:
             return False
 
         try:
-            # Format phone number for WhatsApp
-            if not to_number.startswith('whatsapp:'):
-                to_number = f"whatsapp:{to_number}"
-
-            # Send message
-            message_obj = client.messages.create(
-                body=message,
-                from_=self.from_number,
-                to=to_number
-            )
-
-            print(f"✅ WhatsApp sent successfully to {to_number}")
-            print(f"   Message SID: {message_obj.sid}")
-            return True
-
+            result = self._send(client, to_number, message)
         except Exception as e:
-            print(f"❌ Error sending WhatsApp: {str(e)}")
+            result = {'error': str(e)}
+        if result['error']:
+            print(f"❌ Error sending WhatsApp: {result['error']}")
             return False
 
+        print(f"✅ WhatsApp sent successfully to {to_number}")
+        print(f"   Message SID: {result['sid']}")
+        return True
+
     def get_appointment_reminder_message(self, appointment_data, hours_before=24):
         """
-        Get WhatsApp message template for appointment reminder
+        Get WhatsApp message template for appointment reminder (compiled once, see common/reminder_templates.py)
 
         Args:
             appointment_data: Dictionary with appointment information
@@ -80,59 +202,7 @@ class WhatsAppService:
         Returns:
             str: WhatsApp message content
         """
-        patient_name = appointment_data.get('patient_name', 'Paciente')
-        doctor_name = appointment_data.get('doctor_name', 'Doctor')
-        appointment_date = appointment_data.get('appointment_date')
-        appointment_time = appointment_data.get('appointment_time')
-        reason = appointment_data.get('reason', 'Consulta médica')
-        clinic_address = appointment_data.get('clinic_address', 'Av. Principal 123, Quito')
-        clinic_phone = appointment_data.get('clinic_phone', '02-123-4567')
-
-        # Parse datetime if string
-        if isinstance(appointment_date, str):
-            try:
-                dt = datetime.fromisoformat(appointment_date.replace('Z', '+00:00'))
-                appointment_date = dt.strftime('%d/%m/%Y')
-                appointment_time = dt.strftime('%H:%M')
-            except:
-                pass
-
-        # Determine reminder timing text
-        if hours_before == 24:
-            timing_text = "mañana"
-        elif hours_before < 24:
-            timing_text = f"en {hours_before} horas"
-        else:
-            days = hours_before // 24
-            timing_text = f"en {days} día{'s' if days > 1 else ''}"
-
-        message = f"""🏥 *Clínica Bienestar*
-_Recordatorio de Cita Médica_
-
-Hola *{patient_name}*,
-
-Le recordamos que tiene una cita médica programada *{timing_text}*.
-
-📅 *Fecha:* {appointment_date}
-⏰ *Hora:* {appointment_time}
-👨‍⚕️ *Doctor:* Dr. {doctor_name}
-📋 *Motivo:* {reason}
-
-⚠️ *Importante:*
-• Llegue 10 minutos antes
-• Traiga su cédula de identidad
-• Si no puede asistir, avísenos
-
-📍 *Ubicación:* {clinic_address}
-📞 *Teléfono:* {clinic_phone}
-
-_Gracias por confiar en Clínica Bienestar_
-
----
-_Este es un recordatorio automático_
-"""
-
-        return message
+        return reminder_templates.whatsapp(appointment_data, hours_before)
 
     def send_appointment_reminder(self, to_number, appointment_data, hours_before=24):
         """
@@ -149,15 +219,20 @@ _Este es un recordatorio automático_
         message = self.get_appointment_reminder_message(appointment_data, hours_before)
         return self.send_whatsapp_message(to_number, message)
 
-    def send_bulk_reminders(self, reminders_list):
+    def send_bulk_reminders(self, reminders_list, workers=None):
         """
-        Send multiple WhatsApp reminders
+        Send multiple WhatsApp reminders concurrently, paced to the sender's rate limit
 
         Args:
             reminders_list: List of dictionaries with 'to_number' and 'appointment_data'
+                            (and optionally 'hours_before', 24 by default)
+            workers: Parallel senders (default: WHATSAPP_BULK_WORKERS)
 
         Returns:
-            dict: Statistics of sent/failed messages
+            dict: Statistics of the run: total, sent, failed, results (message SID or None per
+                  reminder, in order), retries, rate_limited (429 answers), throttled_seconds
+                  (time paced by the token bucket), seconds, per_second and the first errors
+                  (to_number, error)
         """
         stats = {
             'total': len(reminders_list),
@@ -165,14 +240,43 @@ _Este es un recordatorio automático_
             'failed': 0
         }
 
-        for reminder in reminders_list:
-            to_number = reminder.get('to_number')
-            appointment_data = reminder.get('appointment_data')
-            hours_before = reminder.get('hours_before', 24)
+        client = self._get_twilio_client()
+        if not client:
+            stats['failed'] = len(reminders_list)
+            return stats
 
-            if self.send_appointment_reminder(to_number, appointment_data, hours_before):
-                stats['sent'] += 1
-            else:
-                stats['failed'] += 1
+        started = time.monotonic()
 
+        def send(reminder):
+            # A bad reminder (no number, no appointment data, odd API answer) fails alone
+            try:
+                message = reminder_templates.whatsapp(reminder['appointment_data'], reminder.get('hours_before', 24))
+                return self._send(client, reminder['to_number'], message)
+            except Exception as e:
+                return {'sid': None, 'error': f"{type(e).__name__}: {str(e)}", 'attempts': 1,
+                        'rate_limited': 0, 'waited': 0.0}
+
+        results = []
+        if reminders_list:
+            workers = min(workers or self.workers, len(reminders_list))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='whatsapp') as executor:
+                results = list(executor.map(send, reminders_list))
+
+        seconds = time.monotonic() - started
+        stats['sent'] = sum(1 for result in results if result['sid'])
+        stats['failed'] = stats['total'] - stats['sent']
+        stats.update({
+            'results': [result['sid'] for result in results],
+            'retries': sum(result['attempts'] - 1 for result in results),
+            'rate_limited': sum(result['rate_limited'] for result in results),
+            'throttled_seconds': round(sum(result['waited'] for result in results), 3),
+            'seconds': round(seconds, 3),
+            'per_second': round(stats['sent'] / seconds, 1) if seconds else None,
+            'errors': [
+                (reminder.get('to_number'), result['error'])
+                for reminder, result in zip(reminders_list, results, strict=False) if result['error']
+            ][:SUMMARY_MAX_ERRORS],
+        })
+        print(f"📱 WhatsApp run: {stats['sent']}/{stats['total']} sent, {stats['retries']} retries, "
+              f"{stats['rate_limited']} rate limited, {stats['seconds']}s")
         return stats
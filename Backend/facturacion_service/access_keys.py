@@ -0,0 +1,238 @@
+"""
+Access keys (claves de acceso) in bulk
+Generation and validation of many 49-digit keys at once with precomputed modulo 11
+weights; NumPy (optional) turns the check-digit computation into one matrix product
+"""
+import re
+from datetime import date, datetime
+from operator import mul
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - optional dependency
+    numpy = None
+
+
+CLAVE_LENGTH = 49
+BASE_LENGTH = 48
+
+# Modulo 11 weights for the 48-digit base, left to right: 2, 3, ..., 7 cycling from the rightmost digit
+WEIGHTS = tuple(2 + (BASE_LENGTH - 1 - position) % 6 for position in range(BASE_LENGTH))
+
+# Check digit for each remainder: 11 - r, where 11 -> 0 and 10 -> 1
+CHECK_DIGITS = tuple((11 - remainder) % 11 if remainder != 1 else 1 for remainder in range(11))
+
+# Layout of the key: (name, start, end)
+FIELDS = (
+    ('fecha_emision', 0, 8),
+    ('tipo_comprobante', 8, 10),
+    ('ruc', 10, 23),
+    ('ambiente', 23, 24),
+    ('establecimiento', 24, 27),
+    ('punto_emision', 27, 30),
+    ('secuencial', 30, 39),
+    ('codigo_numerico', 39, 47),
+    ('tipo_emision', 47, 48),
+    ('digito_verificador', 48, 49),
+)
+
+TIPOS_COMPROBANTE = ('01', '03', '04', '05', '06', '07')
+AMBIENTES = ('1', '2')
+
+_FECHA_DMY = re.compile(r'^(\d{2})/(\d{2})/(\d{4})$')
+_DIGIT_OFFSET = ord('0')
+# sum(weight * byte) over ASCII digits exceeds sum(weight * digit) by this constant
+_ASCII_OFFSET = _DIGIT_OFFSET * sum(WEIGHTS)
+
+if numpy is not None:
+    _WEIGHTS_ARRAY = numpy.array(WEIGHTS, dtype=numpy.int64)
+    _CHECK_DIGITS_ARRAY = numpy.array([ord(str(digit)) for digit in CHECK_DIGITS], dtype=numpy.uint8)
+
+
+def modulo11(base):
+    """Check digit of one 48-digit base"""
+    return CHECK_DIGITS[(sum(map(mul, WEIGHTS, base.encode('ascii'))) - _ASCII_OFFSET) % 11]
+
+
+def check_digits(bases):
+    """
+    Check digits of many 48-digit bases
+
+    Args:
+        bases: Sequence of 48-character digit strings
+
+    Returns:
+        String with one check digit per base, in order
+    """
+    if not bases:
+        return ''
+
+    if numpy is None:
+        return ''.join(str(modulo11(base)) for base in bases)
+
+    digits = numpy.frombuffer(''.join(bases).encode('ascii'), dtype=numpy.uint8).reshape(-1, BASE_LENGTH)
+    totals = (digits - _DIGIT_OFFSET).astype(numpy.int64) @ _WEIGHTS_ARRAY
+    return _CHECK_DIGITS_ARRAY[totals % 11].tobytes().decode('ascii')
+
+
+def _fecha_ddmmyyyy(fecha):
+    """'dd/mm/YYYY', date/datetime or ISO 'YYYY-MM-DD' -> 'ddmmYYYY' (no strptime)"""
+    if isinstance(fecha, date | datetime):
+        return f"{fecha.day:02d}{fecha.month:02d}{fecha.year:04d}"
+
+    match = _FECHA_DMY.match(fecha)
+    if match:
+        day, month, year = match.groups()
+    elif len(fecha) == 10 and fecha[4] == '-' and fecha[7] == '-':
+        year, month, day = fecha[:4], fecha[5:7], fecha[8:]
+    else:
+        raise ValueError(f"Invalid emission date: {fecha}")
+
+    if not (1 <= int(day) <= 31 and 1 <= int(month) <= 12):
+        raise ValueError(f"Invalid emission date: {fecha}")
+    return f"{day}{month}{year}"
+
+
+def default_codigo_numerico(secuencial):
+    """Deterministic 8-digit numeric code, so regenerating an invoice yields the same key"""
+    return f"{int(secuencial) % 100000000:08d}"
+
+
+def generate_access_keys(fechas_emision, secuenciales, ruc, tipo_comprobante='01', ambiente='1',
+                         establecimiento='001', punto_emision='001', tipo_emision='1',
+                         codigos_numericos=None):
+    """
+    Generate many 49-digit access keys
+
+    Args:
+        fechas_emision: Emission dates ('dd/mm/YYYY', 'YYYY-MM-DD' or date), or a single
+                        date shared by every key
+        secuenciales: Sequential numbers
+        ruc: Issuer RUC (13 digits)
+        tipo_comprobante: Document type ('01' invoice)
+        ambiente: '1' test, '2' production
+        establecimiento: Establishment code (3 digits)
+        punto_emision: Point of sale code (3 digits)
+        tipo_emision: Emission type (1 digit)
+        codigos_numericos: 8-digit numeric codes (default: derived from the sequential)
+
+    Returns:
+        List of access keys, same order as secuenciales
+    """
+    if isinstance(fechas_emision, str | date):
+        fechas = [_fecha_ddmmyyyy(fechas_emision)] * len(secuenciales)
+    else:
+        cache = {}
+        fechas = [cache.get(fecha) or cache.setdefault(fecha, _fecha_ddmmyyyy(fecha)) for fecha in fechas_emision]
+
+    if len(fechas) != len(secuenciales):
+        raise ValueError("fechas_emision and secuenciales must have the same length")
+
+    codigos = codigos_numericos or [default_codigo_numerico(secuencial) for secuencial in secuenciales]
+
+    emisor = f"{tipo_comprobante}{ruc}{ambiente}{establecimiento}{punto_emision}"
+    if len(emisor) != 22 or not emisor.isdigit() or len(str(tipo_emision)) != 1:
+        raise ValueError(f"Invalid issuer data for access key: {emisor}")
+
+    bases = [
+        f"{fecha}{emisor}{int(secuencial):09d}{codigo}{tipo_emision}"
+        for fecha, secuencial, codigo in zip(fechas, secuenciales, codigos, strict=False)
+    ]
+
+    invalid = next((base for base in bases if len(base) != BASE_LENGTH or not base.isdigit()), None)
+    if invalid is not None:
+        raise ValueError(f"Invalid access key base: {invalid}")
+
+    return [base + digit for base, digit in zip(bases, check_digits(bases), strict=False)]
+
+
+def generate_access_key(fecha_emision, secuencial, ruc, **kwargs):
+    """Single access key (same arguments as generate_access_keys)"""
+    return generate_access_keys(fecha_emision, [secuencial], ruc, **kwargs)[0]
+
+
+def parse_access_key(clave_acceso):
+    """Split an access key into its fields (no validation)"""
+    return {name: clave_acceso[start:end] for name, start, end in FIELDS}
+
+
+# Reasons returned by validate_access_keys, in the order they are checked
+MOTIVOS = (None, 'fecha', 'tipo_comprobante', 'ambiente', 'digito_verificador')
+
+
+def _validate_one(clave):
+    if not (1 <= int(clave[0:2]) <= 31 and 1 <= int(clave[2:4]) <= 12):
+        return 'fecha'
+    if clave[8:10] not in TIPOS_COMPROBANTE:
+        return 'tipo_comprobante'
+    if clave[23] not in AMBIENTES:
+        return 'ambiente'
+    if clave[BASE_LENGTH] != str(modulo11(clave[:BASE_LENGTH])):
+        return 'digito_verificador'
+    return None
+
+
+def _validate_matrix(claves):
+    """Field checks and check digits of well-formed keys as one (n, 49) digit matrix"""
+    digits = (
+        numpy.frombuffer(''.join(claves).encode('ascii'), dtype=numpy.uint8).reshape(-1, CLAVE_LENGTH)
+        - _DIGIT_OFFSET
+    ).astype(numpy.int64)
+
+    day = digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 2] * 10 + digits[:, 3]
+    tipo = digits[:, 8] * 10 + digits[:, 9]
+    expected = numpy.array(CHECK_DIGITS, dtype=numpy.int64)[(digits[:, :BASE_LENGTH] @ _WEIGHTS_ARRAY) % 11]
+
+    codes = numpy.select(
+        [
+            (day < 1) | (day > 31) | (month < 1) | (month > 12),
+            ~numpy.isin(tipo, [int(code) for code in TIPOS_COMPROBANTE]),
+            ~numpy.isin(digits[:, 23], [int(code) for code in AMBIENTES]),
+            digits[:, BASE_LENGTH] != expected
+        ],
+        [1, 2, 3, 4],
+        default=0
+    )
+    return [MOTIVOS[code] for code in codes.tolist()]
+
+
+def validate_access_keys(claves_acceso):
+    """
+    Validate many access keys
+
+    Checks length, digits, emission date, document type, environment and the
+    modulo 11 check digit (all rows at once when NumPy is available).
+
+    Args:
+        claves_acceso: Sequence of access keys (None allowed)
+
+    Returns:
+        List with None for valid keys or the reason it is invalid:
+        'longitud', 'no_numerica', 'fecha', 'tipo_comprobante', 'ambiente',
+        'digito_verificador'
+    """
+    errores = [None] * len(claves_acceso)
+    candidatas = []
+
+    for index, clave in enumerate(claves_acceso):
+        if not clave or len(clave) != CLAVE_LENGTH:
+            errores[index] = 'longitud'
+        elif not clave.isascii() or not clave.isdigit():
+            errores[index] = 'no_numerica'
+        else:
+            candidatas.append(index)
+
+    if not candidatas:
+        return errores
+
+    claves = [claves_acceso[index] for index in candidatas]
+    motivos = _validate_matrix(claves) if numpy is not None else [_validate_one(clave) for clave in claves]
+    for index, motivo in zip(candidatas, motivos, strict=False):
+        errores[index] = motivo
+
+    return errores
+
+
+def is_valid_access_key(clave_acceso):
+    return validate_access_keys([clave_acceso])[0] is None
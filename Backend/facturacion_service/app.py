@@ -5,6 +5,8 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import threading
+import time
 from flask import Flask
 from flask_cors import CORS
 from dotenv import load_dotenv
@@ -13,7 +15,9 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from routes import facturacion_bp
-from electronic_invoice_routes import electronic_invoice_bp
+from electronic_invoice_routes import electronic_invoice_bp, drain_sri_outbox
+from sri_production import warm_up_sri_clients
+from sri_outbox import get_sri_outbox
 
 # Create Flask app
 app = Flask(__name__)
@@ -25,6 +29,31 @@ CORS(app, origins=os.getenv('CORS_ORIGINS', '*').split(','))
 app.register_blueprint(facturacion_bp, url_prefix='/api/facturacion')
 app.register_blueprint(electronic_invoice_bp, url_prefix='/api/facturacion/sri')
 
+# Warm up SRI SOAP clients in the background so the first authorization skips WSDL parsing
+if os.getenv('SRI_WARMUP', 'True') == 'True':
+    threading.Thread(target=warm_up_sri_clients, name='sri-warmup', daemon=True).start()
+
+
+def drain_outbox_periodically(interval):
+    """Send invoices issued in contingency once the SRI answers again (leases keep workers apart)"""
+    while True:
+        time.sleep(interval)
+        try:
+            backlog = get_sri_outbox().backlog()
+            if backlog['pendientes'] or backlog['por_aplicar']:
+                print(f"SRI outbox drain: {drain_sri_outbox()}")
+        except Exception as e:
+            print(f"SRI outbox drain error: {str(e)}")
+
+
+# Contingency backlog drain (0 disables it; use POST /electronic-invoices/contingency/drain)
+SRI_OUTBOX_DRAIN_INTERVAL = int(os.getenv('SRI_OUTBOX_DRAIN_INTERVAL', 30))
+if SRI_OUTBOX_DRAIN_INTERVAL > 0:
+    threading.Thread(
+        target=drain_outbox_periodically, args=(SRI_OUTBOX_DRAIN_INTERVAL,),
+        name='sri-outbox', daemon=True
+    ).start()
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
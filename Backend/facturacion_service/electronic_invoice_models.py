@@ -269,7 +269,7 @@ class ElectronicInvoiceModel:
     @staticmethod
     def update_electronic_data(invoice_id, clave_acceso, numero_autorizacion=None,
                                 fecha_autorizacion=None, xml_content=None,
-                                estado_sri=None, mensaje_sri=None):
+                                estado_sri=None, mensaje_sri=None, tipo_emision=None):
         """Update invoice with electronic data"""
         with db.get_cursor(commit=True) as cursor:
             cursor.execute("""
@@ -279,13 +279,51 @@ class ElectronicInvoiceModel:
                     fecha_autorizacion = %s,
                     xml_content = %s,
                     estado_sri = %s,
-                    mensaje_sri = %s
+                    mensaje_sri = %s,
+                    tipo_emision = COALESCE(%s, tipo_emision)
                 WHERE invoice_id = %s
                 RETURNING *
             """, (clave_acceso, numero_autorizacion, fecha_autorizacion,
-                  xml_content, estado_sri, mensaje_sri, invoice_id))
+                  xml_content, estado_sri, mensaje_sri, tipo_emision, invoice_id))
             return cursor.fetchone()
 
+    @staticmethod
+    def apply_sri_results(results):
+        """
+        Apply drained contingency results to invoices and the authorization log in one transaction
+
+        Args:
+            results: List of dicts with invoice_id, clave_acceso, estado_sri
+                     (AUTORIZADA, NO_AUTORIZADA, ERROR), numero_autorizacion,
+                     fecha_autorizacion and mensaje_sri
+        """
+        with db.get_cursor(commit=True) as cursor:
+            cursor.executemany("""
+                UPDATE invoices
+                SET estado_sri = %s,
+                    numero_autorizacion = %s,
+                    fecha_autorizacion = %s,
+                    mensaje_sri = %s,
+                    status = CASE WHEN %s = 'AUTORIZADA' THEN 'ISSUED' ELSE status END
+                WHERE invoice_id = %s AND clave_acceso = %s
+            """, [
+                (r['estado_sri'], r.get('numero_autorizacion'), r.get('fecha_autorizacion'),
+                 r.get('mensaje_sri'), r['estado_sri'], r['invoice_id'], r['clave_acceso'])
+                for r in results
+            ])
+            cursor.executemany("""
+                INSERT INTO sri_authorization_log (
+                    invoice_id, clave_acceso, estado, numero_autorizacion,
+                    fecha_autorizacion, mensaje
+                )
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, [
+                (r['invoice_id'], r['clave_acceso'], r['estado_sri'], r.get('numero_autorizacion'),
+                 r.get('fecha_autorizacion'), r.get('mensaje_sri'))
+                for r in results
+            ])
+            return len(results)
+
     @staticmethod
     def update_sri_status(invoice_id, estado_sri, mensaje_sri=None):
         """Update SRI status"""
@@ -299,6 +337,32 @@ class ElectronicInvoiceModel:
             """, (estado_sri, mensaje_sri, invoice_id))
             return cursor.fetchone()
 
+    @staticmethod
+    def get_download_info(invoice_id):
+        """Get the fields needed to locate stored files (without xml_content)"""
+        with db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT invoice_id, invoice_number, clave_acceso, estado_sri,
+                       numero_autorizacion, fecha_autorizacion,
+                       xml_content IS NOT NULL AS has_xml
+                FROM invoices
+                WHERE invoice_id = %s
+            """, (invoice_id,))
+            return cursor.fetchone()
+
+    @staticmethod
+    def get_access_keys_page(after_id=0, limit=5000):
+        """Invoices with an access key after `after_id` (keyset pagination for bulk validation)"""
+        with db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT invoice_id, invoice_number, issue_date, clave_acceso
+                FROM invoices
+                WHERE clave_acceso IS NOT NULL AND invoice_id > %s
+                ORDER BY invoice_id
+                LIMIT %s
+            """, (after_id, limit))
+            return cursor.fetchall()
+
     @staticmethod
     def get_complete_invoice(invoice_id):
         """Get complete invoice data with all related information"""
@@ -394,6 +458,7 @@ class ElectronicInvoiceModel:
                     COUNT(CASE WHEN estado_sri = 'PENDIENTE' THEN 1 END) as pendientes,
                     COUNT(CASE WHEN estado_sri = 'NO_AUTORIZADA' THEN 1 END) as rechazadas,
                     COUNT(CASE WHEN estado_sri = 'ERROR' THEN 1 END) as errores,
+                    COUNT(CASE WHEN estado_sri = 'CONTINGENCIA' THEN 1 END) as en_contingencia,
                     COALESCE(SUM(CASE WHEN estado_sri = 'AUTORIZADA' THEN total_amount ELSE 0 END), 0) as monto_autorizado
                 FROM invoices
                 WHERE clave_acceso IS NOT NULL
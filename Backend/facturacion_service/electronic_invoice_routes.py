@@ -1,10 +1,11 @@
 """
 Routes for Electronic Invoicing (SRI)
 """
-from flask import Blueprint, request
+from flask import Blueprint, request, Response
 from datetime import datetime, date
 import sys
 import os
+import time
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from common.auth_middleware import token_required
@@ -17,10 +18,134 @@ from electronic_invoice_models import (
 from sri_electronic_invoice import (
     SRIElectronicInvoice, SRIWebService, FORMAS_PAGO
 )
+from sri_production import get_sri_client
+from sri_outbox import get_sri_outbox, get_contingency_monitor, TIPO_EMISION_CONTINGENCIA, CONTINGENCY_MODES
 from xml_storage import xml_storage
+from file_downloads import send_xml_file, send_ride_file
+from ride_renderer import get_ride_renderer
 
 electronic_invoice_bp = Blueprint('electronic_invoice', __name__)
 
+# invoices.estado_sri for each final outbox state
+OUTBOX_ESTADOS_SRI = {
+    'AUTORIZADO': 'AUTORIZADA',
+    'NO AUTORIZADO': 'NO_AUTORIZADA',
+    'DEVUELTA': 'ERROR'
+}
+
+# Seconds a client should wait before asking again for a RIDE that is being rendered
+RIDE_RETRY_AFTER = 2
+
+
+def _to_date(value):
+    return value if isinstance(value, date) else datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _store_authorized(invoice_number, xml_content, issue_date, numero_autorizacion, fecha_autorizacion):
+    """Save the authorized XML and queue its RIDE (cached by access key)"""
+    xml_storage.save_xml(
+        invoice_number=invoice_number,
+        xml_content=xml_content,
+        estado='AUTORIZADO',
+        date=issue_date
+    )
+
+    get_ride_renderer().submit(
+        invoice_number,
+        xml_content,
+        autorizacion={
+            'numero_autorizacion': numero_autorizacion,
+            'fecha_autorizacion': fecha_autorizacion
+        }
+    )
+
+
+def _queue_contingency(invoice, estado='PENDIENTE', mensaje=None):
+    """Put an invoice in the SRI outbox and mark it as issued in contingency"""
+    get_sri_outbox().enqueue(
+        invoice['clave_acceso'],
+        invoice['invoice_number'],
+        invoice['xml_content'],
+        invoice_id=invoice['invoice_id'],
+        issue_date=invoice.get('issue_date'),
+        tipo_emision=invoice.get('tipo_emision'),
+        estado=estado,
+        mensaje=mensaje
+    )
+
+    estado_sri = 'CONTINGENCIA' if estado == 'PENDIENTE' else 'RECIBIDA'
+    ElectronicInvoiceModel.update_sri_status(
+        invoice_id=invoice['invoice_id'],
+        estado_sri=estado_sri,
+        mensaje_sri=mensaje
+    )
+
+    return success_response({
+        'invoice_id': invoice['invoice_id'],
+        'clave_acceso': invoice['clave_acceso'],
+        'estado': estado_sri,
+        'backlog': get_sri_outbox().backlog()['pendientes'],
+        'mensaje': 'SRI unavailable, invoice queued for deferred authorization'
+    }, 'Invoice queued for authorization', 202)
+
+
+def apply_outbox_results(outbox=None):
+    """
+    Write finished outbox results to the database and the XML storage
+
+    Results are marked as applied only after the database update, so a crash
+    in between re-applies them on the next drain.
+
+    Returns:
+        Number of invoices updated
+    """
+    outbox = outbox or get_sri_outbox()
+    rows = outbox.unapplied()
+    if not rows:
+        return 0
+
+    results = [
+        {
+            'invoice_id': row['invoice_id'],
+            'clave_acceso': row['clave_acceso'],
+            'estado_sri': OUTBOX_ESTADOS_SRI[row['estado']],
+            'numero_autorizacion': row['numero_autorizacion'],
+            'fecha_autorizacion': row['fecha_autorizacion'],
+            'mensaje_sri': 'Factura autorizada por SRI (contingencia)' if row['estado'] == 'AUTORIZADO' else row['mensaje']
+        }
+        for row in rows if row['invoice_id'] is not None
+    ]
+    ElectronicInvoiceModel.apply_sri_results(results)
+
+    for row in rows:
+        issue_date = _to_date(row['issue_date']) if row['issue_date'] else None
+        if row['estado'] == 'AUTORIZADO':
+            _store_authorized(row['invoice_number'], row['xml'], issue_date,
+                              row['numero_autorizacion'], row['fecha_autorizacion'])
+        else:
+            xml_storage.save_xml(row['invoice_number'], row['xml'], estado='RECHAZADO', date=issue_date)
+
+    outbox.mark_applied([row['clave_acceso'] for row in rows])
+    return len(rows)
+
+
+def drain_sri_outbox(max_batches=None):
+    """
+    Send the contingency backlog to the SRI in bulk and apply the results
+
+    Returns:
+        Drain metrics (throughput, remaining backlog) plus 'aplicadas'
+    """
+    outbox = get_sri_outbox()
+    lote = outbox.drain(get_sri_client, max_batches=max_batches)
+
+    metricas = lote['metricas']
+    if metricas['lotes']:
+        get_contingency_monitor().record(metricas['sri_disponible'])
+
+    metricas['aplicadas'] = apply_outbox_results(outbox)
+    return metricas
+
 
 # ============= SRI CONFIGURATION ENDPOINTS =============
 
@@ -212,6 +337,10 @@ def create_electronic_invoice(current_user):
             ]
             InvoiceAdditionalInfoModel.create_many(info_data)
 
+        # In contingency the invoice is signed locally and queued; the SRI is not contacted
+        contingencia = get_contingency_monitor().is_active()
+        tipo_emision = TIPO_EMISION_CONTINGENCIA if contingencia else sri_config['tipo_emision']
+
         # Generate XML
         sri_generator = SRIElectronicInvoice(
             ruc_emisor=sri_config['ruc'],
@@ -221,7 +350,7 @@ def create_electronic_invoice(current_user):
             codigo_establecimiento=sri_config['codigo_establecimiento'],
             punto_emision=sri_config['punto_emision'],
             ambiente=sri_config['ambiente'],
-            tipo_emision=sri_config['tipo_emision']
+            tipo_emision=tipo_emision
         )
 
         # Get complete invoice data
@@ -252,7 +381,19 @@ def create_electronic_invoice(current_user):
             'info_adicional': data.get('info_adicional', [])
         }
 
-        result = sri_generator.generate_xml(xml_data)
+        # Build the document as a tree and hand it to the signer directly (no re-parse)
+        xml_tree, clave_acceso = sri_generator.generate_xml_tree(xml_data)
+
+        if sri_config.get('certificado_digital_path'):
+            xml_content = sri_generator.sign_xml(
+                xml_tree,
+                sri_config['certificado_digital_path'],
+                sri_config.get('certificado_password')
+            )
+        else:
+            xml_content = sri_generator.serialize_xml(xml_tree, pretty_print=True)
+
+        result = {'xml': xml_content, 'clave_acceso': clave_acceso}
 
         # Save XML to file system
         xml_filepath = xml_storage.save_xml(
@@ -270,15 +411,27 @@ def create_electronic_invoice(current_user):
             invoice_id=invoice_id,
             clave_acceso=result['clave_acceso'],
             xml_content=result['xml'],
-            estado_sri='PENDIENTE'
+            estado_sri='CONTINGENCIA' if contingencia else 'PENDIENTE',
+            tipo_emision=tipo_emision
         )
 
+        if contingencia:
+            get_sri_outbox().enqueue(
+                result['clave_acceso'],
+                invoice_number,
+                result['xml'],
+                invoice_id=invoice_id,
+                issue_date=issue_date,
+                tipo_emision=tipo_emision,
+                mensaje='Emitida en contingencia'
+            )
+
         # Log generation
         SRIAuthorizationLogModel.create(
             invoice_id=invoice_id,
             clave_acceso=result['clave_acceso'],
-            estado='GENERADO',
-            mensaje='XML generado exitosamente'
+            estado='CONTINGENCIA' if contingencia else 'GENERADO',
+            mensaje='XML generado en contingencia, pendiente de envio al SRI' if contingencia else 'XML generado exitosamente'
         )
 
         return success_response({
@@ -286,7 +439,12 @@ def create_electronic_invoice(current_user):
             'items': complete_invoice['items'],
             'clave_acceso': result['clave_acceso'],
             'xml': result['xml'],
-            'message': 'Electronic invoice created successfully. Use /authorize endpoint to send to SRI.'
+            'contingencia': contingencia,
+            'message': (
+                'Electronic invoice issued in contingency mode. It will be sent to SRI automatically.'
+                if contingencia else
+                'Electronic invoice created successfully. Use /authorize endpoint to send to SRI.'
+            )
         }, 'Electronic invoice created successfully', 201)
 
     except Exception as e:
@@ -317,6 +475,10 @@ def authorize_electronic_invoice(current_user, invoice_id):
         if invoice.get('estado_sri') == 'AUTORIZADA':
             return error_response('Invoice is already authorized', 400)
 
+        monitor = get_contingency_monitor()
+        if monitor.is_active():
+            return _queue_contingency(invoice, mensaje='SRI no disponible (contingencia)')
+
         # Get SRI configuration
         sri_config = SRIConfigurationModel.get_active_config()
 
@@ -324,7 +486,12 @@ def authorize_electronic_invoice(current_user, invoice_id):
         sri_ws = SRIWebService(ambiente=sri_config['ambiente'])
 
         # Send to SRI
+        inicio = time.monotonic()
         reception_response = sri_ws.enviar_comprobante(invoice['xml_content'])
+        monitor.record(reception_response['estado'] != 'ERROR', time.monotonic() - inicio)
+
+        if reception_response['estado'] == 'ERROR' and get_sri_outbox().get_mode() != 'off':
+            return _queue_contingency(invoice, mensaje=reception_response.get('mensaje'))
 
         # Update status
         if reception_response['estado'] == 'RECIBIDA':
@@ -344,15 +511,23 @@ def authorize_electronic_invoice(current_user, invoice_id):
             )
 
             # Check authorization
+            inicio = time.monotonic()
             auth_response = sri_ws.consultar_autorizacion(invoice['clave_acceso'])
+            monitor.record(auth_response['estado'] != 'ERROR', time.monotonic() - inicio)
+
+            if auth_response['estado'] in ('EN PROCESO', 'ERROR') and get_sri_outbox().get_mode() != 'off':
+                # Received but not decided yet: the outbox keeps polling it
+                return _queue_contingency(invoice, estado='RECIBIDA', mensaje=f"Autorizacion {auth_response['estado']}")
 
             if auth_response['estado'] == 'AUTORIZADO':
+                fecha_autorizacion = datetime.now()
+
                 # Update invoice with authorization
                 ElectronicInvoiceModel.update_electronic_data(
                     invoice_id=invoice_id,
                     clave_acceso=invoice['clave_acceso'],
                     numero_autorizacion=auth_response['numero_autorizacion'],
-                    fecha_autorizacion=datetime.now(),
+                    fecha_autorizacion=fecha_autorizacion,
                     xml_content=invoice['xml_content'],
                     estado_sri='AUTORIZADA',
                     mensaje_sri='Factura autorizada por SRI'
@@ -361,14 +536,18 @@ def authorize_electronic_invoice(current_user, invoice_id):
                 # Update invoice status to ISSUED
                 InvoiceModel.update_status(invoice_id, 'ISSUED')
 
-                # Save authorized XML to file system
-                xml_storage.save_xml(
-                    invoice_number=invoice['invoice_number'],
-                    xml_content=invoice['xml_content'],
-                    estado='AUTORIZADO',
-                    date=invoice['issue_date']
+                # Save authorized XML and render the RIDE in the background pool
+                _store_authorized(
+                    invoice['invoice_number'],
+                    invoice['xml_content'],
+                    invoice['issue_date'],
+                    auth_response['numero_autorizacion'],
+                    fecha_autorizacion.strftime('%d/%m/%Y %H:%M:%S')
                 )
 
+                # Issued in contingency and authorized here: nothing left to drain
+                get_sri_outbox().discard(invoice['clave_acceso'])
+
                 # Log authorization
                 SRIAuthorizationLogModel.create(
                     invoice_id=invoice_id,
@@ -502,6 +681,144 @@ def get_invoice_xml(current_user, invoice_id):
         return error_response('An error occurred', 500)
 
 
+@electronic_invoice_bp.route('/electronic-invoices/<int:invoice_id>/xml/download', methods=['GET'])
+@token_required
+def download_invoice_xml(current_user, invoice_id):
+    """Download invoice XML streamed from storage (Range, gzip/zstd variants)"""
+    try:
+        invoice = ElectronicInvoiceModel.get_download_info(invoice_id)
+
+        if not invoice:
+            return error_response('Invoice not found', 404)
+
+        name = f"{invoice['clave_acceso'] or invoice['invoice_number']}.xml"
+        response = send_xml_file(xml_storage, invoice['invoice_number'], download_name=name)
+        if response is not None:
+            return response
+
+        if not invoice['has_xml']:
+            return error_response('XML not available for this invoice', 404)
+
+        # Not in storage (e.g. storage restored without this file): serve the database copy
+        complete_invoice = ElectronicInvoiceModel.get_complete_invoice(invoice_id)
+        return Response(
+            complete_invoice['invoice']['xml_content'],
+            mimetype='application/xml',
+            headers={'Content-Disposition': f'attachment; filename="{name}"'}
+        )
+
+    except Exception as e:
+        print(f"Download invoice XML error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+@electronic_invoice_bp.route('/electronic-invoices/<int:invoice_id>/ride', methods=['GET'])
+@token_required
+def download_invoice_ride(current_user, invoice_id):
+    """Download RIDE PDF streamed from storage (?inline=true to display); 202 while it is being rendered"""
+    try:
+        invoice = ElectronicInvoiceModel.get_download_info(invoice_id)
+
+        if not invoice:
+            return error_response('Invoice not found', 404)
+
+        # Authorized invoices only get the RIDE rendered with their authorization data
+        clave_acceso = invoice['clave_acceso'] if invoice.get('numero_autorizacion') else None
+        response = send_ride_file(xml_storage, invoice['invoice_number'], clave_acceso=clave_acceso)
+        if response is not None:
+            return response
+
+        # Not rendered yet: queue it in the renderer pool instead of blocking this request
+        stored = xml_storage.find_xml(invoice['invoice_number'])
+        if stored is None:
+            return error_response('RIDE not available for this invoice', 404)
+
+        fecha_autorizacion = invoice.get('fecha_autorizacion')
+        get_ride_renderer().submit(
+            invoice['invoice_number'],
+            xml_storage.read_stored_file(xml_storage.base_path / stored['path']),
+            autorizacion={
+                'numero_autorizacion': invoice.get('numero_autorizacion'),
+                'fecha_autorizacion': fecha_autorizacion.strftime('%d/%m/%Y %H:%M:%S') if fecha_autorizacion else None
+            }
+        )
+
+        response, status = success_response(
+            {'invoice_id': invoice_id, 'invoice_number': invoice['invoice_number']},
+            'RIDE is being generated, try again shortly', 202
+        )
+        return response, status, {'Retry-After': str(RIDE_RETRY_AFTER)}
+
+    except Exception as e:
+        print(f"Download RIDE error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+@electronic_invoice_bp.route('/electronic-invoices/contingency', methods=['GET'])
+@token_required
+def get_contingency_status(current_user):
+    """Contingency mode, outbox backlog and last drain throughput"""
+    try:
+        outbox = get_sri_outbox()
+        return success_response({
+            'contingencia': get_contingency_monitor().status(),
+            'backlog': outbox.backlog(),
+            'ultimo_drenado': outbox.last_drain()
+        })
+
+    except Exception as e:
+        print(f"Get contingency status error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+@electronic_invoice_bp.route('/electronic-invoices/contingency', methods=['PUT'])
+@token_required
+def set_contingency_mode(current_user):
+    """
+    Force contingency mode for every worker
+
+    Request body: {"modo": "on" | "off" | "auto"}
+    """
+    try:
+        if current_user.get('role_name') not in ['ADMIN', 'ADMINISTRADOR']:
+            return error_response('Insufficient permissions', 403)
+
+        modo = (request.get_json() or {}).get('modo')
+        if modo not in CONTINGENCY_MODES:
+            return error_response(f"modo must be one of: {', '.join(CONTINGENCY_MODES)}", 400)
+
+        get_sri_outbox().set_mode(modo)
+        return success_response({'contingencia': get_contingency_monitor().status()}, 'Contingency mode updated')
+
+    except Exception as e:
+        print(f"Set contingency mode error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+@electronic_invoice_bp.route('/electronic-invoices/contingency/drain', methods=['POST'])
+@token_required
+def drain_contingency_outbox(current_user):
+    """
+    Send the contingency backlog to SRI now
+
+    Request body (optional): {"max_lotes": 5}
+    """
+    try:
+        if current_user.get('role_name') not in ['ADMIN', 'ADMINISTRADOR']:
+            return error_response('Insufficient permissions', 403)
+
+        data = request.get_json(silent=True) or {}
+        metricas = drain_sri_outbox(max_batches=data.get('max_lotes'))
+
+        return success_response({'metricas': metricas}, 'Outbox drained')
+
+    except Exception as e:
+        print(f"Drain outbox error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return error_response(f'An error occurred: {str(e)}', 500)
+
+
 @electronic_invoice_bp.route('/electronic-invoices/statistics', methods=['GET'])
 @token_required
 def get_electronic_invoice_statistics(current_user):
@@ -0,0 +1,95 @@
+"""
+File-backed downloads for invoice XML and RIDE PDFs
+Responses stream straight from disk (wsgi.file_wrapper / sendfile under gunicorn),
+with Range/ETag support; compressed XML blobs go out as-is when the client accepts
+their encoding and are decompressed while streaming otherwise
+"""
+import os
+import sys
+
+from flask import Response, request, send_file
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Stored files never change under the same checksum/path
+DOWNLOAD_MAX_AGE = int(os.getenv('DOWNLOAD_MAX_AGE', 3600))
+
+# Encodings the storage can serve without recompressing on each request
+SUPPORTED_ENCODINGS = ('zstd', 'gzip')
+
+
+def accepted_encodings():
+    """Content encodings from Accept-Encoding that the storage can serve (q > 0)"""
+    return [encoding for encoding in SUPPORTED_ENCODINGS if request.accept_encodings[encoding] > 0]
+
+
+def send_xml_file(storage, invoice_number, download_name=None):
+    """
+    Send the stored XML of an invoice from disk
+
+    Args:
+        storage: XMLStorageManager
+        invoice_number: Invoice number
+        download_name: Attachment file name (default: <invoice_number>.xml)
+
+    Returns:
+        Flask response, or None if no XML is stored for the invoice
+    """
+    stored = storage.get_xml_file(invoice_number, accepted_encodings())
+    if stored is None:
+        return None
+
+    download_name = download_name or f"{invoice_number}.xml"
+    etag = f"{stored['checksum']}-{stored['encoding'] or 'identity'}" if stored['checksum'] else True
+
+    if stored['path'] is None:
+        # Decompressed while streaming (no Range: the plain bytes are not on disk)
+        response = Response(stored['stream'], mimetype='application/xml', direct_passthrough=True)
+        response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+        if stored['size'] is not None:
+            response.content_length = stored['size']
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = DOWNLOAD_MAX_AGE
+        response.make_conditional(request)
+    else:
+        response = send_file(
+            stored['path'],
+            mimetype='application/xml',
+            as_attachment=True,
+            download_name=download_name,
+            conditional=True,
+            etag=etag,
+            max_age=DOWNLOAD_MAX_AGE
+        )
+
+    if stored['encoding']:
+        response.headers['Content-Encoding'] = stored['encoding']
+    response.vary.add('Accept-Encoding')
+
+    return response
+
+
+def send_ride_file(storage, invoice_number, download_name=None, clave_acceso=None):
+    """
+    Send the stored RIDE PDF of an invoice from disk
+
+    PDFs are already compressed internally, so they are served as-is (Range supported).
+    Pass the access key of an authorized invoice so a PENDIENTE RIDE is never served.
+
+    Returns:
+        Flask response, or None if no RIDE is stored for the invoice
+    """
+    path = storage.get_ride_file(invoice_number, clave_acceso)
+    if path is None:
+        return None
+
+    return send_file(
+        path,
+        mimetype='application/pdf',
+        as_attachment=request.args.get('inline') != 'true',
+        download_name=download_name or f"{invoice_number}.pdf",
+        conditional=True,
+        max_age=DOWNLOAD_MAX_AGE
+    )
@@ -0,0 +1,494 @@
+"""
+RIDE (Representacion Impresa del Documento Electronico) rendering
+Builds the printable PDF from the invoice XML and renders batches in a process pool
+
+The RIDE is rendered from the comprobante XML itself (signed or unsigned), so the
+same code serves new authorizations, on-demand downloads and month-end batches.
+"""
+import io
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from lxml import etree
+from reportlab.graphics.barcode import code128
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Worker processes for RIDE rendering (0 = CPU count)
+RIDE_PROCESSES = int(os.getenv('RIDE_PROCESSES', 0))
+# Seconds a request waits for an on-demand RIDE
+RIDE_TIMEOUT = float(os.getenv('RIDE_TIMEOUT', 30))
+
+AMBIENTES = {'1': 'PRUEBAS', '2': 'PRODUCCIÓN'}
+EMISIONES = {'1': 'NORMAL', '2': 'INDISPONIBILIDAD DEL SISTEMA'}
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 28
+ROW_HEIGHT = 12
+FONT = 'Helvetica'
+FONT_BOLD = 'Helvetica-Bold'
+
+# Item table columns: (title, x offset, width, alignment)
+COLUMNS = (
+    ('Cod. Principal', 0, 70, 'left'),
+    ('Cant.', 70, 40, 'right'),
+    ('Descripción', 115, 245, 'left'),
+    ('P. Unitario', 360, 65, 'right'),
+    ('Descuento', 425, 50, 'right'),
+    ('Precio Total', 475, 64, 'right'),
+)
+
+
+def parse_comprobante(xml):
+    """
+    Extract the fields printed on the RIDE from an invoice XML
+
+    Args:
+        xml: Invoice XML as string, bytes or lxml element
+
+    Returns:
+        Dictionary with emisor, comprobante, comprador, detalles, totales, pagos, adicional
+    """
+    if isinstance(xml, str):
+        xml = xml.encode('utf-8')
+    root = xml if isinstance(xml, etree._Element) else etree.fromstring(xml)
+
+    def text(node, path, default=''):
+        value = node.findtext(path)
+        return value.strip() if value else default
+
+    tributaria = root.find('infoTributaria')
+    factura = root.find('infoFactura')
+
+    totales = {'subtotal_15': 0.0, 'subtotal_0': 0.0, 'iva': 0.0}
+    for impuesto in factura.iterfind('totalConImpuestos/totalImpuesto'):
+        base = float(text(impuesto, 'baseImponible', '0'))
+        if text(impuesto, 'codigoPorcentaje') == '0':
+            totales['subtotal_0'] += base
+        else:
+            totales['subtotal_15'] += base
+            totales['iva'] += float(text(impuesto, 'valor', '0'))
+
+    totales.update({
+        'subtotal_sin_impuestos': float(text(factura, 'totalSinImpuestos', '0')),
+        'descuento': float(text(factura, 'totalDescuento', '0')),
+        'propina': float(text(factura, 'propina', '0')),
+        'total': float(text(factura, 'importeTotal', '0')),
+    })
+
+    return {
+        'emisor': {
+            'razon_social': text(tributaria, 'razonSocial'),
+            'nombre_comercial': text(tributaria, 'nombreComercial'),
+            'ruc': text(tributaria, 'ruc'),
+            'dir_matriz': text(tributaria, 'dirMatriz'),
+            'dir_establecimiento': text(factura, 'dirEstablecimiento'),
+        },
+        'comprobante': {
+            'numero': f"{text(tributaria, 'estab')}-{text(tributaria, 'ptoEmi')}-{text(tributaria, 'secuencial')}",
+            'clave_acceso': text(tributaria, 'claveAcceso'),
+            'ambiente': AMBIENTES.get(text(tributaria, 'ambiente'), text(tributaria, 'ambiente')),
+            'emision': EMISIONES.get(text(tributaria, 'tipoEmision'), text(tributaria, 'tipoEmision')),
+            'fecha_emision': text(factura, 'fechaEmision'),
+        },
+        'comprador': {
+            'razon_social': text(factura, 'razonSocialComprador'),
+            'identificacion': text(factura, 'identificacionComprador'),
+            'direccion': text(factura, 'direccionComprador'),
+        },
+        'detalles': [
+            {
+                'codigo': text(detalle, 'codigoPrincipal'),
+                'cantidad': float(text(detalle, 'cantidad', '0')),
+                'descripcion': text(detalle, 'descripcion'),
+                'precio_unitario': float(text(detalle, 'precioUnitario', '0')),
+                'descuento': float(text(detalle, 'descuento', '0')),
+                'total': float(text(detalle, 'precioTotalSinImpuesto', '0')),
+            }
+            for detalle in root.iterfind('detalles/detalle')
+        ],
+        'totales': totales,
+        'pagos': [
+            (text(pago, 'formaPago'), float(text(pago, 'total', '0')))
+            for pago in factura.iterfind('pagos/pago')
+        ],
+        'adicional': [
+            (campo.get('nombre', ''), (campo.text or '').strip())
+            for campo in root.iterfind('infoAdicional/campoAdicional')
+        ],
+    }
+
+
+def _fit(text, width, font=FONT, size=7):
+    """Truncate text to fit a column width"""
+    if stringWidth(text, font, size) <= width:
+        return text
+    while text and stringWidth(text + '…', font, size) > width:
+        text = text[:-1]
+    return text + '…'
+
+
+def _draw_cell(pdf, text, x, width, y, align):
+    if align == 'right':
+        pdf.drawRightString(x + width - 2, y, text)
+    else:
+        pdf.drawString(x + 2, y, _fit(text, width - 4))
+
+
+class _RIDEDocument:
+    """Single-pass canvas layout of one RIDE; pages are added as the item table grows"""
+
+    def __init__(self, data, autorizacion):
+        self.data = data
+        self.autorizacion = autorizacion or {}
+        self.buffer = io.BytesIO()
+        self.pdf = canvas.Canvas(self.buffer, pagesize=A4, pageCompression=1)
+        self.pdf.setTitle(f"RIDE {data['comprobante']['numero']}")
+        self.pages = 1
+
+    def render(self):
+        y = self._first_page_header()
+        y = self._table_header(y)
+
+        for detalle in self.data['detalles']:
+            if y < MARGIN + ROW_HEIGHT:
+                y = self._table_header(self._new_page())
+            y = self._row(detalle, y)
+
+        if y < MARGIN + 150:
+            y = self._new_page()
+        self._footer(y - 10)
+
+        self.pdf.showPage()
+        self.pdf.save()
+        return self.buffer.getvalue(), self.pages
+
+    def _new_page(self):
+        self.pdf.showPage()
+        self.pages += 1
+        comprobante = self.data['comprobante']
+        self.pdf.setFont(FONT_BOLD, 8)
+        self.pdf.drawString(MARGIN, PAGE_HEIGHT - MARGIN - 8, f"FACTURA No. {comprobante['numero']}")
+        self.pdf.setFont(FONT, 7)
+        self.pdf.drawRightString(
+            PAGE_WIDTH - MARGIN, PAGE_HEIGHT - MARGIN - 8,
+            f"Clave de acceso {comprobante['clave_acceso']} - Página {self.pages}"
+        )
+        return PAGE_HEIGHT - MARGIN - 20
+
+    def _first_page_header(self):
+        pdf = self.pdf
+        emisor = self.data['emisor']
+        comprobante = self.data['comprobante']
+        comprador = self.data['comprador']
+        top = PAGE_HEIGHT - MARGIN
+
+        # Issuer (left box)
+        pdf.rect(MARGIN, top - 150, 255, 150)
+        pdf.setFont(FONT_BOLD, 10)
+        pdf.drawString(MARGIN + 8, top - 20, _fit(emisor['razon_social'], 240, FONT_BOLD, 10))
+        pdf.setFont(FONT, 8)
+        pdf.drawString(MARGIN + 8, top - 36, _fit(emisor['nombre_comercial'], 240, FONT, 8))
+        pdf.drawString(MARGIN + 8, top - 60, 'Dirección Matriz:')
+        pdf.drawString(MARGIN + 8, top - 71, _fit(emisor['dir_matriz'], 240, FONT, 8))
+        pdf.drawString(MARGIN + 8, top - 90, 'Dirección Sucursal:')
+        pdf.drawString(MARGIN + 8, top - 101, _fit(emisor['dir_establecimiento'], 240, FONT, 8))
+
+        # Document (right box)
+        x = MARGIN + 265
+        pdf.rect(x, top - 200, PAGE_WIDTH - MARGIN - x, 200)
+        pdf.setFont(FONT_BOLD, 9)
+        pdf.drawString(x + 8, top - 16, f"R.U.C.: {emisor['ruc']}")
+        pdf.setFont(FONT_BOLD, 11)
+        pdf.drawString(x + 8, top - 32, 'FACTURA')
+        pdf.setFont(FONT, 8)
+        pdf.drawString(x + 8, top - 46, f"No. {comprobante['numero']}")
+        pdf.drawString(x + 8, top - 62, 'NÚMERO DE AUTORIZACIÓN')
+        pdf.drawString(x + 8, top - 73, self.autorizacion.get('numero_autorizacion') or 'PENDIENTE')
+        pdf.drawString(x + 8, top - 89, f"FECHA Y HORA DE AUTORIZACIÓN: {self.autorizacion.get('fecha_autorizacion') or '-'}")
+        pdf.drawString(x + 8, top - 103, f"AMBIENTE: {comprobante['ambiente']}")
+        pdf.drawString(x + 8, top - 117, f"EMISIÓN: {comprobante['emision']}")
+        pdf.drawString(x + 8, top - 131, 'CLAVE DE ACCESO')
+
+        barcode = code128.Code128(comprobante['clave_acceso'], barHeight=32, barWidth=0.72)
+        barcode.drawOn(pdf, x + 2, top - 172)
+        pdf.setFont(FONT, 7)
+        pdf.drawString(x + 8, top - 184, comprobante['clave_acceso'])
+
+        # Buyer
+        y = top - 210
+        pdf.rect(MARGIN, y - 36, PAGE_WIDTH - 2 * MARGIN, 36)
+        pdf.setFont(FONT, 8)
+        pdf.drawString(MARGIN + 8, y - 12, f"Razón Social / Nombres y Apellidos: {_fit(comprador['razon_social'], 260, FONT, 8)}")
+        pdf.drawString(MARGIN + 390, y - 12, f"Identificación: {comprador['identificacion']}")
+        pdf.drawString(MARGIN + 8, y - 26, f"Fecha Emisión: {comprobante['fecha_emision']}")
+        if comprador['direccion']:
+            pdf.drawString(MARGIN + 150, y - 26, f"Dirección: {_fit(comprador['direccion'], 370, FONT, 8)}")
+
+        return y - 46
+
+    def _table_header(self, y):
+        pdf = self.pdf
+        pdf.setFont(FONT_BOLD, 7)
+        pdf.rect(MARGIN, y - ROW_HEIGHT, PAGE_WIDTH - 2 * MARGIN, ROW_HEIGHT)
+        for title, offset, width, align in COLUMNS:
+            _draw_cell(pdf, title, MARGIN + offset, width, y - 9, align)
+        pdf.setFont(FONT, 7)
+        return y - ROW_HEIGHT
+
+    def _row(self, detalle, y):
+        values = (
+            detalle['codigo'],
+            f"{detalle['cantidad']:.2f}",
+            detalle['descripcion'],
+            f"{detalle['precio_unitario']:.2f}",
+            f"{detalle['descuento']:.2f}",
+            f"{detalle['total']:.2f}",
+        )
+        for value, (_, offset, width, align) in zip(values, COLUMNS, strict=False):
+            _draw_cell(self.pdf, value, MARGIN + offset, width, y - 9, align)
+        self.pdf.line(MARGIN, y - ROW_HEIGHT, PAGE_WIDTH - MARGIN, y - ROW_HEIGHT)
+        return y - ROW_HEIGHT
+
+    def _footer(self, y):
+        from sri_electronic_invoice import FORMAS_PAGO
+
+        pdf = self.pdf
+        totales = self.data['totales']
+
+        # Totals (right)
+        rows = (
+            ('SUBTOTAL 15%', totales['subtotal_15']),
+            ('SUBTOTAL 0%', totales['subtotal_0']),
+            ('SUBTOTAL SIN IMPUESTOS', totales['subtotal_sin_impuestos']),
+            ('TOTAL DESCUENTO', totales['descuento']),
+            ('IVA 15%', totales['iva']),
+            ('PROPINA', totales['propina']),
+            ('VALOR TOTAL', totales['total']),
+        )
+        x = PAGE_WIDTH - MARGIN - 200
+        for i, (label, value) in enumerate(rows):
+            row_y = y - i * ROW_HEIGHT
+            pdf.setFont(FONT_BOLD if label == 'VALOR TOTAL' else FONT, 7)
+            pdf.rect(x, row_y - ROW_HEIGHT, 200, ROW_HEIGHT)
+            pdf.drawString(x + 4, row_y - 9, label)
+            pdf.drawRightString(x + 196, row_y - 9, f"{value:.2f}")
+
+        # Additional information and payments (left)
+        pdf.setFont(FONT_BOLD, 7)
+        pdf.drawString(MARGIN, y - 9, 'Información Adicional')
+        pdf.setFont(FONT, 7)
+        line_y = y - 21
+        for nombre, valor in self.data['adicional']:
+            pdf.drawString(MARGIN, line_y, _fit(f"{nombre}: {valor}", 300))
+            line_y -= 10
+
+        line_y -= 6
+        pdf.setFont(FONT_BOLD, 7)
+        pdf.drawString(MARGIN, line_y, 'Forma de pago')
+        pdf.drawRightString(MARGIN + 300, line_y, 'Valor')
+        pdf.setFont(FONT, 7)
+        for codigo, total in self.data['pagos']:
+            line_y -= 10
+            pdf.drawString(MARGIN, line_y, _fit(f"{codigo} - {FORMAS_PAGO.get(codigo, '')}", 250))
+            pdf.drawRightString(MARGIN + 300, line_y, f"{total:.2f}")
+
+
+def render_ride_pages(xml, autorizacion=None):
+    """
+    Render the RIDE PDF of an invoice
+
+    Args:
+        xml: Invoice XML (string, bytes or lxml element)
+        autorizacion: Optional dict with numero_autorizacion and fecha_autorizacion
+
+    Returns:
+        Tuple (pdf bytes, page count)
+    """
+    return _RIDEDocument(parse_comprobante(xml), autorizacion).render()
+
+
+def render_ride(xml, autorizacion=None):
+    """Render the RIDE PDF of an invoice and return the PDF bytes"""
+    return render_ride_pages(xml, autorizacion)[0]
+
+
+def _render_in_worker(xml, autorizacion):
+    """Process pool entry point: PDF plus the data the parent needs to store it"""
+    data = parse_comprobante(xml)
+    pdf, pages = _RIDEDocument(data, autorizacion).render()
+    return pdf, pages, data['comprobante']['clave_acceso'], data['comprobante']['fecha_emision']
+
+
+def _fecha(fecha_emision):
+    try:
+        return datetime.strptime(fecha_emision, '%d/%m/%Y').date()
+    except (TypeError, ValueError):
+        return None
+
+
+class RIDERenderer:
+    """
+    Renders RIDEs off the request thread and caches them in XMLStorageManager
+
+    PDFs are cached by access key: a RIDE that is already stored is returned
+    without rendering again (unless force=True). Only authorized RIDEs are
+    cached; one rendered without numero_autorizacion prints PENDIENTE and is
+    rendered again once the authorization data is available.
+    """
+
+    def __init__(self, storage, processes=None):
+        """
+        Args:
+            storage: XMLStorageManager where PDFs are stored (save_ride)
+            processes: Worker processes (default: RIDE_PROCESSES or CPU count)
+        """
+        self.storage = storage
+        self.processes = processes or RIDE_PROCESSES or os.cpu_count() or 1
+        self._pool = None
+        self._lock = threading.Lock()
+        # In-flight renders by (invoice_number, authorized): repeated requests share one job
+        self._rendering = {}
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.processes)
+            return self._pool
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+
+    def submit(self, invoice_number, xml, autorizacion=None, force=False):
+        """
+        Render a RIDE in the process pool and store it
+
+        Args:
+            invoice_number: Invoice number (file name of the stored PDF)
+            xml: Invoice XML string
+            autorizacion: Optional dict with numero_autorizacion and fecha_autorizacion
+            force: Render even if a RIDE for the access key is already stored
+
+        Returns:
+            Future resolving to a dict with path, clave_acceso, paginas and cache (bool)
+        """
+        from sri_production import extraer_clave_acceso
+
+        result = Future()
+        clave_acceso = extraer_clave_acceso(xml)
+
+        cached = None if force or not clave_acceso else self.storage.get_ride_by_clave(clave_acceso)
+        if cached is not None:
+            result.set_result({'path': str(cached), 'clave_acceso': clave_acceso, 'paginas': None, 'cache': True})
+            return result
+
+        authorized = bool((autorizacion or {}).get('numero_autorizacion'))
+        key = (invoice_number, authorized)
+
+        with self._lock:
+            if not force and key in self._rendering:
+                return self._rendering[key]
+            self._rendering[key] = result
+
+        def store(future):
+            with self._lock:
+                if self._rendering.get(key) is result:
+                    del self._rendering[key]
+            try:
+                pdf, pages, clave, fecha_emision = future.result()
+                path = self.storage.save_ride(
+                    invoice_number, pdf, date=_fecha(fecha_emision),
+                    clave_acceso=clave if authorized else None
+                )
+                result.set_result({'path': path, 'clave_acceso': clave, 'paginas': pages, 'cache': False})
+            except Exception as e:
+                print(f"RIDE rendering error ({invoice_number}): {str(e)}")
+                result.set_exception(e)
+
+        try:
+            self._get_pool().submit(_render_in_worker, xml, autorizacion).add_done_callback(store)
+        except Exception:
+            with self._lock:
+                self._rendering.pop(key, None)
+            raise
+        return result
+
+    def render(self, invoice_number, xml, autorizacion=None, force=False, timeout=None):
+        """
+        Render (or fetch from cache) a RIDE and wait for it
+
+        Returns:
+            Path of the stored PDF
+        """
+        future = self.submit(invoice_number, xml, autorizacion, force)
+        return future.result(timeout=timeout or RIDE_TIMEOUT)['path']
+
+    def render_many(self, jobs, force=False, progress_callback=None):
+        """
+        Batch rendering for month-end: every job runs in the pool, cached RIDEs are skipped
+
+        Args:
+            jobs: List of dicts with invoice_number, xml and optional autorizacion
+            force: Re-render RIDEs already stored
+            progress_callback: Called with the metrics snapshot after each RIDE
+
+        Returns:
+            Dictionary with 'resultados' (same order as jobs) and 'metricas'
+        """
+        start = time.perf_counter()
+        metricas = {'total': len(jobs), 'procesados': 0, 'renderizados': 0, 'en_cache': 0,
+                    'errores': 0, 'paginas': 0, 'duracion_segundos': 0.0, 'paginas_por_segundo': 0.0}
+        resultados = [None] * len(jobs)
+
+        futures = {
+            self.submit(job['invoice_number'], job['xml'], job.get('autorizacion'), force): index
+            for index, job in enumerate(jobs)
+        }
+
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                resultado = future.result()
+                metricas['en_cache' if resultado['cache'] else 'renderizados'] += 1
+                metricas['paginas'] += resultado['paginas'] or 0
+            except Exception as e:
+                resultado = {'path': None, 'error': str(e)}
+                metricas['errores'] += 1
+
+            resultado['invoice_number'] = jobs[index]['invoice_number']
+            resultados[index] = resultado
+            metricas['procesados'] += 1
+
+            elapsed = time.perf_counter() - start
+            metricas['duracion_segundos'] = round(elapsed, 3)
+            metricas['paginas_por_segundo'] = round(metricas['paginas'] / elapsed, 1) if elapsed else 0.0
+            if progress_callback:
+                progress_callback(dict(metricas))
+
+        return {'resultados': resultados, 'metricas': metricas}
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_ride_renderer(storage=None):
+    """Process-wide RIDE renderer bound to the shared XML storage"""
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            if storage is None:
+                from xml_storage import xml_storage as storage
+            _renderer = RIDERenderer(storage)
+        return _renderer
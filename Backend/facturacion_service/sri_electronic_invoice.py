@@ -11,8 +11,6 @@ Production Ready:
 import hashlib
 import base64
 from datetime import datetime
-from xml.etree.ElementTree import Element, SubElement, tostring
-from xml.dom import minidom
 import os
 import sys
 from lxml import etree
@@ -24,6 +22,11 @@ from zeep.transports import Transport
 from requests import Session
 import logging
 
+from access_keys import generate_access_keys, modulo11
+
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
 
 class SRIElectronicInvoice:
     """
@@ -74,63 +77,58 @@ class SRIElectronicInvoice:
         self.ambiente = ambiente  # 1=Pruebas, 2=Produccion
         self.tipo_emision = tipo_emision  # 1=Normal
 
-    def generate_access_key(self, fecha_emision, tipo_comprobante, secuencial):
+    def generate_access_key(self, fecha_emision, tipo_comprobante, secuencial, codigo_numerico=None):
         """
         Generate 49-digit access key (Clave de Acceso)
 
-        Format: DDMMYYYYTCRUCESSSSSSSSSCNNNNNNNNM
+        Format: DDMMYYYY TC RUC E EEEPPP SSSSSSSSS NNNNNNNN T M
         DD = Day, MM = Month, YYYY = Year
         TC = Document Type (01 for invoice)
         RUC = RUC (13 digits)
         E = Environment (1=Test, 2=Production)
-        SSS = Establishment (3 digits)
-        SSS = Point of sale (3 digits)
-        NNNNNNN = Sequential number (9 digits)
-        C = Emission code (1)
+        EEE = Establishment (3 digits)
+        PPP = Point of sale (3 digits)
+        SSSSSSSSS = Sequential number (9 digits)
+        NNNNNNNN = Numeric code (8 digits, default derived from the sequential)
+        T = Emission type (1 digit)
         M = Check digit (modulo 11)
         """
-        fecha = datetime.strptime(fecha_emision, '%d/%m/%Y')
-
-        # Build the 48-digit base
-        base = (
-            f"{fecha.day:02d}"                          # Day (2 digits)
-            f"{fecha.month:02d}"                        # Month (2 digits)
-            f"{fecha.year:04d}"                         # Year (4 digits)
-            f"{tipo_comprobante}"                       # Document type (2 digits)
-            f"{self.ruc_emisor}"                        # RUC (13 digits)
-            f"{self.ambiente}"                          # Environment (1 digit)
-            f"{self.codigo_establecimiento}"            # Establishment (3 digits)
-            f"{self.punto_emision}"                     # Point of sale (3 digits)
-            f"{int(secuencial):09d}"                    # Sequential (9 digits)
-            f"{self.tipo_emision}"                      # Emission type (1 digit)
-        )
+        return self.generate_access_keys(
+            fecha_emision, [secuencial], tipo_comprobante,
+            codigos_numericos=[codigo_numerico] if codigo_numerico else None
+        )[0]
 
-        # Calculate check digit using modulo 11
-        check_digit = self._calculate_modulo11(base)
+    def generate_access_keys(self, fechas_emision, secuenciales, tipo_comprobante=TIPO_FACTURA,
+                             codigos_numericos=None):
+        """
+        Generate many access keys for this issuer at once (re-issuance, migrations)
 
-        return base + str(check_digit)
+        Args:
+            fechas_emision: List of dates ('dd/mm/YYYY', 'YYYY-MM-DD' or date) or a single date
+            secuenciales: List of sequential numbers
+            tipo_comprobante: Document type (default: invoice)
+            codigos_numericos: Optional list of 8-digit numeric codes
+
+        Returns:
+            List of 49-digit access keys
+        """
+        return generate_access_keys(
+            fechas_emision,
+            secuenciales,
+            self.ruc_emisor,
+            tipo_comprobante=tipo_comprobante,
+            ambiente=self.ambiente,
+            establecimiento=self.codigo_establecimiento,
+            punto_emision=self.punto_emision,
+            tipo_emision=self.tipo_emision,
+            codigos_numericos=codigos_numericos
+        )
 
     def _calculate_modulo11(self, base_number):
         """Calculate modulo 11 check digit"""
-        factor = 7
-        total = 0
-
-        # Process from right to left
-        for digit in reversed(base_number):
-            total += int(digit) * factor
-            factor = 2 if factor == 7 else factor + 1
-
-        remainder = total % 11
-        check_digit = 11 - remainder
-
-        if check_digit == 11:
-            return 0
-        elif check_digit == 10:
-            return 1
-        else:
-            return check_digit
+        return modulo11(base_number)
 
-    def generate_xml(self, invoice_data):
+    def generate_xml(self, invoice_data, pretty_print=True):
         """
         Generate SRI-compliant XML for electronic invoice
 
@@ -142,9 +140,31 @@ class SRIElectronicInvoice:
                 - items: List of invoice items
                 - totales: Total amounts
                 - info_adicional: Additional information (optional)
+            pretty_print: Indent the serialized XML
+
+        Returns:
+            Dictionary with 'xml' (string formatted for SRI), 'tree' (lxml
+            root element, can be passed to sign_xml without re-parsing),
+            'clave_acceso' and 'numero_autorizacion'
+        """
+        root, clave_acceso = self.generate_xml_tree(invoice_data)
+
+        return {
+            'xml': self.serialize_xml(root, pretty_print=pretty_print),
+            'tree': root,
+            'clave_acceso': clave_acceso,
+            'numero_autorizacion': clave_acceso  # In offline mode, access key = authorization number
+        }
+
+    def generate_xml_tree(self, invoice_data):
+        """
+        Build the invoice document directly as an lxml tree (single pass)
+
+        Args:
+            invoice_data: Same dictionary as generate_xml
 
         Returns:
-            XML string formatted for SRI
+            Tuple (root element, clave_acceso)
         """
         # Generate access key
         clave_acceso = self.generate_access_key(
@@ -153,175 +173,171 @@ class SRIElectronicInvoice:
             invoice_data['secuencial']
         )
 
+        def add(parent, tag, text):
+            element = etree.SubElement(parent, tag)
+            element.text = text
+            return element
+
         # Create root element
-        root = Element('factura', {
+        root = etree.Element('factura', {
             'id': 'comprobante',
             'version': '2.1.0'
         })
 
         # 1. InfoTributaria (Tax Information)
-        info_tributaria = SubElement(root, 'infoTributaria')
-        SubElement(info_tributaria, 'ambiente').text = self.ambiente
-        SubElement(info_tributaria, 'tipoEmision').text = self.tipo_emision
-        SubElement(info_tributaria, 'razonSocial').text = self.razon_social
-        SubElement(info_tributaria, 'nombreComercial').text = self.nombre_comercial
-        SubElement(info_tributaria, 'ruc').text = self.ruc_emisor
-        SubElement(info_tributaria, 'claveAcceso').text = clave_acceso
-        SubElement(info_tributaria, 'codDoc').text = self.TIPO_FACTURA
-        SubElement(info_tributaria, 'estab').text = self.codigo_establecimiento
-        SubElement(info_tributaria, 'ptoEmi').text = self.punto_emision
-        SubElement(info_tributaria, 'secuencial').text = f"{int(invoice_data['secuencial']):09d}"
-        SubElement(info_tributaria, 'dirMatriz').text = self.direccion_matriz
+        info_tributaria = etree.SubElement(root, 'infoTributaria')
+        add(info_tributaria, 'ambiente', self.ambiente)
+        add(info_tributaria, 'tipoEmision', self.tipo_emision)
+        add(info_tributaria, 'razonSocial', self.razon_social)
+        add(info_tributaria, 'nombreComercial', self.nombre_comercial)
+        add(info_tributaria, 'ruc', self.ruc_emisor)
+        add(info_tributaria, 'claveAcceso', clave_acceso)
+        add(info_tributaria, 'codDoc', self.TIPO_FACTURA)
+        add(info_tributaria, 'estab', self.codigo_establecimiento)
+        add(info_tributaria, 'ptoEmi', self.punto_emision)
+        add(info_tributaria, 'secuencial', f"{int(invoice_data['secuencial']):09d}")
+        add(info_tributaria, 'dirMatriz', self.direccion_matriz)
 
         # 2. InfoFactura (Invoice Information)
-        info_factura = SubElement(root, 'infoFactura')
-        SubElement(info_factura, 'fechaEmision').text = invoice_data['fecha_emision']
-        SubElement(info_factura, 'dirEstablecimiento').text = self.direccion_matriz
+        info_factura = etree.SubElement(root, 'infoFactura')
+        add(info_factura, 'fechaEmision', invoice_data['fecha_emision'])
+        add(info_factura, 'dirEstablecimiento', self.direccion_matriz)
 
         # Buyer information
         cliente = invoice_data['cliente']
-        SubElement(info_factura, 'tipoIdentificacionComprador').text = cliente.get('tipo_doc', self.DOC_TYPE_CEDULA)
-        SubElement(info_factura, 'razonSocialComprador').text = cliente['nombre']
-        SubElement(info_factura, 'identificacionComprador').text = cliente['identificacion']
+        add(info_factura, 'tipoIdentificacionComprador', cliente.get('tipo_doc', self.DOC_TYPE_CEDULA))
+        add(info_factura, 'razonSocialComprador', cliente['nombre'])
+        add(info_factura, 'identificacionComprador', cliente['identificacion'])
 
         if cliente.get('direccion'):
-            SubElement(info_factura, 'direccionComprador').text = cliente['direccion']
+            add(info_factura, 'direccionComprador', cliente['direccion'])
         if cliente.get('email'):
-            SubElement(info_factura, 'email').text = cliente['email']
+            add(info_factura, 'email', cliente['email'])
         if cliente.get('telefono'):
-            SubElement(info_factura, 'telefono').text = cliente['telefono']
+            add(info_factura, 'telefono', cliente['telefono'])
 
         # Totals
         totales = invoice_data['totales']
-        SubElement(info_factura, 'totalSinImpuestos').text = f"{totales['subtotal_sin_impuestos']:.2f}"
-        SubElement(info_factura, 'totalDescuento').text = f"{totales.get('descuento_total', 0):.2f}"
+        add(info_factura, 'totalSinImpuestos', f"{totales['subtotal_sin_impuestos']:.2f}")
+        add(info_factura, 'totalDescuento', f"{totales.get('descuento_total', 0):.2f}")
 
         # Tax totals
-        total_con_impuestos = SubElement(info_factura, 'totalConImpuestos')
+        total_con_impuestos = etree.SubElement(info_factura, 'totalConImpuestos')
 
         # IVA 0%
         if totales.get('subtotal_iva_0', 0) > 0:
-            total_impuesto = SubElement(total_con_impuestos, 'totalImpuesto')
-            SubElement(total_impuesto, 'codigo').text = self.IVA_CODE
-            SubElement(total_impuesto, 'codigoPorcentaje').text = self.IVA_0
-            SubElement(total_impuesto, 'baseImponible').text = f"{totales['subtotal_iva_0']:.2f}"
-            SubElement(total_impuesto, 'valor').text = "0.00"
+            total_impuesto = etree.SubElement(total_con_impuestos, 'totalImpuesto')
+            add(total_impuesto, 'codigo', self.IVA_CODE)
+            add(total_impuesto, 'codigoPorcentaje', self.IVA_0)
+            add(total_impuesto, 'baseImponible', f"{totales['subtotal_iva_0']:.2f}")
+            add(total_impuesto, 'valor', "0.00")
 
         # IVA 15%
         if totales.get('subtotal_iva_15', 0) > 0:
-            total_impuesto = SubElement(total_con_impuestos, 'totalImpuesto')
-            SubElement(total_impuesto, 'codigo').text = self.IVA_CODE
-            SubElement(total_impuesto, 'codigoPorcentaje').text = self.IVA_15
-            SubElement(total_impuesto, 'baseImponible').text = f"{totales['subtotal_iva_15']:.2f}"
-            SubElement(total_impuesto, 'valor').text = f"{totales['iva_15']:.2f}"
+            total_impuesto = etree.SubElement(total_con_impuestos, 'totalImpuesto')
+            add(total_impuesto, 'codigo', self.IVA_CODE)
+            add(total_impuesto, 'codigoPorcentaje', self.IVA_15)
+            add(total_impuesto, 'baseImponible', f"{totales['subtotal_iva_15']:.2f}")
+            add(total_impuesto, 'valor', f"{totales['iva_15']:.2f}")
 
-        SubElement(info_factura, 'propina').text = "0.00"
-        SubElement(info_factura, 'importeTotal').text = f"{totales['importe_total']:.2f}"
-        SubElement(info_factura, 'moneda').text = "DOLAR"  # Ecuador uses USD
+        add(info_factura, 'propina', "0.00")
+        add(info_factura, 'importeTotal', f"{totales['importe_total']:.2f}")
+        add(info_factura, 'moneda', "DOLAR")  # Ecuador uses USD
 
         # Payment methods
         if invoice_data.get('formas_pago'):
-            pagos = SubElement(info_factura, 'pagos')
+            pagos = etree.SubElement(info_factura, 'pagos')
             for forma_pago in invoice_data['formas_pago']:
-                pago = SubElement(pagos, 'pago')
-                SubElement(pago, 'formaPago').text = forma_pago['codigo']
-                SubElement(pago, 'total').text = f"{forma_pago['total']:.2f}"
+                pago = etree.SubElement(pagos, 'pago')
+                add(pago, 'formaPago', forma_pago['codigo'])
+                add(pago, 'total', f"{forma_pago['total']:.2f}")
                 if forma_pago.get('plazo'):
-                    SubElement(pago, 'plazo').text = str(forma_pago['plazo'])
+                    add(pago, 'plazo', str(forma_pago['plazo']))
                 if forma_pago.get('unidad_tiempo'):
-                    SubElement(pago, 'unidadTiempo').text = forma_pago['unidad_tiempo']
+                    add(pago, 'unidadTiempo', forma_pago['unidad_tiempo'])
 
         # 3. Detalles (Line Items)
-        detalles = SubElement(root, 'detalles')
+        detalles = etree.SubElement(root, 'detalles')
 
         for item in invoice_data['items']:
-            detalle = SubElement(detalles, 'detalle')
-            SubElement(detalle, 'codigoPrincipal').text = item['codigo']
+            detalle = etree.SubElement(detalles, 'detalle')
+            add(detalle, 'codigoPrincipal', item['codigo'])
 
             if item.get('codigo_auxiliar'):
-                SubElement(detalle, 'codigoAuxiliar').text = item['codigo_auxiliar']
+                add(detalle, 'codigoAuxiliar', item['codigo_auxiliar'])
 
-            SubElement(detalle, 'descripcion').text = item['descripcion']
-            SubElement(detalle, 'cantidad').text = f"{item['cantidad']:.2f}"
-            SubElement(detalle, 'precioUnitario').text = f"{item['precio_unitario']:.6f}"
-            SubElement(detalle, 'descuento').text = f"{item.get('descuento', 0):.2f}"
-            SubElement(detalle, 'precioTotalSinImpuesto').text = f"{item['precio_total_sin_impuesto']:.2f}"
+            add(detalle, 'descripcion', item['descripcion'])
+            add(detalle, 'cantidad', f"{item['cantidad']:.2f}")
+            add(detalle, 'precioUnitario', f"{item['precio_unitario']:.6f}")
+            add(detalle, 'descuento', f"{item.get('descuento', 0):.2f}")
+            add(detalle, 'precioTotalSinImpuesto', f"{item['precio_total_sin_impuesto']:.2f}")
 
             # Item taxes
-            impuestos = SubElement(detalle, 'impuestos')
-            impuesto = SubElement(impuestos, 'impuesto')
-            SubElement(impuesto, 'codigo').text = self.IVA_CODE
-            SubElement(impuesto, 'codigoPorcentaje').text = item['codigo_iva']
-            SubElement(impuesto, 'tarifa').text = f"{item['tarifa_iva']:.0f}"
-            SubElement(impuesto, 'baseImponible').text = f"{item['precio_total_sin_impuesto']:.2f}"
-            SubElement(impuesto, 'valor').text = f"{item['valor_iva']:.2f}"
+            impuestos = etree.SubElement(detalle, 'impuestos')
+            impuesto = etree.SubElement(impuestos, 'impuesto')
+            add(impuesto, 'codigo', self.IVA_CODE)
+            add(impuesto, 'codigoPorcentaje', item['codigo_iva'])
+            add(impuesto, 'tarifa', f"{item['tarifa_iva']:.0f}")
+            add(impuesto, 'baseImponible', f"{item['precio_total_sin_impuesto']:.2f}")
+            add(impuesto, 'valor', f"{item['valor_iva']:.2f}")
 
         # 4. InfoAdicional (Additional Information) - Optional
         if invoice_data.get('info_adicional'):
-            info_adicional = SubElement(root, 'infoAdicional')
+            info_adicional = etree.SubElement(root, 'infoAdicional')
             for campo in invoice_data['info_adicional']:
-                camp_adicional = SubElement(info_adicional, 'campoAdicional', {'nombre': campo['nombre']})
-                camp_adicional.text = campo['valor']
-
-        # Format XML with indentation
-        xml_string = self._prettify_xml(root)
+                add(info_adicional, 'campoAdicional', campo['valor']).set('nombre', campo['nombre'])
 
-        return {
-            'xml': xml_string,
-            'clave_acceso': clave_acceso,
-            'numero_autorizacion': clave_acceso  # In offline mode, access key = authorization number
-        }
+        return root, clave_acceso
 
-    def _prettify_xml(self, element):
-        """Format XML with proper indentation"""
-        rough_string = tostring(element, encoding='utf-8')
-        reparsed = minidom.parseString(rough_string)
-        return reparsed.toprettyxml(indent="  ", encoding='UTF-8').decode('utf-8')
+    @staticmethod
+    def serialize_xml(element, pretty_print=False):
+        """Serialize an lxml tree with the XML declaration SRI expects"""
+        body = etree.tostring(element, encoding='UTF-8', pretty_print=pretty_print)
+        return XML_DECLARATION + body.decode('utf-8')
 
-    def sign_xml(self, xml_string, certificate_path, password):
+    def sign_xml(self, xml, certificate_path, password):
         """
         Sign XML with digital certificate (PKCS#12)
 
         PRODUCTION READY: Uses XMLDSig with signxml library
 
         Args:
-            xml_string: XML to sign
+            xml: XML to sign, as string or lxml element (generate_xml()['tree'])
             certificate_path: Path to .p12 certificate file
             password: Certificate password
 
         Returns:
             Signed XML string
         """
-        from sri_production import XMLDigitalSigner
+        from sri_production import get_xml_signer
 
         try:
-            signer = XMLDigitalSigner(certificate_path, password)
-            signed_xml = signer.sign_xml(xml_string)
-            return signed_xml
+            signer = get_xml_signer(certificate_path, password)
+            return signer.sign_xml(xml)
         except Exception as e:
             print(f"Warning: XML signing failed: {str(e)}")
             print("Returning unsigned XML. Configure certificate for production.")
-            return xml_string
+            return xml if isinstance(xml, str) else self.serialize_xml(xml)
 
     def generate_ride(self, invoice_data, clave_acceso):
         """
         Generate RIDE (Representacion Impresa del Documento Electronico)
         This is the PDF representation of the electronic invoice
 
+        Rendering happens in the calling thread; use ride_renderer.get_ride_renderer()
+        to render off the request thread and cache the PDF in storage.
+
         Args:
-            invoice_data: Invoice data
-            clave_acceso: Access key
+            invoice_data: Invoice data (same dictionary as generate_xml)
+            clave_acceso: Access key (authorization number in offline mode)
 
         Returns:
-            PDF bytes or path to PDF file
+            PDF bytes
         """
-        # TODO: Implement PDF generation with ReportLab or similar
-        # The RIDE must contain:
-        # - Barcode with access key
-        # - All invoice information
-        # - SRI authorization information
-        print("Warning: RIDE generation not implemented.")
-        return None
+        from ride_renderer import render_ride
+
+        root, _ = self.generate_xml_tree(invoice_data)
+        return render_ride(root, {'numero_autorizacion': clave_acceso})
 
 
 class SRIWebService:
@@ -365,10 +381,10 @@ class SRIWebService:
         Returns:
             Response from SRI (RECIBIDA, DEVUELTA, or error)
         """
-        from sri_production import SRISOAPClient
+        from sri_production import get_sri_client
 
         try:
-            client = SRISOAPClient(self.ambiente)
+            client = get_sri_client(self.ambiente)
             response = client.enviar_comprobante(xml_string)
             return response
         except Exception as e:
@@ -393,10 +409,10 @@ class SRIWebService:
         Returns:
             Authorization information (AUTORIZADO, NO AUTORIZADO, EN PROCESO)
         """
-        from sri_production import SRISOAPClient
+        from sri_production import get_sri_client
 
         try:
-            client = SRISOAPClient(self.ambiente)
+            client = get_sri_client(self.ambiente)
             response = client.consultar_autorizacion(clave_acceso)
             return response
         except Exception as e:
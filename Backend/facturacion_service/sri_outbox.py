@@ -0,0 +1,519 @@
+"""
+Contingency mode for SRI outages
+Signed invoices are queued in a persistent SQLite outbox while the SRI is down or slow,
+and drained in bulk (batch reception + authorization polling) once it recovers
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+SRI_OUTBOX_PATH = os.getenv(
+    'SRI_OUTBOX_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'storage', 'sri_outbox.db')
+)
+
+# auto: switch on after consecutive SRI failures; on/off: forced by an administrator
+CONTINGENCY_MODE = os.getenv('SRI_CONTINGENCY_MODE', 'auto')
+CONTINGENCY_MODES = ('auto', 'on', 'off')
+CONTINGENCY_FAILURES = int(os.getenv('SRI_CONTINGENCY_FAILURES', 3))
+CONTINGENCY_COOLDOWN = int(os.getenv('SRI_CONTINGENCY_COOLDOWN', 60))
+# Calls slower than this count as failures (the front desk should not wait on the SRI)
+CONTINGENCY_SLOW_SECONDS = float(os.getenv('SRI_CONTINGENCY_SLOW_SECONDS', 10))
+
+# tipoEmision used for invoices issued in contingency. The offline scheme only accepts "1"
+# (the invoice is valid once signed); "2" is the legacy "indisponibilidad del sistema"
+TIPO_EMISION_CONTINGENCIA = os.getenv('SRI_TIPO_EMISION_CONTINGENCIA', '1')
+
+OUTBOX_BATCH_SIZE = int(os.getenv('SRI_OUTBOX_BATCH_SIZE', 100))
+# Rows claimed by a drain stay invisible to other workers for this long (EN PROCESO retry delay)
+OUTBOX_LEASE_SECONDS = int(os.getenv('SRI_OUTBOX_LEASE_SECONDS', 120))
+
+# Outbox states: PENDIENTE -> RECIBIDA -> AUTORIZADO | NO AUTORIZADO, or DEVUELTA
+PENDING_STATES = ('PENDIENTE', 'RECIBIDA')
+FINAL_STATES = ('AUTORIZADO', 'NO AUTORIZADO', 'DEVUELTA')
+
+# Reception errors meaning the SRI already has the document (resent after a lost response)
+CLAVE_REGISTRADA = ('43', '45')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    clave_acceso TEXT PRIMARY KEY,
+    invoice_id INTEGER,
+    invoice_number TEXT NOT NULL,
+    ambiente TEXT NOT NULL DEFAULT '1',
+    tipo_emision TEXT,
+    issue_date TEXT,
+    xml TEXT NOT NULL,
+    estado TEXT NOT NULL DEFAULT 'PENDIENTE',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    mensaje TEXT,
+    numero_autorizacion TEXT,
+    fecha_autorizacion TEXT,
+    encolado_at REAL NOT NULL,
+    actualizado_at REAL NOT NULL,
+    lease_id TEXT,
+    lease_until REAL,
+    aplicado INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_outbox_estado ON outbox (estado, encolado_at);
+CREATE INDEX IF NOT EXISTS ix_outbox_aplicado ON outbox (aplicado, estado);
+
+CREATE TABLE IF NOT EXISTS outbox_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SRIOutbox:
+    """
+    Persistent queue of signed invoices waiting for SRI authorization
+
+    Shared by every worker through WAL mode; drains claim rows with a lease so
+    two workers never send the same invoice. Final results stay in the outbox
+    until the caller has applied them to the invoices table (mark_applied).
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = str(db_path or SRI_OUTBOX_PATH)
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # ------------------------------------------------------------------
+    # Queue
+    # ------------------------------------------------------------------
+
+    def enqueue(self, clave_acceso, invoice_number, xml, invoice_id=None, issue_date=None,
+                tipo_emision=None, estado='PENDIENTE', mensaje=None):
+        """
+        Queue a signed invoice (no-op if the access key is already queued)
+
+        Args:
+            clave_acceso: 49-digit access key (the ambiente is taken from it)
+            invoice_number: Invoice number (001-001-000000001)
+            xml: Signed XML
+            invoice_id: Invoice id in the database
+            issue_date: Issue date (date or ISO string)
+            tipo_emision: Emission type the XML was generated with
+            estado: 'PENDIENTE' (not sent) or 'RECIBIDA' (only authorization pending)
+            mensaje: Reason the invoice went to the outbox
+
+        Returns:
+            True if the invoice was queued
+        """
+        now = time.time()
+        ambiente = clave_acceso[23] if len(clave_acceso or '') == 49 else '1'
+        with self._connection() as conn:
+            cursor = conn.execute("""
+                INSERT OR IGNORE INTO outbox (
+                    clave_acceso, invoice_id, invoice_number, ambiente, tipo_emision,
+                    issue_date, xml, estado, mensaje, encolado_at, actualizado_at
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (clave_acceso, invoice_id, invoice_number, ambiente, tipo_emision,
+                  str(issue_date) if issue_date else None, xml, estado, mensaje, now, now))
+            return cursor.rowcount == 1
+
+    def discard(self, clave_acceso):
+        """Drop a queued invoice (authorized through the normal flow)"""
+        with self._connection() as conn:
+            conn.execute("DELETE FROM outbox WHERE clave_acceso = ?", (clave_acceso,))
+
+    def get(self, clave_acceso):
+        row = self._connection().execute(
+            "SELECT * FROM outbox WHERE clave_acceso = ?", (clave_acceso,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def claim(self, limit=OUTBOX_BATCH_SIZE, lease_seconds=OUTBOX_LEASE_SECONDS):
+        """
+        Lease up to `limit` pending rows, oldest first
+
+        The lease is taken in a single UPDATE so concurrent drains get disjoint rows.
+        Rows that are not finished keep their lease until it expires, which is also
+        the retry delay for invoices still EN PROCESO.
+        """
+        lease_id = uuid.uuid4().hex
+        now = time.time()
+        placeholders = ', '.join('?' for _ in PENDING_STATES)
+        with self._connection() as conn:
+            conn.execute(f"""
+                UPDATE outbox
+                SET lease_id = ?, lease_until = ?
+                WHERE clave_acceso IN (
+                    SELECT clave_acceso FROM outbox
+                    WHERE estado IN ({placeholders})
+                      AND (lease_until IS NULL OR lease_until < ?)
+                    ORDER BY encolado_at
+                    LIMIT ?
+                )
+            """, (lease_id, now + lease_seconds, *PENDING_STATES, now, limit))
+
+        rows = self._connection().execute(
+            "SELECT * FROM outbox WHERE lease_id = ? ORDER BY encolado_at", (lease_id,)
+        )
+        return [dict(row) for row in rows]
+
+    def update_many(self, updates):
+        """
+        Store drain results in one transaction
+
+        Args:
+            updates: Iterable of dicts with clave_acceso, estado and optionally
+                     mensaje, numero_autorizacion, fecha_autorizacion, intento (bool)
+                     and error (bool: SRI unavailable, the lease is released)
+        """
+        now = time.time()
+        with self._connection() as conn:
+            conn.executemany("""
+                UPDATE outbox
+                SET estado = ?,
+                    mensaje = COALESCE(?, mensaje),
+                    numero_autorizacion = COALESCE(?, numero_autorizacion),
+                    fecha_autorizacion = COALESCE(?, fecha_autorizacion),
+                    intentos = intentos + ?,
+                    actualizado_at = ?,
+                    lease_until = CASE WHEN ? THEN NULL ELSE lease_until END
+                WHERE clave_acceso = ?
+            """, [
+                (update['estado'], update.get('mensaje'), update.get('numero_autorizacion'),
+                 update.get('fecha_autorizacion'), 1 if update.get('intento', True) else 0, now,
+                 update['estado'] in FINAL_STATES or bool(update.get('error')), update['clave_acceso'])
+                for update in updates
+            ])
+
+    def unapplied(self):
+        """Finished rows whose result has not been written to the invoices table yet"""
+        placeholders = ', '.join('?' for _ in FINAL_STATES)
+        rows = self._connection().execute(
+            f"SELECT * FROM outbox WHERE aplicado = 0 AND estado IN ({placeholders}) ORDER BY encolado_at",
+            FINAL_STATES
+        )
+        return [dict(row) for row in rows]
+
+    def mark_applied(self, claves_acceso):
+        with self._connection() as conn:
+            conn.executemany(
+                "UPDATE outbox SET aplicado = 1 WHERE clave_acceso = ?",
+                [(clave,) for clave in claves_acceso]
+            )
+
+    def purge(self, older_than_days=30):
+        """Delete applied rows older than `older_than_days` (the XML lives in the storage)"""
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "DELETE FROM outbox WHERE aplicado = 1 AND actualizado_at < ?",
+                (time.time() - older_than_days * 86400,)
+            )
+            return cursor.rowcount
+
+    # ------------------------------------------------------------------
+    # Drain
+    # ------------------------------------------------------------------
+
+    def drain(self, get_client, batch_size=OUTBOX_BATCH_SIZE, max_intentos=3, intervalo=2.0,
+              max_batches=None, progress_callback=None):
+        """
+        Send queued invoices to the SRI in batches and poll their authorization
+
+        Stops at the first batch where the SRI fails again (still down), leaving
+        the remaining backlog for the next drain.
+
+        Args:
+            get_client: Callable ambiente -> SRISOAPClient (e.g. sri_production.get_sri_client)
+            batch_size: Invoices claimed per batch
+            max_intentos: Authorization polling rounds per batch
+            intervalo: Seconds between polling rounds
+            max_batches: Stop after this many batches (default: until the backlog is empty)
+            progress_callback: Optional callable receiving the metrics after each batch
+
+        Returns:
+            Dictionary with 'finalizados' (rows that reached a final state) and 'metricas'
+        """
+        inicio = time.monotonic()
+        backlog_inicial = self.backlog()['pendientes']
+        metricas = {
+            'backlog_inicial': backlog_inicial,
+            'lotes': 0,
+            'enviados': 0,
+            'autorizados': 0,
+            'rechazados': 0,
+            'en_proceso': 0,
+            'errores': 0,
+            'sri_disponible': True
+        }
+        finalizados = []
+
+        while max_batches is None or metricas['lotes'] < max_batches:
+            rows = self.claim(batch_size)
+            if not rows:
+                break
+            metricas['lotes'] += 1
+
+            updates, caida = self._drain_batch(rows, get_client, max_intentos, intervalo)
+            self.update_many(updates)
+
+            for update in updates:
+                if update['estado'] == 'AUTORIZADO':
+                    metricas['autorizados'] += 1
+                elif update['estado'] in ('NO AUTORIZADO', 'DEVUELTA'):
+                    metricas['rechazados'] += 1
+                elif update['estado'] == 'RECIBIDA' and not update.get('error'):
+                    metricas['en_proceso'] += 1
+                if update.get('error'):
+                    metricas['errores'] += 1
+                if update.get('enviado'):
+                    metricas['enviados'] += 1
+                if update['estado'] in FINAL_STATES:
+                    finalizados.append(update)
+
+            if progress_callback:
+                progress_callback(self._drain_metrics(metricas, inicio))
+
+            if caida:
+                metricas['sri_disponible'] = False
+                logger.warning(f"SRI still unavailable, drain stopped after {metricas['lotes']} batches")
+                break
+
+        resultado = self._drain_metrics(metricas, inicio)
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO outbox_meta (key, value) VALUES ('ultimo_drenado', ?)",
+                (json.dumps(dict(resultado, fecha=time.strftime('%Y-%m-%dT%H:%M:%S'))),)
+            )
+
+        logger.info(f"Outbox drain finished: {resultado}")
+        return {'finalizados': finalizados, 'metricas': resultado}
+
+    def _drain_batch(self, rows, get_client, max_intentos, intervalo):
+        """Reception + authorization of one claimed batch; returns (updates, sri_down)"""
+        updates = {}
+        caida = False
+
+        por_ambiente = {}
+        for row in rows:
+            por_ambiente.setdefault(row['ambiente'], []).append(row)
+
+        for ambiente, grupo in por_ambiente.items():
+            client = get_client(ambiente)
+
+            por_enviar = [row for row in grupo if row['estado'] == 'PENDIENTE']
+            recibidas = [row['clave_acceso'] for row in grupo if row['estado'] == 'RECIBIDA']
+
+            if por_enviar:
+                recepcion = client.enviar_comprobantes_lote([row['xml'] for row in por_enviar])
+                for row, result in zip(por_enviar, recepcion['resultados'], strict=False):
+                    clave = row['clave_acceso']
+                    codigos = {
+                        str(mensaje.get('identificador'))
+                        for comprobante in result.get('comprobantes', [])
+                        for mensaje in comprobante.get('mensajes', [])
+                    }
+                    if result['estado'] == 'RECIBIDA' or (result['estado'] == 'DEVUELTA' and codigos & set(CLAVE_REGISTRADA)):
+                        recibidas.append(clave)
+                        updates[clave] = {'clave_acceso': clave, 'estado': 'RECIBIDA', 'enviado': True}
+                    elif result['estado'] == 'DEVUELTA':
+                        updates[clave] = {'clave_acceso': clave, 'estado': 'DEVUELTA', 'enviado': True,
+                                          'mensaje': result.get('mensaje')}
+                    else:
+                        caida = True
+                        updates[clave] = {'clave_acceso': clave, 'estado': 'PENDIENTE', 'error': True,
+                                          'mensaje': result.get('mensaje')}
+
+            if recibidas and not caida:
+                autorizacion = client.consultar_autorizaciones_lote(
+                    recibidas, max_intentos=max_intentos, intervalo=intervalo
+                )
+                for result in autorizacion['resultados']:
+                    clave = result['clave_acceso']
+                    update = updates.setdefault(clave, {'clave_acceso': clave})
+                    update['estado'] = result['estado'] if result['estado'] in FINAL_STATES else 'RECIBIDA'
+                    if result['estado'] == 'ERROR':
+                        caida = True
+                        update['error'] = True
+                    mensajes = result.get('mensajes') or []
+                    if mensajes:
+                        update['mensaje'] = mensajes[0].get('mensaje')
+                    update['numero_autorizacion'] = result.get('numero_autorizacion')
+                    update['fecha_autorizacion'] = result.get('fecha_autorizacion')
+            else:
+                for clave in recibidas:
+                    updates.setdefault(clave, {'clave_acceso': clave, 'estado': 'RECIBIDA', 'intento': False})
+
+        return list(updates.values()), caida
+
+    def _drain_metrics(self, metricas, inicio):
+        duracion = time.monotonic() - inicio
+        procesados = metricas['autorizados'] + metricas['rechazados']
+        return dict(
+            metricas,
+            procesados=procesados,
+            backlog_restante=self.backlog()['pendientes'],
+            duracion_segundos=round(duracion, 3),
+            por_segundo=round(procesados / duracion, 2) if duracion > 0 else 0.0
+        )
+
+    # ------------------------------------------------------------------
+    # Metrics and mode
+    # ------------------------------------------------------------------
+
+    def backlog(self):
+        """Queued invoices by state, age of the oldest pending one and results not yet applied"""
+        conn = self._connection()
+        por_estado = {
+            row['estado']: row['total']
+            for row in conn.execute("SELECT estado, COUNT(*) AS total FROM outbox GROUP BY estado")
+        }
+        placeholders = ', '.join('?' for _ in PENDING_STATES)
+        oldest = conn.execute(
+            f"SELECT MIN(encolado_at) AS encolado_at FROM outbox WHERE estado IN ({placeholders})",
+            PENDING_STATES
+        ).fetchone()
+        por_aplicar = conn.execute(
+            f"SELECT COUNT(*) AS total FROM outbox WHERE aplicado = 0 AND estado IN ({', '.join('?' for _ in FINAL_STATES)})",
+            FINAL_STATES
+        ).fetchone()
+
+        return {
+            'pendientes': sum(por_estado.get(estado, 0) for estado in PENDING_STATES),
+            'por_estado': por_estado,
+            'por_aplicar': por_aplicar['total'],
+            'antiguedad_segundos': round(time.time() - oldest['encolado_at'], 1) if oldest['encolado_at'] else 0
+        }
+
+    def last_drain(self):
+        row = self._connection().execute(
+            "SELECT value FROM outbox_meta WHERE key = 'ultimo_drenado'"
+        ).fetchone()
+        return json.loads(row['value']) if row else None
+
+    def get_mode(self):
+        row = self._connection().execute(
+            "SELECT value FROM outbox_meta WHERE key = 'modo'"
+        ).fetchone()
+        return row['value'] if row else CONTINGENCY_MODE
+
+    def set_mode(self, mode):
+        """Force contingency on/off for every worker ('auto' returns to failure detection)"""
+        if mode not in CONTINGENCY_MODES:
+            raise ValueError(f"Invalid contingency mode: {mode}")
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO outbox_meta (key, value) VALUES ('modo', ?)", (mode,))
+
+
+class SRIContingencyMonitor:
+    """
+    Circuit breaker deciding when invoices go to the outbox instead of the SRI
+
+    In 'auto' mode, `failures` consecutive errors (or calls slower than
+    `slow_seconds`) open the circuit for `cooldown` seconds. After the cooldown
+    the next request tries the SRI again; one more failure reopens it.
+    Failure counts are per process; the forced mode is shared via the outbox.
+    """
+
+    def __init__(self, outbox, failures=CONTINGENCY_FAILURES, cooldown=CONTINGENCY_COOLDOWN,
+                 slow_seconds=CONTINGENCY_SLOW_SECONDS):
+        self.outbox = outbox
+        self.failures = failures
+        self.cooldown = cooldown
+        self.slow_seconds = slow_seconds
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def is_active(self):
+        """True if new invoices should be issued in contingency"""
+        mode = self.outbox.get_mode()
+        if mode != 'auto':
+            return mode == 'on'
+        with self._lock:
+            return self._is_open()
+
+    def _is_open(self):
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.cooldown
+
+    def record(self, ok, duration=0.0):
+        """Record the outcome of one SRI call (slow successes count as failures)"""
+        if ok and duration <= self.slow_seconds:
+            self.record_success()
+        else:
+            self.record_failure()
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("SRI available again, leaving contingency mode")
+            self.consecutive_failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failures:
+                if self.opened_at is None:
+                    logger.warning(f"SRI unavailable after {self.consecutive_failures} failures, entering contingency mode")
+                self.opened_at = time.monotonic()
+
+    def status(self):
+        mode = self.outbox.get_mode()
+        with self._lock:
+            return {
+                'modo': mode,
+                'activo': mode == 'on' or (mode == 'auto' and self._is_open()),
+                'fallos_consecutivos': self.consecutive_failures,
+                'reintento_en_segundos': round(
+                    max(0.0, self.cooldown - (time.monotonic() - self.opened_at)), 1
+                ) if self.opened_at is not None else 0
+            }
+
+
+_outbox = None
+_monitor = None
+_registry_lock = threading.Lock()
+
+
+def get_sri_outbox():
+    """Process-wide outbox (the database file is created on first use)"""
+    global _outbox
+    if _outbox is None:
+        with _registry_lock:
+            if _outbox is None:
+                _outbox = SRIOutbox()
+    return _outbox
+
+
+def get_contingency_monitor():
+    """Process-wide contingency monitor bound to the shared outbox"""
+    global _monitor
+    if _monitor is None:
+        outbox = get_sri_outbox()
+        with _registry_lock:
+            if _monitor is None:
+                _monitor = SRIContingencyMonitor(outbox)
+    return _monitor
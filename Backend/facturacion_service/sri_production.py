@@ -4,16 +4,23 @@ PRODUCTION READY - Complete implementation with XMLDSig and SOAP
 """
 from lxml import etree
 from signxml import XMLSigner, methods
-from cryptography.hazmat.primitives.serialization import pkcs12, Encoding, PrivateFormat, NoEncryption
+from cryptography.hazmat.primitives.serialization import pkcs12
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.x509 import load_pem_x509_certificate
+from OpenSSL.crypto import X509
 from zeep import Client, Settings
 from zeep.transports import Transport
+from zeep.cache import SqliteCache
 from zeep.exceptions import Fault as ZeepFault
 from requests import Session
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import logging
 import os
+import threading
+import time
+from datetime import datetime, timezone
 from pathlib import Path
 
 
@@ -21,11 +28,34 @@ from pathlib import Path
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Bundled WSDL copies (schema inlined) and the bindings used to point them at each ambiente
+WSDL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wsdl')
+RECEPCION_WSDL = 'RecepcionComprobantesOffline.wsdl'
+AUTORIZACION_WSDL = 'AutorizacionComprobantesOffline.wsdl'
+RECEPCION_BINDING = '{http://ec.gob.sri.ws.recepcion}RecepcionComprobantesOfflinePortBinding'
+AUTORIZACION_BINDING = '{http://ec.gob.sri.ws.autorizacion}AutorizacionComprobantesOfflinePortBinding'
+
+# On-disk zeep cache for remotely loaded WSDL/XSD documents
+WSDL_CACHE_PATH = os.getenv(
+    'SRI_WSDL_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'storage', 'cache', 'sri_wsdl.db')
+)
+WSDL_CACHE_TIMEOUT = int(os.getenv('SRI_WSDL_CACHE_TIMEOUT', 7 * 24 * 3600))
+
+# Certificate rotation check interval and bulk signing pool settings
+CERT_CHECK_INTERVAL = int(os.getenv('SRI_CERT_CHECK_INTERVAL', 60))
+SIGNING_PROCESSES = int(os.getenv('SRI_SIGNING_PROCESSES', 0))
+SIGNING_POOL_MIN_BATCH = int(os.getenv('SRI_SIGNING_POOL_MIN_BATCH', 16))
+
 
 class XMLDigitalSigner:
     """
     Production-ready XML Digital Signature (XMLDSig) implementation
     Signs XML documents with PKCS#12 certificates for SRI compliance
+
+    The PKCS#12 file is decrypted once and the key material kept in memory.
+    Use get_xml_signer() to share one instance per certificate across the
+    process; it reloads the certificate when the file is replaced.
     """
 
     def __init__(self, certificate_path=None, password=None):
@@ -42,12 +72,22 @@ class XMLDigitalSigner:
         self.private_key = None
         self.certificate = None
 
+        self._cert_chain = None
+        self._file_signature = None
+        self._last_check = 0.0
+        self._load_lock = threading.Lock()
+        self._local = threading.local()
+        self._pool = None
+        self._pool_size = None
+
         if certificate_path and os.path.exists(certificate_path):
             self._load_certificate()
 
     def _load_certificate(self):
         """Load PKCS#12 certificate and extract private key"""
         try:
+            file_signature = self._stat_certificate()
+
             with open(self.certificate_path, 'rb') as f:
                 cert_data = f.read()
 
@@ -58,26 +98,95 @@ class XMLDigitalSigner:
                 backend=default_backend()
             )
 
+            # Certificate chain in the form signxml uses, built once instead of per signature
+            cert_chain = [X509.from_cryptography(certificate)]
+            cert_chain.extend(X509.from_cryptography(extra) for extra in additional_certs or [])
+
             self.private_key = private_key
             self.certificate = certificate
             self.cert_data = cert_data
+            self._cert_chain = cert_chain
+            self._file_signature = file_signature
 
             logger.info(f"Certificate loaded successfully from {self.certificate_path}")
             logger.info(f"Certificate subject: {certificate.subject}")
             logger.info(f"Certificate issuer: {certificate.issuer}")
-            logger.info(f"Valid from: {certificate.not_valid_before_utc}")
-            logger.info(f"Valid until: {certificate.not_valid_after_utc}")
+            valid_from, valid_until = _certificate_validity(certificate)
+            logger.info(f"Valid from: {valid_from}")
+            logger.info(f"Valid until: {valid_until}")
 
         except Exception as e:
             logger.error(f"Error loading certificate: {str(e)}")
             raise
 
-    def sign_xml(self, xml_string):
+    def _stat_certificate(self):
+        """Identity of the certificate file on disk (changes when it is replaced)"""
+        stat = os.stat(self.certificate_path)
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def reload_if_changed(self, force=False):
+        """
+        Reload the certificate if the .p12 file was rotated
+
+        The file is checked at most every SRI_CERT_CHECK_INTERVAL seconds.
+        If the new file can't be loaded (e.g. still being copied) the current
+        key material is kept.
+
+        Args:
+            force: Check now, ignoring the interval
+
+        Returns:
+            Boolean indicating if the certificate was reloaded
+        """
+        if not self.certificate_path:
+            return False
+
+        now = time.monotonic()
+        if not force and now - self._last_check < CERT_CHECK_INTERVAL:
+            return False
+
+        with self._load_lock:
+            self._last_check = now
+            try:
+                if self._stat_certificate() == self._file_signature:
+                    return False
+            except OSError:
+                return False
+
+            logger.info(f"Certificate file changed, reloading {self.certificate_path}")
+            previous = (self.private_key, self.certificate, self.cert_data,
+                        self._cert_chain, self._file_signature)
+            try:
+                self._load_certificate()
+            except Exception:
+                (self.private_key, self.certificate, self.cert_data,
+                 self._cert_chain, self._file_signature) = previous
+                return False
+
+            # Pool workers hold the previous key
+            self._shutdown_pool()
+            return True
+
+    def _get_signer(self):
+        """XMLSigner for the current thread (signers are reused, not rebuilt per call)"""
+        signer = getattr(self._local, 'signer', None)
+        if signer is None:
+            signer = XMLSigner(
+                method=methods.enveloped,
+                signature_algorithm='rsa-sha256',
+                digest_algorithm='sha256',
+                c14n_algorithm='http://www.w3.org/TR/2001/REC-xml-c14n-20010315'
+            )
+            self._local.signer = signer
+        return signer
+
+    def sign_xml(self, xml):
         """
         Sign XML with digital certificate using XMLDSig
 
         Args:
-            xml_string: XML content as string
+            xml: XML content as string/bytes, or an lxml element (avoids
+                 re-parsing a document that was just generated)
 
         Returns:
             Signed XML as string
@@ -90,52 +199,87 @@ class XMLDigitalSigner:
             # If no certificate configured, return unsigned XML with warning
             logger.warning("No certificate configured. Returning unsigned XML.")
             logger.warning("For production, configure certificate in sri_configuration table.")
-            return xml_string
+            return xml if isinstance(xml, str) else _to_xml_string(xml)
 
         try:
-            # Parse XML string to lxml element
-            root = etree.fromstring(xml_string.encode('utf-8'))
-
-            # Create signer with certificate
-            signer = XMLSigner(
-                method=methods.enveloped,
-                signature_algorithm='rsa-sha256',
-                digest_algorithm='sha256',
-                c14n_algorithm='http://www.w3.org/TR/2001/REC-xml-c14n-20010315'
-            )
-
-            # Convert private key to PEM format for signxml
-            private_key_pem = self.private_key.private_bytes(
-                encoding=Encoding.PEM,
-                format=PrivateFormat.PKCS8,
-                encryption_algorithm=NoEncryption()
-            )
-
-            # Convert certificate to PEM format
-            cert_pem = self.certificate.public_bytes(Encoding.PEM)
-
-            # Sign the XML
-            signed_root = signer.sign(
+            # Parse XML string to lxml element (trees are signed as-is)
+            if isinstance(xml, str):
+                root = etree.fromstring(xml.encode('utf-8'))
+            elif isinstance(xml, bytes):
+                root = etree.fromstring(xml)
+            else:
+                root = xml
+
+            # Sign with the in-memory key and certificate chain (no PEM round-trip)
+            signed_root = self._get_signer().sign(
                 root,
-                key=private_key_pem,
-                cert=cert_pem
+                key=self.private_key,
+                cert=self._cert_chain
             )
 
-            # Convert back to string
-            signed_xml = etree.tostring(
-                signed_root,
-                encoding='UTF-8',
-                xml_declaration=True,
-                pretty_print=True
-            ).decode('utf-8')
+            # Convert back to string (no pretty_print: whitespace added after
+            # signing changes the canonical form and invalidates the signature)
+            signed_xml = _to_xml_string(signed_root)
 
-            logger.info("XML signed successfully with digital certificate")
+            logger.debug("XML signed successfully with digital certificate")
             return signed_xml
 
         except Exception as e:
             logger.error(f"Error signing XML: {str(e)}")
             raise
 
+    def sign_many(self, xml_strings, processes=None):
+        """
+        Sign many XML documents using a process pool
+
+        RSA signing is CPU-bound, so batches are spread over worker processes
+        that each load the certificate once. Small batches (or processes=1)
+        are signed in the current process.
+
+        Args:
+            xml_strings: List of XML strings
+            processes: Worker processes (default: SRI_SIGNING_PROCESSES or CPU count)
+
+        Returns:
+            List of signed XML strings, in the same order as the input
+        """
+        processes = processes or SIGNING_PROCESSES or os.cpu_count() or 1
+
+        if (processes == 1 or len(xml_strings) < SIGNING_POOL_MIN_BATCH
+                or not self.certificate or not self.private_key):
+            return [self.sign_xml(xml_string) for xml_string in xml_strings]
+
+        pool = self._get_pool(processes)
+        chunksize = max(1, len(xml_strings) // (processes * 4))
+        return list(pool.map(_sign_in_worker, xml_strings, chunksize=chunksize))
+
+    def _get_pool(self, processes):
+        """Get or create the signing process pool"""
+        with self._load_lock:
+            if self._pool is not None and self._pool_size != processes:
+                self._shutdown_pool()
+
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=processes,
+                    initializer=_init_signing_worker,
+                    initargs=(self.certificate_path, self.password)
+                )
+                self._pool_size = processes
+
+            return self._pool
+
+    def _shutdown_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=False)
+            self._pool = None
+            self._pool_size = None
+
+    def close(self):
+        """Release the signing process pool"""
+        with self._load_lock:
+            self._shutdown_pool()
+
     def verify_certificate_validity(self):
         """
         Verify if certificate is still valid
@@ -146,22 +290,93 @@ class XMLDigitalSigner:
         if not self.certificate:
             return False
 
-        from datetime import datetime, timezone
         now = datetime.now(timezone.utc)
+        valid_from, valid_until = _certificate_validity(self.certificate)
 
-        is_valid = (
-            self.certificate.not_valid_before_utc <= now <=
-            self.certificate.not_valid_after_utc
-        )
+        is_valid = valid_from <= now <= valid_until
 
         if not is_valid:
             logger.warning(f"Certificate is not valid. Valid period: "
-                         f"{self.certificate.not_valid_before_utc} to "
-                         f"{self.certificate.not_valid_after_utc}")
+                         f"{valid_from} to {valid_until}")
 
         return is_valid
 
 
+def _to_xml_string(element):
+    """Serialize an lxml element with the XML declaration SRI expects"""
+    if isinstance(element, bytes):
+        return element.decode('utf-8')
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + etree.tostring(element, encoding='UTF-8').decode('utf-8')
+
+
+def _certificate_validity(certificate):
+    """Validity period as aware UTC datetimes (the *_utc properties need cryptography >= 42)"""
+    if hasattr(certificate, 'not_valid_before_utc'):
+        return certificate.not_valid_before_utc, certificate.not_valid_after_utc
+    return (
+        certificate.not_valid_before.replace(tzinfo=timezone.utc),
+        certificate.not_valid_after.replace(tzinfo=timezone.utc)
+    )
+
+
+# ============= SIGNER REGISTRY =============
+
+_signers = {}
+_signers_lock = threading.Lock()
+
+# Signer held by each sign_many() worker process
+_worker_signer = None
+
+
+def _init_signing_worker(certificate_path, password):
+    """Process pool initializer: load the certificate once per worker"""
+    global _worker_signer
+    _worker_signer = XMLDigitalSigner(certificate_path, password)
+
+
+def _sign_in_worker(xml_string):
+    return _worker_signer.sign_xml(xml_string)
+
+
+def get_xml_signer(certificate_path, password):
+    """
+    Get the process-wide XMLDigitalSigner for a certificate
+
+    The .p12 file is decrypted only the first time; later calls reuse the
+    in-memory key and check (rate-limited) whether the file was rotated.
+
+    Args:
+        certificate_path: Path to .p12 certificate file
+        password: Certificate password
+
+    Returns:
+        XMLDigitalSigner (without certificate if the file does not exist)
+    """
+    if not certificate_path or not os.path.exists(certificate_path):
+        return XMLDigitalSigner(certificate_path, password)
+
+    key = (os.path.abspath(certificate_path), password)
+    signer = _signers.get(key)
+    if signer is None:
+        with _signers_lock:
+            signer = _signers.get(key)
+            if signer is None:
+                signer = XMLDigitalSigner(certificate_path, password)
+                _signers[key] = signer
+                return signer
+
+    signer.reload_if_changed()
+    return signer
+
+
+def reset_xml_signers():
+    """Drop all cached signers and their process pools"""
+    with _signers_lock:
+        for signer in _signers.values():
+            signer.close()
+        _signers.clear()
+
+
 class SRISOAPClient:
     """
     Production-ready SOAP client for SRI Web Services
@@ -175,14 +390,30 @@ class SRISOAPClient:
     PRODUCCION_RECEPCION = "https://cel.sri.gob.ec/comprobantes-electronicos-ws/RecepcionComprobantesOffline?wsdl"
     PRODUCCION_AUTORIZACION = "https://cel.sri.gob.ec/comprobantes-electronicos-ws/AutorizacionComprobantesOffline?wsdl"
 
-    def __init__(self, ambiente="1"):
+    # Final authorization states (anything else is polled again)
+    ESTADOS_FINALES = ('AUTORIZADO', 'NO AUTORIZADO')
+
+    def __init__(self, ambiente="1", url_recepcion=None, url_autorizacion=None, max_workers=None,
+                 use_local_wsdl=None):
         """
         Initialize SRI SOAP client
 
+        Prefer get_sri_client() over constructing this directly: clients are
+        expensive to build (WSDL parsing) and safe to share between requests.
+
         Args:
             ambiente: "1" for testing, "2" for production
+            url_recepcion: Override reception WSDL URL (local stand-ins)
+            url_autorizacion: Override authorization WSDL URL (local stand-ins)
+            max_workers: Parallelism limit for batch operations
+                         (default: SRI_BATCH_WORKERS or 8)
+            use_local_wsdl: Use the bundled WSDL copies (default: SRI_WSDL_LOCAL or True)
         """
         self.ambiente = ambiente
+        self.max_workers = max_workers or int(os.getenv('SRI_BATCH_WORKERS', 8))
+        if use_local_wsdl is None:
+            use_local_wsdl = os.getenv('SRI_WSDL_LOCAL', 'True') == 'True'
+        self.use_local_wsdl = use_local_wsdl
 
         # Select URLs based on environment
         if ambiente == "1":
@@ -194,12 +425,21 @@ class SRISOAPClient:
             self.url_autorizacion = self.PRODUCCION_AUTORIZACION
             logger.info("Using SRI PRODUCTION environment")
 
+        if url_recepcion:
+            self.url_recepcion = url_recepcion
+        if url_autorizacion:
+            self.url_autorizacion = url_autorizacion
+
         # Configure session with timeout
+        # Pool sized to the batch parallelism so concurrent calls reuse keep-alive connections
         self.session = Session()
         self.session.headers.update({'Content-Type': 'text/xml; charset=utf-8'})
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
 
-        # Configure transport
-        self.transport = Transport(session=self.session, timeout=30)
+        # Configure transport (remote WSDL/XSD downloads are cached on disk across restarts)
+        self.transport = Transport(session=self.session, timeout=30, cache=_get_wsdl_cache())
 
         # Configure zeep settings
         self.settings = Settings(
@@ -208,42 +448,89 @@ class SRISOAPClient:
             xsd_ignore_sequence_order=True
         )
 
-        # Initialize clients (lazy loading)
+        # Initialize clients (lazy loading, shared across threads)
+        self._client_lock = threading.Lock()
         self._recepcion_client = None
+        self._recepcion_service = None
         self._autorizacion_client = None
+        self._autorizacion_service = None
+
+    def _build_client(self, wsdl_url, local_wsdl, binding):
+        """
+        Create a zeep client and the service proxy bound to the SRI endpoint
+
+        The bundled WSDL copy is preferred (no WSDL/XSD download at all);
+        otherwise the remote WSDL is fetched through the on-disk zeep cache.
+        """
+        endpoint = wsdl_url.split('?', 1)[0]
+        local_path = os.path.join(WSDL_DIR, local_wsdl)
+
+        if self.use_local_wsdl and os.path.exists(local_path):
+            client = Client(local_path, transport=self.transport, settings=self.settings)
+            service = client.create_service(binding, endpoint)
+            logger.info(f"SOAP client initialized from bundled WSDL {local_wsdl} -> {endpoint}")
+        else:
+            client = Client(wsdl_url, transport=self.transport, settings=self.settings)
+            service = client.service
+            logger.info(f"SOAP client initialized: {wsdl_url}")
+
+        return client, service
+
+    def _get_recepcion_service(self):
+        """Get or create reception service proxy"""
+        if self._recepcion_service is None:
+            with self._client_lock:
+                if self._recepcion_service is None:
+                    try:
+                        self._recepcion_client, self._recepcion_service = self._build_client(
+                            self.url_recepcion, RECEPCION_WSDL, RECEPCION_BINDING
+                        )
+                    except Exception as e:
+                        logger.error(f"Error creating reception client: {str(e)}")
+                        raise
+
+        return self._recepcion_service
+
+    def _get_autorizacion_service(self):
+        """Get or create authorization service proxy"""
+        if self._autorizacion_service is None:
+            with self._client_lock:
+                if self._autorizacion_service is None:
+                    try:
+                        self._autorizacion_client, self._autorizacion_service = self._build_client(
+                            self.url_autorizacion, AUTORIZACION_WSDL, AUTORIZACION_BINDING
+                        )
+                    except Exception as e:
+                        logger.error(f"Error creating authorization client: {str(e)}")
+                        raise
+
+        return self._autorizacion_service
 
     def _get_recepcion_client(self):
         """Get or create reception client"""
-        if self._recepcion_client is None:
-            try:
-                self._recepcion_client = Client(
-                    self.url_recepcion,
-                    transport=self.transport,
-                    settings=self.settings
-                )
-                logger.info(f"Reception client initialized: {self.url_recepcion}")
-            except Exception as e:
-                logger.error(f"Error creating reception client: {str(e)}")
-                raise
-
+        self._get_recepcion_service()
         return self._recepcion_client
 
     def _get_autorizacion_client(self):
         """Get or create authorization client"""
-        if self._autorizacion_client is None:
-            try:
-                self._autorizacion_client = Client(
-                    self.url_autorizacion,
-                    transport=self.transport,
-                    settings=self.settings
-                )
-                logger.info(f"Authorization client initialized: {self.url_autorizacion}")
-            except Exception as e:
-                logger.error(f"Error creating authorization client: {str(e)}")
-                raise
-
+        self._get_autorizacion_service()
         return self._autorizacion_client
 
+    def warm_up(self):
+        """
+        Load both WSDLs ahead of the first invoice
+
+        Returns:
+            Boolean indicating if both clients are ready
+        """
+        try:
+            self._get_recepcion_service()
+            self._get_autorizacion_service()
+            return True
+        except Exception as e:
+            logger.warning(f"SRI client warm-up failed: {str(e)}")
+            return False
+
     def enviar_comprobante(self, xml_string):
         """
         Send invoice to SRI for validation
@@ -261,10 +548,13 @@ class SRISOAPClient:
             }
         """
         try:
-            client = self._get_recepcion_client()
+            service = self._get_recepcion_service()
+
+            # The xml part is xs:base64Binary: zeep encodes bytes, but sends str as-is
+            xml_bytes = xml_string.encode('utf-8') if isinstance(xml_string, str) else xml_string
 
             # Call SRI web service
-            response = client.service.validarComprobante(xml_string)
+            response = service.validarComprobante(xml_bytes)
 
             # Process response
             estado = response.estado if hasattr(response, 'estado') else 'DESCONOCIDO'
@@ -352,10 +642,10 @@ class SRISOAPClient:
             }
         """
         try:
-            client = self._get_autorizacion_client()
+            service = self._get_autorizacion_service()
 
             # Call SRI web service
-            response = client.service.autorizacionComprobante(clave_acceso)
+            response = service.autorizacionComprobante(clave_acceso)
 
             # Process response
             result = {
@@ -422,6 +712,149 @@ class SRISOAPClient:
                 'mensajes': [{'mensaje': f'Error: {str(e)}', 'tipo': 'ERROR'}]
             }
 
+    def enviar_comprobantes_lote(self, xml_strings, max_workers=None, progress_callback=None):
+        """
+        Send many signed invoices to SRI concurrently
+
+        All calls share this client's keep-alive session and zeep client.
+
+        Args:
+            xml_strings: List of signed XML strings
+            max_workers: Parallelism limit (default: self.max_workers)
+            progress_callback: Optional callable receiving a metrics snapshot
+                               after each invoice is processed
+
+        Returns:
+            Dictionary with 'resultados' (same order as input, one
+            enviar_comprobante() result each) and 'metricas'
+        """
+        metrics = SRIBatchMetrics(len(xml_strings), 'recepcion', progress_callback)
+
+        def _enviar(xml_string):
+            metrics.record_call()
+            result = self.enviar_comprobante(xml_string)
+            metrics.record(result['estado'])
+            return result
+
+        resultados = self._run_concurrently(
+            _enviar, xml_strings, max_workers, self._get_recepcion_service, 'sri-recepcion'
+        )
+
+        logger.info(f"Batch reception finished: {metrics.snapshot()}")
+        return {'resultados': resultados, 'metricas': metrics.snapshot()}
+
+    def consultar_autorizaciones_lote(self, claves_acceso, max_workers=None, max_intentos=5,
+                                      intervalo=3.0, progress_callback=None):
+        """
+        Poll authorization status of many access keys concurrently
+
+        Keys are polled in rounds: every pending key is queried in parallel,
+        keys that reached a final state (AUTORIZADO / NO AUTORIZADO) leave
+        the batch, and the rest are retried after `intervalo` seconds until
+        `max_intentos` rounds have been made.
+
+        Args:
+            claves_acceso: List of 49-digit access keys
+            max_workers: Parallelism limit (default: self.max_workers)
+            max_intentos: Maximum polling rounds per key
+            intervalo: Seconds to wait between rounds
+            progress_callback: Optional callable receiving a metrics snapshot
+                               each time a key reaches its last state
+
+        Returns:
+            Dictionary with 'resultados' (same order as input, one
+            consultar_autorizacion() result each, plus 'clave_acceso' and
+            'intentos') and 'metricas'
+        """
+        metrics = SRIBatchMetrics(len(claves_acceso), 'autorizacion', progress_callback)
+        resultados = [None] * len(claves_acceso)
+        pendientes = list(range(len(claves_acceso)))
+
+        for intento in range(1, max_intentos + 1):
+            ultimo_intento = intento == max_intentos
+
+            def _consultar(index, intento=intento, ultimo_intento=ultimo_intento):
+                metrics.record_call()
+                result = self.consultar_autorizacion(claves_acceso[index])
+                result['clave_acceso'] = claves_acceso[index]
+                result['intentos'] = intento
+                if result['estado'] in self.ESTADOS_FINALES or ultimo_intento:
+                    metrics.record(result['estado'])
+                return result
+
+            ronda = self._run_concurrently(
+                _consultar, pendientes, max_workers, self._get_autorizacion_service, 'sri-autorizacion'
+            )
+
+            siguientes = []
+            for index, result in zip(pendientes, ronda, strict=False):
+                resultados[index] = result
+                if result['estado'] not in self.ESTADOS_FINALES:
+                    siguientes.append(index)
+
+            pendientes = siguientes
+            if not pendientes:
+                break
+
+            if not ultimo_intento:
+                logger.info(f"{len(pendientes)} access keys still pending, retrying in {intervalo}s")
+                time.sleep(intervalo)
+
+        logger.info(f"Batch authorization finished: {metrics.snapshot()}")
+        return {'resultados': resultados, 'metricas': metrics.snapshot()}
+
+    def procesar_lote(self, xml_strings, max_workers=None, max_intentos=5, intervalo=3.0,
+                      progress_callback=None):
+        """
+        Send many signed invoices and poll the authorization of those received
+
+        Args:
+            xml_strings: List of signed XML strings
+            max_workers: Parallelism limit (default: self.max_workers)
+            max_intentos: Maximum polling rounds per key
+            intervalo: Seconds to wait between polling rounds
+            progress_callback: Optional callable receiving metrics snapshots
+
+        Returns:
+            Dictionary with 'recepcion' and 'autorizacion' batch results
+        """
+        recepcion = self.enviar_comprobantes_lote(
+            xml_strings, max_workers=max_workers, progress_callback=progress_callback
+        )
+
+        claves_acceso = []
+        for xml_string, result in zip(xml_strings, recepcion['resultados'], strict=False):
+            if result['estado'] == 'RECIBIDA':
+                clave = result.get('clave_acceso') or extraer_clave_acceso(xml_string)
+                if clave:
+                    claves_acceso.append(clave)
+
+        autorizacion = self.consultar_autorizaciones_lote(
+            claves_acceso,
+            max_workers=max_workers,
+            max_intentos=max_intentos,
+            intervalo=intervalo,
+            progress_callback=progress_callback
+        )
+
+        return {'recepcion': recepcion, 'autorizacion': autorizacion}
+
+    def _run_concurrently(self, func, items, max_workers, client_getter, thread_name_prefix):
+        """Map func over items with a bounded thread pool, preserving order"""
+        if not items:
+            return []
+
+        # Load the WSDL once before fanning out so workers don't race to build the client
+        try:
+            client_getter()
+        except Exception:
+            # Each call reports the error in its own result
+            pass
+
+        workers = min(max_workers or self.max_workers, len(items))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=thread_name_prefix) as executor:
+            return list(executor.map(func, items))
+
     def test_connection(self):
         """
         Test connection to SRI web services
@@ -431,9 +864,162 @@ class SRISOAPClient:
         """
         try:
             # Try to get WSDL
-            client = self._get_recepcion_client()
+            self._get_recepcion_service()
             logger.info("Connection to SRI web services successful")
             return True
         except Exception as e:
             logger.error(f"Connection test failed: {str(e)}")
             return False
+
+
+
+class SRIBatchMetrics:
+    """
+    Thread-safe progress metrics for SRI batch operations
+    """
+
+    def __init__(self, total, operacion, progress_callback=None):
+        """
+        Args:
+            total: Number of invoices / access keys in the batch
+            operacion: 'recepcion' or 'autorizacion'
+            progress_callback: Optional callable receiving snapshot() dicts
+        """
+        self.total = total
+        self.operacion = operacion
+        self.progress_callback = progress_callback
+        self.procesados = 0
+        self.llamadas_soap = 0
+        self.por_estado = {}
+        self._inicio = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record_call(self):
+        """Count one SOAP call"""
+        with self._lock:
+            self.llamadas_soap += 1
+
+    def record(self, estado):
+        """Count one item reaching its last state"""
+        with self._lock:
+            self.procesados += 1
+            self.por_estado[estado] = self.por_estado.get(estado, 0) + 1
+            snapshot = self._snapshot()
+
+        if self.progress_callback:
+            try:
+                self.progress_callback(snapshot)
+            except Exception as e:
+                logger.warning(f"Batch progress callback failed: {str(e)}")
+
+    def snapshot(self):
+        """Current metrics as a dictionary"""
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        duracion = time.monotonic() - self._inicio
+        return {
+            'operacion': self.operacion,
+            'total': self.total,
+            'procesados': self.procesados,
+            'pendientes': self.total - self.procesados,
+            'por_estado': dict(self.por_estado),
+            'llamadas_soap': self.llamadas_soap,
+            'duracion_segundos': round(duracion, 3),
+            'por_segundo': round(self.procesados / duracion, 2) if duracion > 0 else 0.0
+        }
+
+
+def extraer_clave_acceso(xml_string):
+    """
+    Extract claveAcceso from an invoice XML
+
+    Args:
+        xml_string: Invoice XML (signed or unsigned)
+
+    Returns:
+        49-digit access key or None
+    """
+    try:
+        data = xml_string.encode('utf-8') if isinstance(xml_string, str) else xml_string
+        root = etree.fromstring(data)
+        node = root.find('.//infoTributaria/claveAcceso')
+        return node.text.strip() if node is not None and node.text else None
+    except etree.XMLSyntaxError:
+        return None
+
+
+# ============= CLIENT REGISTRY =============
+
+_wsdl_cache = None
+_clients = {}
+_registry_lock = threading.Lock()
+
+
+def _get_wsdl_cache():
+    """Shared on-disk zeep cache (None if the cache file can't be created)"""
+    global _wsdl_cache
+    if _wsdl_cache is None:
+        try:
+            os.makedirs(os.path.dirname(WSDL_CACHE_PATH), exist_ok=True)
+            _wsdl_cache = SqliteCache(path=WSDL_CACHE_PATH, timeout=WSDL_CACHE_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"WSDL disk cache disabled: {str(e)}")
+            return None
+    return _wsdl_cache
+
+
+def get_sri_client(ambiente="1", url_recepcion=None, url_autorizacion=None):
+    """
+    Get the process-wide SRISOAPClient for an environment
+
+    Clients keep their parsed WSDL and pooled keep-alive session, so every
+    request after the first skips WSDL handling entirely.
+
+    Args:
+        ambiente: "1" for testing, "2" for production
+        url_recepcion: Override reception WSDL URL (local stand-ins)
+        url_autorizacion: Override authorization WSDL URL (local stand-ins)
+
+    Returns:
+        Shared SRISOAPClient instance
+    """
+    key = (str(ambiente), url_recepcion, url_autorizacion)
+    client = _clients.get(key)
+    if client is None:
+        with _registry_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = SRISOAPClient(
+                    str(ambiente),
+                    url_recepcion=url_recepcion,
+                    url_autorizacion=url_autorizacion
+                )
+                _clients[key] = client
+    return client
+
+
+def warm_up_sri_clients(*ambientes):
+    """
+    Build and load the SRI clients for the given environments
+
+    Called at service start so the first authorization doesn't pay for
+    WSDL parsing.
+
+    Args:
+        ambientes: Environments to warm up (default: SRI_AMBIENTE or "1")
+
+    Returns:
+        Dictionary ambiente -> Boolean (ready)
+    """
+    ambientes = ambientes or (os.getenv('SRI_AMBIENTE', '1'),)
+    return {ambiente: get_sri_client(ambiente).warm_up() for ambiente in ambientes}
+
+
+def reset_sri_clients():
+    """Drop all registered clients (tests, configuration changes)"""
+    with _registry_lock:
+        for client in _clients.values():
+            client.session.close()
+        _clients.clear()
@@ -0,0 +1,249 @@
+"""
+Servidor SOAP local que simula los web services offline del SRI
+Usado por los tests para no depender de celcer.sri.gob.ec
+"""
+import base64
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WSDL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'wsdl')
+SRI_ADDRESS = re.compile(r'https://cel\.sri\.gob\.ec/comprobantes-electronicos-ws/\w+')
+
+
+def _cargar_wsdl(nombre):
+    """WSDL empaquetado con el servicio, con un marcador en lugar de la direccion del SRI"""
+    with open(os.path.join(WSDL_DIR, nombre), encoding='utf-8') as f:
+        return SRI_ADDRESS.sub('{location}', f.read())
+
+
+RECEPCION_WSDL = _cargar_wsdl('RecepcionComprobantesOffline.wsdl')
+AUTORIZACION_WSDL = _cargar_wsdl('AutorizacionComprobantesOffline.wsdl')
+
+SOAP_ENVELOPE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+    '<soap:Body>{body}</soap:Body>'
+    '</soap:Envelope>'
+)
+
+
+class _SRIStubHandler(BaseHTTPRequestHandler):
+    """Atiende WSDL (GET) y llamadas SOAP (POST) del stub"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.stub._registrar_conexion()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _responder(self, status, body):
+        payload = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        stub = self.server.stub
+        stub.wsdl_descargas += 1
+        if self.path.startswith('/RecepcionComprobantesOffline'):
+            self._responder(200, RECEPCION_WSDL.replace('{location}', stub.url_recepcion_servicio))
+        elif self.path.startswith('/AutorizacionComprobantesOffline'):
+            self._responder(200, AUTORIZACION_WSDL.replace('{location}', stub.url_autorizacion_servicio))
+        else:
+            self._responder(404, '')
+
+    def do_POST(self):
+        stub = self.server.stub
+        length = int(self.headers.get('Content-Length', 0))
+        request_body = self.rfile.read(length).decode('utf-8')
+
+        if stub.caido:
+            # Caida simulada: el SRI responde 503 sin cuerpo SOAP
+            with stub._lock:
+                stub.llamadas_rechazadas += 1
+            self._responder(503, '')
+            return
+
+        with stub._llamada_en_curso():
+            if self.path.startswith('/RecepcionComprobantesOffline'):
+                body = stub._validar_comprobante(request_body)
+            elif self.path.startswith('/AutorizacionComprobantesOffline'):
+                body = stub._autorizacion_comprobante(request_body)
+            else:
+                self._responder(404, '')
+                return
+
+        self._responder(200, SOAP_ENVELOPE.format(body=body))
+
+
+class SRIStubServer:
+    """
+    Stand-in local de RecepcionComprobantesOffline y AutorizacionComprobantesOffline
+
+    - Recepcion: decodifica el XML en base64, extrae la claveAcceso y responde RECIBIDA
+    - Autorizacion: responde EN PROCESO las primeras `consultas_en_proceso` veces
+      por clave y luego AUTORIZADO
+    - Registra conexiones TCP, llamadas SOAP y concurrencia maxima observada
+    - `caido` (o simular_caida()) responde 503 a toda llamada SOAP
+    - `rechazar_duplicados` devuelve DEVUELTA (43 CLAVE ACCESO REGISTRADA) al reenviar una clave
+    """
+
+    def __init__(self, consultas_en_proceso=0, latencia=0.0, rechazar_duplicados=False):
+        self.consultas_en_proceso = consultas_en_proceso
+        self.latencia = latencia
+        self.rechazar_duplicados = rechazar_duplicados
+        self.caido = False
+        self.llamadas_rechazadas = 0
+
+        self.conexiones = 0
+        self.wsdl_descargas = 0
+        self.llamadas_recepcion = 0
+        self.llamadas_autorizacion = 0
+        self.concurrencia_maxima = 0
+        self.claves_recibidas = []
+
+        self._en_curso = 0
+        self._consultas_por_clave = {}
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _SRIStubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def url_recepcion_servicio(self):
+        return f"{self.base_url}/RecepcionComprobantesOffline"
+
+    @property
+    def url_autorizacion_servicio(self):
+        return f"{self.base_url}/AutorizacionComprobantesOffline"
+
+    @property
+    def url_recepcion(self):
+        return f"{self.url_recepcion_servicio}?wsdl"
+
+    @property
+    def url_autorizacion(self):
+        return f"{self.url_autorizacion_servicio}?wsdl"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    @contextmanager
+    def simular_caida(self):
+        """SRI no disponible dentro del bloque"""
+        self.caido = True
+        try:
+            yield self
+        finally:
+            self.caido = False
+
+    def _registrar_conexion(self):
+        with self._lock:
+            self.conexiones += 1
+
+    @contextmanager
+    def _llamada_en_curso(self):
+        with self._lock:
+            self._en_curso += 1
+            self.concurrencia_maxima = max(self.concurrencia_maxima, self._en_curso)
+        try:
+            if self.latencia:
+                time.sleep(self.latencia)
+            yield
+        finally:
+            with self._lock:
+                self._en_curso -= 1
+
+    def _validar_comprobante(self, request_body):
+        match = re.search(r'<(?:\w+:)?xml>([^<]*)</(?:\w+:)?xml>', request_body)
+        xml = base64.b64decode(match.group(1)).decode('utf-8') if match else ''
+        clave = re.search(r'<claveAcceso>(\d+)</claveAcceso>', xml)
+
+        with self._lock:
+            self.llamadas_recepcion += 1
+            duplicada = bool(clave) and clave.group(1) in self.claves_recibidas
+            if clave:
+                self.claves_recibidas.append(clave.group(1))
+
+        if duplicada and self.rechazar_duplicados:
+            return (
+                '<ns2:validarComprobanteResponse xmlns:ns2="http://ec.gob.sri.ws.recepcion">'
+                '<RespuestaRecepcionComprobante><estado>DEVUELTA</estado><comprobantes>'
+                f'<comprobante><claveAcceso>{clave.group(1)}</claveAcceso><mensajes><mensaje>'
+                '<identificador>43</identificador><mensaje>CLAVE ACCESO REGISTRADA</mensaje>'
+                '<tipo>ERROR</tipo></mensaje></mensajes></comprobante></comprobantes>'
+                '</RespuestaRecepcionComprobante></ns2:validarComprobanteResponse>'
+            )
+
+        if not clave:
+            return (
+                '<ns2:validarComprobanteResponse xmlns:ns2="http://ec.gob.sri.ws.recepcion">'
+                '<RespuestaRecepcionComprobante><estado>DEVUELTA</estado><comprobantes>'
+                '<comprobante><claveAcceso></claveAcceso><mensajes><mensaje>'
+                '<identificador>35</identificador><mensaje>ARCHIVO NO CUMPLE ESTRUCTURA XML</mensaje>'
+                '<tipo>ERROR</tipo></mensaje></mensajes></comprobante></comprobantes>'
+                '</RespuestaRecepcionComprobante></ns2:validarComprobanteResponse>'
+            )
+
+        return (
+            '<ns2:validarComprobanteResponse xmlns:ns2="http://ec.gob.sri.ws.recepcion">'
+            '<RespuestaRecepcionComprobante><estado>RECIBIDA</estado><comprobantes/>'
+            '</RespuestaRecepcionComprobante></ns2:validarComprobanteResponse>'
+        )
+
+    def _autorizacion_comprobante(self, request_body):
+        match = re.search(r'<(?:\w+:)?claveAccesoComprobante>(\d*)</', request_body)
+        clave = match.group(1) if match else ''
+
+        with self._lock:
+            self.llamadas_autorizacion += 1
+            consultas = self._consultas_por_clave.get(clave, 0) + 1
+            self._consultas_por_clave[clave] = consultas
+
+        if consultas <= self.consultas_en_proceso:
+            autorizacion = '<autorizacion><estado>EN PROCESO</estado></autorizacion>'
+        else:
+            autorizacion = (
+                '<autorizacion><estado>AUTORIZADO</estado>'
+                f'<numeroAutorizacion>{clave}</numeroAutorizacion>'
+                '<fechaAutorizacion>2025-12-15T10:30:00-05:00</fechaAutorizacion>'
+                '<ambiente>PRUEBAS</ambiente><comprobante><![CDATA[<factura/>]]></comprobante>'
+                '<mensajes/></autorizacion>'
+            )
+
+        return (
+            '<ns2:autorizacionComprobanteResponse xmlns:ns2="http://ec.gob.sri.ws.autorizacion">'
+            '<RespuestaAutorizacionComprobante>'
+            f'<claveAccesoConsultada>{clave}</claveAccesoConsultada>'
+            '<numeroComprobantes>1</numeroComprobantes>'
+            f'<autorizaciones>{autorizacion}</autorizaciones>'
+            '</RespuestaAutorizacionComprobante></ns2:autorizacionComprobanteResponse>'
+        )
@@ -0,0 +1,117 @@
+"""
+Tests de generacion y validacion en lote de claves de acceso
+"""
+import os
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import access_keys
+from access_keys import (
+    generate_access_keys,
+    is_valid_access_key,
+    modulo11,
+    parse_access_key,
+    validate_access_keys,
+)
+from sri_electronic_invoice import SRIElectronicInvoice
+
+# Claves publicadas en ejemplos del SRI (digito verificador modulo 11, pesos 2..7 desde la derecha)
+CLAVES_SRI = [
+    '0503201201176001321000110010030009900641234567814',
+    '2302202101099268888500120010010000000011234567810',
+]
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def backend(request, monkeypatch):
+    """Cada test corre con NumPy y con la ruta pura Python"""
+    if request.param == 'numpy':
+        if access_keys.numpy is None:
+            pytest.skip('numpy no instalado')
+    else:
+        monkeypatch.setattr(access_keys, 'numpy', None)
+    return request.param
+
+
+def _generador():
+    return SRIElectronicInvoice(
+        ruc_emisor='0999999999001',
+        razon_social='CLINICA PRUEBAS',
+        nombre_comercial='CLINICA',
+        direccion_matriz='Guayaquil',
+        ambiente='1'
+    )
+
+
+def test_claves_del_sri_son_validas(backend):
+    assert validate_access_keys(CLAVES_SRI) == [None, None]
+    for clave in CLAVES_SRI:
+        assert str(modulo11(clave[:48])) == clave[48]
+
+
+def test_generar_en_lote_49_digitos(backend):
+    claves = generate_access_keys(
+        '15/12/2025', list(range(1, 1001)), '0999999999001', establecimiento='001', punto_emision='002'
+    )
+
+    assert len(claves) == 1000
+    assert all(len(clave) == 49 and clave.isdigit() for clave in claves)
+    assert validate_access_keys(claves) == [None] * 1000
+
+    campos = parse_access_key(claves[41])
+    assert campos['fecha_emision'] == '15122025'
+    assert campos['ruc'] == '0999999999001'
+    assert campos['punto_emision'] == '002'
+    assert campos['secuencial'] == '000000042'
+    assert campos['codigo_numerico'] == '00000042'
+    assert campos['tipo_emision'] == '1'
+
+
+def test_numpy_y_python_coinciden(monkeypatch):
+    if access_keys.numpy is None:
+        pytest.skip('numpy no instalado')
+
+    fechas = [date(2025, 1 + i % 12, 1 + i % 28) for i in range(500)]
+    secuenciales = list(range(7, 507))
+    con_numpy = generate_access_keys(fechas, secuenciales, '1790012345001', ambiente='2')
+
+    monkeypatch.setattr(access_keys, 'numpy', None)
+    assert generate_access_keys(fechas, secuenciales, '1790012345001', ambiente='2') == con_numpy
+
+
+def test_validar_en_lote_motivos(backend):
+    [valida] = generate_access_keys('2025-12-15', [9], '0999999999001')
+    digito_malo = valida[:48] + str((int(valida[48]) + 1) % 10)
+
+    resultado = validate_access_keys([
+        valida,
+        None,
+        valida[:41],
+        valida[:10] + 'X' + valida[11:],
+        '32' + valida[2:],
+        valida[:8] + '99' + valida[10:],
+        valida[:23] + '7' + valida[24:],
+        digito_malo,
+    ])
+
+    assert resultado == [
+        None, 'longitud', 'longitud', 'no_numerica', 'fecha',
+        'tipo_comprobante', 'ambiente', 'digito_verificador'
+    ]
+    assert is_valid_access_key(valida) and not is_valid_access_key(digito_malo)
+
+
+def test_generador_usa_lote_y_codigo_numerico():
+    generador = _generador()
+
+    clave = generador.generate_access_key('15/12/2025', '01', '123')
+    assert len(clave) == 49
+    assert clave == generador.generate_access_keys(['15/12/2025'], [123])[0]
+    assert parse_access_key(generador.generate_access_key('15/12/2025', '01', 1, '87654321'))['codigo_numerico'] == '87654321'
+
+    with pytest.raises(ValueError):
+        generador.generate_access_key('2025/12/15', '01', 1)
@@ -0,0 +1,203 @@
+"""
+Tests de descargas de XML y RIDE servidas desde disco
+"""
+import gzip
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import xml_storage as xml_storage_module
+from file_downloads import send_ride_file, send_xml_file
+from flask import Flask
+from xml_storage import XMLStorageManager
+
+XML = '<?xml version="1.0" encoding="UTF-8"?>\n<factura id="comprobante">' + '<detalle>x</detalle>' * 500 + '</factura>'
+PDF = b'%PDF-1.4\n' + bytes(range(256)) * 400
+
+
+def _app(storage):
+    app = Flask(__name__)
+
+    @app.route('/xml/<numero>')
+    def xml(numero):
+        return send_xml_file(storage, numero) or ('', 404)
+
+    @app.route('/ride/<numero>')
+    def ride(numero):
+        return send_ride_file(storage, numero) or ('', 404)
+
+    return app
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = XMLStorageManager(tmp_path, codec='gzip')
+    storage.save_xml('001-001-000000001', XML, 'PENDIENTE', date(2025, 12, 15))
+    storage.save_ride('001-001-000000001', PDF, date(2025, 12, 15))
+    return storage
+
+
+def _archivos(storage):
+    return sorted(p for p in storage.base_path.rglob('*') if p.is_file())
+
+
+def test_xml_plano_descomprimido_al_vuelo(storage):
+    antes = _archivos(storage)
+    client = _app(storage).test_client()
+    response = client.get('/xml/001-001-000000001', headers={'Accept-Encoding': 'identity'})
+
+    assert response.status_code == 200
+    assert response.data.decode('utf-8') == XML
+    assert response.headers['Content-Length'] == str(len(XML.encode('utf-8')))
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Content-Type'].startswith('application/xml')
+    assert 'attachment' in response.headers['Content-Disposition']
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert _archivos(storage) == antes
+
+
+def test_iter_blob_por_bloques(storage):
+    blob_path, codec = storage._find_blob(storage.calculate_checksum(XML))
+    bloques = list(storage.iter_blob(blob_path, codec, chunk_size=1024))
+
+    assert len(bloques) > 1
+    assert b''.join(bloques).decode('utf-8') == XML
+
+
+def test_xml_gzip_sirve_el_blob_sin_recomprimir(storage, monkeypatch):
+    monkeypatch.setattr(xml_storage_module, '_compress', lambda *a: pytest.fail('no debe recomprimir'))
+    client = _app(storage).test_client()
+
+    response = client.get('/xml/001-001-000000001', headers={'Accept-Encoding': 'gzip, deflate'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data).decode('utf-8') == XML
+    assert len(response.data) < len(XML)
+
+
+def test_xml_etag_por_codificacion(storage):
+    client = _app(storage).test_client()
+    plano = client.get('/xml/001-001-000000001')
+    comprimido = client.get('/xml/001-001-000000001', headers={'Accept-Encoding': 'gzip'})
+
+    assert plano.headers['ETag'] != comprimido.headers['ETag']
+    assert storage.calculate_checksum(XML) in plano.headers['ETag']
+
+    revalidado = client.get('/xml/001-001-000000001', headers={'If-None-Match': plano.headers['ETag']})
+    assert revalidado.status_code == 304
+
+
+def test_ride_con_range(storage):
+    client = _app(storage).test_client()
+
+    completo = client.get('/ride/001-001-000000001')
+    parcial = client.get('/ride/001-001-000000001', headers={'Range': 'bytes=100-199'})
+
+    assert completo.data == PDF
+    assert completo.headers['Accept-Ranges'] == 'bytes'
+    assert parcial.status_code == 206
+    assert parcial.data == PDF[100:200]
+    assert parcial.headers['Content-Range'] == f'bytes 100-199/{len(PDF)}'
+
+
+def test_sin_archivo_devuelve_none(storage):
+    client = _app(storage).test_client()
+
+    assert client.get('/xml/001-001-000000099').status_code == 404
+    assert client.get('/ride/001-001-000000099').status_code == 404
+
+
+def test_prefiere_autorizado_y_blob_zstd(tmp_path):
+    if xml_storage_module.zstandard is None:
+        pytest.skip('zstandard no instalado')
+
+    storage = XMLStorageManager(tmp_path, codec='zstd')
+    storage.save_xml('001-001-000000002', XML, 'PENDIENTE', date(2025, 12, 15))
+    autorizado = XML.replace('comprobante', 'autorizado')
+    storage.save_xml('001-001-000000002', autorizado, 'AUTORIZADO', date(2025, 12, 15))
+
+    stored = storage.get_xml_file('001-001-000000002', ['zstd', 'gzip'])
+    assert stored['encoding'] == 'zstd'
+    assert stored['checksum'] == storage.calculate_checksum(autorizado)
+    assert stored['path'].parent.parent == storage.objects_dir
+
+    client = _app(storage).test_client()
+    response = client.get('/xml/001-001-000000002', headers={'Accept-Encoding': 'zstd'})
+    assert response.headers['Content-Encoding'] == 'zstd'
+    assert xml_storage_module.zstandard.ZstdDecompressor().decompress(response.data).decode('utf-8') == autorizado
+
+    response = client.get('/xml/001-001-000000002', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.data.decode('utf-8') == autorizado
+    assert not list(tmp_path.rglob('*.gz'))
+
+
+def test_ride_autorizado_no_sirve_el_pendiente(storage):
+    clave = '1512202501019032977300110010010000000011234567811'
+
+    # Solo existe el RIDE renderizado antes de la autorizacion (sin clave indexada)
+    assert storage.get_ride_file('001-001-000000001') is not None
+    assert storage.get_ride_file('001-001-000000001', clave) is None
+
+    storage.save_ride('001-001-000000001', PDF + b'autorizado', date(2025, 12, 15), clave_acceso=clave)
+    with open(storage.get_ride_file('001-001-000000001', clave), 'rb') as f:
+        assert f.read() == PDF + b'autorizado'
+
+
+class _RendererStub:
+    def __init__(self):
+        self.enviados = []
+
+    def submit(self, invoice_number, xml, autorizacion=None, force=False):
+        self.enviados.append((invoice_number, autorizacion['numero_autorizacion']))
+
+    def render(self, *args, **kwargs):
+        pytest.fail('no debe renderizar en el hilo de la peticion')
+
+
+def test_ruta_ride_encola_sin_bloquear(storage, monkeypatch):
+    import electronic_invoice_routes as rutas
+    import jwt
+
+    from common import auth_middleware
+    from common.config import Config
+
+    clave = '1512202501019032977300110010010000000011234567811'
+    storage.save_xml('001-001-000000001', XML, 'AUTORIZADO', date(2025, 12, 15))
+    renderer = _RendererStub()
+    monkeypatch.setattr(rutas, 'xml_storage', storage)
+    monkeypatch.setattr(rutas, 'get_ride_renderer', lambda: renderer)
+    monkeypatch.setattr(rutas.ElectronicInvoiceModel, 'get_download_info', staticmethod(lambda invoice_id: {
+        'invoice_id': invoice_id, 'invoice_number': '001-001-000000001', 'clave_acceso': clave,
+        'estado_sri': 'AUTORIZADA', 'numero_autorizacion': clave,
+        'fecha_autorizacion': datetime(2025, 12, 15, 10), 'has_xml': True
+    }))
+
+    app = Flask(__name__)
+    app.register_blueprint(rutas.electronic_invoice_bp)
+    ahora = datetime.utcnow()
+    firma = Config.JWT_PRIVATE_KEY if auth_middleware.JWT_ALGORITHM == 'RS256' else Config.JWT_SECRET_KEY
+    token = jwt.encode({
+        'user_id': 1, 'role_id': 1, 'email': 'admin@test.local',
+        'iss': auth_middleware.JWT_ISSUER, 'aud': auth_middleware.JWT_AUDIENCE,
+        'iat': ahora, 'exp': ahora + timedelta(minutes=5)
+    }, firma, algorithm=auth_middleware.JWT_ALGORITHM)
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    # El PDF pendiente existe, pero la factura esta autorizada: se encola el RIDE autorizado
+    response = client.get('/electronic-invoices/7/ride', headers=headers)
+    assert response.status_code == 202
+    assert response.headers['Retry-After'] == str(rutas.RIDE_RETRY_AFTER)
+    assert renderer.enviados == [('001-001-000000001', clave)]
+
+    storage.save_ride('001-001-000000001', PDF + b'autorizado', date(2025, 12, 15), clave_acceso=clave)
+    response = client.get('/electronic-invoices/7/ride', headers=headers)
+    assert response.status_code == 200
+    assert response.data == PDF + b'autorizado'
+    assert len(renderer.enviados) == 1
@@ -0,0 +1,168 @@
+"""
+Tests de generacion del RIDE (PDF) y del pool de renderizado con cache
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ride_renderer
+from ride_renderer import RIDERenderer, parse_comprobante, render_ride_pages
+from sri_electronic_invoice import SRIElectronicInvoice
+from xml_storage import XMLStorageManager
+
+
+@pytest.fixture
+def generator():
+    return SRIElectronicInvoice(
+        ruc_emisor='0190329773001',
+        razon_social='CLINICA DE PRUEBAS S.A.',
+        nombre_comercial='Clinica Test',
+        direccion_matriz='Av. 10 de Agosto N37-185, Quito'
+    )
+
+
+def _invoice_data(secuencial=1, num_items=3):
+    item = {
+        'codigo': 'CONS001', 'descripcion': 'Consulta médica general con valoración dermatológica completa',
+        'cantidad': 1.0, 'precio_unitario': 50.0, 'descuento': 0.0, 'precio_total_sin_impuesto': 50.0,
+        'codigo_iva': '3', 'tarifa_iva': 15.0, 'valor_iva': 7.5
+    }
+    return {
+        'secuencial': str(secuencial),
+        'fecha_emision': '15/12/2025',
+        'cliente': {'tipo_doc': '05', 'nombre': 'Paciente Prueba', 'identificacion': '1712345678',
+                    'direccion': 'Quito'},
+        'items': [item] * num_items,
+        'totales': {
+            'subtotal_sin_impuestos': 50.0 * num_items, 'descuento_total': 0.0,
+            'subtotal_iva_15': 50.0 * num_items, 'iva_15': 7.5 * num_items,
+            'importe_total': 57.5 * num_items
+        },
+        'formas_pago': [{'codigo': '19', 'total': 57.5 * num_items}],
+        'info_adicional': [{'nombre': 'Email', 'valor': 'paciente@email.com'}]
+    }
+
+
+def test_parse_comprobante(generator):
+    xml = generator.generate_xml(_invoice_data(7))['xml']
+    data = parse_comprobante(xml)
+
+    assert data['emisor']['ruc'] == '0190329773001'
+    assert data['comprobante']['numero'] == '001-001-000000007'
+    assert data['comprobante']['ambiente'] == 'PRUEBAS'
+    assert len(data['detalles']) == 3
+    assert data['totales']['subtotal_15'] == 150.0
+    assert data['totales']['iva'] == 22.5
+    assert data['totales']['total'] == 172.5
+    assert data['pagos'] == [('19', 172.5)]
+    assert data['adicional'] == [('Email', 'paciente@email.com')]
+
+
+def test_render_pdf_paginado(generator):
+    corto, paginas_corto = render_ride_pages(generator.generate_xml(_invoice_data(1, 3))['xml'])
+    largo, paginas_largo = render_ride_pages(generator.generate_xml(_invoice_data(2, 150))['xml'])
+
+    assert corto.startswith(b'%PDF') and corto.rstrip().endswith(b'%%EOF')
+    assert paginas_corto == 1
+    assert largo.startswith(b'%PDF')
+    assert paginas_largo > 2
+
+
+def test_generate_ride_devuelve_pdf(generator):
+    pdf = generator.generate_ride(_invoice_data(), '1512202501019032977300110010010000000011234567811')
+    assert pdf.startswith(b'%PDF')
+
+
+def test_render_many_en_pool_y_cache(generator, tmp_path):
+    storage = XMLStorageManager(tmp_path, codec='gzip')
+    renderer = RIDERenderer(storage, processes=2)
+    jobs = [
+        {
+            'invoice_number': f"001-001-{i:09d}",
+            'xml': generator.generate_xml(_invoice_data(i))['xml'],
+            'autorizacion': {'numero_autorizacion': 'AUT', 'fecha_autorizacion': '15/12/2025 10:00:00'}
+        }
+        for i in range(1, 7)
+    ]
+    try:
+        lote = renderer.render_many(jobs)
+
+        assert lote['metricas']['renderizados'] == 6
+        assert lote['metricas']['errores'] == 0
+        assert lote['metricas']['paginas'] == 6
+        for job, resultado in zip(jobs, lote['resultados'], strict=False):
+            assert resultado['invoice_number'] == job['invoice_number']
+            assert os.path.join('ride', '2025', '12') in resultado['path']
+            assert storage.get_ride(job['invoice_number'], date=ride_renderer._fecha('15/12/2025')).startswith(b'%PDF')
+
+        # Segunda pasada: todo sale del cache por clave de acceso
+        repetido = renderer.render_many(jobs)
+        assert repetido['metricas']['en_cache'] == 6
+        assert [r['path'] for r in repetido['resultados']] == [r['path'] for r in lote['resultados']]
+    finally:
+        renderer.close()
+
+
+def test_cache_no_usa_el_pool(generator, tmp_path, monkeypatch):
+    storage = XMLStorageManager(tmp_path, codec='gzip')
+    xml = generator.generate_xml(_invoice_data())['xml']
+    clave = parse_comprobante(xml)['comprobante']['clave_acceso']
+    storage.save_ride('001-001-000000001', b'%PDF-1.4 cache', clave_acceso=clave)
+
+    renderer = RIDERenderer(storage, processes=1)
+    monkeypatch.setattr(renderer, '_get_pool', lambda: pytest.fail('no debe renderizar'))
+
+    path = renderer.render('001-001-000000001', xml)
+    with open(path, 'rb') as f:
+        assert f.read() == b'%PDF-1.4 cache'
+
+    # La clave se conserva al reconstruir el catalogo
+    storage.reconcile()
+    assert storage.get_ride_by_clave(clave) is not None
+
+
+def test_ride_pendiente_no_queda_en_cache(generator, tmp_path):
+    storage = XMLStorageManager(tmp_path, codec='gzip')
+    renderer = RIDERenderer(storage, processes=1)
+    xml = generator.generate_xml(_invoice_data())['xml']
+    autorizacion = {'numero_autorizacion': 'AUT-0001', 'fecha_autorizacion': '15/12/2025 10:00:00'}
+    try:
+        # Descarga antes de la autorizacion: se imprime PENDIENTE y no se indexa por clave
+        pendiente = renderer.submit('001-001-000000001', xml).result(timeout=30)
+        assert pendiente['cache'] is False
+        assert storage.get_ride_by_clave(pendiente['clave_acceso']) is None
+
+        # Al autorizar se vuelve a renderizar con el numero de autorizacion
+        autorizado = renderer.submit('001-001-000000001', xml, autorizacion).result(timeout=30)
+        assert autorizado['cache'] is False and autorizado['path'] == pendiente['path']
+
+        # Desde aqui el RIDE autorizado sale del cache, aunque se pida sin autorizacion
+        assert renderer.submit('001-001-000000001', xml, autorizacion).result(timeout=30)['cache'] is True
+        assert renderer.submit('001-001-000000001', xml).result(timeout=30)['cache'] is True
+    finally:
+        renderer.close()
+
+
+def test_peticiones_repetidas_comparten_el_render(generator, tmp_path, monkeypatch):
+    storage = XMLStorageManager(tmp_path, codec='gzip')
+    renderer = RIDERenderer(storage, processes=1)
+    xml = generator.generate_xml(_invoice_data())['xml']
+    autorizacion = {'numero_autorizacion': 'AUT-0001', 'fecha_autorizacion': '15/12/2025 10:00:00'}
+    renders = []
+    pool = renderer._get_pool()
+    monkeypatch.setattr(renderer, '_get_pool', lambda: renders.append(1) or pool)
+    try:
+        primero = renderer.submit('001-001-000000001', xml, autorizacion)
+        segundo = renderer.submit('001-001-000000001', xml, autorizacion)
+        assert segundo is primero
+        assert primero.result(timeout=30)['cache'] is False
+        assert len(renders) == 1
+
+        # Terminado el render, la siguiente peticion sale del cache
+        assert renderer.submit('001-001-000000001', xml, autorizacion).result(timeout=30)['cache'] is True
+        assert not renderer._rendering
+    finally:
+        renderer.close()
@@ -0,0 +1,186 @@
+"""
+Tests del modo contingencia: outbox persistente y drenado en lote contra un SRI local
+"""
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sri_outbox import SRIContingencyMonitor, SRIOutbox
+from sri_production import SRISOAPClient
+from sri_stub import SRIStubServer
+
+
+def _factura(secuencial):
+    clave = f"151220250109999999990011001001{secuencial:09d}1234567811"
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<factura id="comprobante" version="2.1.0"><infoTributaria>'
+        f'<claveAcceso>{clave}</claveAcceso>'
+        '</infoTributaria></factura>'
+    )
+    return clave, xml
+
+
+@pytest.fixture
+def sri():
+    with SRIStubServer(consultas_en_proceso=1) as server:
+        yield server
+
+
+@pytest.fixture
+def client(sri):
+    return SRISOAPClient(
+        ambiente="1",
+        url_recepcion=sri.url_recepcion,
+        url_autorizacion=sri.url_autorizacion,
+        max_workers=4
+    )
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    outbox = SRIOutbox(tmp_path / 'sri_outbox.db')
+    yield outbox
+    outbox.close()
+
+
+def _encolar(outbox, cantidad):
+    claves = []
+    for secuencial in range(1, cantidad + 1):
+        clave, xml = _factura(secuencial)
+        outbox.enqueue(clave, f"001-001-{secuencial:09d}", xml, invoice_id=secuencial, tipo_emision='1')
+        claves.append(clave)
+    return claves
+
+
+def test_encolar_es_idempotente_y_persistente(outbox, tmp_path):
+    clave, xml = _factura(1)
+
+    assert outbox.enqueue(clave, '001-001-000000001', xml) is True
+    assert outbox.enqueue(clave, '001-001-000000001', xml) is False
+
+    reabierto = SRIOutbox(tmp_path / 'sri_outbox.db')
+    fila = reabierto.get(clave)
+    assert fila['estado'] == 'PENDIENTE'
+    assert fila['ambiente'] == '1'
+    assert reabierto.backlog()['pendientes'] == 1
+
+
+def test_claim_no_entrega_dos_veces_la_misma_fila(outbox):
+    _encolar(outbox, 10)
+
+    primero = outbox.claim(limit=6)
+    segundo = outbox.claim(limit=6)
+
+    assert len(primero) == 6
+    assert len(segundo) == 4
+    assert not {f['clave_acceso'] for f in primero} & {f['clave_acceso'] for f in segundo}
+    assert outbox.claim(limit=6) == []
+
+
+def test_drenado_en_lote_autoriza_todo(sri, client, outbox):
+    claves = _encolar(outbox, 25)
+    progreso = []
+
+    lote = outbox.drain(lambda ambiente: client, batch_size=10, intervalo=0, progress_callback=progreso.append)
+
+    metricas = lote['metricas']
+    assert metricas['backlog_inicial'] == 25
+    assert metricas['lotes'] == 3
+    assert metricas['autorizados'] == 25
+    assert metricas['backlog_restante'] == 0
+    assert metricas['por_segundo'] > 0
+    assert len(progreso) == 3
+
+    assert sorted(f['clave_acceso'] for f in lote['finalizados']) == sorted(claves)
+    assert all(f['numero_autorizacion'] == f['clave_acceso'] for f in lote['finalizados'])
+    assert sorted(sri.claves_recibidas) == sorted(claves)
+
+    # Los resultados quedan por aplicar hasta que la base de datos los registra
+    assert len(outbox.unapplied()) == 25
+    outbox.mark_applied(claves)
+    assert outbox.unapplied() == []
+    assert outbox.last_drain()['autorizados'] == 25
+
+
+def test_caida_del_sri_detiene_el_drenado_sin_perder_facturas(sri, client, outbox):
+    claves = _encolar(outbox, 12)
+
+    with sri.simular_caida():
+        lote = outbox.drain(lambda ambiente: client, batch_size=5, intervalo=0)
+
+    assert lote['metricas']['sri_disponible'] is False
+    assert lote['metricas']['lotes'] == 1
+    assert lote['finalizados'] == []
+    assert outbox.backlog()['pendientes'] == 12
+    assert sri.llamadas_rechazadas == 5
+    assert outbox.get(claves[0])['intentos'] == 1
+
+    # Al recuperarse el SRI, el siguiente drenado vacia el backlog (lease liberado)
+    lote = outbox.drain(lambda ambiente: client, batch_size=5, intervalo=0)
+    assert lote['metricas']['autorizados'] == 12
+    assert outbox.backlog()['pendientes'] == 0
+
+
+def test_en_proceso_queda_recibida_y_reenvio_duplicado_no_se_pierde(client, outbox, sri):
+    sri.consultas_en_proceso = 5
+    sri.rechazar_duplicados = True
+    [clave] = _encolar(outbox, 1)
+
+    lote = outbox.drain(lambda ambiente: client, max_intentos=2, intervalo=0)
+    assert lote['metricas']['en_proceso'] == 1
+    assert outbox.get(clave)['estado'] == 'RECIBIDA'
+
+    # Con el lease vencido se consulta de nuevo sin reenviar el comprobante
+    with outbox._connection() as conn:
+        conn.execute("UPDATE outbox SET lease_until = 0")
+    sri.consultas_en_proceso = 0
+    lote = outbox.drain(lambda ambiente: client, intervalo=0)
+    assert lote['metricas']['autorizados'] == 1
+    assert sri.llamadas_recepcion == 1
+
+    # Un comprobante que el SRI ya tiene (respuesta perdida) pasa a consultar autorizacion
+    clave2, xml2 = _factura(2)
+    client.enviar_comprobante(xml2)
+    outbox.enqueue(clave2, '001-001-000000002', xml2)
+    outbox.drain(lambda ambiente: client, intervalo=0)
+    assert outbox.get(clave2)['estado'] == 'AUTORIZADO'
+
+
+def test_monitor_abre_tras_fallos_y_cierra_al_recuperarse(outbox):
+    monitor = SRIContingencyMonitor(outbox, failures=3, cooldown=0.2, slow_seconds=1)
+
+    monitor.record(False)
+    monitor.record(True, duration=5)  # lenta cuenta como fallo
+    assert monitor.is_active() is False
+    monitor.record(False)
+    assert monitor.is_active() is True
+
+    time.sleep(0.25)
+    assert monitor.is_active() is False  # medio abierto: se reintenta el SRI
+    monitor.record(False)
+    assert monitor.is_active() is True
+    monitor.record(True, duration=0.1)
+    assert monitor.is_active() is False
+    assert monitor.status()['fallos_consecutivos'] == 0
+
+
+def test_modo_forzado_compartido(outbox, tmp_path):
+    monitor = SRIContingencyMonitor(outbox)
+    otro_worker = SRIContingencyMonitor(SRIOutbox(tmp_path / 'sri_outbox.db'))
+
+    outbox.set_mode('on')
+    assert monitor.is_active() and otro_worker.is_active()
+
+    outbox.set_mode('off')
+    for _ in range(5):
+        otro_worker.record_failure()
+    assert otro_worker.is_active() is False
+
+    with pytest.raises(ValueError):
+        outbox.set_mode('quizas')
@@ -0,0 +1,148 @@
+"""
+Tests del cliente SOAP del SRI contra un SRI local
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import sri_production
+from sri_production import SRISOAPClient, extraer_clave_acceso, get_sri_client, reset_sri_clients
+from sri_stub import SRIStubServer
+
+
+def _xml_factura(secuencial):
+    clave = f"1512202501099999999900110010010{secuencial:09d}12345678"[:49]
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<factura id="comprobante" version="2.1.0"><infoTributaria>'
+        f'<claveAcceso>{clave}</claveAcceso>'
+        '</infoTributaria></factura>'
+    ), clave
+
+
+@pytest.fixture
+def sri():
+    """SRI local con una respuesta EN PROCESO por clave antes de autorizar"""
+    with SRIStubServer(consultas_en_proceso=1, latencia=0.02) as server:
+        yield server
+
+
+@pytest.fixture
+def client(sri):
+    return SRISOAPClient(
+        ambiente="1",
+        url_recepcion=sri.url_recepcion,
+        url_autorizacion=sri.url_autorizacion,
+        max_workers=4
+    )
+
+
+def test_extraer_clave_acceso():
+    xml, clave = _xml_factura(7)
+    assert extraer_clave_acceso(xml) == clave
+    assert extraer_clave_acceso('no es xml') is None
+
+
+def test_enviar_comprobantes_lote(sri, client):
+    """Todas las facturas se reciben, en orden, sobre conexiones reutilizadas"""
+    facturas = [_xml_factura(i) for i in range(1, 21)]
+    progreso = []
+
+    lote = client.enviar_comprobantes_lote(
+        [xml for xml, _ in facturas], progress_callback=progreso.append
+    )
+
+    assert [r['estado'] for r in lote['resultados']] == ['RECIBIDA'] * 20
+    assert sorted(sri.claves_recibidas) == sorted(clave for _, clave in facturas)
+    assert lote['metricas']['procesados'] == 20
+    assert lote['metricas']['por_estado'] == {'RECIBIDA': 20}
+    assert len(progreso) == 20
+
+    # Concurrencia real pero acotada, y keep-alive (no una conexion por factura)
+    assert 1 < sri.concurrencia_maxima <= 4
+    assert sri.conexiones <= 4 + 1  # workers + descarga del WSDL
+
+
+def test_consultar_autorizaciones_lote_reintenta_en_proceso(sri, client):
+    claves = [_xml_factura(i)[1] for i in range(1, 11)]
+
+    lote = client.consultar_autorizaciones_lote(claves, intervalo=0)
+
+    assert [r['clave_acceso'] for r in lote['resultados']] == claves
+    assert all(r['estado'] == 'AUTORIZADO' for r in lote['resultados'])
+    assert all(r['intentos'] == 2 for r in lote['resultados'])
+    assert lote['metricas']['llamadas_soap'] == 20
+    assert lote['metricas']['por_estado'] == {'AUTORIZADO': 10}
+
+
+def test_consultar_autorizaciones_lote_agota_intentos(sri, client):
+    sri.consultas_en_proceso = 10
+    claves = [_xml_factura(i)[1] for i in range(1, 4)]
+
+    lote = client.consultar_autorizaciones_lote(claves, max_intentos=3, intervalo=0)
+
+    assert all(r['estado'] == 'EN PROCESO' for r in lote['resultados'])
+    assert lote['metricas']['procesados'] == 3
+    assert sri.llamadas_autorizacion == 9
+
+
+def test_procesar_lote(sri, client):
+    facturas = [_xml_factura(i) for i in range(1, 6)]
+    xmls = [xml for xml, _ in facturas] + ['<factura/>']
+
+    lote = client.procesar_lote(xmls, intervalo=0)
+
+    assert lote['recepcion']['metricas']['por_estado'] == {'RECIBIDA': 5, 'DEVUELTA': 1}
+    autorizados = lote['autorizacion']['resultados']
+    assert [r['clave_acceso'] for r in autorizados] == [clave for _, clave in facturas]
+    assert all(r['estado'] == 'AUTORIZADO' for r in autorizados)
+
+
+def test_wsdl_local_sin_descargas(sri, client):
+    """Con las copias empaquetadas del WSDL no se descarga nada del SRI"""
+    xml, clave = _xml_factura(1)
+
+    assert client.enviar_comprobante(xml)['estado'] == 'RECIBIDA'
+    assert client.consultar_autorizacion(clave)['estado'] == 'EN PROCESO'
+    assert sri.wsdl_descargas == 0
+
+
+def test_wsdl_remoto_usa_cache_en_disco(sri, tmp_path, monkeypatch):
+    monkeypatch.setattr(sri_production, 'WSDL_CACHE_PATH', str(tmp_path / 'sri_wsdl.db'))
+    monkeypatch.setattr(sri_production, '_wsdl_cache', None)
+
+    for _ in range(2):
+        remoto = SRISOAPClient(
+            ambiente="1",
+            url_recepcion=sri.url_recepcion,
+            url_autorizacion=sri.url_autorizacion,
+            use_local_wsdl=False
+        )
+        assert remoto.warm_up()
+
+    # Segundo cliente (p.ej. otro proceso) sale del cache en disco
+    assert sri.wsdl_descargas == 2
+    assert (tmp_path / 'sri_wsdl.db').exists()
+
+
+def test_registro_reutiliza_clientes(sri):
+    reset_sri_clients()
+    try:
+        primero = get_sri_client("1", sri.url_recepcion, sri.url_autorizacion)
+        segundo = get_sri_client("1", sri.url_recepcion, sri.url_autorizacion)
+        assert primero is segundo
+        assert get_sri_client("2") is not primero
+
+        for i in range(1, 6):
+            xml, _ = _xml_factura(i)
+            assert get_sri_client("1", sri.url_recepcion, sri.url_autorizacion).enviar_comprobante(xml)['estado'] == 'RECIBIDA'
+
+        # Un solo cliente zeep y una sola conexion keep-alive para todas las facturas
+        assert primero._recepcion_client is not None
+        assert sri.conexiones == 1
+    finally:
+        reset_sri_clients()
@@ -0,0 +1,92 @@
+"""
+Tests de generacion del XML de factura electronica SRI
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from lxml import etree
+from sri_electronic_invoice import SRIElectronicInvoice
+from sri_production import get_xml_signer, reset_xml_signers
+from test_xml_signing import _verificar, crear_p12
+
+
+@pytest.fixture
+def generator():
+    return SRIElectronicInvoice(
+        ruc_emisor='0190329773001',
+        razon_social='CLINICA DE PRUEBAS S.A.',
+        nombre_comercial='Clinica Test',
+        direccion_matriz='Av. 10 de Agosto N37-185, Quito'
+    )
+
+
+def _invoice_data(num_items=2):
+    item = {
+        'codigo': 'CONS001', 'descripcion': 'Consulta médica general', 'cantidad': 1.0,
+        'precio_unitario': 50.0, 'descuento': 0.0, 'precio_total_sin_impuesto': 50.0,
+        'codigo_iva': '3', 'tarifa_iva': 15.0, 'valor_iva': 7.5
+    }
+    return {
+        'secuencial': '25',
+        'fecha_emision': '15/12/2025',
+        'cliente': {'tipo_doc': '05', 'nombre': 'Paciente Prueba', 'identificacion': '1712345678',
+                    'email': 'paciente@email.com'},
+        'items': [item] * num_items,
+        'totales': {
+            'subtotal_sin_impuestos': 50.0 * num_items, 'descuento_total': 0.0,
+            'subtotal_iva_15': 50.0 * num_items, 'iva_15': 7.5 * num_items,
+            'importe_total': 57.5 * num_items
+        },
+        'formas_pago': [{'codigo': '01', 'total': 57.5 * num_items}],
+        'info_adicional': [{'nombre': 'Email', 'valor': 'paciente@email.com'}]
+    }
+
+
+def test_generate_xml_estructura(generator):
+    result = generator.generate_xml(_invoice_data(3))
+    root = etree.fromstring(result['xml'].encode('utf-8'))
+
+    assert result['xml'].startswith('<?xml version="1.0" encoding="UTF-8"?>')
+    assert root.get('id') == 'comprobante'
+    assert root.findtext('infoTributaria/claveAcceso') == result['clave_acceso']
+    assert root.findtext('infoTributaria/secuencial') == '000000025'
+    assert len(root.findall('detalles/detalle')) == 3
+    assert root.findtext('detalles/detalle/descripcion') == 'Consulta médica general'
+    assert root.find('infoAdicional/campoAdicional').get('nombre') == 'Email'
+
+
+def test_pretty_print_opcional(generator):
+    data = _invoice_data()
+    indentado = generator.generate_xml(data)['xml']
+    compacto = generator.generate_xml(data, pretty_print=False)['xml']
+
+    assert '\n  <infoTributaria>' in indentado
+    assert compacto.count('\n') == 1
+    assert etree.tostring(etree.fromstring(compacto.encode())) == \
+        etree.tostring(etree.fromstring(indentado.encode(), etree.XMLParser(remove_blank_text=True)))
+
+
+def test_firma_del_arbol_sin_reparsear(generator, tmp_path):
+    path = str(tmp_path / 'firma.p12')
+    cert = crear_p12(path, 'clave123', 'CLINICA PRUEBAS')
+    try:
+        tree, clave = generator.generate_xml_tree(_invoice_data())
+        signed = generator.sign_xml(tree, path, 'clave123')
+
+        verified = _verificar(signed, cert)
+        assert verified.findtext('infoTributaria/claveAcceso') == clave
+        assert signed == get_xml_signer(path, 'clave123').sign_xml(generator.generate_xml_tree(_invoice_data())[0])
+    finally:
+        reset_xml_signers()
+
+
+def test_sin_certificado_serializa_el_arbol(generator, tmp_path):
+    tree, _ = generator.generate_xml_tree(_invoice_data())
+    unsigned = generator.sign_xml(tree, str(tmp_path / 'no_existe.p12'), 'x')
+
+    assert unsigned == generator.serialize_xml(tree)
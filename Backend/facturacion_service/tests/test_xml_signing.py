@@ -0,0 +1,133 @@
+"""
+Tests de firma XMLDSig con certificado en memoria
+"""
+import os
+import sys
+from datetime import UTC, datetime, timedelta, timezone
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sri_production
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import BestAvailableEncryption, Encoding, pkcs12
+from cryptography.x509.oid import NameOID
+from signxml import XMLVerifier
+from sri_production import get_xml_signer, reset_xml_signers
+
+
+def crear_p12(path, password, common_name):
+    """Certificado autofirmado PKCS#12 para pruebas"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.now(UTC)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=365))
+        .sign(key, hashes.SHA256())
+    )
+    data = pkcs12.serialize_key_and_certificates(
+        b'firma', key, cert, None, BestAvailableEncryption(password.encode())
+    )
+    with open(path, 'wb') as f:
+        f.write(data)
+    return cert
+
+
+def _factura(n):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<factura id="comprobante" version="2.1.0"><infoTributaria><secuencial>{n:09d}</secuencial>'
+        '</infoTributaria></factura>'
+    )
+
+
+def _verificar(signed_xml, cert):
+    return XMLVerifier().verify(signed_xml.encode('utf-8'), x509_cert=cert.public_bytes(Encoding.PEM)).signed_xml
+
+
+@pytest.fixture
+def certificado(tmp_path):
+    path = tmp_path / 'firma.p12'
+    cert = crear_p12(path, 'clave123', 'CLINICA PRUEBAS')
+    yield str(path), cert
+    reset_xml_signers()
+
+
+def test_firma_verificable(certificado):
+    path, cert = certificado
+    signed = get_xml_signer(path, 'clave123').sign_xml(_factura(1))
+
+    assert 'ds:Signature' in signed
+    assert _verificar(signed, cert).find('.//secuencial').text == '000000001'
+
+
+def test_registro_carga_el_p12_una_vez(certificado, monkeypatch):
+    path, _ = certificado
+    cargas = []
+    original = sri_production.pkcs12.load_key_and_certificates
+    monkeypatch.setattr(
+        sri_production.pkcs12, 'load_key_and_certificates',
+        lambda *args, **kwargs: cargas.append(1) or original(*args, **kwargs)
+    )
+
+    signers = {id(get_xml_signer(path, 'clave123')) for _ in range(5)}
+    for i in range(5):
+        get_xml_signer(path, 'clave123').sign_xml(_factura(i))
+
+    assert len(signers) == 1
+    assert len(cargas) == 1
+
+
+def test_rotacion_de_certificado(certificado, monkeypatch):
+    path, cert_anterior = certificado
+    monkeypatch.setattr(sri_production, 'CERT_CHECK_INTERVAL', 0)
+
+    signer = get_xml_signer(path, 'clave123')
+    assert signer.certificate.serial_number == cert_anterior.serial_number
+
+    # Reemplazo atomico del archivo, como lo haria un despliegue
+    nuevo = path + '.nuevo'
+    cert_nuevo = crear_p12(nuevo, 'clave123', 'CLINICA PRUEBAS 2026')
+    os.replace(nuevo, path)
+
+    assert get_xml_signer(path, 'clave123') is signer
+    assert signer.certificate.serial_number == cert_nuevo.serial_number
+    _verificar(signer.sign_xml(_factura(1)), cert_nuevo)
+
+
+def test_rotacion_fallida_conserva_certificado(certificado, monkeypatch):
+    path, cert = certificado
+    monkeypatch.setattr(sri_production, 'CERT_CHECK_INTERVAL', 0)
+    signer = get_xml_signer(path, 'clave123')
+
+    with open(path, 'wb') as f:
+        f.write(b'archivo a medio copiar')
+
+    assert signer.reload_if_changed() is False
+    assert signer.certificate.serial_number == cert.serial_number
+
+
+def test_sign_many_con_pool_de_procesos(certificado):
+    path, cert = certificado
+    signer = get_xml_signer(path, 'clave123')
+    facturas = [_factura(i) for i in range(1, 41)]
+
+    firmadas = signer.sign_many(facturas, processes=2)
+
+    assert len(firmadas) == 40
+    for i, signed in enumerate(firmadas, start=1):
+        assert _verificar(signed, cert).find('.//secuencial').text == f'{i:09d}'
+
+
+def test_sin_certificado_devuelve_xml_sin_firmar(tmp_path):
+    signer = get_xml_signer(str(tmp_path / 'no_existe.p12'), 'x')
+    assert signer.sign_many([_factura(1)]) == [_factura(1)]
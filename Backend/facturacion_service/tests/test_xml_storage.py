@@ -0,0 +1,203 @@
+"""
+Tests del almacenamiento de XML direccionado por contenido
+"""
+import json
+import os
+import sys
+import time
+from datetime import date
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import xml_storage as xml_storage_module
+from xml_storage import XMLStorageManager, atomic_write
+
+FECHA = date(2025, 12, 15)
+
+
+def _xml(secuencial):
+    detalles = ''.join(
+        f'<detalle><codigoPrincipal>MED{i:03d}</codigoPrincipal><cantidad>1.00</cantidad></detalle>'
+        for i in range(20)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<factura id="comprobante" version="2.1.0"><infoTributaria><secuencial>{secuencial}</secuencial>'
+        f'</infoTributaria><detalles>{detalles}</detalles></factura>'
+    )
+
+
+@pytest.fixture(params=['gzip', 'zstd'])
+def storage(request, tmp_path):
+    if request.param == 'zstd' and xml_storage_module.zstandard is None:
+        pytest.skip('zstandard no instalado')
+    return XMLStorageManager(tmp_path, codec=request.param)
+
+
+def _blobs(storage):
+    return [p for p in storage.objects_dir.rglob('*') if p.is_file()]
+
+
+def test_ciclo_completo_comparte_un_blob(storage):
+    xml = _xml('000000001')
+
+    pendiente = storage.save_xml('001-001-000000001', xml, 'PENDIENTE', FECHA)
+    storage.backup_xml('001-001-000000001', xml)
+    autorizado = storage.save_xml('001-001-000000001', xml, 'AUTORIZADO', FECHA)
+
+    assert pendiente.endswith(os.path.join('2025', '12', 'facturas', '001-001-000000001.ref'))
+    assert autorizado.endswith(os.path.join('autorizados', '001-001-000000001_AUTORIZADO.ref'))
+    assert len(_blobs(storage)) == 1
+    assert _blobs(storage)[0].stat().st_size < len(xml.encode('utf-8'))
+
+    assert storage.get_xml('001-001-000000001', 'PENDIENTE', FECHA) == xml
+    assert storage.get_xml('001-001-000000001', 'AUTORIZADO', FECHA) == xml
+    assert storage.get_xml('001-001-000000002', 'PENDIENTE', FECHA) is None
+
+
+def test_entrada_indice_con_checksum(storage):
+    xml = _xml('000000007')
+    path = storage.save_xml('001-001-000000007', xml, 'NO_AUTORIZADO', FECHA)
+
+    with open(path, encoding='utf-8') as f:
+        entry = json.load(f)
+
+    assert entry['checksum'] == storage.calculate_checksum(xml)
+    assert entry['codec'] == storage.codec
+    assert entry['size'] == len(xml.encode('utf-8'))
+    assert entry['estado'] == 'NO_AUTORIZADO'
+    assert 'rechazados' in path
+
+
+def test_verify_xml_usa_el_indice(storage, monkeypatch):
+    xml = _xml('000000003')
+    storage.save_xml('001-001-000000003', xml, date=FECHA)
+    monkeypatch.setattr(storage, 'read_blob', lambda checksum: pytest.fail('no debe descomprimir'))
+
+    assert storage.verify_xml('001-001-000000003', xml, FECHA)
+    assert not storage.verify_xml('001-001-000000003', xml + ' ', FECHA)
+
+
+def test_blob_de_otro_codec_se_reutiliza(tmp_path):
+    xml = _xml('000000004')
+    XMLStorageManager(tmp_path, codec='gzip').save_xml('001-001-000000004', xml, date=FECHA)
+
+    storage = XMLStorageManager(tmp_path, codec='zstd' if xml_storage_module.zstandard else 'gzip')
+    storage.save_xml('001-001-000000004', xml, 'AUTORIZADO', FECHA)
+
+    assert len(_blobs(storage)) == 1
+    assert storage.get_xml('001-001-000000004', 'AUTORIZADO', FECHA) == xml
+
+
+def test_escritura_atomica_no_deja_temporales(tmp_path, monkeypatch):
+    destino = tmp_path / 'a' / 'b.ref'
+    atomic_write(destino, b'original')
+
+    def fallo(*args):
+        raise OSError('disco lleno')
+
+    monkeypatch.setattr(xml_storage_module.os, 'replace', fallo)
+    with pytest.raises(OSError):
+        atomic_write(destino, b'nuevo')
+
+    assert destino.read_bytes() == b'original'
+    assert [p.name for p in destino.parent.iterdir()] == ['b.ref']
+
+
+def test_migracion_de_archivos_planos(tmp_path):
+    storage = XMLStorageManager(tmp_path, codec='gzip')
+    xml = _xml('000000005')
+    month = storage.xml_dir / '2025' / '12'
+    (month / 'facturas').mkdir(parents=True)
+    (month / 'autorizados').mkdir()
+    (month / 'facturas' / '001-001-000000005.xml').write_text(xml, encoding='utf-8')
+    (month / 'autorizados' / '001-001-000000005_AUTORIZADO.xml').write_text(xml, encoding='utf-8')
+    (storage.backup_dir / '001-001-000000005_20251215_103000.xml').write_text(xml, encoding='utf-8')
+
+    # Los archivos planos se siguen leyendo antes de migrar
+    assert storage.get_xml('001-001-000000005', 'AUTORIZADO', FECHA) == xml
+
+    stats = storage.migrate_legacy()
+
+    assert stats['migrated'] == 3
+    assert stats['bytes_after'] < stats['bytes_before'] / 3
+    assert not list(tmp_path.rglob('*.xml'))
+    assert len(_blobs(storage)) == 1
+    assert storage.get_xml_entry('001-001-000000005', 'AUTORIZADO', FECHA)['invoice_number'] == '001-001-000000005'
+    assert storage.get_xml('001-001-000000005', 'PENDIENTE', FECHA) == xml
+
+    totales = storage.get_storage_stats()
+    assert totales['total_xmls'] == 2
+    assert totales['total_backups'] == 1
+    assert totales['total_blobs'] == 1
+    assert len(storage.list_xmls(2025, 12, 'AUTORIZADO')) == 1
+
+
+def test_catalogo_responde_sin_recorrer_el_arbol(tmp_path, monkeypatch):
+    storage = XMLStorageManager(tmp_path, codec='gzip')
+    storage.save_xml('001-001-000000001', _xml('1'), 'PENDIENTE', FECHA)
+    storage.save_xml('001-001-000000001', _xml('1'), 'AUTORIZADO', FECHA)
+    storage.save_xml('001-001-000000002', _xml('2'), 'ERROR', date(2025, 11, 3))
+    storage.backup_xml('001-001-000000001', _xml('1'))
+    storage.save_ride('001-001-000000001', b'%PDF-1.4 prueba', FECHA)
+
+    monkeypatch.setattr(xml_storage_module.Path, 'rglob', lambda *a: pytest.fail('rglob'))
+    monkeypatch.setattr(xml_storage_module.Path, 'glob', lambda *a: pytest.fail('glob'))
+
+    assert len(storage.list_xmls()) == 3
+    assert storage.list_xmls(2025, 12, 'AUTORIZADO') == [
+        str(tmp_path / 'xml' / '2025' / '12' / 'autorizados' / '001-001-000000001_AUTORIZADO.ref')
+    ]
+    assert len(storage.list_xmls(2025, 11)) == 1
+    assert storage.list_xmls(2025, 11, 'PENDIENTE') == []
+
+    stats = storage.get_storage_stats()
+    assert (stats['total_xmls'], stats['total_backups'], stats['total_rides'], stats['total_blobs']) == (3, 1, 1, 2)
+    assert stats['logical_size_mb'] >= stats['blob_size_mb']
+
+    filas = storage.catalog.find('001-001-000000001')
+    assert {fila['kind'] for fila in filas} == {'xml', 'backup', 'ride'}
+    assert all(fila['checksum'] == storage.calculate_checksum(_xml('1')) for fila in filas if fila['kind'] != 'ride')
+
+
+def test_reconcile_reconstruye_el_indice(tmp_path):
+    storage = XMLStorageManager(tmp_path, codec='gzip')
+    storage.save_xml('001-001-000000001', _xml('1'), 'PENDIENTE', FECHA)
+    storage.save_xml('001-001-000000002', _xml('2'), 'AUTORIZADO', FECHA)
+
+    # Cambios hechos a mano, fuera del storage
+    os.remove(storage.list_xmls(2025, 12, 'AUTORIZADO')[0])
+    legado = storage.xml_dir / '2025' / '12' / 'facturas' / '001-001-000000009.xml'
+    legado.write_text(_xml('9'), encoding='utf-8')
+
+    assert storage.reconcile() == {'entries': 2, 'blobs': 2, 'added': 1, 'removed': 1}
+    assert sorted(os.path.basename(p) for p in storage.list_xmls()) == ['001-001-000000001.ref', '001-001-000000009.xml']
+    assert storage.get_storage_stats()['reconciled_at'] is not None
+
+    # Un catalogo nuevo sobre un archivo existente se construye solo
+    storage.catalog.close()
+    os.remove(tmp_path / 'catalog.db')
+    assert len(XMLStorageManager(tmp_path, codec='gzip').list_xmls(2025, 12)) == 2
+
+
+def test_consultas_en_milisegundos(tmp_path):
+    storage = XMLStorageManager(tmp_path, codec='gzip')
+    storage.catalog.upsert_entries([
+        {
+            'path': f"xml/2025/{m:02d}/autorizados/001-001-{i:09d}_AUTORIZADO.ref", 'kind': 'xml',
+            'invoice_number': f"001-001-{i:09d}", 'estado': 'AUTORIZADO', 'status_dir': 'autorizados',
+            'year': 2025, 'month': m, 'size': 6000, 'file_size': 200, 'checksum': f"{i:064x}", 'codec': 'gzip'
+        }
+        for m in range(1, 13) for i in range(m * 10000, m * 10000 + 2000)
+    ])
+
+    start = time.perf_counter()
+    mes = storage.list_xmls(2025, 6, 'AUTORIZADO')
+    stats = storage.get_storage_stats()
+    elapsed = time.perf_counter() - start
+
+    assert len(mes) == 2000
+    assert stats['total_xmls'] == 24000
+    assert elapsed < 0.5
@@ -0,0 +1,210 @@
+"""
+Metadata catalog for the XML storage
+SQLite index of every stored entry (XML, backup, RIDE) and blob, maintained on each save
+"""
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    invoice_number TEXT NOT NULL,
+    estado TEXT,
+    status_dir TEXT,
+    year INTEGER,
+    month INTEGER,
+    size INTEGER NOT NULL DEFAULT 0,
+    file_size INTEGER NOT NULL DEFAULT 0,
+    checksum TEXT,
+    codec TEXT,
+    saved_at TEXT,
+    clave_acceso TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_entries_period ON entries (kind, year, month, status_dir);
+CREATE INDEX IF NOT EXISTS ix_entries_invoice ON entries (invoice_number);
+CREATE INDEX IF NOT EXISTS ix_entries_checksum ON entries (checksum);
+
+CREATE TABLE IF NOT EXISTS blobs (
+    checksum TEXT PRIMARY KEY,
+    codec TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS catalog_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+ENTRY_COLUMNS = (
+    'path', 'kind', 'invoice_number', 'estado', 'status_dir', 'year', 'month',
+    'size', 'file_size', 'checksum', 'codec', 'saved_at', 'clave_acceso'
+)
+
+
+class XMLCatalog:
+    """
+    Persistent index of the XML storage
+
+    Paths are stored relative to the storage base so the archive can be moved.
+    One connection per thread; WAL mode lets several workers read while one writes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._local = threading.local()
+        self.created = not os.path.exists(self.db_path)
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(entries)")}
+            if 'clave_acceso' not in columns:
+                conn.execute("ALTER TABLE entries ADD COLUMN clave_acceso TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_clave ON entries (clave_acceso)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    def upsert_entry(self, **entry):
+        """Insert or replace one entry (keyword arguments from ENTRY_COLUMNS)"""
+        self.upsert_entries([entry])
+
+    def upsert_entries(self, entries):
+        values = [tuple(entry.get(column) for column in ENTRY_COLUMNS) for entry in entries]
+        placeholders = ', '.join('?' for _ in ENTRY_COLUMNS)
+        with self._connection() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO entries ({', '.join(ENTRY_COLUMNS)}) VALUES ({placeholders})",
+                values
+            )
+
+    def add_blob(self, checksum, codec, size, stored_size):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO blobs (checksum, codec, size, stored_size) VALUES (?, ?, ?, ?)",
+                (checksum, codec, size, stored_size)
+            )
+
+    def remove_entry(self, path):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM entries WHERE path = ?", (path,))
+
+    def replace_all(self, entries, blobs):
+        """
+        Replace the whole catalog in one transaction (used by reconcile)
+
+        Args:
+            entries: Iterable of entry dictionaries
+            blobs: Iterable of (checksum, codec, size, stored_size)
+        """
+        placeholders = ', '.join('?' for _ in ENTRY_COLUMNS)
+        with self._connection() as conn:
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM blobs")
+            conn.executemany(
+                f"INSERT OR REPLACE INTO entries ({', '.join(ENTRY_COLUMNS)}) VALUES ({placeholders})",
+                (tuple(entry.get(column) for column in ENTRY_COLUMNS) for entry in entries)
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO blobs (checksum, codec, size, stored_size) VALUES (?, ?, ?, ?)",
+                blobs
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO catalog_meta (key, value) VALUES ('reconciled_at', ?)",
+                (datetime.now().isoformat(timespec='seconds'),)
+            )
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def list_paths(self, kind='xml', year=None, month=None, status_dir=None):
+        query = "SELECT path FROM entries WHERE kind = ?"
+        params = [kind]
+        if year is not None:
+            query += " AND year = ?"
+            params.append(int(year))
+        if month is not None:
+            query += " AND month = ?"
+            params.append(int(month))
+        if status_dir is not None:
+            query += " AND status_dir = ?"
+            params.append(status_dir)
+        query += " ORDER BY path"
+
+        return [row['path'] for row in self._connection().execute(query, params)]
+
+    def find(self, invoice_number):
+        """All catalog rows for an invoice (every status, backups and RIDE)"""
+        rows = self._connection().execute(
+            "SELECT * FROM entries WHERE invoice_number = ? ORDER BY kind, path", (invoice_number,)
+        )
+        return [dict(row) for row in rows]
+
+    def find_by_clave(self, clave_acceso, kind='ride'):
+        """Rows of a given kind stored for an access key, newest first"""
+        rows = self._connection().execute(
+            "SELECT * FROM entries WHERE clave_acceso = ? AND kind = ? ORDER BY saved_at DESC",
+            (clave_acceso, kind)
+        )
+        return [dict(row) for row in rows]
+
+    def claves_by_path(self, kind='ride'):
+        """Access keys known for stored paths (not recoverable from file names)"""
+        rows = self._connection().execute(
+            "SELECT path, clave_acceso FROM entries WHERE kind = ? AND clave_acceso IS NOT NULL", (kind,)
+        )
+        return {row['path']: row['clave_acceso'] for row in rows}
+
+    def stats(self):
+        conn = self._connection()
+        counts = {
+            row['kind']: row
+            for row in conn.execute(
+                "SELECT kind, COUNT(*) AS total, SUM(size) AS size, SUM(file_size) AS file_size "
+                "FROM entries GROUP BY kind"
+            )
+        }
+        blobs = conn.execute(
+            "SELECT COUNT(*) AS total, COALESCE(SUM(stored_size), 0) AS stored_size FROM blobs"
+        ).fetchone()
+        reconciled = conn.execute(
+            "SELECT value FROM catalog_meta WHERE key = 'reconciled_at'"
+        ).fetchone()
+
+        def count(kind, field='total'):
+            row = counts.get(kind)
+            return (row[field] or 0) if row else 0
+
+        return {
+            'total_xmls': count('xml'),
+            'total_rides': count('ride'),
+            'total_backups': count('backup'),
+            'total_blobs': blobs['total'],
+            'file_size': sum(count(kind, 'file_size') for kind in counts),
+            'logical_size': count('xml', 'size') + count('backup', 'size'),
+            'blob_size': blobs['stored_size'],
+            'reconciled_at': reconciled['value'] if reconciled else None
+        }
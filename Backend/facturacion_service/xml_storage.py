@@ -4,41 +4,144 @@ Handles storage, retrieval, and organization of XML files
 """
 import os
 import sys
+import gzip
+import json
+import tempfile
 from datetime import datetime
 from pathlib import Path
 import hashlib
 
+try:
+    import zstandard
+except ImportError:  # gzip fallback
+    zstandard = None
+
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from xml_catalog import XMLCatalog
+
+
+# Compression codec for new blobs: zstd when available, gzip otherwise
+XML_STORAGE_CODEC = os.getenv('XML_STORAGE_CODEC', 'zstd' if zstandard else 'gzip')
+XML_STORAGE_LEVEL = int(os.getenv('XML_STORAGE_LEVEL', 9))
+
+CODEC_EXTENSIONS = {'zstd': '.xml.zst', 'gzip': '.xml.gz'}
+ENTRY_SUFFIX = '.ref'
+
+# Metadata index (default: <storage>/catalog.db)
+XML_CATALOG_PATH = os.getenv('XML_CATALOG_PATH')
+
+# Bytes read per chunk when a blob is decompressed into a download
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Status folder preferred when an invoice has several stored versions
+STATUS_PRIORITY = ('autorizados', 'facturas', 'rechazados')
+
+AUTHORIZED_STATES = ('AUTORIZADO', 'AUTORIZADA')
+REJECTED_STATES = ('RECHAZADO', 'NO_AUTORIZADO', 'NO_AUTORIZADA', 'ERROR')
+
+
+def _compress(data, codec, level=XML_STORAGE_LEVEL):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstandard no está instalado (XML_STORAGE_CODEC=zstd)")
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if codec == 'gzip':
+        # mtime=0 keeps the output deterministic for identical content
+        return gzip.compress(data, compresslevel=min(level, 9), mtime=0)
+    raise ValueError(f"Codec de almacenamiento no soportado: {codec}")
+
+
+def _decompress(data, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstandard no está instalado; no se puede leer un blob .zst")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    raise ValueError(f"Codec de almacenamiento no soportado: {codec}")
+
+
+def _fsync_directory(directory):
+    """Persist a rename in its directory (not supported on Windows)"""
+    if os.name == 'nt':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data):
+    """
+    Write bytes to path atomically: temp file in the same directory, fsync, rename
+
+    Readers see either the previous file or the complete new one, never a partial write.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    _fsync_directory(path.parent)
+
 
 class XMLStorageManager:
     """
     Manages storage of XML files for electronic invoices
 
+    XML content is stored once, compressed and addressed by its SHA-256 checksum.
+    Status folders hold small index entries (.ref, JSON) pointing to the blob, so a
+    PENDIENTE, AUTORIZADO and backup copy of the same XML share a single blob.
+
     Directory structure:
     storage/
+    ├── objects/
+    │   ├── 3f/
+    │   │   ├── 3fa1...c9.xml.zst
     ├── xml/
     │   ├── 2024/
     │   │   ├── 12/
     │   │   │   ├── facturas/
-    │   │   │   │   ├── 001-001-000000001.xml
-    │   │   │   │   ├── 001-001-000000002.xml
+    │   │   │   │   ├── 001-001-000000001.ref
+    │   │   │   │   ├── 001-001-000000002.ref
     │   │   │   ├── autorizados/
-    │   │   │   │   ├── 001-001-000000001_AUTORIZADO.xml
+    │   │   │   │   ├── 001-001-000000001_AUTORIZADO.ref
     │   │   │   ├── rechazados/
-    │   │   │       ├── 001-001-000000003_ERROR.xml
-    │   ├── ride/
-    │   │   ├── 2024/
-    │   │   │   ├── 12/
-    │   │   │   │   ├── 001-001-000000001.pdf
+    │   │   │       ├── 001-001-000000003_ERROR.ref
+    ├── backup/
+    │   ├── 001-001-000000001_20241215_103000.ref
+    ├── ride/
+    │   ├── 2024/
+    │   │   ├── 12/
+    │   │   │   ├── 001-001-000000001.pdf
+
+    Plain .xml files written by earlier versions are still readable and can be
+    converted with migrate_legacy().
+
+    Every write is also recorded in an SQLite catalog (XMLCatalog), so listings and
+    statistics never walk the tree. reconcile() rebuilds the catalog from disk.
     """
 
-    def __init__(self, base_path=None):
+    def __init__(self, base_path=None, codec=None, catalog_path=None):
         """
         Initialize XML Storage Manager
 
         Args:
             base_path: Base directory for storage (default: backend/storage)
+            codec: Compression for new blobs, 'zstd' or 'gzip' (default: XML_STORAGE_CODEC)
+            catalog_path: SQLite metadata index (default: XML_CATALOG_PATH or <base_path>/catalog.db)
         """
         if base_path is None:
             # Default to backend/storage
@@ -46,19 +149,30 @@ class XMLStorageManager:
             base_path = os.path.join(backend_dir, 'storage')
 
         self.base_path = Path(base_path)
+        self.codec = codec or XML_STORAGE_CODEC
+        if self.codec not in CODEC_EXTENSIONS:
+            raise ValueError(f"Codec de almacenamiento no soportado: {self.codec}")
+
         self._ensure_directories()
 
+        self.catalog = XMLCatalog(catalog_path or XML_CATALOG_PATH or self.base_path / 'catalog.db')
+        if self.catalog.created:
+            # First run against an existing archive: index what is already on disk
+            self.reconcile()
+
     def _ensure_directories(self):
         """Create necessary directory structure"""
         # Main directories
         self.xml_dir = self.base_path / 'xml'
         self.ride_dir = self.base_path / 'ride'
         self.backup_dir = self.base_path / 'backup'
+        self.objects_dir = self.base_path / 'objects'
 
         # Create if they don't exist
         self.xml_dir.mkdir(parents=True, exist_ok=True)
         self.ride_dir.mkdir(parents=True, exist_ok=True)
         self.backup_dir.mkdir(parents=True, exist_ok=True)
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
 
     def _get_date_path(self, base_dir, date=None):
         """
@@ -82,48 +196,286 @@ class XMLStorageManager:
 
         return path
 
-    def save_xml(self, invoice_number, xml_content, estado='PENDIENTE', date=None):
+    def _status_location(self, invoice_number, estado):
+        """
+        Status subdirectory and file stem for an invoice
+
+        Returns:
+            Tuple (subdirectory name, file stem without extension)
         """
-        Save XML file organized by date and status
+        if estado in AUTHORIZED_STATES:
+            return 'autorizados', f"{invoice_number}_AUTORIZADO"
+        if estado in REJECTED_STATES:
+            return 'rechazados', f"{invoice_number}_{estado}"
+        return 'facturas', invoice_number
+
+    def _entry_path(self, invoice_number, estado, date=None):
+        subdir, stem = self._status_location(invoice_number, estado)
+        return self._get_date_path(self.xml_dir, date) / subdir / f"{stem}{ENTRY_SUFFIX}"
+
+    # ------------------------------------------------------------------
+    # Content-addressed blobs
+    # ------------------------------------------------------------------
+
+    def _blob_path(self, checksum, codec):
+        return self.objects_dir / checksum[:2] / f"{checksum}{CODEC_EXTENSIONS[codec]}"
+
+    def _find_blob(self, checksum):
+        """Existing blob for a checksum in any codec, as (path, codec) or (None, None)"""
+        for codec in CODEC_EXTENSIONS:
+            path = self._blob_path(checksum, codec)
+            if path.exists():
+                return path, codec
+        return None, None
+
+    def put_blob(self, xml_content):
+        """
+        Store XML content once, compressed and addressed by its SHA-256
 
         Args:
-            invoice_number: Invoice number (e.g., "001-001-000000001")
             xml_content: XML content as string
-            estado: Status (PENDIENTE, AUTORIZADO, RECHAZADO)
-            date: Date for organization (default: today)
 
         Returns:
-            Full path to saved file
+            Dictionary with checksum, codec, size (uncompressed bytes) and stored_size
         """
-        # Get date-based directory
-        date_path = self._get_date_path(self.xml_dir, date)
+        data = xml_content.encode('utf-8')
+        checksum = self.calculate_checksum(xml_content)
+
+        path, codec = self._find_blob(checksum)
+        if path is None:
+            codec = self.codec
+            path = self._blob_path(checksum, codec)
+            atomic_write(path, _compress(data, codec))
+
+        blob = {
+            'checksum': checksum,
+            'codec': codec,
+            'size': len(data),
+            'stored_size': path.stat().st_size
+        }
+        self.catalog.add_blob(**blob)
 
-        # Create status subdirectory
-        if estado == 'AUTORIZADO' or estado == 'AUTORIZADA':
-            status_dir = date_path / 'autorizados'
-        elif estado in ['RECHAZADO', 'NO_AUTORIZADO', 'NO_AUTORIZADA', 'ERROR']:
-            status_dir = date_path / 'rechazados'
-        else:
-            status_dir = date_path / 'facturas'
+        return blob
 
-        status_dir.mkdir(exist_ok=True)
+    def _read_blob_bytes(self, checksum):
+        path, codec = self._find_blob(checksum)
+        if path is None:
+            return None
 
-        # Filename
-        if estado == 'AUTORIZADO' or estado == 'AUTORIZADA':
-            filename = f"{invoice_number}_AUTORIZADO.xml"
-        elif estado in ['RECHAZADO', 'NO_AUTORIZADO', 'NO_AUTORIZADA', 'ERROR']:
-            filename = f"{invoice_number}_{estado}.xml"
-        else:
-            filename = f"{invoice_number}.xml"
+        with open(path, 'rb') as f:
+            return _decompress(f.read(), codec)
+
+    def read_blob(self, checksum):
+        """
+        Read XML content by checksum
+
+        Returns:
+            XML content as string or None if the blob does not exist
+        """
+        data = self._read_blob_bytes(checksum)
+        return data.decode('utf-8') if data is not None else None
+
+    def iter_blob(self, path, codec, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """
+        Plain XML bytes of a stored blob, decompressed chunk by chunk as they are sent
+
+        Nothing is written to disk and the whole document is never held in memory.
+        """
+        with open(path, 'rb') as f:
+            if codec == 'zstd':
+                if zstandard is None:
+                    raise RuntimeError("zstandard no está instalado; no se puede leer un blob .zst")
+                yield from zstandard.ZstdDecompressor().read_to_iter(f, read_size=chunk_size, write_size=chunk_size)
+                return
+            if codec != 'gzip':
+                raise ValueError(f"Codec de almacenamiento no soportado: {codec}")
+            with gzip.GzipFile(fileobj=f) as stream:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+
+    def find_xml(self, invoice_number):
+        """
+        Catalog row of the most relevant stored XML for an invoice
+
+        Authorized beats pending beats rejected; newest first within a status.
+        """
+        rows = [row for row in self.catalog.find(invoice_number) if row['kind'] == 'xml']
+        if not rows:
+            return None
+
+        rows.sort(key=lambda row: row['saved_at'] or '', reverse=True)
+        rows.sort(key=lambda row: STATUS_PRIORITY.index(row['status_dir'])
+                  if row['status_dir'] in STATUS_PRIORITY else len(STATUS_PRIORITY))
+        return rows[0]
+
+    def get_xml_file(self, invoice_number, encodings=()):
+        """
+        File on disk to serve an invoice XML as-is (sendfile), without loading it
+
+        Args:
+            invoice_number: Invoice number
+            encodings: Content encodings accepted by the client ('zstd', 'gzip')
+
+        Returns:
+            Dictionary with path, encoding (None = plain XML), checksum, estado and
+            size, or None if no XML is stored for the invoice. If the client does not
+            accept the blob's codec, path is None and stream iterates the decompressed
+            XML (see iter_blob).
+        """
+        row = self.find_xml(invoice_number)
+        if row is None:
+            return None
+
+        if row['codec'] is None:
+            # Legacy plain file: serve it directly
+            path = self.base_path / row['path']
+            return {'path': path, 'encoding': None, 'checksum': row['checksum'], 'estado': row['estado'],
+                    'size': path.stat().st_size} if path.exists() else None
+
+        checksum = row['checksum']
+        blob_path, codec = self._find_blob(checksum)
+        if blob_path is None:
+            return None
+
+        stored = {'path': blob_path, 'encoding': codec, 'checksum': checksum, 'estado': row['estado'],
+                  'size': blob_path.stat().st_size}
+        if codec not in encodings:
+            # Decompressed on the fly into the response
+            stored.update(path=None, encoding=None, size=row['size'], stream=self.iter_blob(blob_path, codec))
+        return stored
+
+    def get_ride_file(self, invoice_number, clave_acceso=None):
+        """
+        Path of the stored RIDE PDF for an invoice (any date), or None
+
+        Args:
+            invoice_number: Invoice number
+            clave_acceso: Access key of an authorized invoice; only the authorized
+                RIDE (indexed by this key) is returned, never a PENDIENTE one
+
+        Returns:
+            Path object; the PDF is not read
+        """
+        if clave_acceso:
+            return self.get_ride_by_clave(clave_acceso)
+
+        for row in self.catalog.find(invoice_number):
+            if row['kind'] == 'ride':
+                path = self.base_path / row['path']
+                if path.exists():
+                    return path
+        return None
 
-        filepath = status_dir / filename
+    # ------------------------------------------------------------------
+    # Index entries
+    # ------------------------------------------------------------------
 
-        # Save XML
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(xml_content)
+    def _write_entry(self, path, invoice_number, estado, blob):
+        entry = {
+            'invoice_number': invoice_number,
+            'estado': estado,
+            'saved_at': datetime.now().isoformat(timespec='seconds'),
+            **blob
+        }
+        data = json.dumps(entry, ensure_ascii=False).encode('utf-8')
+        atomic_write(path, data)
+
+        self.catalog.upsert_entry(**self._catalog_row(path, entry, len(data)))
+        return entry
+
+    def _catalog_row(self, path, entry, file_size):
+        """
+        Catalog row for a stored file; kind, period and status folder come from its location
+
+        storage/xml/<year>/<month>/<status>/..., storage/backup/..., storage/ride/<year>/<month>/...
+        """
+        relative = Path(path).relative_to(self.base_path)
+        parts = relative.parts
+        row = {
+            'path': relative.as_posix(),
+            'kind': parts[0] if parts[0] in ('backup', 'ride') else 'xml',
+            'invoice_number': entry['invoice_number'],
+            'estado': entry.get('estado'),
+            'size': entry.get('size', file_size),
+            'file_size': file_size,
+            'checksum': entry.get('checksum'),
+            'codec': entry.get('codec'),
+            'saved_at': entry.get('saved_at'),
+            'clave_acceso': entry.get('clave_acceso')
+        }
+        if parts[0] in ('xml', 'ride') and len(parts) > 3:
+            row['year'], row['month'] = int(parts[1]), int(parts[2])
+        if parts[0] == 'xml' and len(parts) > 4:
+            row['status_dir'] = parts[3]
+
+        return row
+
+    def _legacy_entry(self, path):
+        """Invoice number and status of a plain .xml file from its name and folder"""
+        stem = path.stem
+        if path.parent == self.backup_dir:
+            return stem.rsplit('_', 2)[0], 'BACKUP'
+        if path.parent.name == 'autorizados':
+            return stem.rsplit('_', 1)[0], 'AUTORIZADO'
+        if path.parent.name == 'rechazados':
+            invoice_number, estado = stem.split('_', 1)
+            return invoice_number, estado
+        return stem, 'PENDIENTE'
+
+    def _read_entry(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def read_stored_file(self, path):
+        """Content of an index entry or of a legacy plain .xml file"""
+        path = Path(path)
+        if path.suffix == ENTRY_SUFFIX:
+            entry = self._read_entry(path)
+            return self.read_blob(entry['checksum']) if entry else None
+
+        if path.exists():
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read()
+
+        return None
+
+    def save_xml(self, invoice_number, xml_content, estado='PENDIENTE', date=None):
+        """
+        Save XML organized by date and status
+
+        The content is stored as a compressed blob (shared with identical copies)
+        and an index entry is written in the status folder.
+
+        Args:
+            invoice_number: Invoice number (e.g., "001-001-000000001")
+            xml_content: XML content as string
+            estado: Status (PENDIENTE, AUTORIZADO, RECHAZADO)
+            date: Date for organization (default: today)
+
+        Returns:
+            Full path to the index entry
+        """
+        blob = self.put_blob(xml_content)
+        filepath = self._entry_path(invoice_number, estado, date)
+        self._write_entry(filepath, invoice_number, estado, blob)
 
         return str(filepath)
 
+    def get_xml_entry(self, invoice_number, estado='PENDIENTE', date=None):
+        """
+        Index entry of a stored XML (checksum, codec, sizes) without reading the blob
+
+        Returns:
+            Dictionary or None if not found
+        """
+        return self._read_entry(self._entry_path(invoice_number, estado, date))
+
     def get_xml(self, invoice_number, estado='PENDIENTE', date=None):
         """
         Retrieve XML file
@@ -136,28 +488,14 @@ class XMLStorageManager:
         Returns:
             XML content as string or None if not found
         """
-        date_path = self._get_date_path(self.xml_dir, date)
-
-        # Determine subdirectory
-        if estado == 'AUTORIZADO' or estado == 'AUTORIZADA':
-            status_dir = date_path / 'autorizados'
-            filename = f"{invoice_number}_AUTORIZADO.xml"
-        elif estado in ['RECHAZADO', 'NO_AUTORIZADO', 'NO_AUTORIZADA', 'ERROR']:
-            status_dir = date_path / 'rechazados'
-            filename = f"{invoice_number}_{estado}.xml"
-        else:
-            status_dir = date_path / 'facturas'
-            filename = f"{invoice_number}.xml"
-
-        filepath = status_dir / filename
+        entry_path = self._entry_path(invoice_number, estado, date)
+        if entry_path.exists():
+            return self.read_stored_file(entry_path)
 
-        if filepath.exists():
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return f.read()
-
-        return None
+        # Plain file written before the content-addressed store
+        return self.read_stored_file(entry_path.with_suffix('.xml'))
 
-    def save_ride(self, invoice_number, pdf_content, date=None):
+    def save_ride(self, invoice_number, pdf_content, date=None, clave_acceso=None):
         """
         Save RIDE PDF file
 
@@ -165,6 +503,7 @@ class XMLStorageManager:
             invoice_number: Invoice number
             pdf_content: PDF content as bytes
             date: Date for organization (default: today)
+            clave_acceso: Access key, indexed so the RIDE works as a render cache
 
         Returns:
             Full path to saved file
@@ -174,11 +513,30 @@ class XMLStorageManager:
         filepath = date_path / filename
 
         # Save PDF
-        with open(filepath, 'wb') as f:
-            f.write(pdf_content)
+        atomic_write(filepath, pdf_content)
+
+        self.catalog.upsert_entry(**self._catalog_row(
+            filepath,
+            {
+                'invoice_number': invoice_number,
+                'clave_acceso': clave_acceso,
+                'saved_at': datetime.now().isoformat(timespec='seconds')
+            },
+            len(pdf_content)
+        ))
 
         return str(filepath)
 
+    def get_ride_by_clave(self, clave_acceso):
+        """
+        Path of the stored RIDE PDF for an access key (cache lookup), or None
+        """
+        for row in self.catalog.find_by_clave(clave_acceso):
+            path = self.base_path / row['path']
+            if path.exists():
+                return path
+        return None
+
     def get_ride(self, invoice_number, date=None):
         """
         Retrieve RIDE PDF file
@@ -204,25 +562,26 @@ class XMLStorageManager:
         """
         Create backup of XML with timestamp
 
+        The backup is an index entry; identical content reuses the existing blob.
+
         Args:
             invoice_number: Invoice number
             xml_content: XML content
 
         Returns:
-            Path to backup file
+            Path to backup entry
         """
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{invoice_number}_{timestamp}.xml"
-        filepath = self.backup_dir / filename
+        filepath = self.backup_dir / f"{invoice_number}_{timestamp}{ENTRY_SUFFIX}"
 
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(xml_content)
+        blob = self.put_blob(xml_content)
+        self._write_entry(filepath, invoice_number, 'BACKUP', blob)
 
         return str(filepath)
 
     def list_xmls(self, year=None, month=None, estado=None):
         """
-        List XML files with optional filters
+        List XML entries with optional filters
 
         Args:
             year: Filter by year
@@ -230,33 +589,17 @@ class XMLStorageManager:
             estado: Filter by status
 
         Returns:
-            List of file paths
+            List of file paths (index entries and legacy .xml files), from the catalog
         """
-        files = []
-
         if year and month:
-            # Specific year/month
-            date_path = self.xml_dir / str(year) / f"{month:02d}"
-            if date_path.exists():
-                if estado:
-                    if estado == 'AUTORIZADO':
-                        search_dir = date_path / 'autorizados'
-                    elif estado in ['RECHAZADO', 'ERROR']:
-                        search_dir = date_path / 'rechazados'
-                    else:
-                        search_dir = date_path / 'facturas'
-
-                    if search_dir.exists():
-                        files = list(search_dir.glob('*.xml'))
-                else:
-                    # All statuses
-                    for subdir in ['facturas', 'autorizados', 'rechazados']:
-                        subdir_path = date_path / subdir
-                        if subdir_path.exists():
-                            files.extend(list(subdir_path.glob('*.xml')))
+            # Specific year/month, optionally one status folder
+            status_dir = self._status_location('', estado)[0] if estado else None
+            paths = self.catalog.list_paths('xml', year, month, status_dir)
         else:
             # All files
-            files = list(self.xml_dir.rglob('*.xml'))
+            paths = self.catalog.list_paths('xml')
+
+        files = [self.base_path / path for path in paths]
 
         return [str(f) for f in files]
 
@@ -284,39 +627,131 @@ class XMLStorageManager:
         Returns:
             Boolean indicating if checksums match
         """
+        provided_checksum = self.calculate_checksum(xml_content)
+
+        # The index entry already carries the checksum: no decompression needed
+        entry = self.get_xml_entry(invoice_number, date=date)
+        if entry is not None:
+            return entry['checksum'] == provided_checksum
+
         stored_xml = self.get_xml(invoice_number, date=date)
 
         if stored_xml is None:
             return False
 
-        stored_checksum = self.calculate_checksum(stored_xml)
-        provided_checksum = self.calculate_checksum(xml_content)
+        return self.calculate_checksum(stored_xml) == provided_checksum
+
+    def migrate_legacy(self):
+        """
+        Convert plain .xml files (xml/ and backup/) into blobs + index entries
+
+        Each file is replaced by its entry only after the blob is durably written.
+
+        Returns:
+            Dictionary with migrated file count and bytes before/after
+        """
+        stats = {'migrated': 0, 'bytes_before': 0, 'bytes_after': 0}
+        new_blobs = set()
 
-        return stored_checksum == provided_checksum
+        for directory in (self.xml_dir, self.backup_dir):
+            for path in sorted(directory.rglob('*.xml')):
+                with open(path, 'r', encoding='utf-8') as f:
+                    xml_content = f.read()
+
+                invoice_number, estado = self._legacy_entry(path)
+
+                existed = self._find_blob(self.calculate_checksum(xml_content))[0] is not None
+                blob = self.put_blob(xml_content)
+                self._write_entry(path.with_suffix(ENTRY_SUFFIX), invoice_number, estado, blob)
+
+                stats['bytes_before'] += path.stat().st_size
+                if not existed and blob['checksum'] not in new_blobs:
+                    new_blobs.add(blob['checksum'])
+                    stats['bytes_after'] += blob['stored_size']
+
+                path.unlink()
+                self.catalog.remove_entry(path.relative_to(self.base_path).as_posix())
+                stats['migrated'] += 1
+
+        return stats
+
+    def reconcile(self):
+        """
+        Rebuild the catalog from what is on disk (full scan)
+
+        Use after restoring a backup, copying files by hand or on a catalog
+        that is suspected to be out of sync.
+
+        Returns:
+            Dictionary with entries and blobs indexed, and paths added/removed
+        """
+        previous = set(self.catalog.list_paths('xml')) | set(self.catalog.list_paths('backup')) \
+            | set(self.catalog.list_paths('ride'))
+        ride_claves = self.catalog.claves_by_path('ride')
+
+        rows = []
+        for directory, patterns in (
+            (self.xml_dir, (f"*{ENTRY_SUFFIX}", '*.xml')),
+            (self.backup_dir, (f"*{ENTRY_SUFFIX}", '*.xml')),
+            (self.ride_dir, ('*.pdf',))
+        ):
+            for pattern in patterns:
+                for path in directory.rglob(pattern):
+                    file_size = path.stat().st_size
+                    if path.suffix == ENTRY_SUFFIX:
+                        entry = self._read_entry(path)
+                    elif path.suffix == '.pdf':
+                        entry = {
+                            'invoice_number': path.stem,
+                            'clave_acceso': ride_claves.get(path.relative_to(self.base_path).as_posix())
+                        }
+                    else:
+                        invoice_number, estado = self._legacy_entry(path)
+                        entry = {'invoice_number': invoice_number, 'estado': estado}
+
+                    if entry:
+                        rows.append(self._catalog_row(path, entry, file_size))
+
+        # Uncompressed size is only known from the entries pointing to each blob
+        sizes = {row['checksum']: row['size'] for row in rows if row['checksum']}
+        blobs = []
+        for codec, extension in CODEC_EXTENSIONS.items():
+            for path in self.objects_dir.rglob(f"*{extension}"):
+                checksum = path.name[:-len(extension)]
+                blobs.append((checksum, codec, sizes.get(checksum, 0), path.stat().st_size))
+
+        self.catalog.replace_all(rows, blobs)
+
+        current = {row['path'] for row in rows}
+        return {
+            'entries': len(rows),
+            'blobs': len(blobs),
+            'added': len(current - previous),
+            'removed': len(previous - current)
+        }
 
     def get_storage_stats(self):
         """
-        Get storage statistics
+        Get storage statistics from the catalog (no filesystem scan)
 
         Returns:
             Dictionary with statistics
         """
+        catalog = self.catalog.stats()
+
         stats = {
-            'total_xmls': len(list(self.xml_dir.rglob('*.xml'))),
-            'total_rides': len(list(self.ride_dir.rglob('*.pdf'))),
-            'total_backups': len(list(self.backup_dir.glob('*.xml'))),
-            'size_mb': 0
+            'total_xmls': catalog['total_xmls'],
+            'total_rides': catalog['total_rides'],
+            'total_backups': catalog['total_backups'],
+            'total_blobs': catalog['total_blobs'],
+            # Entries, RIDEs and blobs actually on disk
+            'size_mb': round((catalog['file_size'] + catalog['blob_size']) / (1024 * 1024), 2),
+            # Uncompressed size the entries represent (what plain files would occupy)
+            'logical_size_mb': round(catalog['logical_size'] / (1024 * 1024), 2),
+            'blob_size_mb': round(catalog['blob_size'] / (1024 * 1024), 2),
+            'reconciled_at': catalog['reconciled_at']
         }
 
-        # Calculate total size
-        total_size = 0
-        for directory in [self.xml_dir, self.ride_dir, self.backup_dir]:
-            for file in directory.rglob('*'):
-                if file.is_file():
-                    total_size += file.stat().st_size
-
-        stats['size_mb'] = round(total_size / (1024 * 1024), 2)
-
         return stats
 
 
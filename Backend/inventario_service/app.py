@@ -5,6 +5,8 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import threading
+import time
 from flask import Flask
 from flask_cors import CORS
 from dotenv import load_dotenv
@@ -13,6 +15,8 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from routes import inventario_bp
+from models import StockReservationModel, StockMovementModel
+from stock_ledger import STOCK_SNAPSHOT_INTERVAL
 
 # Create Flask app
 app = Flask(__name__)
@@ -23,6 +27,47 @@ CORS(app, origins=os.getenv('CORS_ORIGINS', '*').split(','))
 # Register blueprints
 app.register_blueprint(inventario_bp, url_prefix='/api/inventario')
 
+
+def release_expired_reservations_periodically(interval):
+    """Give back the stock of reservations nobody committed or released in time"""
+    while True:
+        time.sleep(interval)
+        try:
+            released = StockReservationModel.release_expired()
+            if released:
+                print(f"Expired stock reservations released: {released}")
+        except Exception as e:
+            print(f"Stock reservation sweep error: {str(e)}")
+
+
+# Expired reservation sweep (0 disables it)
+STOCK_RESERVATION_SWEEP_INTERVAL = int(os.getenv('STOCK_RESERVATION_SWEEP_INTERVAL', 60))
+if STOCK_RESERVATION_SWEEP_INTERVAL > 0:
+    threading.Thread(
+        target=release_expired_reservations_periodically, args=(STOCK_RESERVATION_SWEEP_INTERVAL,),
+        name='stock-reservations', daemon=True
+    ).start()
+
+
+def snapshot_stock_periodically(interval):
+    """Keep stock-at-date queries short: a snapshot of the products that moved"""
+    while True:
+        time.sleep(interval)
+        try:
+            # Every worker runs this loop; the database skips snapshots taken less than interval ago
+            products = StockMovementModel.take_snapshot(min_age_seconds=interval * 0.9)
+            if products:
+                print(f"Stock snapshot taken: {products} products")
+        except Exception as e:
+            print(f"Stock snapshot error: {str(e)}")
+
+
+if STOCK_SNAPSHOT_INTERVAL > 0:
+    threading.Thread(
+        target=snapshot_stock_periodically, args=(STOCK_SNAPSHOT_INTERVAL,),
+        name='stock-snapshots', daemon=True
+    ).start()
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
@@ -3,9 +3,17 @@ Models for Inventario Service
 """
 import sys
 import os
+from collections import defaultdict
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from psycopg2.extras import execute_values
+
 from common.database import db
+from stock_reservations import (
+    RESERVED, COMMITTED, EXPIRED, RESERVATION_TTL_MINUTES,
+    InsufficientStockError, plan_demand, lock_order, allocate
+)
+from stock_ledger import AJUSTE, CONSUMO
 
 
 class ProductModel:
@@ -17,7 +25,7 @@ class ProductModel:
         with db.get_cursor() as cursor:
             cursor.execute("""
                 SELECT product_id, sku, name, description, cost_price, sale_price,
-                       stock_quantity, min_stock_alert, is_active
+                       stock_quantity, reserved_quantity, min_stock_alert, is_active
                 FROM products
                 WHERE product_id = %s
             """, (product_id,))
@@ -124,9 +132,11 @@ class ProductModel:
             return cursor.fetchone()
 
     @staticmethod
-    def update_stock(product_id, quantity_change):
-        """Update product stock quantity"""
+    def update_stock(product_id, quantity_change, movement_type=AJUSTE, reference=None, notes=None,
+                     created_by=None):
+        """Update product stock quantity (recorded in the stock ledger)"""
         with db.get_cursor(commit=True) as cursor:
+            StockMovementModel.set_context(cursor, movement_type, reference, notes, created_by)
             cursor.execute("""
                 UPDATE products
                 SET stock_quantity = stock_quantity + %s
@@ -137,7 +147,7 @@ class ProductModel:
 
     @staticmethod
     def get_low_stock_products():
-        """Get products with low stock"""
+        """Get products with low stock (the WHERE matches the idx_products_low_stock partial index)"""
         with db.get_cursor() as cursor:
             cursor.execute("""
                 SELECT product_id, sku, name, stock_quantity, min_stock_alert
@@ -303,27 +313,69 @@ class TreatmentRecipeModel:
 
     @staticmethod
     def calculate_treatment_cost(treatment_id):
-        """Calculate the total cost of ingredients for a treatment"""
+        """Total cost of ingredients for a treatment (precomputed in treatment_availability)"""
         with db.get_cursor() as cursor:
             cursor.execute("""
-                SELECT SUM(tr.quantity_needed * p.cost_price) as total_cost
-                FROM treatment_recipes tr
-                JOIN products p ON tr.product_id = p.product_id
-                WHERE tr.treatment_id = %s
+                SELECT total_cost
+                FROM treatment_availability
+                WHERE treatment_id = %s
             """, (treatment_id,))
             result = cursor.fetchone()
             return float(result['total_cost']) if result and result['total_cost'] else 0.0
 
+    @staticmethod
+    def get_availability(treatment_ids=None, quantity=1, category=None, only_available=False):
+        """
+        Cost and availability of many treatments in one read of treatment_availability
+
+        Args:
+            treatment_ids: Treatment IDs (default: every active treatment)
+            quantity: Times each treatment should be performed
+            category: Treatment category filter
+            only_available: Return only treatments whose recipe fits quantity times
+
+        Returns:
+            Rows with cost, max_producible (None = no recipe, no limit) and is_available
+        """
+        query = """
+            SELECT t.treatment_id, t.name, t.category, t.base_price,
+                   ta.ingredient_count, ta.total_cost, ta.max_producible, ta.limiting_product_id,
+                   (ta.max_producible IS NULL OR ta.max_producible >= %s) as is_available
+            FROM treatment_availability ta
+            JOIN treatments t ON t.treatment_id = ta.treatment_id
+            WHERE t.is_active = TRUE
+        """
+        params = [quantity]
+
+        if treatment_ids:
+            query += " AND ta.treatment_id = ANY(%s)"
+            params.append(list(treatment_ids))
+
+        if category:
+            query += " AND t.category = %s"
+            params.append(category)
+
+        if only_available:
+            query += " AND (ta.max_producible IS NULL OR ta.max_producible >= %s)"
+            params.append(quantity)
+
+        query += " ORDER BY t.name"
+
+        with db.get_cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
     @staticmethod
     def check_stock_availability(treatment_id, quantity=1):
-        """Check if there's enough stock for the treatment"""
+        """Check if there's enough unreserved stock for the treatment"""
         with db.get_cursor() as cursor:
             cursor.execute("""
                 SELECT tr.product_id, p.name as product_name,
                        tr.quantity_needed, p.stock_quantity,
+                       (p.stock_quantity - p.reserved_quantity) as available_quantity,
                        (tr.quantity_needed * %s) as required_quantity,
                        CASE
-                           WHEN p.stock_quantity >= (tr.quantity_needed * %s) THEN TRUE
+                           WHEN p.stock_quantity - p.reserved_quantity >= (tr.quantity_needed * %s) THEN TRUE
                            ELSE FALSE
                        END as is_available
                 FROM treatment_recipes tr
@@ -331,3 +383,494 @@ class TreatmentRecipeModel:
                 WHERE tr.treatment_id = %s
             """, (quantity, quantity, treatment_id))
             return cursor.fetchall()
+
+
+class StockReservationModel:
+    """
+    Stock reservations (reserve a recipe under row locks, then commit or release)
+
+    Every transaction takes the advisory locks of its references first, then locks
+    stock_reservations rows and then products rows with SELECT ... FOR UPDATE ordered
+    by id, so concurrent reservations never deadlock.
+    """
+
+    @staticmethod
+    def _load_recipes(cursor, treatment_ids):
+        """{treatment_id: [(product_id, quantity_needed), ...]}"""
+        recipes = defaultdict(list)
+        if not treatment_ids:
+            return recipes
+
+        cursor.execute("""
+            SELECT treatment_id, product_id, quantity_needed
+            FROM treatment_recipes
+            WHERE treatment_id = ANY(%s)
+        """, (sorted(treatment_ids),))
+        for row in cursor.fetchall():
+            recipes[row['treatment_id']].append((row['product_id'], row['quantity_needed']))
+        return recipes
+
+    @staticmethod
+    def _lock_products(cursor, product_ids):
+        """Lock product rows in product_id order; returns {product_id: row}"""
+        if not product_ids:
+            return {}
+
+        cursor.execute("""
+            SELECT product_id, name, stock_quantity, reserved_quantity, is_active
+            FROM products
+            WHERE product_id = ANY(%s)
+            ORDER BY product_id
+            FOR UPDATE
+        """, (sorted(product_ids),))
+        return {row['product_id']: row for row in cursor.fetchall()}
+
+    @staticmethod
+    def _apply(cursor, totals, assignment):
+        """One UPDATE ... FROM (VALUES ...) for every product touched"""
+        execute_values(cursor, f"""
+            UPDATE products AS p
+            SET {assignment}
+            FROM (VALUES %s) AS v(product_id, quantity)
+            WHERE p.product_id = v.product_id
+        """, sorted(totals.items()))
+
+    @staticmethod
+    def _get_items(cursor, reservation_ids):
+        """{reservation_id: [{'product_id', 'quantity'}, ...]}"""
+        items = defaultdict(list)
+        if reservation_ids:
+            cursor.execute("""
+                SELECT reservation_id, product_id, quantity
+                FROM stock_reservation_items
+                WHERE reservation_id = ANY(%s)
+                ORDER BY reservation_id, product_id
+            """, (list(reservation_ids),))
+            for row in cursor.fetchall():
+                items[row['reservation_id']].append({'product_id': row['product_id'], 'quantity': row['quantity']})
+        return items
+
+    @staticmethod
+    def _finish(cursor, reservation_ids, status):
+        """Commit, release or expire reservations already locked by the caller"""
+        if not reservation_ids:
+            return {}
+
+        cursor.execute("""
+            SELECT product_id, SUM(quantity) as quantity
+            FROM stock_reservation_items
+            WHERE reservation_id = ANY(%s)
+            GROUP BY product_id
+        """, (list(reservation_ids),))
+        totals = {row['product_id']: int(row['quantity']) for row in cursor.fetchall()}
+
+        if totals:
+            StockReservationModel._lock_products(cursor, totals.keys())
+            if status == COMMITTED:
+                StockMovementModel.set_context(cursor, CONSUMO)
+                assignment = ("stock_quantity = p.stock_quantity - v.quantity, "
+                              "reserved_quantity = p.reserved_quantity - v.quantity")
+            else:
+                assignment = "reserved_quantity = p.reserved_quantity - v.quantity"
+            StockReservationModel._apply(cursor, totals, assignment)
+
+        cursor.execute("""
+            UPDATE stock_reservations
+            SET status = %s, finished_at = NOW()
+            WHERE reservation_id = ANY(%s)
+        """, (status, list(reservation_ids)))
+        return totals
+
+    @staticmethod
+    def reserve_many(requests, created_by=None, consume=False, atomic=False,
+                     ttl_minutes=RESERVATION_TTL_MINUTES):
+        """
+        Reserve stock for many requests in one transaction
+
+        A reference that already has an active reservation gets it back; one whose
+        stock was already consumed (COMMITTED) gets that reservation back and nothing
+        is written, so retrying a consume never deducts twice.
+
+        Args:
+            requests: Normalized requests (stock_reservations.normalize_request)
+            created_by: User ID
+            consume: Deduct stock right away (reservation created as COMMITTED);
+                     an active reservation with the same reference is committed
+            atomic: Raise InsufficientStockError (nothing is written) if any request
+                    does not fit; otherwise requests that fit are reserved and the rest
+                    come back with their shortages
+            ttl_minutes: Minutes until an unfinished reservation expires
+
+        Returns:
+            One dict per request, in order: reservation_id, reference, status,
+            items and shortages
+        """
+        with db.get_cursor(commit=True) as cursor:
+            # Retrying with the same reference returns the active reservation, or the
+            # committed one: a reference whose stock was consumed is done
+            references = sorted({request['reference'] for request in requests if request['reference']})
+            existing = {}
+            done = {}
+            if references:
+                # A new reference has no row to lock yet: a transaction advisory lock per
+                # reference (in key order) makes concurrent calls with it wait for each other
+                cursor.execute("""
+                    SELECT pg_advisory_xact_lock(key)
+                    FROM (
+                        SELECT DISTINCT hashtext(reference) AS key
+                        FROM unnest(%s::text[]) AS reference
+                        ORDER BY key
+                    ) keys
+                """, (references,))
+                cursor.execute("""
+                    SELECT reservation_id, reference, status
+                    FROM stock_reservations
+                    WHERE reference = ANY(%s) AND status IN (%s, %s)
+                    ORDER BY reservation_id
+                    FOR UPDATE
+                """, (references, RESERVED, COMMITTED))
+                for row in cursor.fetchall():
+                    (done if row['status'] == COMMITTED else existing)[row['reference']] = row['reservation_id']
+                existing = {reference: reservation_id for reference, reservation_id in existing.items()
+                            if reference not in done}
+
+            pending = [request for request in requests if request['reference'] not in existing
+                       and request['reference'] not in done]
+            recipes = StockReservationModel._load_recipes(
+                cursor, {treatment_id for request in pending for treatment_id, _ in request['treatments']}
+            )
+            demands = [plan_demand(request, recipes) for request in pending]
+
+            # Products of reservations being committed are locked in the same ordered pass
+            existing_items = StockReservationModel._get_items(cursor, list(existing.values()) + list(done.values()))
+            held = [(item['product_id'], item['quantity'])
+                    for reservation_id in existing.values() for item in existing_items[reservation_id]]
+            locked = StockReservationModel._lock_products(cursor, lock_order(demands + [held] if consume else demands))
+            stock = {product_id: row for product_id, row in locked.items() if row['is_active']}
+            shortages, totals = allocate(demands, stock)
+
+            if atomic and any(shortages):
+                raise InsufficientStockError([
+                    {'reference': request['reference'], 'index': index, 'shortages': missing}
+                    for index, (request, missing) in enumerate(zip(pending, shortages, strict=False)) if missing
+                ])
+
+            if totals:
+                if consume:
+                    StockMovementModel.set_context(
+                        cursor, CONSUMO, requests[0]['reference'] if len(requests) == 1 else None,
+                        created_by=created_by
+                    )
+                    StockReservationModel._apply(cursor, totals, "stock_quantity = p.stock_quantity - v.quantity")
+                else:
+                    StockReservationModel._apply(cursor, totals, "reserved_quantity = p.reserved_quantity + v.quantity")
+
+            fitting = [index for index, missing in enumerate(shortages) if not missing]
+            new_ids = {}
+            if fitting:
+                rows = execute_values(cursor, """
+                    INSERT INTO stock_reservations (reference, status, created_by, expires_at, finished_at)
+                    VALUES %s
+                    RETURNING reservation_id
+                """, [
+                    (pending[index]['reference'], COMMITTED if consume else RESERVED, created_by,
+                     None if consume else f"{int(ttl_minutes)} minutes", consume)
+                    for index in fitting
+                ], template="(%s, %s, %s, NOW() + %s::interval, CASE WHEN %s THEN NOW() END)", fetch=True)
+                new_ids = {index: row['reservation_id'] for index, row in zip(fitting, rows, strict=False)}
+
+                items = [
+                    (new_ids[index], product_id, quantity)
+                    for index in fitting for product_id, quantity in demands[index]
+                ]
+                if items:
+                    execute_values(cursor, """
+                        INSERT INTO stock_reservation_items (reservation_id, product_id, quantity)
+                        VALUES %s
+                    """, items)
+
+            existing_status = RESERVED
+            if consume and existing:
+                StockReservationModel._finish(cursor, existing.values(), COMMITTED)
+                existing_status = COMMITTED
+
+            results = []
+            index = 0
+            for request in requests:
+                if request['reference'] in done:
+                    reservation_id = done[request['reference']]
+                    results.append({
+                        'reservation_id': reservation_id,
+                        'reference': request['reference'],
+                        'status': COMMITTED,
+                        'items': existing_items.get(reservation_id, []),
+                        'shortages': []
+                    })
+                    continue
+
+                if request['reference'] in existing:
+                    reservation_id = existing[request['reference']]
+                    results.append({
+                        'reservation_id': reservation_id,
+                        'reference': request['reference'],
+                        'status': existing_status,
+                        'items': existing_items.get(reservation_id, []),
+                        'shortages': []
+                    })
+                    continue
+
+                reservation_id = new_ids.get(index)
+                results.append({
+                    'reservation_id': reservation_id,
+                    'reference': request['reference'],
+                    'status': (COMMITTED if consume else RESERVED) if reservation_id else None,
+                    'items': [{'product_id': product_id, 'quantity': quantity} for product_id, quantity in demands[index]]
+                    if reservation_id else [],
+                    'shortages': shortages[index]
+                })
+                index += 1
+
+            return results
+
+    @staticmethod
+    def finish_many(status, reservation_ids=None, references=None):
+        """
+        Commit (deduct stock) or release active reservations in one transaction
+
+        Args:
+            status: COMMITTED or RELEASED
+            reservation_ids: Reservation IDs
+            references: Caller references (matches the active reservation)
+
+        Returns:
+            Dict with the finished reservation IDs, the ones already finished and
+            the IDs/references not found
+        """
+        reservation_ids = sorted({int(reservation_id) for reservation_id in reservation_ids or []})
+        references = sorted(set(references or []))
+
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("""
+                SELECT reservation_id, reference, status
+                FROM stock_reservations
+                WHERE reservation_id = ANY(%s)
+                   OR (reference = ANY(%s) AND status = %s)
+                ORDER BY reservation_id
+                FOR UPDATE
+            """, (reservation_ids, references, RESERVED))
+            rows = cursor.fetchall()
+
+            active = [row['reservation_id'] for row in rows if row['status'] == RESERVED]
+            totals = StockReservationModel._finish(cursor, active, status)
+
+            found_ids = {row['reservation_id'] for row in rows}
+            found_references = {row['reference'] for row in rows if row['status'] == RESERVED}
+            return {
+                'reservation_ids': active,
+                'already_finished': [
+                    {'reservation_id': row['reservation_id'], 'status': row['status']}
+                    for row in rows if row['status'] != RESERVED
+                ],
+                'not_found': [reservation_id for reservation_id in reservation_ids if reservation_id not in found_ids]
+                + [reference for reference in references if reference not in found_references],
+                'products': len(totals)
+            }
+
+    @staticmethod
+    def release_expired(limit=500):
+        """Expire reservations past expires_at (SKIP LOCKED keeps workers apart)"""
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("""
+                SELECT reservation_id
+                FROM stock_reservations
+                WHERE status = %s AND expires_at < NOW()
+                ORDER BY reservation_id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (RESERVED, limit))
+            expired = [row['reservation_id'] for row in cursor.fetchall()]
+            StockReservationModel._finish(cursor, expired, EXPIRED)
+            return len(expired)
+
+    @staticmethod
+    def get_by_id(reservation_id):
+        """Get reservation with its items"""
+        with db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT reservation_id, reference, status, created_by, created_at, expires_at, finished_at
+                FROM stock_reservations
+                WHERE reservation_id = %s
+            """, (reservation_id,))
+            reservation = cursor.fetchone()
+            if reservation:
+                reservation['items'] = StockReservationModel._get_items(cursor, [reservation_id])[reservation_id]
+            return reservation
+
+
+class StockMovementModel:
+    """
+    Stock ledger: bulk movements, history and stock at a date
+
+    stock_movements is written by the products trigger (scripts/add_stock_ledger.sql)
+    for every stock change; set_context tags the rows of the current transaction.
+    """
+
+    @staticmethod
+    def set_context(cursor, movement_type, reference=None, notes=None, created_by=None):
+        """Type, reference, notes and user of the movements written by this transaction"""
+        cursor.execute("""
+            SELECT set_config('inventario.movement_type', %s, true),
+                   set_config('inventario.movement_reference', %s, true),
+                   set_config('inventario.movement_notes', %s, true),
+                   set_config('inventario.movement_user', %s, true)
+        """, (movement_type, reference or '', notes or '', str(created_by) if created_by else ''))
+
+    @staticmethod
+    def apply_many(movements, movement_type, reference=None, notes=None, created_by=None,
+                   allow_negative=False):
+        """
+        Apply many stock deltas in one transaction (all or nothing)
+
+        Args:
+            movements: List of (product_id, quantity_change) sorted by product_id
+                       (stock_ledger.normalize_movements)
+            movement_type: Ledger movement type
+            reference: Caller reference (delivery note, count sheet...)
+            notes: Free text stored with every movement
+            created_by: User ID
+            allow_negative: Skip the check that stock stays >= reserved stock
+
+        Returns:
+            Dict with the updated products and the product IDs not found; nothing is
+            written if any product is missing
+
+        Raises:
+            InsufficientStockError: a decrease would take stock held by reservations
+        """
+        with db.get_cursor(commit=True) as cursor:
+            locked = StockReservationModel._lock_products(cursor, [product_id for product_id, _ in movements])
+            not_found = [product_id for product_id, _ in movements if product_id not in locked]
+            if not_found:
+                return {'products': [], 'not_found': not_found}
+
+            if not allow_negative:
+                shortages = []
+                for product_id, change in movements:
+                    row = locked[product_id]
+                    available = (row['stock_quantity'] or 0) - row['reserved_quantity']
+                    if change < 0 and available + change < 0:
+                        shortages.append({
+                            'product_id': product_id,
+                            'product_name': row['name'],
+                            'required_quantity': -change,
+                            'available_quantity': max(available, 0)
+                        })
+                if shortages:
+                    raise InsufficientStockError(shortages)
+
+            StockMovementModel.set_context(cursor, movement_type, reference, notes, created_by)
+            rows = execute_values(cursor, """
+                UPDATE products AS p
+                SET stock_quantity = COALESCE(p.stock_quantity, 0) + v.quantity_change
+                FROM (VALUES %s) AS v(product_id, quantity_change)
+                WHERE p.product_id = v.product_id
+                RETURNING p.product_id, v.quantity_change, p.stock_quantity, p.reserved_quantity
+            """, movements, fetch=True)
+
+            return {'products': sorted(rows, key=lambda row: row['product_id']), 'not_found': []}
+
+    @staticmethod
+    def list_movements(product_id=None, movement_type=None, since=None, until=None, before_id=None, limit=100):
+        """Ledger rows, newest first (before_id pages through older rows)"""
+        query = """
+            SELECT movement_id, product_id, quantity_change, stock_after, movement_type,
+                   reference, notes, created_by, created_at
+            FROM stock_movements
+            WHERE TRUE
+        """
+        params = []
+
+        if product_id:
+            query += " AND product_id = %s"
+            params.append(product_id)
+
+        if movement_type:
+            query += " AND movement_type = %s"
+            params.append(movement_type)
+
+        if since:
+            query += " AND created_at >= %s"
+            params.append(since)
+
+        if until:
+            query += " AND created_at <= %s"
+            params.append(until)
+
+        if before_id:
+            query += " AND movement_id < %s"
+            params.append(before_id)
+
+        query += " ORDER BY movement_id DESC LIMIT %s"
+        params.append(limit)
+
+        with db.get_cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+    @staticmethod
+    def get_stock_at(at, product_ids=None):
+        """
+        Stock of each product at a date: its latest snapshot taken up to that date plus
+        the movements recorded after the snapshot and up to the date
+
+        Args:
+            at: datetime
+            product_ids: Product IDs (None = every active product)
+        """
+        query = """
+            SELECT p.product_id, p.sku, p.name,
+                   COALESCE(s.stock_quantity, 0) + COALESCE((
+                       SELECT SUM(m.quantity_change)
+                       FROM stock_movements m
+                       WHERE m.product_id = p.product_id
+                         AND m.movement_id > COALESCE(s.last_movement_id, 0)
+                         AND m.created_at <= %s
+                   ), 0)::INT as stock_quantity,
+                   s.taken_at as snapshot_at
+            FROM products p
+            LEFT JOIN LATERAL (
+                SELECT stock_quantity, last_movement_id, taken_at
+                FROM stock_snapshots
+                WHERE product_id = p.product_id AND taken_at <= %s
+                ORDER BY taken_at DESC
+                LIMIT 1
+            ) s ON TRUE
+        """
+        params = [at, at]
+
+        if product_ids is not None:
+            query += " WHERE p.product_id = ANY(%s)"
+            params.append(list(product_ids))
+        else:
+            query += " WHERE p.is_active = TRUE"
+
+        query += " ORDER BY p.product_id"
+
+        with db.get_cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+    @staticmethod
+    def take_snapshot(min_age_seconds=None):
+        """
+        Snapshot the stock of products with movements since the last snapshot
+
+        Returns:
+            Products saved, or None if the last snapshot is younger than min_age_seconds
+            or another worker is taking one
+        """
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("SELECT take_stock_snapshot(%s::interval) as products", (
+                f"{int(min_age_seconds)} seconds" if min_age_seconds else None,
+            ))
+            return cursor.fetchone()['products']
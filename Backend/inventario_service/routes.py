@@ -2,13 +2,20 @@
 Routes for Inventario Service
 """
 from flask import Blueprint, request
+from psycopg2.errors import UniqueViolation
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from common.auth_middleware import token_required
 from common.utils import success_response, error_response, get_pagination_params
-from models import ProductModel, TreatmentModel, TreatmentRecipeModel
+from models import (
+    ProductModel, TreatmentModel, TreatmentRecipeModel, StockReservationModel, StockMovementModel
+)
+from stock_reservations import (
+    COMMITTED, RELEASED, RESERVATION_BATCH_LIMIT, InsufficientStockError, normalize_request
+)
+from stock_ledger import AJUSTE, MOVEMENT_TYPES, normalize_movements, parse_timestamp
 
 inventario_bp = Blueprint('inventario', __name__)
 
@@ -139,7 +146,18 @@ def update_stock(current_user, product_id):
         if 'quantity_change' not in data:
             return error_response('quantity_change is required', 400)
 
-        result = ProductModel.update_stock(product_id, data['quantity_change'])
+        movement_type = data.get('movement_type', AJUSTE)
+        if movement_type not in MOVEMENT_TYPES:
+            return error_response(f"movement_type must be one of {', '.join(MOVEMENT_TYPES)}", 400)
+
+        result = ProductModel.update_stock(
+            product_id,
+            data['quantity_change'],
+            movement_type=movement_type,
+            reference=data.get('reference'),
+            notes=data.get('notes'),
+            created_by=current_user.get('user_id')
+        )
 
         if not result:
             return error_response('Product not found', 404)
@@ -164,6 +182,127 @@ def get_low_stock(current_user):
         return error_response('An error occurred', 500)
 
 
+# ============= STOCK LEDGER ENDPOINTS =============
+
+@inventario_bp.route('/stock/movements', methods=['POST'])
+@token_required
+def apply_stock_movements(current_user):
+    """Apply many stock deltas in one transaction (all products or none)"""
+    try:
+        data = request.get_json() or {}
+        movement_type = data.get('movement_type', AJUSTE)
+
+        try:
+            movements = normalize_movements(data.get('movements'), movement_type)
+        except ValueError as e:
+            return error_response(str(e), 400)
+
+        reference = data.get('reference')
+        if reference is not None and (not isinstance(reference, str) or len(reference) > 100):
+            return error_response('reference must be a string of up to 100 characters', 400)
+
+        if not movements:
+            return success_response({'products': [], 'count': 0}, 'No stock changes')
+
+        result = StockMovementModel.apply_many(
+            movements,
+            movement_type,
+            reference=reference,
+            notes=data.get('notes'),
+            created_by=current_user.get('user_id'),
+            allow_negative=bool(data.get('allow_negative'))
+        )
+
+        if result['not_found']:
+            return error_response('Products not found', 404, result['not_found'])
+
+        return success_response(
+            {'products': result['products'], 'count': len(result['products'])},
+            'Stock movements applied successfully'
+        )
+
+    except InsufficientStockError as e:
+        return error_response('Insufficient stock', 409, e.shortages)
+    except Exception as e:
+        print(f"Apply stock movements error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+@inventario_bp.route('/stock/movements', methods=['GET'])
+@token_required
+def list_stock_movements(current_user):
+    """Stock ledger, newest first (?before_id= for the next page)"""
+    try:
+        try:
+            since = parse_timestamp(request.args['since']) if request.args.get('since') else None
+            until = parse_timestamp(request.args['until']) if request.args.get('until') else None
+        except ValueError as e:
+            return error_response(str(e), 400)
+
+        movements = StockMovementModel.list_movements(
+            product_id=request.args.get('product_id', type=int),
+            movement_type=request.args.get('movement_type'),
+            since=since,
+            until=until,
+            before_id=request.args.get('before_id', type=int),
+            limit=min(request.args.get('limit', 100, type=int), 1000)
+        )
+
+        return success_response({
+            'movements': movements,
+            'count': len(movements),
+            'next_before_id': movements[-1]['movement_id'] if movements else None
+        })
+
+    except Exception as e:
+        print(f"List stock movements error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+@inventario_bp.route('/stock/at', methods=['GET'])
+@token_required
+def get_stock_at(current_user):
+    """Stock of every active product (or ?ids=1,2,3) at ?date= (a bare date means end of day)"""
+    try:
+        if not request.args.get('date'):
+            return error_response('date is required', 400)
+
+        try:
+            at = parse_timestamp(request.args['date'])
+        except ValueError as e:
+            return error_response(str(e), 400)
+
+        ids = request.args.get('ids')
+        try:
+            product_ids = [int(value) for value in ids.split(',') if value.strip()] if ids else None
+        except ValueError:
+            return error_response('ids must be a comma separated list of integers', 400)
+
+        products = StockMovementModel.get_stock_at(at, product_ids)
+        return success_response({'date': at.isoformat(), 'products': products, 'count': len(products)})
+
+    except Exception as e:
+        print(f"Get stock at date error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+@inventario_bp.route('/stock/snapshots', methods=['POST'])
+@token_required
+def take_stock_snapshot(current_user):
+    """Snapshot the stock of the products that moved since the last snapshot"""
+    try:
+        products = StockMovementModel.take_snapshot()
+
+        if products is None:
+            return error_response('A stock snapshot is already running', 409)
+
+        return success_response({'products': products}, 'Stock snapshot taken', 201)
+
+    except Exception as e:
+        print(f"Take stock snapshot error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
 # ============= TREATMENTS ENDPOINTS =============
 
 @inventario_bp.route('/treatments', methods=['GET'])
@@ -355,17 +494,25 @@ def check_stock(current_user, treatment_id):
     """Check stock availability for treatment"""
     try:
         quantity = request.args.get('quantity', 1, type=int)
-        availability = TreatmentRecipeModel.check_stock_availability(treatment_id, quantity)
+        details = request.args.get('details', 'false').lower() == 'true'
 
-        all_available = all(item['is_available'] for item in availability)
+        summary = TreatmentRecipeModel.get_availability([treatment_id], quantity)
+        if not summary:
+            return error_response('Treatment not found', 404)
+        summary = summary[0]
 
         response_data = {
             'treatment_id': treatment_id,
             'quantity': quantity,
-            'all_available': all_available,
-            'items': availability
+            'all_available': summary['is_available'],
+            'max_producible': summary['max_producible'],
+            'limiting_product_id': summary['limiting_product_id']
         }
 
+        # Per-ingredient breakdown only when something is missing or on request
+        if details or not summary['is_available']:
+            response_data['items'] = TreatmentRecipeModel.check_stock_availability(treatment_id, quantity)
+
         return success_response(response_data)
 
     except Exception as e:
@@ -373,6 +520,176 @@ def check_stock(current_user, treatment_id):
         return error_response('An error occurred', 500)
 
 
+@inventario_bp.route('/treatments/availability', methods=['GET'])
+@token_required
+def get_treatments_availability(current_user):
+    """Cost and availability of the whole treatment catalog (or ?ids=1,2,3)"""
+    try:
+        quantity = request.args.get('quantity', 1, type=int)
+        category = request.args.get('category')
+        only_available = request.args.get('only_available', 'false').lower() == 'true'
+
+        ids = request.args.get('ids')
+        try:
+            treatment_ids = [int(value) for value in ids.split(',') if value.strip()] if ids else None
+        except ValueError:
+            return error_response('ids must be a comma separated list of integers', 400)
+
+        treatments = TreatmentRecipeModel.get_availability(
+            treatment_ids=treatment_ids,
+            quantity=quantity,
+            category=category,
+            only_available=only_available
+        )
+
+        return success_response({'quantity': quantity, 'treatments': treatments, 'count': len(treatments)})
+
+    except Exception as e:
+        print(f"Get treatments availability error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+# ============= STOCK RESERVATIONS ENDPOINTS =============
+
+def _normalize_reservations(items):
+    """Validate reservation requests; returns (requests, error message)"""
+    try:
+        requests = [normalize_request(item) for item in items]
+    except ValueError as e:
+        return None, str(e)
+
+    references = [item['reference'] for item in requests if item['reference']]
+    if len(references) != len(set(references)):
+        return None, 'Duplicate reference in batch'
+    return requests, None
+
+
+@inventario_bp.route('/reservations', methods=['POST'])
+@token_required
+def create_reservation(current_user):
+    """Reserve the stock of a treatment recipe (all products or none)"""
+    try:
+        data = request.get_json() or {}
+        requests, error = _normalize_reservations([data])
+        if error:
+            return error_response(error, 400)
+
+        [reservation] = StockReservationModel.reserve_many(
+            requests,
+            created_by=current_user.get('user_id'),
+            consume=bool(data.get('consume')),
+            atomic=True
+        )
+        return success_response({'reservation': reservation}, 'Stock reserved successfully', 201)
+
+    except InsufficientStockError as e:
+        return error_response('Insufficient stock', 409, e.shortages[0]['shortages'])
+    except UniqueViolation:
+        return error_response('A reservation with this reference is already being created', 409)
+    except Exception as e:
+        print(f"Create reservation error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+@inventario_bp.route('/reservations/batch', methods=['POST'])
+@token_required
+def create_reservations_batch(current_user):
+    """Reserve stock for many requests in one transaction"""
+    try:
+        data = request.get_json() or {}
+        items = data.get('reservations')
+        if not isinstance(items, list) or not items:
+            return error_response('reservations is required', 400)
+        if len(items) > RESERVATION_BATCH_LIMIT:
+            return error_response(f'At most {RESERVATION_BATCH_LIMIT} reservations per batch', 400)
+
+        requests, error = _normalize_reservations(items)
+        if error:
+            return error_response(error, 400)
+
+        results = StockReservationModel.reserve_many(
+            requests,
+            created_by=current_user.get('user_id'),
+            consume=bool(data.get('consume')),
+            atomic=bool(data.get('atomic'))
+        )
+        reserved = sum(1 for result in results if result['reservation_id'])
+
+        response_data = {
+            'reservations': results,
+            'reserved': reserved,
+            'rejected': len(results) - reserved
+        }
+        return success_response(response_data, 'Stock reservations processed')
+
+    except InsufficientStockError as e:
+        return error_response('Insufficient stock', 409, e.shortages)
+    except UniqueViolation:
+        return error_response('A reservation with this reference is already being created', 409)
+    except Exception as e:
+        print(f"Create reservations batch error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+def _finish_reservations(status):
+    data = request.get_json() or {}
+    reservation_ids = data.get('reservation_ids') or []
+    references = data.get('references') or []
+
+    if not isinstance(reservation_ids, list) or not isinstance(references, list):
+        return error_response('reservation_ids and references must be lists', 400)
+    if not reservation_ids and not references:
+        return error_response('reservation_ids or references are required', 400)
+    if len(reservation_ids) + len(references) > RESERVATION_BATCH_LIMIT:
+        return error_response(f'At most {RESERVATION_BATCH_LIMIT} reservations per batch', 400)
+    if not all(isinstance(reservation_id, int) for reservation_id in reservation_ids):
+        return error_response('reservation_ids must be integers', 400)
+
+    result = StockReservationModel.finish_many(status, reservation_ids, references)
+    return success_response(result)
+
+
+@inventario_bp.route('/reservations/commit', methods=['POST'])
+@token_required
+def commit_reservations(current_user):
+    """Consume reserved stock (by reservation_ids and/or references)"""
+    try:
+        return _finish_reservations(COMMITTED)
+
+    except Exception as e:
+        print(f"Commit reservations error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+@inventario_bp.route('/reservations/release', methods=['POST'])
+@token_required
+def release_reservations(current_user):
+    """Return reserved stock (by reservation_ids and/or references)"""
+    try:
+        return _finish_reservations(RELEASED)
+
+    except Exception as e:
+        print(f"Release reservations error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+@inventario_bp.route('/reservations/<int:reservation_id>', methods=['GET'])
+@token_required
+def get_reservation(current_user, reservation_id):
+    """Get reservation by ID"""
+    try:
+        reservation = StockReservationModel.get_by_id(reservation_id)
+
+        if not reservation:
+            return error_response('Reservation not found', 404)
+
+        return success_response({'reservation': reservation})
+
+    except Exception as e:
+        print(f"Get reservation error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
 # Health check
 @inventario_bp.route('/health', methods=['GET'])
 def health_check():
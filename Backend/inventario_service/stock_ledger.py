@@ -0,0 +1,71 @@
+"""
+Stock ledger (pure validation logic)
+Movement types, batch normalization and snapshot settings; the ledger itself is
+written by the products trigger in scripts/add_stock_ledger.sql
+"""
+import os
+from collections import defaultdict
+from datetime import datetime
+
+# Movement types (SALDO_INICIAL is written by the trigger when a product is created with stock)
+ENTRADA = 'ENTRADA'
+SALIDA = 'SALIDA'
+AJUSTE = 'AJUSTE'
+CONSUMO = 'CONSUMO'
+SALDO_INICIAL = 'SALDO_INICIAL'
+
+MOVEMENT_TYPES = (ENTRADA, SALIDA, AJUSTE, CONSUMO)
+
+# Maximum products per bulk movement call
+MOVEMENTS_BATCH_LIMIT = int(os.getenv('STOCK_MOVEMENTS_BATCH_LIMIT', 5000))
+
+# Seconds between ledger snapshots (0 disables the background snapshot)
+STOCK_SNAPSHOT_INTERVAL = int(os.getenv('STOCK_SNAPSHOT_INTERVAL', 3600))
+
+
+def normalize_movements(items, movement_type=AJUSTE):
+    """
+    Validate a batch of movements and merge repeated products
+
+    Args:
+        items: [{"product_id": int, "quantity_change": int}, ...]
+        movement_type: One of MOVEMENT_TYPES; ENTRADA only adds stock and
+                       SALIDA/CONSUMO only remove it
+
+    Returns:
+        List of (product_id, quantity_change) sorted by product_id (the lock order),
+        without zero deltas
+    """
+    if movement_type not in MOVEMENT_TYPES:
+        raise ValueError(f"movement_type must be one of {', '.join(MOVEMENT_TYPES)}")
+    if not isinstance(items, list) or not items:
+        raise ValueError('movements is required')
+    if len(items) > MOVEMENTS_BATCH_LIMIT:
+        raise ValueError(f'At most {MOVEMENTS_BATCH_LIMIT} movements per batch')
+
+    deltas = defaultdict(int)
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError('Each movement must be an object')
+        product_id, change = item.get('product_id'), item.get('quantity_change')
+        if isinstance(product_id, bool) or not isinstance(product_id, int) or product_id <= 0:
+            raise ValueError('product_id must be a positive integer')
+        if isinstance(change, bool) or not isinstance(change, int):
+            raise ValueError('quantity_change must be an integer')
+        if (movement_type == ENTRADA and change <= 0) or (movement_type in (SALIDA, CONSUMO) and change >= 0):
+            raise ValueError(f'quantity_change has the wrong sign for {movement_type}')
+        deltas[product_id] += change
+
+    return sorted((product_id, change) for product_id, change in deltas.items() if change)
+
+
+def parse_timestamp(value):
+    """ISO date or datetime ('2025-12-01', '2025-12-01T18:30:00') -> datetime"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError('date must be an ISO date or datetime') from None
+    if len(value) == 10:
+        # A bare date means the end of that day
+        parsed = parsed.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return parsed
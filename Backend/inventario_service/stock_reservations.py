@@ -0,0 +1,139 @@
+"""
+Stock reservations (pure planning logic)
+Turns treatment recipes into per-product demand and allocates locked stock between
+reservation requests; the SQL side lives in StockReservationModel
+"""
+import os
+from collections import defaultdict
+
+# Reservation states
+RESERVED = 'RESERVED'
+COMMITTED = 'COMMITTED'
+RELEASED = 'RELEASED'
+EXPIRED = 'EXPIRED'
+
+# Minutes a reservation holds stock before the sweeper releases it
+RESERVATION_TTL_MINUTES = int(os.getenv('STOCK_RESERVATION_TTL_MINUTES', 120))
+
+# Maximum reservation requests accepted by one batch call
+RESERVATION_BATCH_LIMIT = int(os.getenv('STOCK_RESERVATION_BATCH_LIMIT', 500))
+
+
+class InsufficientStockError(Exception):
+    """Raised when a reservation cannot be covered; carries the shortages"""
+
+    def __init__(self, shortages):
+        super().__init__('Insufficient stock')
+        self.shortages = shortages
+
+
+def _positive_int(value, field):
+    if isinstance(value, bool) or not isinstance(value, int | str):
+        raise ValueError(f'{field} must be a positive integer')
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f'{field} must be a positive integer') from None
+    if number <= 0:
+        raise ValueError(f'{field} must be a positive integer')
+    return number
+
+
+def normalize_request(data):
+    """
+    Validate one reservation request coming from the API
+
+    Args:
+        data: {"reference": str?, "treatments": [{"treatment_id", "quantity"}],
+               "products": [{"product_id", "quantity"}]}
+
+    Returns:
+        Dict with reference, treatments and products as lists of (id, quantity)
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Each reservation must be an object')
+
+    treatments = [
+        (_positive_int(item.get('treatment_id'), 'treatment_id'), _positive_int(item.get('quantity', 1), 'quantity'))
+        for item in data.get('treatments') or []
+    ]
+    products = [
+        (_positive_int(item.get('product_id'), 'product_id'), _positive_int(item.get('quantity', 1), 'quantity'))
+        for item in data.get('products') or []
+    ]
+    if not treatments and not products:
+        raise ValueError('treatments or products are required')
+
+    reference = data.get('reference')
+    if reference is not None and (not isinstance(reference, str) or not reference.strip() or len(reference) > 100):
+        raise ValueError('reference must be a non-empty string of up to 100 characters')
+
+    return {'reference': reference, 'treatments': treatments, 'products': products}
+
+
+def plan_demand(request, recipes):
+    """
+    Units needed per product for one request
+
+    Args:
+        request: Normalized request (see normalize_request)
+        recipes: {treatment_id: [(product_id, quantity_needed), ...]}
+
+    Returns:
+        List of (product_id, quantity) sorted by product_id, the order rows are locked in
+    """
+    demand = defaultdict(int)
+    for treatment_id, quantity in request['treatments']:
+        for product_id, quantity_needed in recipes.get(treatment_id, ()):
+            demand[product_id] += quantity_needed * quantity
+    for product_id, quantity in request['products']:
+        demand[product_id] += quantity
+    return sorted((product_id, quantity) for product_id, quantity in demand.items() if quantity > 0)
+
+
+def lock_order(demands):
+    """Product ids touched by any demand, ascending (every transaction locks in this order)"""
+    return sorted({product_id for demand in demands for product_id, _ in demand})
+
+
+def allocate(demands, stock):
+    """
+    Allocate locked stock between requests, first come first served
+
+    A request is all-or-nothing: it gets every product it needs or nothing, and a
+    failed request does not consume stock later requests could use. A request with
+    no demand (treatments without recipe) always fits.
+
+    Args:
+        demands: List of demands from plan_demand, in request order
+        stock: {product_id: {'name', 'stock_quantity', 'reserved_quantity'}} for the locked rows;
+               a missing product counts as unavailable
+
+    Returns:
+        (results, totals): results has one list of shortages per request ([] when it
+        fits); totals is {product_id: units reserved by the successful requests}
+    """
+    available = {
+        product_id: (row['stock_quantity'] or 0) - (row['reserved_quantity'] or 0)
+        for product_id, row in stock.items()
+    }
+    totals = defaultdict(int)
+    results = []
+
+    for demand in demands:
+        shortages = []
+        for product_id, quantity in demand:
+            free = available.get(product_id, 0) - totals[product_id]
+            if product_id not in stock or quantity > free:
+                shortages.append({
+                    'product_id': product_id,
+                    'product_name': stock.get(product_id, {}).get('name'),
+                    'required_quantity': quantity,
+                    'available_quantity': max(free, 0) if product_id in stock else 0
+                })
+        if not shortages:
+            for product_id, quantity in demand:
+                totals[product_id] += quantity
+        results.append(shortages)
+
+    return results, {product_id: quantity for product_id, quantity in totals.items() if quantity}
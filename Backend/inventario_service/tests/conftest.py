@@ -0,0 +1,82 @@
+"""
+Fixtures compartidas: base PostgreSQL de pruebas (TEST_DATABASE_URL con el esquema de
+init_database.sql) y un catalogo temporal de productos y tratamientos
+"""
+import os
+import sys
+import uuid
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+# Scripts de esquema del servicio, en orden (todos son idempotentes)
+MIGRACIONES = ['add_stock_reservations.sql', 'add_treatment_availability.sql', 'add_stock_ledger.sql']
+
+
+@pytest.fixture(scope='session')
+def base_de_datos():
+    if not TEST_DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL no configurada')
+
+    # El pool se crea al importar common.database: si otro test ya lo abrio, se reabre
+    ya_importado = 'common.database' in sys.modules
+    anterior = os.environ.get('DATABASE_URL')
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+    sys.path.append(BACKEND_DIR)
+    from common.database import db
+    if ya_importado and anterior != TEST_DATABASE_URL:
+        db.close_all_connections()
+        db._initialize_pool()
+
+    for script in MIGRACIONES:
+        with open(os.path.join(BACKEND_DIR, 'scripts', script), encoding='utf-8') as f:
+            with db.get_cursor(commit=True) as cursor:
+                cursor.execute(f.read())
+
+    return db
+
+
+@pytest.fixture
+def catalogo(base_de_datos):
+    """Productos y tratamientos propios de cada test; se borran al terminar"""
+    db = base_de_datos
+    prefijo = f"TEST-{uuid.uuid4().hex[:8]}"
+    creados = {'products': [], 'treatments': []}
+
+    def producto(stock, costo=1):
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("""
+                INSERT INTO products (sku, name, cost_price, sale_price, stock_quantity)
+                VALUES (%s, %s, %s, %s, %s) RETURNING product_id
+            """, (f"{prefijo}-{len(creados['products'])}", prefijo, costo, costo * 2, stock))
+            creados['products'].append(cursor.fetchone()['product_id'])
+            return creados['products'][-1]
+
+    def tratamiento(receta):
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("INSERT INTO treatments (name, base_price) VALUES (%s, 10) RETURNING treatment_id", (prefijo,))
+            treatment_id = cursor.fetchone()['treatment_id']
+            for product_id, cantidad in receta:
+                cursor.execute("""
+                    INSERT INTO treatment_recipes (treatment_id, product_id, quantity_needed) VALUES (%s, %s, %s)
+                """, (treatment_id, product_id, cantidad))
+            creados['treatments'].append(treatment_id)
+            return treatment_id
+
+    def estado(product_id):
+        with db.get_cursor() as cursor:
+            cursor.execute("SELECT stock_quantity, reserved_quantity FROM products WHERE product_id = %s", (product_id,))
+            fila = cursor.fetchone()
+            return fila['stock_quantity'], fila['reserved_quantity']
+
+    yield producto, tratamiento, estado
+
+    with db.get_cursor(commit=True) as cursor:
+        cursor.execute("""
+            DELETE FROM stock_reservations WHERE reservation_id IN (
+                SELECT reservation_id FROM stock_reservation_items WHERE product_id = ANY(%s))
+        """, (creados['products'],))
+        cursor.execute("DELETE FROM treatments WHERE treatment_id = ANY(%s)", (creados['treatments'],))
+        cursor.execute("DELETE FROM products WHERE product_id = ANY(%s)", (creados['products'],))
@@ -0,0 +1,193 @@
+"""
+Tests del libro de movimientos de stock (movimientos en lote, snapshots y stock a una fecha)
+
+Las pruebas de normalizacion no usan base de datos; el resto necesita PostgreSQL
+(TEST_DATABASE_URL, ver conftest.py) y se omite si no existe.
+"""
+import os
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stock_ledger import AJUSTE, CONSUMO, ENTRADA, SALIDA, normalize_movements, parse_timestamp
+from stock_reservations import InsufficientStockError, normalize_request
+
+# ============= NORMALIZACION (sin base de datos) =============
+
+def test_normalizar_agrupa_por_producto_y_ordena():
+    movimientos = normalize_movements([
+        {'product_id': 9, 'quantity_change': 5},
+        {'product_id': 2, 'quantity_change': -3},
+        {'product_id': 9, 'quantity_change': 2},
+        {'product_id': 4, 'quantity_change': 1},
+        {'product_id': 4, 'quantity_change': -1},
+    ])
+    assert movimientos == [(2, -3), (9, 7)]
+
+
+def test_normalizar_valida_tipo_y_signo():
+    assert normalize_movements([{'product_id': 1, 'quantity_change': 3}], ENTRADA) == [(1, 3)]
+    assert normalize_movements([{'product_id': 1, 'quantity_change': -3}], SALIDA) == [(1, -3)]
+
+    invalidos = [
+        ([{'product_id': 1, 'quantity_change': -3}], ENTRADA),
+        ([{'product_id': 1, 'quantity_change': 3}], CONSUMO),
+        ([{'product_id': 1, 'quantity_change': 3}], 'SALDO_INICIAL'),
+        ([{'product_id': 0, 'quantity_change': 3}], AJUSTE),
+        ([{'product_id': 1, 'quantity_change': '3'}], AJUSTE),
+        ([{'product_id': True, 'quantity_change': 3}], AJUSTE),
+        ([], AJUSTE),
+        (None, AJUSTE),
+    ]
+    for movimientos, tipo in invalidos:
+        with pytest.raises(ValueError):
+            normalize_movements(movimientos, tipo)
+
+
+def test_fecha_sin_hora_es_el_final_del_dia():
+    assert parse_timestamp('2025-12-01').isoformat() == '2025-12-01T23:59:59.999999'
+    assert parse_timestamp('2025-12-01T08:30:00').isoformat() == '2025-12-01T08:30:00'
+    with pytest.raises(ValueError):
+        parse_timestamp('ayer')
+
+
+# ============= POSTGRESQL =============
+
+@pytest.fixture(scope='module')
+def modelos(base_de_datos):
+    import models
+    return models
+
+
+def _libro(db, product_id):
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT quantity_change, stock_after, movement_type, reference, notes, created_by
+            FROM stock_movements WHERE product_id = %s ORDER BY movement_id
+        """, (product_id,))
+        return cursor.fetchall()
+
+
+def _ahora(db):
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT clock_timestamp()::timestamp as ahora")
+        return cursor.fetchone()['ahora']
+
+
+def _stock_a(modelos, fecha, productos):
+    return {fila['product_id']: fila['stock_quantity']
+            for fila in modelos.StockMovementModel.get_stock_at(fecha, productos)}
+
+
+def test_lote_en_una_transaccion_queda_en_el_libro(modelos, catalogo, base_de_datos):
+    producto, _, estado = catalogo
+    a, b = producto(10), producto(0)
+
+    resultado = modelos.StockMovementModel.apply_many(
+        [(a, 15), (b, 40)], ENTRADA, reference='GUIA-001', notes='Proveedor X', created_by=None
+    )
+    assert [(fila['product_id'], fila['stock_quantity']) for fila in resultado['products']] == [(a, 25), (b, 40)]
+
+    assert [(m['quantity_change'], m['stock_after'], m['movement_type']) for m in _libro(base_de_datos, a)] == [
+        (10, 10, 'SALDO_INICIAL'), (15, 25, ENTRADA)
+    ]
+    ultimo = _libro(base_de_datos, b)[-1]
+    assert (ultimo['reference'], ultimo['notes']) == ('GUIA-001', 'Proveedor X')
+    assert estado(b) == (40, 0)
+
+
+def test_lote_es_todo_o_nada(modelos, catalogo, base_de_datos):
+    producto, _, estado = catalogo
+    a, b = producto(10), producto(5)
+
+    # No se puede sacar stock apartado por una reserva
+    modelos.StockReservationModel.reserve_many([normalize_request({'products': [{'product_id': b, 'quantity': 4}]})])
+    with pytest.raises(InsufficientStockError) as error:
+        modelos.StockMovementModel.apply_many([(a, -3), (b, -2)], SALIDA)
+    assert error.value.shortages == [{
+        'product_id': b, 'product_name': error.value.shortages[0]['product_name'],
+        'required_quantity': 2, 'available_quantity': 1
+    }]
+    assert (estado(a), estado(b)) == ((10, 0), (5, 4))
+
+    resultado = modelos.StockMovementModel.apply_many([(a, -3), (999999999, 1)], AJUSTE)
+    assert resultado['not_found'] == [999999999]
+    assert estado(a) == (10, 0)
+
+    modelos.StockMovementModel.apply_many([(a, -3), (b, -2)], SALIDA, allow_negative=True)
+    assert (estado(a), estado(b)) == ((7, 0), (3, 4))
+    assert len(_libro(base_de_datos, a)) == 2
+
+
+def test_toda_escritura_de_stock_queda_registrada(modelos, catalogo, base_de_datos):
+    producto, tratamiento, estado = catalogo
+    insumo = producto(20)
+    curacion = tratamiento([(insumo, 2)])
+
+    modelos.ProductModel.update_stock(insumo, -1, reference='CONTEO-7')
+    modelos.ProductModel.update(insumo, stock_quantity=30)
+    modelos.ProductModel.update(insumo, name='Sin cambio de stock')
+    modelos.StockReservationModel.reserve_many(
+        [normalize_request({'reference': 'CITA-1', 'treatments': [{'treatment_id': curacion}]})], consume=True
+    )
+
+    libro = _libro(base_de_datos, insumo)
+    assert [(m['quantity_change'], m['movement_type'], m['reference']) for m in libro] == [
+        (20, 'SALDO_INICIAL', None), (-1, AJUSTE, 'CONTEO-7'), (11, AJUSTE, None), (-2, CONSUMO, 'CITA-1')
+    ]
+    assert sum(m['quantity_change'] for m in libro) == estado(insumo)[0] == 28
+
+    with pytest.raises(Exception, match='append-only'):
+        with base_de_datos.get_cursor(commit=True) as cursor:
+            cursor.execute("UPDATE stock_movements SET quantity_change = 1 WHERE product_id = %s", (insumo,))
+
+
+def test_stock_a_una_fecha_con_y_sin_snapshot(modelos, catalogo, base_de_datos):
+    producto, _, _ = catalogo
+    a, b = producto(100), producto(50)
+    inicio = _ahora(base_de_datos)
+
+    modelos.StockMovementModel.apply_many([(a, -10), (b, 5)], AJUSTE)
+    despues_del_primero = _ahora(base_de_datos)
+
+    assert modelos.StockMovementModel.take_snapshot() >= 2
+    modelos.StockMovementModel.apply_many([(a, -20)], SALIDA)
+    despues_del_snapshot = _ahora(base_de_datos)
+    modelos.StockMovementModel.apply_many([(a, 1), (b, -50)], AJUSTE)
+
+    assert _stock_a(modelos, inicio, [a, b]) == {a: 100, b: 50}
+    assert _stock_a(modelos, despues_del_primero, [a, b]) == {a: 90, b: 55}
+    assert _stock_a(modelos, despues_del_snapshot, [a, b]) == {a: 70, b: 55}
+    assert _stock_a(modelos, _ahora(base_de_datos), [a, b]) == {a: 71, b: 5}
+
+    # El snapshot solo guarda los productos con movimientos desde el anterior
+    assert modelos.StockMovementModel.take_snapshot() >= 2
+    assert modelos.StockMovementModel.take_snapshot() == 0
+    assert modelos.StockMovementModel.take_snapshot(min_age_seconds=3600) is None
+    assert _stock_a(modelos, _ahora(base_de_datos), [a, b]) == {a: 71, b: 5}
+
+
+def test_lotes_concurrentes_y_snapshots_cuadran_con_el_stock(modelos, catalogo, base_de_datos):
+    producto, _, estado = catalogo
+    productos = [producto(1000) for _ in range(12)]
+
+    def lote(semilla):
+        aleatorio = random.Random(semilla)
+        if semilla % 10 == 0:
+            return modelos.StockMovementModel.take_snapshot()
+        cambios = {product_id: aleatorio.randint(-5, 5) or 1 for product_id in aleatorio.sample(productos, 6)}
+        modelos.StockMovementModel.apply_many(sorted(cambios.items()), AJUSTE)
+
+    # Lotes con productos cruzados: el orden de bloqueo evita deadlocks
+    with ThreadPoolExecutor(max_workers=12) as executor:
+        list(executor.map(lote, range(200)))
+
+    actual = _stock_a(modelos, _ahora(base_de_datos), productos)
+    for product_id in productos:
+        libro = _libro(base_de_datos, product_id)
+        assert actual[product_id] == estado(product_id)[0] == sum(m['quantity_change'] for m in libro)
+        assert libro[-1]['stock_after'] == estado(product_id)[0]
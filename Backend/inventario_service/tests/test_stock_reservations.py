@@ -0,0 +1,251 @@
+"""
+Tests del motor de reservas de stock
+
+La planificacion y asignacion corren siempre; las pruebas de concurrencia necesitan
+PostgreSQL (TEST_DATABASE_URL, ver conftest.py) y se omiten si no existe.
+"""
+import os
+import sys
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stock_reservations import (
+    COMMITTED,
+    EXPIRED,
+    RELEASED,
+    InsufficientStockError,
+    allocate,
+    lock_order,
+    normalize_request,
+    plan_demand,
+)
+
+
+def _stock(**cantidades):
+    return {
+        int(product_id[1:]): {'name': product_id, 'stock_quantity': cantidad, 'reserved_quantity': 0}
+        for product_id, cantidad in cantidades.items()
+    }
+
+
+# ============= Planificacion (sin base de datos) =============
+
+def test_demanda_suma_recetas_y_ordena_por_producto():
+    request = normalize_request({
+        'treatments': [{'treatment_id': 1, 'quantity': 2}, {'treatment_id': 2}],
+        'products': [{'product_id': 3, 'quantity': 4}]
+    })
+    recetas = {1: [(7, 1), (3, 2)], 2: [(3, 1), (5, 10)]}
+
+    assert plan_demand(request, recetas) == [(3, 9), (5, 10), (7, 2)]
+    assert lock_order([[(7, 1)], [(3, 1), (7, 2)], []]) == [3, 7]
+
+
+def test_tratamiento_sin_receta_no_pide_stock():
+    request = normalize_request({'reference': 'appointment:1', 'treatments': [{'treatment_id': 9}]})
+    demanda = plan_demand(request, {})
+
+    assert demanda == []
+    assert allocate([demanda], {}) == ([[]], {})
+
+
+def test_asignacion_todo_o_nada_en_orden_de_llegada():
+    stock = _stock(p1=10, p2=3)
+    stock[2]['reserved_quantity'] = 1
+
+    resultados, totales = allocate([
+        [(1, 4), (2, 1)],
+        [(1, 4), (2, 5)],   # no alcanza p2: no consume p1
+        [(1, 6)],
+        [(1, 1)],           # p1 ya se agoto
+        [(99, 1)],          # producto inexistente
+    ], stock)
+
+    assert [bool(faltantes) for faltantes in resultados] == [False, True, False, True, True]
+    assert resultados[1] == [{'product_id': 2, 'product_name': 'p2', 'required_quantity': 5, 'available_quantity': 1}]
+    assert resultados[4][0]['available_quantity'] == 0
+    assert totales == {1: 10, 2: 1}
+
+
+@pytest.mark.parametrize('data', [
+    {},
+    {'treatments': [{'treatment_id': 1, 'quantity': 0}]},
+    {'treatments': [{'treatment_id': 1, 'quantity': 1.5}]},
+    {'products': [{'product_id': True}]},
+    {'products': [{'product_id': 1}], 'reference': ''},
+])
+def test_solicitudes_invalidas(data):
+    with pytest.raises(ValueError):
+        normalize_request(data)
+
+
+# ============= Concurrencia contra PostgreSQL =============
+
+@pytest.fixture(scope='module')
+def modelo(base_de_datos):
+    from models import StockReservationModel
+    return StockReservationModel
+
+
+def _reservar(modelo, treatment_id, **kwargs):
+    return modelo.reserve_many(
+        [normalize_request({'treatments': [{'treatment_id': treatment_id}], **kwargs})], atomic=True
+    )[0]
+
+
+def test_reservas_concurrentes_no_sobrevenden(modelo, catalogo):
+    producto, tratamiento, estado = catalogo
+    guantes, jeringas = producto(30), producto(100)
+    receta = tratamiento([(guantes, 3), (jeringas, 1)])
+
+    def intento(_):
+        try:
+            return _reservar(modelo, receta)['reservation_id']
+        except InsufficientStockError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        resultados = list(executor.map(intento, range(40)))
+
+    assert sum(1 for r in resultados if r) == 10
+    assert estado(guantes) == (30, 30)
+    assert estado(jeringas) == (100, 10)
+
+
+def test_orden_de_bloqueo_evita_deadlocks(modelo, catalogo):
+    producto, tratamiento, estado = catalogo
+    a, b, c = producto(1000), producto(1000), producto(1000)
+    # Recetas que tocan los mismos productos en distinto orden
+    recetas = [tratamiento([(c, 1), (a, 1)]), tratamiento([(a, 1), (b, 1), (c, 1)]), tratamiento([(b, 1), (a, 1)])]
+    errores = []
+    inicio = threading.Barrier(12)
+
+    def trabajador(indice):
+        inicio.wait()
+        for vuelta in range(15):
+            try:
+                reserva = _reservar(modelo, recetas[(indice + vuelta) % 3])
+                finalizar = COMMITTED if vuelta % 2 else RELEASED
+                modelo.finish_many(finalizar, reservation_ids=[reserva['reservation_id']])
+            except Exception as e:  # un deadlock de PostgreSQL llegaria aqui
+                errores.append(e)
+
+    hilos = [threading.Thread(target=trabajador, args=(i,)) for i in range(12)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert errores == []
+    assert all(estado(product_id)[1] == 0 for product_id in (a, b, c))
+
+
+def test_confirmar_liberar_y_vencer(modelo, catalogo):
+    producto, tratamiento, estado = catalogo
+    insumo = producto(10)
+    receta = tratamiento([(insumo, 2)])
+
+    confirmada = _reservar(modelo, receta)
+    liberada = _reservar(modelo, receta)
+    assert estado(insumo) == (10, 4)
+
+    resultado = modelo.finish_many(COMMITTED, reservation_ids=[confirmada['reservation_id'], 999999999])
+    assert resultado['reservation_ids'] == [confirmada['reservation_id']]
+    assert resultado['not_found'] == [999999999]
+    assert estado(insumo) == (8, 2)
+
+    modelo.finish_many(RELEASED, reservation_ids=[liberada['reservation_id']])
+    assert estado(insumo) == (8, 0)
+
+    # Confirmar dos veces no descuenta dos veces
+    repetida = modelo.finish_many(COMMITTED, reservation_ids=[confirmada['reservation_id']])
+    assert repetida['already_finished'] == [{'reservation_id': confirmada['reservation_id'], 'status': COMMITTED}]
+    assert estado(insumo) == (8, 0)
+
+    vencida = modelo.reserve_many(
+        [normalize_request({'treatments': [{'treatment_id': receta}]})], ttl_minutes=-1
+    )[0]
+    assert estado(insumo) == (8, 2)
+    assert modelo.release_expired() >= 1
+    assert modelo.get_by_id(vencida['reservation_id'])['status'] == EXPIRED
+    assert estado(insumo) == (8, 0)
+
+
+def test_referencia_idempotente_y_consumo_directo(modelo, catalogo):
+    producto, tratamiento, estado = catalogo
+    insumo = producto(5)
+    receta = tratamiento([(insumo, 1)])
+    referencia = f"appointment:{uuid.uuid4().hex}"
+
+    primera = _reservar(modelo, receta, reference=referencia)
+    segunda = _reservar(modelo, receta, reference=referencia)
+    assert primera['reservation_id'] == segunda['reservation_id']
+    assert estado(insumo) == (5, 1)
+
+    # consume=True confirma la reserva activa de la referencia
+    consumida = modelo.reserve_many(
+        [normalize_request({'treatments': [{'treatment_id': receta}], 'reference': referencia})], consume=True
+    )[0]
+    assert consumida['reservation_id'] == primera['reservation_id']
+    assert consumida['status'] == COMMITTED
+    assert estado(insumo) == (4, 0)
+
+    # Una referencia ya consumida no vuelve a descontar (cita completada dos veces)
+    for consume in (True, False):
+        repetida = modelo.reserve_many(
+            [normalize_request({'treatments': [{'treatment_id': receta}], 'reference': referencia})], consume=consume
+        )[0]
+        assert (repetida['reservation_id'], repetida['status']) == (primera['reservation_id'], COMMITTED)
+        assert repetida['items'] == [{'product_id': insumo, 'quantity': 1}]
+    assert estado(insumo) == (4, 0)
+
+    directa = modelo.reserve_many([normalize_request({'products': [{'product_id': insumo, 'quantity': 2}]})], consume=True)[0]
+    assert directa['status'] == COMMITTED
+    assert estado(insumo) == (2, 0)
+    modelo.finish_many(RELEASED, references=[referencia])
+
+
+def test_consumo_concurrente_de_una_referencia_nueva(modelo, catalogo, base_de_datos):
+    producto, tratamiento, estado = catalogo
+    insumo = producto(10)
+    receta = tratamiento([(insumo, 2)])
+    referencia = f"appointment:{uuid.uuid4().hex}"
+    inicio = threading.Barrier(8)
+
+    def consumir(_):
+        inicio.wait()
+        return modelo.reserve_many(
+            [normalize_request({'treatments': [{'treatment_id': receta}], 'reference': referencia})], consume=True
+        )[0]['reservation_id']
+
+    # La misma cita completada a la vez desde varios workers descuenta una sola vez
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        reservas = set(executor.map(consumir, range(8)))
+    assert len(reservas) == 1
+    assert estado(insumo) == (8, 0)
+    with base_de_datos.get_cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) AS n FROM stock_reservations WHERE reference = %s", (referencia,))
+        assert cursor.fetchone()['n'] == 1
+
+
+def test_lote_parcial_y_atomico(modelo, catalogo):
+    producto, tratamiento, estado = catalogo
+    insumo = producto(5)
+    solicitudes = [
+        normalize_request({'products': [{'product_id': insumo, 'quantity': cantidad}]}) for cantidad in (2, 4, 3)
+    ]
+
+    with pytest.raises(InsufficientStockError) as error:
+        modelo.reserve_many(solicitudes, atomic=True)
+    assert error.value.shortages[0]['index'] == 1
+    assert estado(insumo) == (5, 0)
+
+    resultados = modelo.reserve_many(solicitudes)
+    assert [bool(r['reservation_id']) for r in resultados] == [True, False, True]
+    assert resultados[1]['shortages'][0]['available_quantity'] == 3
+    assert estado(insumo) == (5, 5)
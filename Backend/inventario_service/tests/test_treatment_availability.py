@@ -0,0 +1,107 @@
+"""
+Tests de la tabla precalculada treatment_availability (costo y cantidad maxima realizable)
+
+Necesitan PostgreSQL (TEST_DATABASE_URL, ver conftest.py); se omiten si no existe.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stock_reservations import normalize_request
+
+
+@pytest.fixture(scope='module')
+def modelos(base_de_datos):
+    import models
+    return models
+
+
+def _fila(modelos, treatment_id, quantity=1):
+    return modelos.TreatmentRecipeModel.get_availability([treatment_id], quantity)[0]
+
+
+def _desde_join(modelos, treatment_id):
+    """Lo que antes se calculaba con el join en cada llamada"""
+    items = modelos.TreatmentRecipeModel.check_stock_availability(treatment_id)
+    costo = modelos.TreatmentRecipeModel.get_recipe(treatment_id)
+    return (
+        round(sum(float(item['cost_price']) * item['quantity_needed'] for item in costo), 2),
+        min((item['available_quantity'] // item['quantity_needed'] for item in items), default=None)
+    )
+
+
+def test_receta_nueva_y_cambios_de_receta(modelos, catalogo):
+    producto, tratamiento, _ = catalogo
+    gasas, alcohol = producto(50, costo=0.25), producto(9, costo=3)
+    curacion = tratamiento([(gasas, 4)])
+
+    fila = _fila(modelos, curacion)
+    assert (fila['ingredient_count'], float(fila['total_cost']), fila['max_producible']) == (1, 1.0, 12)
+    assert fila['limiting_product_id'] == gasas
+
+    modelos.TreatmentRecipeModel.add_ingredient(curacion, alcohol, 2)
+    fila = _fila(modelos, curacion)
+    assert (float(fila['total_cost']), fila['max_producible'], fila['limiting_product_id']) == (7.0, 4, alcohol)
+    assert (float(fila['total_cost']), fila['max_producible']) == _desde_join(modelos, curacion)
+
+    modelos.TreatmentRecipeModel.add_ingredient(curacion, alcohol, 1)   # ON CONFLICT DO UPDATE
+    assert _fila(modelos, curacion)['max_producible'] == 9
+
+    modelos.TreatmentRecipeModel.remove_ingredient(curacion, gasas)
+    modelos.TreatmentRecipeModel.remove_ingredient(curacion, alcohol)
+    fila = _fila(modelos, curacion)
+    assert (fila['ingredient_count'], float(fila['total_cost']), fila['max_producible']) == (0, 0.0, None)
+    assert fila['is_available'] is True
+
+
+def test_stock_costo_reservas_y_estado_del_producto(modelos, catalogo):
+    producto, tratamiento, _ = catalogo
+    insumo = producto(10, costo=2)
+    uno, dos = tratamiento([(insumo, 1)]), tratamiento([(insumo, 5)])
+
+    modelos.ProductModel.update_stock(insumo, 5)
+    assert (_fila(modelos, uno)['max_producible'], _fila(modelos, dos)['max_producible']) == (15, 3)
+
+    modelos.ProductModel.update(insumo, cost_price=4)
+    assert float(_fila(modelos, dos)['total_cost']) == 20.0
+
+    # Las reservas descuentan del disponible
+    modelos.StockReservationModel.reserve_many([normalize_request({'products': [{'product_id': insumo, 'quantity': 6}]})])
+    assert (_fila(modelos, uno)['max_producible'], _fila(modelos, dos)['max_producible']) == (9, 1)
+    assert _fila(modelos, dos, quantity=2)['is_available'] is False
+
+    modelos.ProductModel.update(insumo, is_active=False)
+    assert _fila(modelos, uno)['max_producible'] == 0
+
+
+def test_actualizacion_en_lote_recalcula_una_vez_por_sentencia(modelos, catalogo, base_de_datos):
+    producto, tratamiento, _ = catalogo
+    productos = [producto(100) for _ in range(20)]
+    tratamientos = [tratamiento([(productos[i], 1), (productos[(i + 1) % 20], 2)]) for i in range(20)]
+
+    with base_de_datos.get_cursor(commit=True) as cursor:
+        cursor.execute("UPDATE products SET stock_quantity = stock_quantity - product_id %% 7 WHERE product_id = ANY(%s)",
+                       (productos,))
+
+    for treatment_id in tratamientos:
+        fila = _fila(modelos, treatment_id)
+        assert (float(fila['total_cost']), fila['max_producible']) == _desde_join(modelos, treatment_id)
+
+
+def test_catalogo_completo_en_una_lectura(modelos, catalogo):
+    producto, tratamiento, _ = catalogo
+    escaso, abundante = producto(3), producto(1000)
+    limitado, holgado, sin_receta = tratamiento([(escaso, 1)]), tratamiento([(abundante, 1)]), tratamiento([])
+    ids = [limitado, holgado, sin_receta]
+
+    catalogo_completo = modelos.TreatmentRecipeModel.get_availability(ids, quantity=5)
+    assert {fila['treatment_id']: fila['is_available'] for fila in catalogo_completo} == {
+        limitado: False, holgado: True, sin_receta: True
+    }
+
+    disponibles = modelos.TreatmentRecipeModel.get_availability(ids, quantity=5, only_available=True)
+    assert sorted(fila['treatment_id'] for fila in disponibles) == sorted([holgado, sin_receta])
+    assert modelos.TreatmentRecipeModel.calculate_treatment_cost(holgado) == 1.0
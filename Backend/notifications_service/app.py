@@ -6,6 +6,7 @@ from flask import Flask
 from flask_cors import CORS
 import os
 import sys
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -15,6 +16,7 @@ load_dotenv()
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from routes import notifications_bp
+from common.notification_service import NotificationService, LOW_STOCK_LISTEN_TIMEOUT
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -26,6 +28,13 @@ CORS(app, origins=os.getenv('CORS_ORIGINS', '*').split(','))
 # Register blueprints
 app.register_blueprint(notifications_bp, url_prefix='/api/notifications')
 
+# Low stock alerts: sent when the products trigger raises them (LISTEN low_stock, 0 disables it)
+if LOW_STOCK_LISTEN_TIMEOUT > 0:
+    threading.Thread(
+        target=NotificationService.listen_for_low_stock_alerts, args=(LOW_STOCK_LISTEN_TIMEOUT,),
+        name='low-stock-alerts', daemon=True
+    ).start()
+
 if __name__ == '__main__':
     port = int(os.getenv('NOTIFICATIONS_SERVICE_PORT', 5007))
     print(f"🔔 Notifications Service running on port {port}")
@@ -9,6 +9,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from common.auth_middleware import token_required
 from common.utils import success_response, error_response
 from common.notification_service import NotificationService
+from common.notification_inbox import NotificationInbox
 
 notifications_bp = Blueprint('notifications', __name__)
 
@@ -18,31 +19,41 @@ notifications_bp = Blueprint('notifications', __name__)
 @notifications_bp.route('/notifications', methods=['GET'])
 @token_required
 def get_notifications(current_user):
-    """Get notifications for current user"""
+    """
+    Get notifications for current user
+
+    Polling: pass the returned cursor as ?since= to get only newer notifications
+    """
     try:
         limit = request.args.get('limit', 50, type=int)
+        since = request.args.get('since', type=int)
         unread_only = request.args.get('unread_only', 'false').lower() == 'true'
 
-        notifications = NotificationService.get_user_notifications(
+        inbox = NotificationInbox.get_notifications(
             current_user['user_id'],
+            since=since,
             limit=limit,
             unread_only=unread_only
         )
 
-        # Count unread
-        all_notifications = NotificationService.get_user_notifications(
-            current_user['user_id'],
-            limit=1000,
-            unread_only=True
-        )
+        return success_response(inbox)
 
+    except Exception as e:
+        print(f"Get notifications error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
+@notifications_bp.route('/notifications/unread-count', methods=['GET'])
+@token_required
+def get_unread_count(current_user):
+    """Get the unread notifications count of the current user"""
+    try:
         return success_response({
-            'notifications': notifications,
-            'unread_count': len(all_notifications)
+            'unread_count': NotificationInbox.get_unread_count(current_user['user_id'])
         })
 
     except Exception as e:
-        print(f"Get notifications error: {str(e)}")
+        print(f"Get unread count error: {str(e)}")
         return error_response('An error occurred', 500)
 
 
@@ -51,18 +62,46 @@ def get_notifications(current_user):
 def mark_notification_read(current_user, log_id):
     """Mark a notification as read"""
     try:
-        success = NotificationService.mark_notification_as_read(log_id)
+        result = NotificationInbox.mark_as_read(current_user['user_id'], log_ids=[log_id])
 
-        if not success:
+        if not result['marked']:
             return error_response('Notification not found or already read', 404)
 
-        return success_response(message='Notification marked as read')
+        return success_response(result, 'Notification marked as read')
 
     except Exception as e:
         print(f"Mark notification read error: {str(e)}")
         return error_response('An error occurred', 500)
 
 
+@notifications_bp.route('/notifications/read', methods=['POST'])
+@token_required
+def mark_notifications_read(current_user):
+    """
+    Mark many notifications of the current user as read
+
+    Body: {"ids": [...]} or {"up_to": <cursor>}; with neither, all of them
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        log_ids = data.get('ids')
+        up_to = data.get('up_to')
+
+        if log_ids is not None and (not isinstance(log_ids, list) or
+                                    not all(isinstance(log_id, int) for log_id in log_ids)):
+            return error_response('ids must be a list of notification IDs', 400)
+        if up_to is not None and not isinstance(up_to, int):
+            return error_response('up_to must be a cursor (integer)', 400)
+
+        result = NotificationInbox.mark_as_read(current_user['user_id'], log_ids=log_ids, up_to=up_to)
+
+        return success_response(result, f"{result['marked']} notifications marked as read")
+
+    except Exception as e:
+        print(f"Mark notifications read error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
 # ============= LOW STOCK ALERTS =============
 
 @notifications_bp.route('/low-stock', methods=['GET'])
@@ -82,13 +121,33 @@ def get_low_stock_products(current_user):
         return error_response('An error occurred', 500)
 
 
+@notifications_bp.route('/low-stock/alerts', methods=['GET'])
+@token_required
+def get_low_stock_alerts(current_user):
+    """Get low stock alerts (?all=true includes resolved ones)"""
+    try:
+        alerts = NotificationService.get_low_stock_alerts(
+            open_only=request.args.get('all', 'false').lower() != 'true',
+            limit=min(request.args.get('limit', 100, type=int), 1000)
+        )
+
+        return success_response({
+            'alerts': alerts,
+            'count': len(alerts)
+        })
+
+    except Exception as e:
+        print(f"Get low stock alerts error: {str(e)}")
+        return error_response('An error occurred', 500)
+
+
 @notifications_bp.route('/low-stock/alerts/send', methods=['POST'])
 @token_required
 def send_low_stock_alerts(current_user):
-    """Send low stock alerts to all admins/doctors"""
+    """Send the pending low stock alerts now (the listener normally sends them)"""
     try:
-        # Only admins can trigger this
-        if current_user.get('role') != 'admin':
+        # Only admins (role_id=1) can trigger this
+        if current_user.get('role_id') != 1:
             return error_response('Unauthorized', 403)
 
         count = NotificationService.send_low_stock_alerts()
@@ -174,14 +233,14 @@ def get_daily_summary(current_user):
     try:
         doctor_id = request.args.get('doctor_id', type=int)
 
-        # If not specified, use current user (if they're a doctor)
+        # If not specified, use current user (if they're a doctor, role_id=2)
         if not doctor_id:
-            if current_user.get('role') != 'doctor':
+            if current_user.get('role_id') != 2:
                 return error_response('Only doctors can view daily summaries', 403)
             doctor_id = current_user['user_id']
 
-        # Admins can view any doctor's summary
-        if current_user.get('role') != 'admin' and doctor_id != current_user['user_id']:
+        # Admins (role_id=1) can view any doctor's summary
+        if current_user.get('role_id') != 1 and doctor_id != current_user['user_id']:
             return error_response('Unauthorized', 403)
 
         summary = NotificationService.generate_daily_summary_for_doctor(doctor_id)
@@ -198,8 +257,8 @@ def get_daily_summary(current_user):
 def send_daily_summaries(current_user):
     """Send daily summaries to all doctors (admin only)"""
     try:
-        # Only admins can trigger this
-        if current_user.get('role') != 'admin':
+        # Only admins (role_id=1) can trigger this
+        if current_user.get('role_id') != 1:
             return error_response('Unauthorized', 403)
 
         count = NotificationService.send_daily_summaries()
@@ -0,0 +1 @@
+# Tests for Notifications Service
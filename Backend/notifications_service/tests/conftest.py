@@ -0,0 +1,108 @@
+"""
+Fixtures compartidas: base PostgreSQL de pruebas (TEST_DATABASE_URL con el esquema de
+init_database.sql), productos y usuarios temporales
+"""
+import os
+import sys
+import uuid
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+# Los tests envian las alertas ellos mismos: sin el hilo LISTEN de la app
+os.environ.setdefault('LOW_STOCK_LISTEN_TIMEOUT', '0')
+
+# Scripts de esquema del servicio, en orden (todos son idempotentes)
+MIGRACIONES = ['add_low_stock_alerts.sql', 'add_reminder_planner.sql', 'add_notification_inbox.sql']
+
+
+@pytest.fixture(scope='session')
+def base_de_datos():
+    if not TEST_DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL no configurada')
+
+    # El pool se crea al importar common.database: si otro test ya lo abrio, se reabre
+    ya_importado = 'common.database' in sys.modules
+    anterior = os.environ.get('DATABASE_URL')
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+    sys.path.append(BACKEND_DIR)
+    from common.database import db
+    if ya_importado and anterior != TEST_DATABASE_URL:
+        db.close_all_connections()
+        db._initialize_pool()
+
+    for script in MIGRACIONES:
+        with open(os.path.join(BACKEND_DIR, 'scripts', script), encoding='utf-8') as f:
+            with db.get_cursor(commit=True) as cursor:
+                cursor.execute(f.read())
+
+    return db
+
+
+@pytest.fixture
+def datos(base_de_datos):
+    """Productos y usuarios propios de cada test; se borran al terminar"""
+    db = base_de_datos
+    prefijo = f"TEST-{uuid.uuid4().hex[:8]}"
+    creados = {'products': [], 'users': []}
+
+    def producto(stock, minimo=10):
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("""
+                INSERT INTO products (sku, name, cost_price, sale_price, stock_quantity, min_stock_alert)
+                VALUES (%s, %s, 1, 2, %s, %s) RETURNING product_id
+            """, (f"{prefijo}-{len(creados['products'])}", prefijo, stock, minimo))
+            creados['products'].append(cursor.fetchone()['product_id'])
+            return creados['products'][-1]
+
+    def usuario(rol='Admin', avisos_stock=None):
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("""
+                INSERT INTO users (role_id, full_name, email, password_hash)
+                SELECT role_id, %s, %s, 'x' FROM roles WHERE name = %s
+                RETURNING user_id
+            """, (prefijo, f"{prefijo}-{len(creados['users'])}@test.local", rol))
+            user_id = cursor.fetchone()['user_id']
+            if avisos_stock is not None:
+                cursor.execute("""
+                    INSERT INTO notification_preferences (user_id, low_stock_notifications) VALUES (%s, %s)
+                """, (user_id, avisos_stock))
+            creados['users'].append(user_id)
+            return user_id
+
+    yield producto, usuario
+
+    with db.get_cursor(commit=True) as cursor:
+        cursor.execute("DELETE FROM users WHERE user_id = ANY(%s)", (creados['users'],))
+        cursor.execute("DELETE FROM products WHERE product_id = ANY(%s)", (creados['products'],))
+
+
+@pytest.fixture
+def api(base_de_datos):
+    """Cliente de la app y tokens JWT de un usuario, firmados como los emite auth_service"""
+    from datetime import datetime, timedelta
+
+    import jwt
+    sys.path.append(os.path.join(BACKEND_DIR, 'notifications_service'))
+    from common import auth_middleware
+    from common.config import Config
+    from notifications_service.app import app
+
+    clave = Config.JWT_PRIVATE_KEY if auth_middleware.JWT_ALGORITHM == 'RS256' else Config.JWT_SECRET_KEY
+
+    def token(user_id):
+        with base_de_datos.get_cursor() as cursor:
+            cursor.execute("SELECT role_id, email FROM users WHERE user_id = %s", (user_id,))
+            usuario = cursor.fetchone()
+        ahora = datetime.utcnow()
+        return {'Authorization': 'Bearer ' + jwt.encode({
+            'user_id': user_id, 'role_id': usuario['role_id'], 'email': usuario['email'],
+            'iss': auth_middleware.JWT_ISSUER, 'aud': auth_middleware.JWT_AUDIENCE,
+            'iat': ahora, 'exp': ahora + timedelta(minutes=5)
+        }, clave, algorithm=auth_middleware.JWT_ALGORITHM)}
+
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client, token
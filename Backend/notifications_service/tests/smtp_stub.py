@@ -0,0 +1,172 @@
+"""
+Servidor SMTP local para los tests de EmailService
+Usado por los tests para no depender de un servidor de correo real
+
+Atiende EHLO/HELO, AUTH PLAIN y LOGIN, MAIL, RCPT, DATA, RSET, NOOP y QUIT (sin STARTTLS).
+"""
+import base64
+import threading
+import time
+from contextlib import contextmanager
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+
+
+class _SMTPStubHandler(StreamRequestHandler):
+    """Una sesion SMTP"""
+
+    def _responder(self, linea):
+        self.wfile.write(f"{linea}\r\n".encode('ascii'))
+
+    def _leer(self):
+        linea = self.rfile.readline()
+        if not linea:
+            return None
+        return linea.decode('utf-8', 'replace').rstrip('\r\n')
+
+    def handle(self):
+        stub = self.server.stub
+        stub._registrar('conexiones')
+        if stub.caido:
+            self._responder('421 Service not available')
+            return
+        self._responder('220 smtp.local ESMTP stub')
+
+        autenticado = not stub.usuario
+        remitente, destinatarios, mensajes = None, [], 0
+        while True:
+            linea = self._leer()
+            if linea is None:
+                return
+            comando = linea[:4].upper()
+
+            if comando == 'EHLO':
+                self._responder('250-smtp.local')
+                self._responder('250-AUTH PLAIN LOGIN')
+                self._responder('250 8BITMIME')
+            elif comando == 'HELO':
+                self._responder('250 smtp.local')
+            elif comando == 'AUTH':
+                partes = linea.split()
+                if partes[1].upper() == 'PLAIN':
+                    datos = partes[2] if len(partes) > 2 else None
+                    if datos is None:
+                        self._responder('334 ')
+                        datos = self._leer()
+                    _, usuario, clave = base64.b64decode(datos).decode('utf-8').split('\0')
+                else:
+                    self._responder('334 VXNlcm5hbWU6')
+                    usuario = base64.b64decode(self._leer()).decode('utf-8')
+                    self._responder('334 UGFzc3dvcmQ6')
+                    clave = base64.b64decode(self._leer()).decode('utf-8')
+                if (usuario, clave) == (stub.usuario, stub.clave):
+                    autenticado = True
+                    stub._registrar('logins')
+                    self._responder('235 Authentication successful')
+                else:
+                    self._responder('535 Authentication failed')
+            elif comando == 'MAIL':
+                if not autenticado:
+                    self._responder('530 Authentication required')
+                    continue
+                remitente, destinatarios = linea.split(':', 1)[1].split()[0].strip('<>'), []
+                self._responder('250 OK')
+            elif comando == 'RCPT':
+                destino = linea.split(':', 1)[1].split()[0].strip('<>')
+                if destino in stub.rechazados:
+                    self._responder('550 Mailbox unavailable')
+                else:
+                    destinatarios.append(destino)
+                    self._responder('250 OK')
+            elif comando == 'DATA':
+                self._responder('354 End data with <CR><LF>.<CR><LF>')
+                lineas = []
+                while True:
+                    dato = self._leer()
+                    if dato is None:
+                        return
+                    if dato == '.':
+                        break
+                    lineas.append(dato[1:] if dato.startswith('..') else dato)
+                time.sleep(stub.latencia)
+                with stub._lock:
+                    stub.mensajes.append((remitente, destinatarios, '\n'.join(lineas)))
+                self._responder('250 OK queued')
+                mensajes += 1
+                # El servidor cierra la sesion (limite por conexion, reinicio)
+                if stub.cortar_cada and mensajes % stub.cortar_cada == 0:
+                    return
+            elif comando == 'RSET':
+                remitente, destinatarios = None, []
+                self._responder('250 OK')
+            elif comando == 'NOOP':
+                self._responder('250 OK')
+            elif comando == 'QUIT':
+                self._responder('221 Bye')
+                return
+            else:
+                self._responder('502 Command not implemented')
+
+
+class SMTPStubServer:
+    """
+    Stand-in local de un servidor SMTP con autenticacion
+
+    - mensajes: (remitente, destinatarios, contenido) aceptados
+    - rechazados: destinatarios que reciben 550
+    - cortar_cada: cierra la conexion tras cada N mensajes aceptados (0: nunca)
+    - latencia: segundos que tarda en aceptar cada mensaje
+    - Registra conexiones TCP y logins
+    """
+
+    def __init__(self, usuario='clinica', clave='secreta', latencia=0.0):
+        self.usuario = usuario
+        self.clave = clave
+        self.latencia = latencia
+        self.mensajes = []
+        self.rechazados = set()
+        self.cortar_cada = 0
+        self.caido = False
+        self.conexiones = 0
+        self.logins = 0
+        self._lock = threading.Lock()
+
+        self._server = ThreadingTCPServer(('127.0.0.1', 0), _SMTPStubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def puerto(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def destinatarios(self):
+        """Destinatarios de los mensajes aceptados, en orden de llegada"""
+        return [destino for _, destinos, _ in self.mensajes for destino in destinos]
+
+    @contextmanager
+    def simular_caida(self):
+        """Las conexiones nuevas dentro del bloque reciben 421"""
+        self.caido = True
+        try:
+            yield self
+        finally:
+            self.caido = False
+
+    def _registrar(self, contador):
+        with self._lock:
+            setattr(self, contador, getattr(self, contador) + 1)
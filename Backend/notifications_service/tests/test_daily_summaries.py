@@ -0,0 +1,135 @@
+"""
+Tests de los resumenes diarios por lote: una consulta de citas para todos los medicos,
+una de stock bajo compartida y un solo INSERT de notificaciones
+
+Necesitan PostgreSQL (TEST_DATABASE_URL, ver conftest.py); se omiten si no existe.
+"""
+import os
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+HOY = datetime.combine(date.today(), datetime.min.time())
+
+
+@pytest.fixture(scope='module')
+def servicio(base_de_datos):
+    from common.notification_service import NotificationService
+    return NotificationService
+
+
+@pytest.fixture
+def consultorio(base_de_datos, datos):
+    """Citas de hoy (y de manana) de los medicos del test, borradas al terminar"""
+    db = base_de_datos
+    pacientes = []
+
+    def cita(doctor_id, inicio, motivo=None, estado='PENDING'):
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("""
+                INSERT INTO patients (doc_number, first_name, last_name) VALUES (%s, 'Paciente', %s)
+                RETURNING patient_id
+            """, (f"T{uuid.uuid4().hex[:12]}", str(len(pacientes))))
+            pacientes.append(cursor.fetchone()['patient_id'])
+            cursor.execute("""
+                INSERT INTO appointments (patient_id, doctor_id, start_time, end_time, reason, status)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (pacientes[-1], doctor_id, inicio, inicio + timedelta(minutes=20), motivo, estado))
+
+    yield cita
+
+    with db.get_cursor(commit=True) as cursor:
+        cursor.execute("DELETE FROM appointments WHERE patient_id = ANY(%s)", (pacientes,))
+        cursor.execute("DELETE FROM patients WHERE patient_id = ANY(%s)", (pacientes,))
+
+
+def _resumenes(db, usuarios):
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT user_id, title, message, metadata FROM notification_logs
+            WHERE notification_type = 'daily_summary' AND user_id = ANY(%s)
+        """, (usuarios,))
+        return {fila['user_id']: fila for fila in cursor.fetchall()}
+
+
+def test_un_resumen_por_medico(servicio, datos, consultorio, base_de_datos):
+    producto, usuario = datos
+    ana, luis, sin_resumen = usuario('Doctor'), usuario('Doctor'), usuario('Doctor')
+    admin = usuario('Admin')
+    with base_de_datos.get_cursor(commit=True) as cursor:
+        cursor.execute("INSERT INTO notification_preferences (user_id, daily_summary_enabled) VALUES (%s, FALSE)",
+                       (sin_resumen,))
+    producto(2, minimo=10)
+
+    consultorio(ana, HOY + timedelta(hours=11), 'Control')
+    consultorio(ana, HOY + timedelta(hours=9))
+    consultorio(ana, HOY + timedelta(hours=15), estado='CANCELLED')
+    consultorio(ana, HOY + timedelta(days=1, hours=9))
+
+    assert servicio.send_daily_summaries() >= 2
+    resumenes = _resumenes(base_de_datos, [ana, luis, sin_resumen, admin])
+    assert set(resumenes) == {ana, luis}
+
+    mensaje = resumenes[ana]['message']
+    assert mensaje.startswith("📅 Tiene 2 cita(s) programada(s) hoy:")
+    assert mensaje.index('09:00 - Paciente 1') < mensaje.index('11:00 - Paciente 0') < mensaje.index('Motivo: Control')
+    assert resumenes[luis]['message'].startswith("📅 No tiene citas programadas para hoy")
+    assert resumenes[ana]['title'] == f"📋 Resumen del Día - {date.today().strftime('%d/%m/%Y')}"
+    # El stock bajo es el mismo para todos
+    assert resumenes[ana]['metadata']['low_stock_count'] == resumenes[luis]['metadata']['low_stock_count'] >= 1
+    assert resumenes[ana]['metadata']['appointments_count'] == 2
+
+    # El resumen de un medico (endpoint) coincide con el del lote
+    assert servicio.generate_daily_summary_for_doctor(ana)['summary_message'] == mensaje
+
+
+def test_consultas_constantes_con_mas_medicos(servicio, datos, consultorio, base_de_datos, monkeypatch):
+    _, usuario = datos
+    medicos = [usuario('Doctor') for _ in range(150)]
+    for i, doctor in enumerate(medicos[:50]):
+        consultorio(doctor, HOY + timedelta(hours=8, minutes=10 * i))
+
+    # Nada por medico: ni consultas propias ni un INSERT por notificacion
+    def por_medico(*args, **kwargs):
+        raise AssertionError('consulta por medico')
+    monkeypatch.setattr(servicio, 'get_today_appointments_for_doctor', por_medico)
+    monkeypatch.setattr(servicio, 'create_notification', por_medico)
+
+    from common.database import db
+    cursores = []
+    original = db.get_cursor
+    monkeypatch.setattr(db, 'get_cursor', lambda *args, **kwargs: cursores.append(1) or original(*args, **kwargs))
+
+    inicio = time.perf_counter()
+    enviados = servicio.send_daily_summaries()
+    assert time.perf_counter() - inicio < 2
+    assert enviados >= 150 and len(cursores) == 4
+
+    resumenes = _resumenes(base_de_datos, medicos)
+    assert len(resumenes) == 150
+    assert sum(fila['metadata']['appointments_count'] for fila in resumenes.values()) == 50
+
+
+def test_endpoints_por_rol(api, datos, consultorio):
+    client, token = api
+    _, usuario = datos
+    ana, luis, admin = usuario('Doctor'), usuario('Doctor'), usuario('Admin')
+    consultorio(ana, HOY + timedelta(hours=9))
+
+    # Un medico ve su resumen, no el de otro medico, y no puede enviar los de todos
+    propio = client.get('/api/notifications/daily-summary', headers=token(ana))
+    assert propio.status_code == 200 and propio.get_json()['data']['appointments_count'] == 1
+    assert client.get(f'/api/notifications/daily-summary?doctor_id={luis}', headers=token(ana)).status_code == 403
+    assert client.post('/api/notifications/daily-summary/send', headers=token(ana)).status_code == 403
+
+    # El admin ve el de cualquier medico y dispara el envio
+    ajeno = client.get(f'/api/notifications/daily-summary?doctor_id={ana}', headers=token(admin))
+    assert ajeno.status_code == 200 and ajeno.get_json()['data']['appointments_count'] == 1
+    assert client.get('/api/notifications/daily-summary', headers=token(admin)).status_code == 403
+    enviados = client.post('/api/notifications/daily-summary/send', headers=token(admin))
+    assert enviados.status_code == 200 and enviados.get_json()['data']['summaries_sent'] >= 2
@@ -0,0 +1,126 @@
+"""
+Tests del envio de correo por conexiones SMTP persistentes: pool por cuenta,
+reconexion, limite de envios por segundo y resumen de cada corrida
+
+Usan un servidor SMTP local (smtp_stub.py); no necesitan base de datos.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from smtp_stub import SMTPStubServer
+
+
+@pytest.fixture
+def servidor():
+    with SMTPStubServer() as server:
+        yield server
+
+
+def _servicio(servidor, pool_size=2, rate_limit=0):
+    from common.email_service import EmailService
+    servicio = EmailService()
+    servicio.smtp_host, servicio.smtp_port = '127.0.0.1', servidor.puerto
+    servicio.smtp_user, servicio.smtp_password = servidor.usuario, servidor.clave
+    servicio.from_email, servicio.use_starttls = 'clinica@test.local', False
+    servicio.pool_size, servicio.rate_limit = pool_size, rate_limit
+    return servicio
+
+
+def _correos(n, prefijo='paciente'):
+    return [
+        {'to_email': f"{prefijo}{i}@test.local", 'subject': f"Recordatorio {i}",
+         'html_content': f"<p>Cita {i}</p>", 'text_content': f"Cita {i}"}
+        for i in range(n)
+    ]
+
+
+def test_conexiones_persistentes(servidor):
+    servicio = _servicio(servidor, pool_size=2)
+    resumen = servicio.send_many(_correos(30))
+
+    assert (resumen['sent'], resumen['failed'], resumen['total']) == (30, 0, 30)
+    assert resumen['results'] == [True] * 30
+    # Un login por conexion, no por mensaje
+    assert resumen['connections'] == servidor.conexiones == servidor.logins <= 2
+    assert sorted(servidor.destinatarios()) == sorted(f"paciente{i}@test.local" for i in range(30))
+
+    # send_email y otra instancia de la misma cuenta reutilizan las mismas conexiones
+    assert _servicio(servidor).send_email('otro@test.local', 'Hola', '<p>Hola</p>')
+    assert servidor.conexiones <= 2
+
+
+def test_reconexion_sin_duplicados(servidor):
+    servidor.cortar_cada = 3
+    servicio = _servicio(servidor, pool_size=1)
+    resumen = servicio.send_many(_correos(10))
+
+    assert resumen['sent'] == 10 and resumen['reconnects'] == 3
+    assert servidor.destinatarios() == [f"paciente{i}@test.local" for i in range(10)]
+
+
+def test_timeout_no_reenvia(servidor, monkeypatch):
+    import time
+
+    import common.email_service as email_service
+    monkeypatch.setattr(email_service, 'SMTP_TIMEOUT', 0.3)
+    servidor.latencia = 0.6
+    servicio = _servicio(servidor, pool_size=1)
+
+    # El servidor acepta el mensaje despues del timeout: no se envia otra vez
+    assert servicio.send_email('lento@test.local', 'Hola', '<p>Hola</p>') is False
+    time.sleep(0.5)
+    assert servidor.destinatarios() == ['lento@test.local']
+
+    # La sesion abandonada se reemplaza por una nueva
+    servidor.latencia = 0
+    assert servicio.send_email('siguiente@test.local', 'Hola', '<p>Hola</p>') is True
+    assert servidor.conexiones == 2 and servidor.destinatarios()[-1] == 'siguiente@test.local'
+
+
+def test_conexion_renovada_tras_limite_de_mensajes(servidor):
+    from common.email_service import get_smtp_pool
+    servicio = _servicio(servidor, pool_size=1)
+    get_smtp_pool(servicio).max_messages = 4
+    resumen = servicio.send_many(_correos(10))
+    assert resumen['sent'] == 10 and resumen['connections'] == 3 and resumen['reconnects'] == 0
+
+
+def test_destinatario_rechazado_no_afecta_al_resto(servidor):
+    servidor.rechazados = {'paciente2@test.local'}
+    servicio = _servicio(servidor, pool_size=1)
+    resumen = servicio.send_many(_correos(5))
+
+    assert (resumen['sent'], resumen['failed']) == (4, 1)
+    assert resumen['results'] == [True, True, False, True, True]
+    assert resumen['errors'][0][0] == 'paciente2@test.local'
+    assert servidor.conexiones == 1
+
+
+def test_envio_concurrente_y_limite_por_segundo(servidor):
+    servidor.latencia = 0.05
+    # 20 mensajes de 50 ms: en serie tomarian un segundo
+    resumen = _servicio(servidor, pool_size=4).send_many(_correos(20))
+    assert resumen['sent'] == 20 and resumen['seconds'] < 0.6
+
+    # 40 por segundo con rafaga de 40: los 20 mensajes que exceden la rafaga esperan medio segundo
+    servidor.latencia = 0
+    limitado = _servicio(servidor, pool_size=4, rate_limit=40)
+    limitado.smtp_user = servidor.usuario = 'cuenta-limitada'
+    resumen = limitado.send_many(_correos(60, 'limitado'))
+    assert resumen['sent'] == 60 and resumen['seconds'] >= 0.45
+
+
+def test_servidor_caido(servidor):
+    servicio = _servicio(servidor, pool_size=1)
+    with servidor.simular_caida():
+        assert servicio.send_email('a@test.local', 'Hola', '<p>Hola</p>') is False
+        resumen = servicio.send_many(_correos(3))
+    assert (resumen['sent'], resumen['failed']) == (0, 3)
+
+    # Al volver el servidor se envia sin reiniciar el servicio
+    assert servicio.send_email('a@test.local', 'Hola', '<p>Hola</p>') is True
@@ -0,0 +1,154 @@
+"""
+Tests de las alertas de stock bajo (trigger de products, de-duplicacion y envio)
+
+Necesitan PostgreSQL (TEST_DATABASE_URL, ver conftest.py); se omiten si no existe.
+"""
+import os
+import select
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+
+@pytest.fixture(scope='module')
+def servicio(base_de_datos):
+    from common.notification_service import NotificationService
+    return NotificationService
+
+
+def _alertas(db, product_id):
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT alert_id, stock_quantity, resolved_at IS NULL as abierta, notified_at IS NOT NULL as enviada
+            FROM low_stock_alerts WHERE product_id = %s ORDER BY alert_id
+        """, (product_id,))
+        return cursor.fetchall()
+
+
+def _stock(db, cambios):
+    """Un solo UPDATE para todos los productos (como un lote de movimientos)"""
+    with db.get_cursor(commit=True) as cursor:
+        for product_id, stock in cambios.items():
+            cursor.execute("UPDATE products SET stock_quantity = %s WHERE product_id = %s", (stock, product_id))
+
+
+def _avisos(db, alert_id):
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT user_id, title, message FROM notification_logs
+            WHERE notification_type = 'low_stock' AND metadata->'alert_ids' @> to_jsonb(%s::int)
+        """, (alert_id,))
+        return cursor.fetchall()
+
+
+def test_una_alerta_por_cruce(servicio, datos, base_de_datos):
+    producto, _ = datos
+    gasas = producto(50, minimo=10)
+    assert _alertas(base_de_datos, gasas) == []
+
+    _stock(base_de_datos, {gasas: 8})
+    _stock(base_de_datos, {gasas: 3})      # sigue bajo: no se repite
+    _stock(base_de_datos, {gasas: 0})
+    assert [(a['stock_quantity'], a['abierta']) for a in _alertas(base_de_datos, gasas)] == [(8, True)]
+
+    _stock(base_de_datos, {gasas: 30})     # se repone: se cierra
+    _stock(base_de_datos, {gasas: 10})     # vuelve a cruzar: alerta nueva
+    assert [(a['stock_quantity'], a['abierta']) for a in _alertas(base_de_datos, gasas)] == [(8, False), (10, True)]
+
+    # Desactivar el producto tambien cierra la alerta; un producto nuevo bajo el minimo abre una
+    with base_de_datos.get_cursor(commit=True) as cursor:
+        cursor.execute("UPDATE products SET is_active = FALSE WHERE product_id = %s", (gasas,))
+    assert not any(a['abierta'] for a in _alertas(base_de_datos, gasas))
+    assert [a['stock_quantity'] for a in _alertas(base_de_datos, producto(2, minimo=5))] == [2]
+
+
+def test_lote_avisa_una_vez_por_transaccion(servicio, datos, base_de_datos):
+    import psycopg2
+    from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+    producto, _ = datos
+    productos = [producto(100) for _ in range(5)]
+
+    oyente = psycopg2.connect(os.environ['DATABASE_URL'])
+    oyente.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        with oyente.cursor() as cursor:
+            cursor.execute("LISTEN low_stock")
+
+        with base_de_datos.get_cursor(commit=True) as cursor:
+            cursor.execute("""
+                UPDATE products SET stock_quantity = product_id %% 3 WHERE product_id = ANY(%s)
+            """, (productos,))
+            cursor.execute("UPDATE products SET stock_quantity = 4 WHERE product_id = %s", (productos[0],))
+
+        assert select.select([oyente], [], [], 5) != ([], [], [])
+        oyente.poll()
+        assert len(oyente.notifies) == 1
+
+        # Sin cruces no hay aviso
+        oyente.notifies.clear()
+        _stock(base_de_datos, {productos[0]: 1})
+        assert select.select([oyente], [], [], 0.5) == ([], [], [])
+    finally:
+        oyente.close()
+
+    assert all(len(_alertas(base_de_datos, product_id)) == 1 for product_id in productos)
+
+
+def test_envio_una_vez_por_destinatario(servicio, datos, base_de_datos):
+    producto, usuario = datos
+    admin, doctor = usuario('Admin'), usuario('Doctor', avisos_stock=True)
+    silenciado, recepcion = usuario('Doctor', avisos_stock=False), usuario('Recepcion')
+    bajos = [producto(50) for _ in range(12)]
+    repuesto = producto(50)
+
+    _stock(base_de_datos, {**{product_id: 1 for product_id in bajos}, repuesto: 2})
+    _stock(base_de_datos, {repuesto: 80})     # se repone antes del envio: no se avisa
+
+    servicio.send_low_stock_alerts()
+    [alerta] = _alertas(base_de_datos, bajos[0])
+    avisos = _avisos(base_de_datos, alerta['alert_id'])
+
+    destinatarios = {aviso['user_id'] for aviso in avisos}
+    assert {admin, doctor} <= destinatarios and not {silenciado, recepcion} & destinatarios
+    assert len(avisos) == len(destinatarios)
+    assert len({(aviso['title'], aviso['message']) for aviso in avisos}) == 1
+    assert '... y ' in avisos[0]['message']
+
+    assert _alertas(base_de_datos, bajos[0])[0]['enviada']
+    assert not _alertas(base_de_datos, repuesto)[0]['enviada']
+
+    # Lo ya enviado no se repite
+    servicio.send_low_stock_alerts()
+    assert len(_avisos(base_de_datos, alerta['alert_id'])) == len(avisos)
+
+
+def test_envios_concurrentes_no_duplican(servicio, datos, base_de_datos):
+    producto, usuario = datos
+    usuario('Admin')
+    productos = [producto(50) for _ in range(30)]
+
+    for product_id in productos:
+        _stock(base_de_datos, {product_id: 0})
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        list(executor.map(lambda _: servicio.send_low_stock_alerts(limit=5), range(12)))
+
+    for product_id in productos:
+        [alerta] = _alertas(base_de_datos, product_id)
+        avisos = _avisos(base_de_datos, alerta['alert_id'])
+        assert alerta['enviada'] and len(avisos) == len({aviso['user_id'] for aviso in avisos})
+
+
+def test_listado_de_stock_bajo(servicio, datos, base_de_datos):
+    producto, _ = datos
+    critico, bajo, normal = producto(0, minimo=20), producto(9), producto(500)
+
+    ids = {fila['product_id']: fila for fila in servicio.get_low_stock_products()}
+    assert critico in ids and bajo in ids and normal not in ids
+    assert (ids[critico]['current_stock'], ids[critico]['units_needed']) == (0, 20)
+
+    assert bajo not in {fila['product_id'] for fila in servicio.get_low_stock_products(minimum_threshold=5)}
+    assert critico in {alerta['product_id'] for alerta in servicio.get_low_stock_alerts()}
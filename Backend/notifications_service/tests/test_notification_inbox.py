@@ -0,0 +1,146 @@
+"""
+Tests de la bandeja de notificaciones: secuencia por usuario, contador de no leidas
+mantenido por triggers, consulta incremental con cursor y marcado masivo
+
+Necesitan PostgreSQL (TEST_DATABASE_URL, ver conftest.py); se omiten si no existe.
+"""
+import os
+import sys
+import threading
+
+import psycopg2
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from conftest import BACKEND_DIR, TEST_DATABASE_URL
+
+
+@pytest.fixture(scope='module')
+def bandeja(base_de_datos):
+    from common.notification_inbox import NotificationInbox
+    return NotificationInbox
+
+
+def _avisar(user_id, n, prefijo='Aviso'):
+    from common.notification_service import NotificationService
+    return [NotificationService.create_notification(user_id, 'test', f"{prefijo} {i}", 'x') for i in range(n)]
+
+
+def _secuencias(db, user_id):
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT inbox_seq FROM notification_logs WHERE user_id = %s ORDER BY log_id", (user_id,))
+        return [fila['inbox_seq'] for fila in cursor.fetchall()]
+
+
+def test_secuencia_y_contador(bandeja, datos, base_de_datos):
+    producto, usuario = datos
+    ana, luis = usuario('Admin'), usuario('Doctor')
+    _avisar(ana, 3)
+    _avisar(luis, 2)
+
+    # Tambien las notificaciones insertadas en lote (alertas de stock) entran a la bandeja
+    producto(1, minimo=10)
+    from common.notification_service import NotificationService
+    NotificationService.send_low_stock_alerts()
+
+    assert _secuencias(base_de_datos, ana) == [1, 2, 3, 4]
+    assert _secuencias(base_de_datos, luis) == [1, 2, 3]
+    assert (bandeja.get_unread_count(ana), bandeja.get_unread_count(luis)) == (4, 3)
+    assert bandeja.get_unread_count(-1) == 0
+
+
+def test_consulta_incremental(bandeja, datos, base_de_datos):
+    _, usuario = datos
+    ana = usuario('Admin')
+    _avisar(ana, 5)
+
+    # Sin cursor: las ultimas, de la mas nueva a la mas vieja
+    primera = bandeja.get_notifications(ana, limit=3)
+    assert [n['title'] for n in primera['notifications']] == ['Aviso 4', 'Aviso 3', 'Aviso 2']
+    assert (primera['cursor'], primera['has_more'], primera['unread_count']) == (5, True, 5)
+
+    # Nada nuevo
+    assert bandeja.get_notifications(ana, since=primera['cursor']) == {
+        'notifications': [], 'unread_count': 5, 'cursor': 5, 'has_more': False}
+
+    # Solo las nuevas, en orden; con mas de `limit` se sigue desde el cursor devuelto
+    _avisar(ana, 3, 'Nuevo')
+    delta = bandeja.get_notifications(ana, since=primera['cursor'], limit=2)
+    assert [n['title'] for n in delta['notifications']] == ['Nuevo 0', 'Nuevo 1']
+    assert (delta['cursor'], delta['has_more'], delta['unread_count']) == (7, True, 8)
+    resto = bandeja.get_notifications(ana, since=delta['cursor'], limit=2)
+    assert [n['title'] for n in resto['notifications']] == ['Nuevo 2'] and not resto['has_more']
+
+    # Otro usuario no ve nada de ana
+    assert bandeja.get_notifications(usuario('Doctor'))['notifications'] == []
+
+
+def test_marcado_masivo(bandeja, datos, base_de_datos):
+    _, usuario = datos
+    ana, luis = usuario('Admin'), usuario('Doctor')
+    avisos = _avisar(ana, 6)
+    ajeno = _avisar(luis, 1)[0]
+
+    # Solo las propias: la de otro usuario no se toca
+    assert bandeja.mark_as_read(ana, log_ids=[avisos[0], avisos[1], ajeno]) == {'marked': 2, 'unread_count': 4}
+    assert bandeja.get_unread_count(luis) == 1
+    # Ya leidas no cuentan otra vez
+    assert bandeja.mark_as_read(ana, log_ids=[avisos[0]])['marked'] == 0
+
+    assert bandeja.mark_as_read(ana, up_to=4) == {'marked': 2, 'unread_count': 2}
+    no_leidas = bandeja.get_notifications(ana, unread_only=True)['notifications']
+    assert [n['inbox_seq'] for n in no_leidas] == [6, 5]
+
+    # Borrar una no leida tambien ajusta el contador
+    with base_de_datos.get_cursor(commit=True) as cursor:
+        cursor.execute("DELETE FROM notification_logs WHERE log_id = %s", (avisos[5],))
+    assert bandeja.get_unread_count(ana) == 1
+    assert bandeja.mark_as_read(ana) == {'marked': 1, 'unread_count': 0}
+
+
+def test_el_cursor_no_salta_notificaciones_sin_confirmar(bandeja, datos, base_de_datos):
+    _, usuario = datos
+    ana = usuario('Admin')
+    _avisar(ana, 1)
+    cursor_inicial = bandeja.get_notifications(ana)['cursor']
+
+    # Una transaccion larga inserta y aun no confirma; otra notificacion llega mientras tanto
+    conexion = psycopg2.connect(TEST_DATABASE_URL)
+    try:
+        with conexion.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO notification_logs (user_id, notification_type, title) VALUES (%s, 'test', 'Lenta')
+            """, (ana,))
+        otra = threading.Thread(target=_avisar, args=(ana, 1, 'Rapida'))
+        otra.start()
+        otra.join(0.5)
+        # La segunda espera a la primera: ninguna es visible y el cursor no avanza
+        assert otra.is_alive()
+        assert bandeja.get_notifications(ana, since=cursor_inicial)['notifications'] == []
+        conexion.commit()
+        otra.join(5)
+    finally:
+        conexion.close()
+
+    delta = bandeja.get_notifications(ana, since=cursor_inicial)
+    assert [n['title'] for n in delta['notifications']] == ['Lenta', 'Rapida 0']
+
+
+def test_carga_inicial_recalcula(bandeja, datos, base_de_datos):
+    _, usuario = datos
+    ana = usuario('Admin')
+    avisos = _avisar(ana, 3)
+    with base_de_datos.get_cursor(commit=True) as cursor:
+        # Filas anteriores a la bandeja: sin secuencia ni contador
+        cursor.execute("UPDATE notification_logs SET inbox_seq = NULL WHERE log_id = %s", (avisos[2],))
+        cursor.execute("DELETE FROM notification_inbox WHERE user_id = %s", (ana,))
+
+    with open(os.path.join(BACKEND_DIR, 'scripts', 'add_notification_inbox.sql'), encoding='utf-8') as f:
+        with base_de_datos.get_cursor(commit=True) as cursor:
+            cursor.execute(f.read())
+
+    assert bandeja.get_unread_count(ana) == 3
+    assert sorted(_secuencias(base_de_datos, ana)) == [1, 2, 3]
+    _avisar(ana, 1)
+    assert _secuencias(base_de_datos, ana)[-1] == 4
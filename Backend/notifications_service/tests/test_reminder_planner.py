@@ -0,0 +1,185 @@
+"""
+Tests del plan de recordatorios de citas: una consulta arma todos los envios, un pool
+de hilos los despacha y un solo INSERT registra los resultados
+
+Necesitan PostgreSQL (TEST_DATABASE_URL, ver conftest.py); se omiten si no existe.
+"""
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+# Hora fija: las citas se ubican respecto a ella, lejos de las de otros tests
+AHORA = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=400)
+
+
+class EnvioFalso:
+    """Registra los envios (desde varios hilos); falla para los destinatarios en `fallar`"""
+
+    def __init__(self, demora=0, fallar=()):
+        self.demora = demora
+        self.fallar = set(fallar)
+        self.enviados = []
+        self.hilos = set()
+        self._lock = threading.Lock()
+
+    def send_appointment_reminder(self, destino, datos, horas):
+        time.sleep(self.demora)
+        with self._lock:
+            self.enviados.append((destino, horas))
+            self.hilos.add(threading.current_thread().name)
+        if destino in self.fallar:
+            raise ConnectionError('SMTP caido')
+        return True
+
+
+@pytest.fixture
+def agenda(base_de_datos):
+    """Medicos con su configuracion, pacientes y citas propios de cada test"""
+    db = base_de_datos
+    prefijo = f"test-{uuid.uuid4().hex[:8]}"
+    creados = {'users': [], 'patients': []}
+
+    def medico(email_horas=(24, 3), whatsapp_horas=(24,), whatsapp=True, automatico=True):
+        with db.get_cursor(commit=True) as cursor:
+            cursor.execute("""
+                INSERT INTO users (role_id, full_name, email, password_hash)
+                VALUES (2, %s, %s, 'x') RETURNING user_id
+            """, (prefijo, f"{prefijo}-{len(creados['users'])}@test.local"))
+            user_id = cursor.fetchone()['user_id']
+            cursor.execute("""
+                INSERT INTO reminder_settings (user_id, email_hours_before, whatsapp_enabled,
+                                               whatsapp_hours_before, auto_send_enabled)
+                VALUES (%s, to_jsonb(%s::int[]), %s, to_jsonb(%s::int[]), %s)
+            """, (user_id, list(email_horas), whatsapp, list(whatsapp_horas), automatico))
+            creados['users'].append(user_id)
+            return user_id
+
+    def cita(doctor_id, inicio, email=True, telefono='0991234567'):
+        with db.get_cursor(commit=True) as cursor:
+            n = len(creados['patients'])
+            cursor.execute("""
+                INSERT INTO patients (doc_number, first_name, last_name, email, phone)
+                VALUES (%s, 'Paciente', %s, %s, %s) RETURNING patient_id
+            """, (f"{prefijo}-{n}", str(n), f"{prefijo}-{n}@paciente.local" if email else None, telefono))
+            patient_id = cursor.fetchone()['patient_id']
+            creados['patients'].append(patient_id)
+            cursor.execute("""
+                INSERT INTO appointments (patient_id, doctor_id, start_time, end_time)
+                VALUES (%s, %s, %s, %s) RETURNING appointment_id
+            """, (patient_id, doctor_id, inicio, inicio + timedelta(minutes=5)))
+            return cursor.fetchone()['appointment_id']
+
+    yield medico, cita
+
+    with db.get_cursor(commit=True) as cursor:
+        cursor.execute("DELETE FROM appointments WHERE doctor_id = ANY(%s)", (creados['users'],))
+        cursor.execute("DELETE FROM patients WHERE patient_id = ANY(%s)", (creados['patients'],))
+        cursor.execute("DELETE FROM users WHERE user_id = ANY(%s)", (creados['users'],))
+
+
+@pytest.fixture
+def gestor(base_de_datos):
+    from common.reminder_manager import ReminderManager
+    gestor = ReminderManager()
+    gestor.email_service, gestor.whatsapp_service = EnvioFalso(), EnvioFalso()
+    return gestor
+
+
+def _registros(db, citas):
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT appointment_id, reminder_type, hours_before, status, recipient_phone
+            FROM reminder_logs WHERE appointment_id = ANY(%s)
+            ORDER BY appointment_id, reminder_type, hours_before
+        """, (list(citas),))
+        return [tuple(fila.values()) for fila in cursor.fetchall()]
+
+
+def test_plan_por_canal_y_horas(gestor, agenda, base_de_datos):
+    medico, cita = agenda
+    ana = medico(email_horas=(24, 3), whatsapp_horas=(24,))
+    sin_whatsapp = medico(email_horas=(48,), whatsapp=False)
+    manual = medico(automatico=False)
+
+    manana = cita(ana, AHORA + timedelta(hours=24, minutes=20))
+    en_tres = cita(ana, AHORA + timedelta(hours=3))
+    fuera = cita(ana, AHORA + timedelta(hours=10))
+    pasado = cita(sin_whatsapp, AHORA + timedelta(hours=48))
+    cita(manual, AHORA + timedelta(hours=24))
+
+    plan = gestor.plan_reminders(AHORA)
+    assert sorted((r['appointment_id'], r['channel'], r['hours_before']) for r in plan) == sorted([
+        (manana, 'email', 24), (manana, 'whatsapp', 24), (en_tres, 'email', 3), (pasado, 'email', 48),
+    ])
+    assert fuera not in {r['appointment_id'] for r in plan}
+    assert plan[0]['patient_name'].startswith('Paciente') and plan[0]['doctor_name']
+
+
+def test_enviados_no_se_repiten(gestor, agenda, base_de_datos):
+    medico, cita = agenda
+    ana = medico()
+    manana = cita(ana, AHORA + timedelta(hours=24))
+    en_tres = cita(ana, AHORA + timedelta(hours=3), telefono='+593987654321')
+    sin_correo = cita(ana, AHORA + timedelta(hours=3, minutes=10), email=False)
+
+    # Un registro ya enviado no se repite; uno fallido se reintenta
+    with base_de_datos.get_cursor(commit=True) as cursor:
+        cursor.execute("""
+            INSERT INTO reminder_logs (appointment_id, reminder_type, hours_before, status)
+            VALUES (%s, 'whatsapp', 24, 'sent'), (%s, 'email', 24, 'failed')
+        """, (manana, manana))
+
+    estadisticas = gestor.process_scheduled_reminders(now=AHORA)
+    assert (estadisticas['email_sent'], estadisticas['whatsapp_sent']) == (2, 0)
+    assert (estadisticas['skipped'], estadisticas['failed'], estadisticas['total_processed']) == (1, 0, 3)
+
+    assert _registros(base_de_datos, [manana, en_tres, sin_correo]) == [
+        (manana, 'email', 24, 'failed', None),
+        (manana, 'email', 24, 'sent', None),
+        (manana, 'whatsapp', 24, 'sent', None),
+        (en_tres, 'email', 3, 'sent', None),
+    ]
+    # Nada pendiente en la siguiente corrida (salvo el paciente sin correo, que se omite otra vez)
+    segunda = gestor.process_scheduled_reminders(now=AHORA)
+    assert (segunda['email_sent'], segunda['skipped']) == (0, 1)
+
+
+def test_un_fallo_no_detiene_la_corrida(gestor, agenda, base_de_datos):
+    medico, cita = agenda
+    ana = medico(email_horas=(24,), whatsapp_horas=(24,))
+    citas = [cita(ana, AHORA + timedelta(hours=24, minutes=5 * i)) for i in range(4)]
+    with base_de_datos.get_cursor() as cursor:
+        cursor.execute("SELECT email FROM patients p JOIN appointments a USING (patient_id) WHERE a.appointment_id = %s",
+                       (citas[1],))
+        gestor.email_service.fallar = {cursor.fetchone()['email']}
+
+    estadisticas = gestor.process_scheduled_reminders(now=AHORA)
+    assert (estadisticas['email_sent'], estadisticas['whatsapp_sent'], estadisticas['failed']) == (3, 4, 1)
+    fallido = [r for r in _registros(base_de_datos, citas) if r[3] == 'failed']
+    assert fallido == [(citas[1], 'email', 24, 'failed', None)]
+    # Numero de WhatsApp con codigo de pais
+    assert {r[4] for r in _registros(base_de_datos, citas) if r[1] == 'whatsapp'} == {'+593991234567'}
+
+
+def test_miles_de_citas_en_segundos(gestor, agenda, base_de_datos):
+    medico, cita = agenda
+    medicos = [medico(email_horas=(24,), whatsapp_horas=(24,)) for _ in range(40)]
+    citas = [
+        cita(doctor, AHORA + timedelta(hours=24, minutes=-25 + 5 * i))
+        for doctor in medicos for i in range(10)
+    ]
+    # 10 ms por mensaje: 800 mensajes en serie serian 8 segundos
+    gestor.email_service.demora = gestor.whatsapp_service.demora = 0.01
+
+    estadisticas = gestor.process_scheduled_reminders(now=AHORA, workers=32)
+    assert (estadisticas['email_sent'], estadisticas['whatsapp_sent']) == (400, 400)
+    assert estadisticas['seconds'] < 4
+    assert len(gestor.email_service.hilos | gestor.whatsapp_service.hilos) > 1
+    assert len(_registros(base_de_datos, citas)) == 800
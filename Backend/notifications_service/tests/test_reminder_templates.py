@@ -0,0 +1,94 @@
+"""
+Tests de las plantillas de recordatorios compiladas una vez: constantes fijadas al
+compilar, fechas en espanol, escape del HTML y render de lotes con cache
+
+No necesitan base de datos.
+"""
+import os
+import sys
+from datetime import date, datetime
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+CITA = {
+    'patient_name': 'Ana <Maria> & Co',
+    'doctor_name': 'Luis Paredes',
+    'appointment_date': datetime(2026, 3, 2, 9, 30),
+    'appointment_time': '09:30',
+    'reason': 'Control',
+}
+
+
+def test_plantilla_compilada():
+    from common.reminder_templates import CompiledTemplate
+    plantilla = CompiledTemplate("{clinica} <{nombre}> {{literal}} {monto:.2f}",
+                                 {'clinica': 'A & B'}, escape=lambda valor: valor.replace('&', '&amp;'))
+    assert plantilla.source == "A &amp; B <{nombre}> {{literal}} {monto:.2f}"
+    assert plantilla.fields == ('nombre', 'monto')
+    assert plantilla.render({'nombre': 'x', 'monto': 3}) == "A &amp; B <x> {literal} 3.00"
+
+
+def test_correo_de_recordatorio():
+    from common.reminder_templates import EMAIL_HTML_TEMPLATE, ReminderTemplates
+    asunto, html_content, texto = ReminderTemplates().email(CITA, 3)
+
+    assert asunto == "🔔 Recordatorio: Cita Médica - 02 de marzo de 2026"
+    # El HTML escapa los datos; el texto plano no
+    assert 'Ana &lt;Maria&gt; &amp; Co' in html_content and '<Maria>' not in html_content
+    assert 'Hola Ana <Maria> & Co,' in texto
+    assert 'programada en 3 horas' in texto and '02 de marzo de 2026' in texto and '⏰ Hora: 09:30' in texto
+    assert 'href="tel:021234567"' in html_content and 'Av. Principal 123, Quito' in html_content
+    # La clinica queda fija al compilar
+    assert 'clinic_name' not in EMAIL_HTML_TEMPLATE.fields and html_content.count('Clínica Bienestar') == 3
+
+
+def test_whatsapp_y_fechas():
+    from common.reminder_templates import ReminderTemplates
+    plantillas = ReminderTemplates()
+
+    mensaje = plantillas.whatsapp({**CITA, 'appointment_date': '2026-12-24T16:05:00Z'}, 72)
+    assert 'Hola *Ana <Maria> & Co*' in mensaje and '*en 3 días*' in mensaje
+    assert '📅 *Fecha:* 24/12/2026' in mensaje and '⏰ *Hora:* 16:05' in mensaje
+    assert '*mañana*' in plantillas.whatsapp(CITA, 24) and '*en 1 día*' in plantillas.whatsapp(CITA, 36)
+
+    # Sin hora, fecha que no se entiende y datos faltantes
+    _, _, texto = plantillas.email({'appointment_date': date(2026, 1, 5)}, 24)
+    assert 'Fecha: 05 de enero de 2026' in texto and 'Hola Paciente,' in texto and 'Motivo: Consulta médica' in texto
+    _, _, texto = plantillas.email({'appointment_date': 'el lunes', 'appointment_time': '10:00'}, 24)
+    assert 'Fecha: el lunes' in texto and 'Hora: 10:00' in texto
+    assert plantillas.email({}, 24)[0].endswith('Próximamente')
+
+
+def test_lote_en_orden_con_cache():
+    from common.reminder_templates import ReminderTemplates
+    plantillas = ReminderTemplates()
+    recordatorios = [
+        {'appointment_data': {**CITA, 'patient_name': f"Paciente {i}"}, 'hours_before': 24}
+        for i in range(50)
+    ]
+
+    mensajes = plantillas.render_batch(recordatorios, channel='whatsapp')
+    assert [m.split('*')[3] for m in mensajes] == [f"Paciente {i}" for i in range(50)]
+    correos = plantillas.render_batch(recordatorios)
+    assert correos[7] == plantillas.email(recordatorios[7]['appointment_data'])
+
+    # Una sola fecha: se calcula una vez para todo el lote
+    assert plantillas.cache_info()['when']['misses'] == 1
+    sin_cache = ReminderTemplates(cache_size=0)
+    assert sin_cache.render_batch(recordatorios) == correos
+    assert sin_cache.cache_info()['when']['hits'] == 0
+
+    with pytest.raises(ValueError):
+        plantillas.render_batch(recordatorios, channel='sms')
+
+
+def test_servicios_usan_las_plantillas():
+    from common.email_service import EmailService
+    from common.reminder_templates import reminder_templates
+    from common.whatsapp_service import WhatsAppService
+
+    _, html_content, texto = reminder_templates.email(CITA, 24)
+    assert EmailService().get_appointment_reminder_template(CITA, 24) == (html_content, texto)
+    assert WhatsAppService().get_appointment_reminder_message(CITA, 3) == reminder_templates.whatsapp(CITA, 3)
@@ -0,0 +1,164 @@
+"""
+Tests del envio masivo de WhatsApp: pool de hilos acotado, ritmo por numero de envio
+(token bucket), reintentos con jitter ante 429/5xx y estadisticas de cada lote
+
+Usan una API de Twilio local (twilio_stub.py); no necesitan base de datos.
+"""
+import os
+import random
+import sys
+import uuid
+from datetime import datetime
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from twilio_stub import TwilioStubServer
+
+CITA = {'patient_name': 'Ana', 'doctor_name': 'Luis Paredes', 'appointment_date': datetime(2026, 3, 2, 9, 30)}
+
+
+@pytest.fixture
+def twilio():
+    with TwilioStubServer() as server:
+        yield server
+
+
+def _servicio(twilio, rate_limit=0, max_attempts=4, retry_backoff=0.01):
+    """Servicio contra la API local; un numero de envio nuevo por test (su propio token bucket)"""
+    from common.whatsapp_service import WhatsAppService
+    servicio = WhatsAppService()
+    servicio.account_sid, servicio.auth_token = twilio.account_sid, twilio.auth_token
+    servicio.enabled, servicio.api_url = True, twilio.base_url
+    servicio.from_number = f"whatsapp:+1555{uuid.uuid4().int % 10 ** 7:07d}"
+    servicio.rate_limit, servicio.max_attempts, servicio.retry_backoff = rate_limit, max_attempts, retry_backoff
+    return servicio
+
+
+def _recordatorios(n):
+    return [
+        {'to_number': f"+5939900{i:05d}", 'appointment_data': {**CITA, 'patient_name': f"Paciente {i}"}}
+        for i in range(n)
+    ]
+
+
+def test_envio_concurrente(twilio):
+    twilio.latencia = 0.05
+    # 40 mensajes de 50 ms: en serie tomarian dos segundos
+    estadisticas = _servicio(twilio).send_bulk_reminders(_recordatorios(40), workers=8)
+
+    assert (estadisticas['sent'], estadisticas['failed'], estadisticas['total']) == (40, 0, 40)
+    assert estadisticas['seconds'] < 1 and estadisticas['retries'] == 0
+    assert sorted(twilio.destinatarios()) == [f"+5939900{i:05d}" for i in range(40)]
+    # Conexiones persistentes: una por hilo, no una por mensaje
+    assert twilio.conexiones <= 8
+
+    # Resultados en el orden de los recordatorios, con el mensaje de cada paciente
+    cuerpos = {mensaje['sid']: mensaje['body'] for mensaje in twilio.mensajes}
+    assert all(f"*Paciente {i}*" in cuerpos[sid] for i, sid in enumerate(estadisticas['results']))
+
+
+def test_sin_ritmo_propio_reintenta_los_429(twilio):
+    twilio.limite_por_segundo = 20
+
+    # La API rechaza el exceso; los reintentos con jitter lo terminan enviando
+    estadisticas = _servicio(twilio, max_attempts=20, retry_backoff=0.05).send_bulk_reminders(
+        _recordatorios(40), workers=8)
+    assert estadisticas['sent'] == 40 and estadisticas['rate_limited'] > 0
+    assert estadisticas['rate_limited'] == twilio.rechazos_por_limite
+
+
+def test_ritmo_del_proveedor(twilio):
+    twilio.limite_por_segundo = 20
+
+    # A un ritmo algo menor que el del proveedor no hay 429: los mensajes esperan en el token bucket
+    estadisticas = _servicio(twilio, rate_limit=18).send_bulk_reminders(_recordatorios(45), workers=8)
+    assert estadisticas['sent'] == 45 and estadisticas['rate_limited'] == twilio.rechazos_por_limite == 0
+    # Rafaga de 18 y los 27 restantes a 18 por segundo
+    assert estadisticas['seconds'] >= 1.4 and estadisticas['throttled_seconds'] > 0
+
+
+def test_reintentos_en_429_y_5xx(twilio):
+    twilio.fallos = [429, 503, 500]
+    estadisticas = _servicio(twilio).send_bulk_reminders(_recordatorios(5), workers=1)
+    assert (estadisticas['sent'], estadisticas['retries'], estadisticas['rate_limited']) == (5, 3, 1)
+    assert twilio.destinatarios() == [f"+5939900{i:05d}" for i in range(5)]
+
+    # Se respeta el Retry-After de un 429
+    twilio.fallos, twilio.retry_after = [], 1
+    twilio.limite_por_segundo = 1
+    servicio = _servicio(twilio)
+    assert servicio.send_whatsapp_message('+593990000001', 'Hola') is True
+    estadisticas = servicio.send_bulk_reminders(_recordatorios(1))
+    assert estadisticas['sent'] == 1 and estadisticas['rate_limited'] == 1 and estadisticas['seconds'] >= 0.9
+
+
+def test_espera_con_jitter(twilio):
+    from common.whatsapp_service import TwilioAPIError
+    servicio = _servicio(twilio, retry_backoff=0.5)
+    random.seed(7)
+
+    esperas = [servicio._retry_wait(3, TwilioAPIError(503, 'x')) for _ in range(200)]
+    # Hasta 0.5 * 2^2 segundos, repartidas (no todos los reintentos a la vez)
+    assert all(0 <= espera <= 2 for espera in esperas) and len(set(esperas)) == 200
+    assert min(esperas) < 0.5 and max(esperas) > 1.5
+    assert servicio._retry_wait(1, TwilioAPIError(429, 'x', retry_after=3)) >= 3
+
+
+def test_timeout_de_respuesta_no_reenvia(twilio):
+    import time
+
+    from common.whatsapp_service import TwilioMessagesClient
+    servicio = _servicio(twilio)
+    servicio._client = TwilioMessagesClient(twilio.account_sid, twilio.auth_token, twilio.base_url, timeout=0.2)
+    twilio.latencia = 0.5
+
+    # Twilio acepta el mensaje despues del timeout: no se envia otra vez
+    estadisticas = servicio.send_bulk_reminders(_recordatorios(1))
+    assert (estadisticas['sent'], estadisticas['failed'], estadisticas['retries']) == (0, 1, 0)
+    assert 'No response' in estadisticas['errors'][0][1]
+    time.sleep(0.5)
+    assert twilio.destinatarios() == ['+593990000000']
+
+    # Sin conexion (nada llego a Twilio) si se reintenta
+    twilio.latencia = 0
+    servicio._client = TwilioMessagesClient(twilio.account_sid, twilio.auth_token, 'http://127.0.0.1:9')
+    estadisticas = servicio.send_bulk_reminders(_recordatorios(1))
+    assert (estadisticas['failed'], estadisticas['retries']) == (1, 3)
+
+
+def test_recordatorio_invalido_no_detiene_el_lote(twilio):
+    recordatorios = _recordatorios(4)
+    del recordatorios[1]['to_number']
+    del recordatorios[2]['appointment_data']
+    estadisticas = _servicio(twilio).send_bulk_reminders(recordatorios, workers=2)
+
+    assert (estadisticas['sent'], estadisticas['failed']) == (2, 2)
+    assert estadisticas['results'][0] and estadisticas['results'][3]
+    assert [error.split(':')[0] for _, error in estadisticas['errors']] == ['KeyError', 'KeyError']
+    assert sorted(twilio.destinatarios()) == ['+593990000000', '+593990000003']
+
+
+def test_errores_y_proveedor_caido(twilio):
+    recordatorios = _recordatorios(4)
+    recordatorios[1]['to_number'] = 'sin-numero'
+    estadisticas = _servicio(twilio).send_bulk_reminders(recordatorios, workers=2)
+
+    # Un numero invalido (400) no se reintenta ni detiene al resto
+    assert (estadisticas['sent'], estadisticas['failed'], estadisticas['retries']) == (3, 1, 0)
+    assert estadisticas['results'][1] is None and all(estadisticas['results'][i] for i in (0, 2, 3))
+    assert estadisticas['errors'][0][0] == 'sin-numero' and '400' in estadisticas['errors'][0][1]
+
+    servicio = _servicio(twilio, max_attempts=2)
+    with twilio.simular_caida():
+        estadisticas = servicio.send_bulk_reminders(_recordatorios(3))
+        assert servicio.send_whatsapp_message('+593990000001', 'Hola') is False
+    assert (estadisticas['sent'], estadisticas['failed'], estadisticas['retries']) == (0, 3, 3)
+
+    # Sin credenciales no se llama a la API
+    llamadas = twilio.llamadas
+    servicio.enabled = False
+    assert servicio.send_bulk_reminders(_recordatorios(2)) == {'total': 2, 'sent': 0, 'failed': 2}
+    assert twilio.llamadas == llamadas
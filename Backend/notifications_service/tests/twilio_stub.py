@@ -0,0 +1,164 @@
+"""
+Servidor HTTP local que simula la API REST de Twilio (recurso Messages)
+Usado por los tests para no depender de api.twilio.com
+
+Atiende POST /2010-04-01/Accounts/<sid>/Messages.json con autenticacion basica y
+cuerpo de formulario (To, From, Body), como lo envia TwilioMessagesClient.
+"""
+import base64
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class _TwilioStubHandler(BaseHTTPRequestHandler):
+    """Crea mensajes (POST)"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.stub._registrar('conexiones')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _responder(self, status, body, headers=None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for nombre, valor in (headers or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _error(self, status, codigo, mensaje, headers=None):
+        self._responder(status, {'code': codigo, 'message': mensaje, 'status': status}, headers)
+
+    def do_POST(self):
+        stub = self.server.stub
+        length = int(self.headers.get('Content-Length', 0))
+        form = {clave: valores[0] for clave, valores in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+        time.sleep(stub.latencia)
+
+        autorizacion = self.headers.get('Authorization', '')
+        credenciales = base64.b64decode(autorizacion[6:]).decode('utf-8') if autorizacion.startswith('Basic ') else ''
+        with stub._lock:
+            stub.llamadas += 1
+            status = stub.fallos.pop(0) if stub.fallos else None
+            if status:
+                self._error(status, 20500 if status >= 500 else 20429, 'Simulated error')
+                return
+            if self.path != f"/2010-04-01/Accounts/{stub.account_sid}/Messages.json":
+                self._error(404, 20404, 'The requested resource was not found')
+                return
+            if credenciales != f"{stub.account_sid}:{stub.auth_token}":
+                self._error(401, 20003, 'Authenticate')
+                return
+            if not form.get('To', '').startswith('whatsapp:+') or not form.get('Body'):
+                self._error(400, 21211, "Invalid 'To' Phone Number")
+                return
+
+            if not stub._dentro_del_limite():
+                stub.rechazos_por_limite += 1
+                self._error(429, 20429, 'Too Many Requests', {'Retry-After': str(stub.retry_after)}
+                            if stub.retry_after is not None else None)
+                return
+
+            mensaje = {'sid': f"SM{len(stub.mensajes) + 1:032d}", 'status': 'queued',
+                       'to': form['To'], 'from': form.get('From'), 'body': form['Body']}
+            stub.mensajes.append(mensaje)
+        self._responder(201, mensaje)
+
+
+class TwilioStubServer:
+    """
+    Stand-in local de la API de mensajes de Twilio
+
+    - mensajes: mensajes aceptados (sid, status, to, from, body), en orden de llegada
+    - fallos: codigos HTTP devueltos, en orden, a las siguientes llamadas (None: se atiende)
+    - limite_por_segundo: mensajes aceptados por segundo, con rafagas de hasta ese numero;
+      los que exceden reciben 429 (0: sin limite)
+    - retry_after: segundos del header Retry-After de cada 429 (None: sin header)
+    - latencia: segundos que tarda cada llamada
+    - Registra conexiones TCP, llamadas y rechazos_por_limite
+    """
+
+    def __init__(self, account_sid='ACtest', auth_token='secreto', limite_por_segundo=0, latencia=0.0):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.limite_por_segundo = limite_por_segundo
+        self.retry_after = None
+        self.latencia = latencia
+        self.mensajes = []
+        self.fallos = []
+        self.conexiones = 0
+        self.llamadas = 0
+        self.rechazos_por_limite = 0
+        self._fichas = None
+        self._actualizado = None
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _TwilioStubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def destinatarios(self):
+        """Numeros (sin el prefijo whatsapp:) de los mensajes aceptados, en orden de llegada"""
+        return [mensaje['to'][len('whatsapp:'):] for mensaje in self.mensajes]
+
+    @contextmanager
+    def simular_caida(self, status=503):
+        """Toda llamada dentro del bloque responde `status`"""
+        with self._lock:
+            self.fallos = [status] * 10000
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self.fallos = []
+
+    def _dentro_del_limite(self):
+        """Toma una ficha del limite de la cuenta (con el lock tomado)"""
+        if not self.limite_por_segundo:
+            return True
+        ahora = time.monotonic()
+        if self._fichas is None:
+            # Rafaga completa en la primera llamada
+            self._fichas, self._actualizado = float(self.limite_por_segundo), ahora
+        self._fichas = min(self.limite_por_segundo,
+                           self._fichas + (ahora - self._actualizado) * self.limite_por_segundo)
+        self._actualizado = ahora
+        if self._fichas < 1:
+            return False
+        self._fichas -= 1
+        return True
+
+    def _registrar(self, contador):
+        with self._lock:
+            setattr(self, contador, getattr(self, contador) + 1)
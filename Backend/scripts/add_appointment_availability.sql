@@ -0,0 +1,71 @@
+-- =====================================================
+-- Appointment Availability (Citas Service)
+-- Rango de tiempo indexado y restriccion de exclusion contra doble agendamiento
+-- =====================================================
+-- Requiere la extension btree_gist (contrib de PostgreSQL)
+-- Ejecutar con: psql -d medical_db -f add_appointment_availability.sql
+--
+-- appointments.time_range = [start_time, end_time) se calcula desde las columnas de la
+-- cita. La restriccion de exclusion impide, dentro de la misma transaccion que escribe,
+-- dos citas no canceladas del mismo medico que se solapen; citas seguidas (10:00-10:30
+-- y 10:30-11:00) no se solapan. Su indice GiST (doctor_id, time_range) sirve tambien a
+-- las consultas de disponibilidad, agenda y horarios libres, que deben usar el mismo
+-- predicado de estado: status IS DISTINCT FROM 'CANCELLED'.
+
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+-- Datos existentes que impedirian crear la columna o la restriccion
+DO $$
+DECLARE
+    v_invalid INT;
+    v_overlaps INT;
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'appointments'::regclass AND conname = 'appointments_no_overlap'
+    ) THEN
+        RETURN;
+    END IF;
+
+    SELECT COUNT(*) INTO v_invalid FROM appointments WHERE end_time <= start_time;
+    IF v_invalid > 0 THEN
+        RAISE EXCEPTION '% appointments do not end after they start; fix them before running this script', v_invalid;
+    END IF;
+
+    SELECT COUNT(*) INTO v_overlaps
+    FROM appointments a
+    JOIN appointments b ON b.doctor_id = a.doctor_id AND b.appointment_id > a.appointment_id
+    WHERE a.status IS DISTINCT FROM 'CANCELLED' AND b.status IS DISTINCT FROM 'CANCELLED'
+      AND a.start_time < b.end_time AND b.start_time < a.end_time;
+    IF v_overlaps > 0 THEN
+        RAISE EXCEPTION '% pairs of overlapping appointments; cancel or move them before running this script', v_overlaps;
+    END IF;
+END $$;
+
+-- timestamp sin zona (como start_time/end_time): tsrange es inmutable y puede ser columna generada
+ALTER TABLE appointments
+    ADD COLUMN IF NOT EXISTS time_range TSRANGE
+    GENERATED ALWAYS AS (tsrange(start_time, end_time, '[)')) STORED;
+
+COMMENT ON COLUMN appointments.time_range IS '[start_time, end_time), maintained by PostgreSQL';
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'appointments'::regclass AND conname = 'appointments_valid_range'
+    ) THEN
+        ALTER TABLE appointments
+            ADD CONSTRAINT appointments_valid_range CHECK (end_time > start_time);
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'appointments'::regclass AND conname = 'appointments_no_overlap'
+    ) THEN
+        ALTER TABLE appointments
+            ADD CONSTRAINT appointments_no_overlap
+            EXCLUDE USING gist (doctor_id WITH =, time_range WITH &&)
+            WHERE (status IS DISTINCT FROM 'CANCELLED');
+    END IF;
+END $$;
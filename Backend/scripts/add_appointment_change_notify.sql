@@ -0,0 +1,79 @@
+-- =====================================================
+-- Appointment Change Notify (Citas Service)
+-- Invalidacion entre procesos del indice de agenda en memoria
+-- =====================================================
+-- Ejecutar con: psql -d medical_db -f add_appointment_change_notify.sql
+--
+-- Cada sentencia que crea, mueve, cambia de estado o borra citas avisa con
+-- NOTIFY appointments_changed y un payload JSON {"origin": ..., "doctors": [...]}:
+-- los medicos afectados (antes y despues del cambio) y el proceso que escribio
+-- (SET LOCAL citas.schedule_origin desde el servicio). Cada proceso de Citas Service
+-- descarta de su indice a esos medicos, salvo que la escritura sea suya.
+-- Si la lista no cabe en el payload, doctors es null (descartar todo el indice).
+
+CREATE OR REPLACE FUNCTION appointments_notify_changes()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_doctors INT[];
+    v_payload TEXT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT n.doctor_id ORDER BY n.doctor_id) INTO v_doctors
+        FROM new_appointments n
+        WHERE n.doctor_id IS NOT NULL;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(DISTINCT o.doctor_id ORDER BY o.doctor_id) INTO v_doctors
+        FROM old_appointments o
+        WHERE o.doctor_id IS NOT NULL;
+    ELSE
+        -- Solo cambios que afectan la agenda (medico, horario o estado)
+        SELECT array_agg(DISTINCT d.doctor_id ORDER BY d.doctor_id) INTO v_doctors
+        FROM new_appointments n
+        JOIN old_appointments o ON o.appointment_id = n.appointment_id
+        CROSS JOIN LATERAL unnest(ARRAY[n.doctor_id, o.doctor_id]) AS d(doctor_id)
+        WHERE d.doctor_id IS NOT NULL
+          AND (n.doctor_id, n.start_time, n.end_time, n.status)
+              IS DISTINCT FROM (o.doctor_id, o.start_time, o.end_time, o.status);
+    END IF;
+
+    IF v_doctors IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    v_payload := json_build_object(
+        'origin', NULLIF(current_setting('citas.schedule_origin', true), ''),
+        'doctors', v_doctors
+    )::TEXT;
+    -- Limite de NOTIFY: 8000 bytes
+    IF length(v_payload) > 7900 THEN
+        v_payload := json_build_object(
+            'origin', NULLIF(current_setting('citas.schedule_origin', true), ''),
+            'doctors', NULL
+        )::TEXT;
+    END IF;
+
+    PERFORM pg_notify('appointments_changed', v_payload);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_appointments_notify_insert ON appointments;
+CREATE TRIGGER trigger_appointments_notify_insert
+AFTER INSERT ON appointments
+REFERENCING NEW TABLE AS new_appointments
+FOR EACH STATEMENT
+EXECUTE FUNCTION appointments_notify_changes();
+
+DROP TRIGGER IF EXISTS trigger_appointments_notify_update ON appointments;
+CREATE TRIGGER trigger_appointments_notify_update
+AFTER UPDATE ON appointments
+REFERENCING OLD TABLE AS old_appointments NEW TABLE AS new_appointments
+FOR EACH STATEMENT
+EXECUTE FUNCTION appointments_notify_changes();
+
+DROP TRIGGER IF EXISTS trigger_appointments_notify_delete ON appointments;
+CREATE TRIGGER trigger_appointments_notify_delete
+AFTER DELETE ON appointments
+REFERENCING OLD TABLE AS old_appointments
+FOR EACH STATEMENT
+EXECUTE FUNCTION appointments_notify_changes();
@@ -0,0 +1,108 @@
+-- =====================================================
+-- Calendar Sync Outbox (Citas Service)
+-- Sincronizacion con Google Calendar fuera de la peticion
+-- =====================================================
+-- Ejecutar con: psql -d medical_db -f add_calendar_sync_outbox.sql
+--
+-- Cada sentencia que crea, modifica, cancela o borra citas deja en calendar_sync_outbox,
+-- en la misma transaccion, lo que hay que llevar al calendario del medico:
+--   UPSERT: crear o actualizar el evento con los datos actuales de la cita
+--   DELETE: borrar el evento (cita cancelada, borrada o movida a otro medico)
+-- Si la transaccion se revierte, la fila tampoco existe. El worker de Citas Service
+-- (calendar_outbox.py) reclama las filas en lotes y reintenta con espera creciente.
+-- Los cambios traidos desde Google Calendar (SET LOCAL citas.calendar_pull = 'on', ver
+-- add_calendar_sync_state.sql) no se encolan: el calendario ya los tiene.
+
+-- Evento de Google Calendar de cada cita (lo escribe el worker)
+ALTER TABLE appointments ADD COLUMN IF NOT EXISTS google_event_id VARCHAR(255);
+
+CREATE TABLE IF NOT EXISTS calendar_sync_outbox (
+    outbox_id BIGSERIAL PRIMARY KEY,
+    appointment_id INTEGER NOT NULL,
+    doctor_id INTEGER NOT NULL,
+    operation VARCHAR(10) NOT NULL CHECK (operation IN ('UPSERT', 'DELETE')),
+    -- Evento a borrar (DELETE); si aun no se conocia se toma el de la cita al procesar
+    google_event_id VARCHAR(255),
+    status VARCHAR(20) NOT NULL DEFAULT 'PENDING'
+        CHECK (status IN ('PENDING', 'DONE', 'SKIPPED', 'FAILED')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_until TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP
+);
+
+-- Solo las pendientes: la cola se recorre por orden de llegada
+CREATE INDEX IF NOT EXISTS idx_calendar_sync_outbox_pending
+ON calendar_sync_outbox(available_at, outbox_id) WHERE status = 'PENDING';
+
+CREATE INDEX IF NOT EXISTS idx_calendar_sync_outbox_appointment
+ON calendar_sync_outbox(appointment_id, outbox_id) WHERE status = 'PENDING';
+
+CREATE OR REPLACE FUNCTION appointments_enqueue_calendar_sync()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('citas.calendar_pull', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO calendar_sync_outbox (appointment_id, doctor_id, operation)
+        SELECT n.appointment_id, n.doctor_id, 'UPSERT'
+        FROM new_appointments n
+        WHERE n.doctor_id IS NOT NULL
+          AND n.status IS DISTINCT FROM 'CANCELLED'
+        ORDER BY n.appointment_id;
+
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO calendar_sync_outbox (appointment_id, doctor_id, operation, google_event_id)
+        SELECT o.appointment_id, o.doctor_id, 'DELETE', o.google_event_id
+        FROM old_appointments o
+        WHERE o.doctor_id IS NOT NULL
+        ORDER BY o.appointment_id;
+
+    ELSE
+        -- Solo cambios visibles en el evento; escribir google_event_id no encola nada
+        INSERT INTO calendar_sync_outbox (appointment_id, doctor_id, operation, google_event_id)
+        SELECT c.appointment_id, c.doctor_id, c.operation, c.google_event_id
+        FROM new_appointments n
+        JOIN old_appointments o ON o.appointment_id = n.appointment_id
+        CROSS JOIN LATERAL (VALUES
+            -- Cancelada o movida a otro medico: fuera del calendario anterior
+            (1, o.appointment_id, o.doctor_id, 'DELETE', o.google_event_id,
+             o.doctor_id IS NOT NULL AND o.status IS DISTINCT FROM 'CANCELLED'
+             AND (n.status = 'CANCELLED' OR n.doctor_id IS DISTINCT FROM o.doctor_id)),
+            (2, n.appointment_id, n.doctor_id, 'UPSERT', NULL,
+             n.doctor_id IS NOT NULL AND n.status IS DISTINCT FROM 'CANCELLED')
+        ) AS c(step, appointment_id, doctor_id, operation, google_event_id, applies)
+        WHERE c.applies
+          AND (n.doctor_id, n.patient_id, n.start_time, n.end_time, n.reason, n.status)
+              IS DISTINCT FROM (o.doctor_id, o.patient_id, o.start_time, o.end_time, o.reason, o.status)
+        ORDER BY n.appointment_id, c.step;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_appointments_calendar_insert ON appointments;
+CREATE TRIGGER trigger_appointments_calendar_insert
+AFTER INSERT ON appointments
+REFERENCING NEW TABLE AS new_appointments
+FOR EACH STATEMENT
+EXECUTE FUNCTION appointments_enqueue_calendar_sync();
+
+DROP TRIGGER IF EXISTS trigger_appointments_calendar_update ON appointments;
+CREATE TRIGGER trigger_appointments_calendar_update
+AFTER UPDATE ON appointments
+REFERENCING OLD TABLE AS old_appointments NEW TABLE AS new_appointments
+FOR EACH STATEMENT
+EXECUTE FUNCTION appointments_enqueue_calendar_sync();
+
+DROP TRIGGER IF EXISTS trigger_appointments_calendar_delete ON appointments;
+CREATE TRIGGER trigger_appointments_calendar_delete
+AFTER DELETE ON appointments
+REFERENCING OLD TABLE AS old_appointments
+FOR EACH STATEMENT
+EXECUTE FUNCTION appointments_enqueue_calendar_sync();
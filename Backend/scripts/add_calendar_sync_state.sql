@@ -0,0 +1,30 @@
+-- =====================================================
+-- Calendar Sync State (Citas Service)
+-- Sincronizacion incremental desde Google Calendar
+-- =====================================================
+-- Ejecutar con: psql -d medical_db -f add_calendar_sync_state.sql
+-- Requiere add_calendar_sync_outbox.sql
+--
+-- Por medico se guarda el syncToken de Google (cambios desde la ultima lectura) y el
+-- pageToken de la pagina en curso, en la misma transaccion que aplica los cambios de
+-- cada pagina a appointments: una lectura interrumpida sigue donde quedo y ningun
+-- cambio se aplica dos veces. Solo se leen los eventos que cambiaron.
+
+CREATE TABLE IF NOT EXISTS calendar_sync_state (
+    doctor_id INTEGER PRIMARY KEY REFERENCES users(user_id) ON DELETE CASCADE,
+    -- NULL: falta la lectura completa inicial (o Google invalido el token)
+    sync_token TEXT,
+    -- Pagina siguiente de una lectura a medias
+    page_token TEXT,
+    locked_until TIMESTAMP,
+    events_pulled BIGINT NOT NULL DEFAULT 0,
+    appointments_updated BIGINT NOT NULL DEFAULT 0,
+    conflicts BIGINT NOT NULL DEFAULT 0,
+    full_syncs INTEGER NOT NULL DEFAULT 0,
+    last_pulled_at TIMESTAMP,
+    last_error TEXT
+);
+
+-- Citas por evento de Google, para aplicar los cambios de una pagina en una consulta
+CREATE INDEX IF NOT EXISTS idx_appointments_google_event
+ON appointments(doctor_id, google_event_id) WHERE google_event_id IS NOT NULL;
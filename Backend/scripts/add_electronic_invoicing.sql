@@ -19,7 +19,7 @@ COMMENT ON COLUMN invoices.clave_acceso IS '49-digit SRI access key';
 COMMENT ON COLUMN invoices.numero_autorizacion IS 'SRI authorization number';
 COMMENT ON COLUMN invoices.fecha_autorizacion IS 'SRI authorization date and time';
 COMMENT ON COLUMN invoices.xml_content IS 'Generated XML for electronic invoice';
-COMMENT ON COLUMN invoices.estado_sri IS 'SRI status: PENDIENTE, RECIBIDA, AUTORIZADA, NO_AUTORIZADA, ERROR';
+COMMENT ON COLUMN invoices.estado_sri IS 'SRI status: PENDIENTE, CONTINGENCIA, RECIBIDA, AUTORIZADA, NO_AUTORIZADA, ERROR';
 COMMENT ON COLUMN invoices.mensaje_sri IS 'SRI response messages or errors';
 COMMENT ON COLUMN invoices.ambiente IS 'SRI environment: 1=Test, 2=Production';
 COMMENT ON COLUMN invoices.tipo_emision IS 'Emission type: 1=Normal';
@@ -0,0 +1,121 @@
+-- =====================================================
+-- Low Stock Alerts (Inventario / Notifications Service)
+-- Deteccion de stock bajo en cada escritura de products
+-- =====================================================
+-- Ejecutar con: psql -d medical_db -f add_low_stock_alerts.sql
+--
+-- Un trigger por sentencia abre una alerta cuando un producto activo cruza hacia abajo
+-- su min_stock_alert y la cierra cuando vuelve a superarlo; nunca hay dos alertas abiertas
+-- del mismo producto. Al abrir alertas avisa con NOTIFY low_stock (una vez por
+-- transaccion) y Notifications Service las reparte a los usuarios una sola vez.
+
+-- Tablas de NotificationService (se crean si la base aun no las tiene)
+CREATE TABLE IF NOT EXISTS notification_logs (
+    log_id SERIAL PRIMARY KEY,
+    user_id INT REFERENCES users(user_id) ON DELETE CASCADE,
+    notification_type VARCHAR(50) NOT NULL,
+    title VARCHAR(255) NOT NULL,
+    message TEXT,
+    metadata JSONB,
+    sent_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    read_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS notification_preferences (
+    user_id INT PRIMARY KEY REFERENCES users(user_id) ON DELETE CASCADE,
+    low_stock_notifications BOOLEAN NOT NULL DEFAULT TRUE,
+    appointment_reminders BOOLEAN NOT NULL DEFAULT TRUE,
+    daily_summary_enabled BOOLEAN NOT NULL DEFAULT TRUE,
+    summary_time TIME NOT NULL DEFAULT '08:00:00'
+);
+
+CREATE TABLE IF NOT EXISTS low_stock_alerts (
+    alert_id SERIAL PRIMARY KEY,
+    product_id INT NOT NULL REFERENCES products(product_id) ON DELETE CASCADE,
+    stock_quantity INT,
+    min_stock_alert INT,
+    opened_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    resolved_at TIMESTAMP,
+    notified_at TIMESTAMP,
+    recipients INT
+);
+
+COMMENT ON COLUMN low_stock_alerts.stock_quantity IS 'Stock when the threshold was crossed';
+COMMENT ON COLUMN low_stock_alerts.notified_at IS 'When the alert was fanned out (NULL = pending)';
+
+-- Una alerta abierta por producto (de-duplicacion)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_low_stock_alerts_open
+    ON low_stock_alerts(product_id) WHERE resolved_at IS NULL;
+
+-- Alertas pendientes de enviar
+CREATE INDEX IF NOT EXISTS idx_low_stock_alerts_pending
+    ON low_stock_alerts(alert_id) WHERE notified_at IS NULL AND resolved_at IS NULL;
+
+-- Listados de stock bajo: solo indexa los productos bajo el minimo
+-- (las consultas deben usar el mismo predicado)
+CREATE INDEX IF NOT EXISTS idx_products_low_stock
+    ON products(stock_quantity) WHERE is_active = TRUE AND stock_quantity <= min_stock_alert;
+
+CREATE OR REPLACE FUNCTION products_detect_low_stock()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_opened INT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO low_stock_alerts (product_id, stock_quantity, min_stock_alert)
+        SELECT n.product_id, n.stock_quantity, n.min_stock_alert
+        FROM new_products n
+        WHERE n.is_active AND n.stock_quantity <= n.min_stock_alert
+        ORDER BY n.product_id
+        ON CONFLICT (product_id) WHERE resolved_at IS NULL DO NOTHING;
+    ELSE
+        -- Cruce hacia arriba (o producto desactivado): se cierra la alerta
+        UPDATE low_stock_alerts a
+        SET resolved_at = NOW()
+        FROM new_products n
+        JOIN old_products o ON o.product_id = n.product_id
+        WHERE a.product_id = n.product_id AND a.resolved_at IS NULL
+          AND COALESCE(o.is_active AND o.stock_quantity <= o.min_stock_alert, FALSE)
+          AND NOT COALESCE(n.is_active AND n.stock_quantity <= n.min_stock_alert, FALSE);
+
+        -- Cruce hacia abajo: se abre una alerta
+        INSERT INTO low_stock_alerts (product_id, stock_quantity, min_stock_alert)
+        SELECT n.product_id, n.stock_quantity, n.min_stock_alert
+        FROM new_products n
+        JOIN old_products o ON o.product_id = n.product_id
+        WHERE COALESCE(n.is_active AND n.stock_quantity <= n.min_stock_alert, FALSE)
+          AND NOT COALESCE(o.is_active AND o.stock_quantity <= o.min_stock_alert, FALSE)
+        ORDER BY n.product_id
+        ON CONFLICT (product_id) WHERE resolved_at IS NULL DO NOTHING;
+    END IF;
+
+    GET DIAGNOSTICS v_opened = ROW_COUNT;
+    IF v_opened > 0 THEN
+        -- Mismo payload: PostgreSQL entrega un solo aviso por transaccion
+        PERFORM pg_notify('low_stock', '');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_products_low_stock ON products;
+CREATE TRIGGER trigger_products_low_stock
+AFTER UPDATE ON products
+REFERENCING OLD TABLE AS old_products NEW TABLE AS new_products
+FOR EACH STATEMENT
+EXECUTE FUNCTION products_detect_low_stock();
+
+DROP TRIGGER IF EXISTS trigger_products_low_stock_insert ON products;
+CREATE TRIGGER trigger_products_low_stock_insert
+AFTER INSERT ON products
+REFERENCING NEW TABLE AS new_products
+FOR EACH STATEMENT
+EXECUTE FUNCTION products_detect_low_stock();
+
+-- Carga inicial: una alerta pendiente por cada producto que ya esta bajo el minimo
+INSERT INTO low_stock_alerts (product_id, stock_quantity, min_stock_alert)
+SELECT product_id, stock_quantity, min_stock_alert
+FROM products
+WHERE is_active = TRUE AND stock_quantity <= min_stock_alert
+ORDER BY product_id
+ON CONFLICT (product_id) WHERE resolved_at IS NULL DO NOTHING;
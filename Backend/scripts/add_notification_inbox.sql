@@ -0,0 +1,154 @@
+-- =====================================================
+-- Notification Inbox (Notifications Service)
+-- Bandeja de notificaciones por usuario con contador de no leidas
+-- =====================================================
+-- Ejecutar con: psql -d medical_db -f add_notification_inbox.sql
+--
+-- Cada notificacion recibe un numero de secuencia por usuario (inbox_seq) al insertarse.
+-- El numero sale de la fila del usuario en notification_inbox, que queda bloqueada hasta
+-- el commit: las notificaciones de un usuario se confirman en orden de secuencia y el
+-- front end puede pedir solo las posteriores a la ultima que vio (?since=<seq>) sin
+-- perder ninguna. La misma fila mantiene el contador de no leidas, asi la consulta
+-- periodica no cuenta filas.
+--
+-- Los INSERT en lote en notification_logs deben ir ordenados por user_id: cada fila
+-- bloquea la bandeja de su usuario hasta el commit y dos lotes en distinto orden
+-- pueden bloquearse entre si (deadlock).
+
+-- Tablas de NotificationService (se crean si la base aun no las tiene)
+CREATE TABLE IF NOT EXISTS notification_logs (
+    log_id SERIAL PRIMARY KEY,
+    user_id INT REFERENCES users(user_id) ON DELETE CASCADE,
+    notification_type VARCHAR(50) NOT NULL,
+    title VARCHAR(255) NOT NULL,
+    message TEXT,
+    metadata JSONB,
+    sent_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    read_at TIMESTAMP
+);
+
+ALTER TABLE notification_logs ADD COLUMN IF NOT EXISTS inbox_seq BIGINT;
+
+COMMENT ON COLUMN notification_logs.inbox_seq IS 'Position in the user''s inbox (1, 2, 3... per user)';
+
+CREATE TABLE IF NOT EXISTS notification_inbox (
+    user_id INT PRIMARY KEY REFERENCES users(user_id) ON DELETE CASCADE,
+    unread_count INT NOT NULL DEFAULT 0,
+    last_seq BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Secuencia y contador de cada notificacion nueva
+CREATE OR REPLACE FUNCTION notification_logs_inbox_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.user_id IS NULL THEN
+        RETURN NEW;
+    END IF;
+
+    INSERT INTO notification_inbox AS i (user_id, unread_count, last_seq)
+    VALUES (NEW.user_id, CASE WHEN NEW.read_at IS NULL THEN 1 ELSE 0 END, 1)
+    ON CONFLICT (user_id) DO UPDATE
+    SET last_seq = i.last_seq + 1,
+        unread_count = i.unread_count + EXCLUDED.unread_count,
+        updated_at = CURRENT_TIMESTAMP
+    RETURNING i.last_seq INTO NEW.inbox_seq;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Lecturas (y borrados) ajustan el contador, una vez por sentencia
+CREATE OR REPLACE FUNCTION notification_logs_inbox_unread()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        UPDATE notification_inbox i
+        SET unread_count = GREATEST(i.unread_count + d.delta, 0), updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT user_id, SUM(delta) AS delta
+            FROM (
+                SELECT user_id, -1 AS delta FROM old_logs WHERE read_at IS NULL
+                UNION ALL
+                SELECT user_id, 1 AS delta FROM new_logs WHERE read_at IS NULL
+            ) cambios
+            WHERE user_id IS NOT NULL
+            GROUP BY user_id
+        ) d
+        WHERE i.user_id = d.user_id AND d.delta <> 0;
+    ELSE
+        UPDATE notification_inbox i
+        SET unread_count = GREATEST(i.unread_count - d.unread, 0), updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT user_id, COUNT(*) AS unread
+            FROM old_logs
+            WHERE read_at IS NULL AND user_id IS NOT NULL
+            GROUP BY user_id
+        ) d
+        WHERE i.user_id = d.user_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Bloquea la fila del usuario en notification_inbox: lotes ordenados por user_id
+DROP TRIGGER IF EXISTS trigger_notification_logs_inbox ON notification_logs;
+CREATE TRIGGER trigger_notification_logs_inbox
+BEFORE INSERT ON notification_logs
+FOR EACH ROW
+EXECUTE FUNCTION notification_logs_inbox_insert();
+
+DROP TRIGGER IF EXISTS trigger_notification_logs_inbox_read ON notification_logs;
+CREATE TRIGGER trigger_notification_logs_inbox_read
+AFTER UPDATE ON notification_logs
+REFERENCING OLD TABLE AS old_logs NEW TABLE AS new_logs
+FOR EACH STATEMENT
+EXECUTE FUNCTION notification_logs_inbox_unread();
+
+DROP TRIGGER IF EXISTS trigger_notification_logs_inbox_delete ON notification_logs;
+CREATE TRIGGER trigger_notification_logs_inbox_delete
+AFTER DELETE ON notification_logs
+REFERENCING OLD TABLE AS old_logs
+FOR EACH STATEMENT
+EXECUTE FUNCTION notification_logs_inbox_unread();
+
+-- Carga inicial: secuencia para las notificaciones anteriores y contadores recalculados
+-- (con la tabla bloqueada para que no entren notificaciones mientras tanto)
+BEGIN;
+LOCK TABLE notification_logs IN SHARE ROW EXCLUSIVE MODE;
+
+UPDATE notification_logs l
+SET inbox_seq = n.seq
+FROM (
+    SELECT l.log_id,
+           GREATEST(COALESCE(i.last_seq, 0), COALESCE(s.max_seq, 0))
+           + ROW_NUMBER() OVER (PARTITION BY l.user_id ORDER BY l.log_id) AS seq
+    FROM notification_logs l
+    LEFT JOIN notification_inbox i ON i.user_id = l.user_id
+    LEFT JOIN (
+        SELECT user_id, MAX(inbox_seq) AS max_seq FROM notification_logs GROUP BY user_id
+    ) s ON s.user_id = l.user_id
+    WHERE l.inbox_seq IS NULL AND l.user_id IS NOT NULL
+) n
+WHERE l.log_id = n.log_id;
+
+INSERT INTO notification_inbox AS i (user_id, unread_count, last_seq)
+SELECT user_id, COUNT(*) FILTER (WHERE read_at IS NULL), MAX(inbox_seq)
+FROM notification_logs
+WHERE user_id IS NOT NULL
+GROUP BY user_id
+ORDER BY user_id
+ON CONFLICT (user_id) DO UPDATE
+SET unread_count = EXCLUDED.unread_count,
+    last_seq = GREATEST(i.last_seq, EXCLUDED.last_seq),
+    updated_at = CURRENT_TIMESTAMP;
+
+COMMIT;
+
+-- Bandeja de un usuario: ultimas notificaciones y las posteriores a un cursor
+CREATE UNIQUE INDEX IF NOT EXISTS uq_notification_logs_inbox
+    ON notification_logs(user_id, inbox_seq);
+
+-- No leidas de un usuario (marcar todas como leidas)
+CREATE INDEX IF NOT EXISTS idx_notification_logs_unread
+    ON notification_logs(user_id, inbox_seq) WHERE read_at IS NULL;
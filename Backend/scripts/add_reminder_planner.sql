@@ -0,0 +1,54 @@
+-- =====================================================
+-- Reminder Planner (Notifications Service)
+-- Plan de recordatorios de citas en una sola consulta
+-- =====================================================
+-- Ejecutar con: psql -d medical_db -f add_reminder_planner.sql
+--
+-- ReminderManager.process_scheduled_reminders cruza en una consulta las citas, la
+-- configuracion de recordatorios de cada medico y los recordatorios ya enviados. Estos
+-- indices sirven ese cruce: citas activas por medico y hora, y envios exitosos por cita.
+
+-- Tablas de ReminderManager (se crean si la base aun no las tiene)
+CREATE TABLE IF NOT EXISTS reminder_settings (
+    setting_id SERIAL PRIMARY KEY,
+    user_id INT UNIQUE NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    email_enabled BOOLEAN NOT NULL DEFAULT TRUE,
+    email_hours_before JSONB NOT NULL DEFAULT '[24, 3]',
+    whatsapp_enabled BOOLEAN NOT NULL DEFAULT FALSE,
+    whatsapp_hours_before JSONB NOT NULL DEFAULT '[24]',
+    auto_send_enabled BOOLEAN NOT NULL DEFAULT TRUE,
+    send_on_days JSONB DEFAULT '["mon", "tue", "wed", "thu", "fri", "sat", "sun"]',
+    quiet_hours_start TIME DEFAULT '22:00:00',
+    quiet_hours_end TIME DEFAULT '08:00:00',
+    smtp_host VARCHAR(255),
+    smtp_port INT,
+    smtp_user VARCHAR(255),
+    smtp_password VARCHAR(255),
+    from_email VARCHAR(255),
+    from_name VARCHAR(255),
+    twilio_account_sid VARCHAR(255),
+    twilio_auth_token VARCHAR(255),
+    twilio_whatsapp_number VARCHAR(50)
+);
+
+CREATE TABLE IF NOT EXISTS reminder_logs (
+    log_id SERIAL PRIMARY KEY,
+    appointment_id INT REFERENCES appointments(appointment_id) ON DELETE CASCADE,
+    patient_id INT REFERENCES patients(patient_id) ON DELETE SET NULL,
+    reminder_type VARCHAR(20) NOT NULL,
+    hours_before INT NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    sent_at TIMESTAMP,
+    error_message TEXT,
+    recipient_email VARCHAR(150),
+    recipient_phone VARCHAR(30),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Recordatorios ya enviados (anti-join del plan)
+CREATE INDEX IF NOT EXISTS idx_reminder_logs_sent
+ON reminder_logs(appointment_id, reminder_type, hours_before) WHERE status = 'sent';
+
+-- Citas que aun pueden recibir recordatorios, por medico y hora
+CREATE INDEX IF NOT EXISTS idx_appointments_reminder_window
+ON appointments(doctor_id, start_time) WHERE status IN ('PENDING', 'CONFIRMED');
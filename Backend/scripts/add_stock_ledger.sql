@@ -0,0 +1,163 @@
+-- =====================================================
+-- Stock Ledger (Inventario Service)
+-- Movimientos de stock (solo insercion) y snapshots periodicos
+-- =====================================================
+-- Requiere add_stock_reservations.sql
+-- Ejecutar con: psql -d medical_db -f add_stock_ledger.sql
+--
+-- Cada cambio de products.stock_quantity (cualquier sentencia) queda registrado por
+-- trigger en stock_movements. El tipo, referencia, notas y usuario se pasan con
+-- SET LOCAL inventario.movement_* desde el servicio.
+-- El stock a una fecha = ultimo snapshot del producto anterior a la fecha + movimientos
+-- posteriores al snapshot hasta esa fecha.
+
+CREATE TABLE IF NOT EXISTS stock_movements (
+    movement_id BIGSERIAL PRIMARY KEY,
+    product_id INT NOT NULL,
+    quantity_change INT NOT NULL CHECK (quantity_change <> 0),
+    stock_after INT,
+    movement_type VARCHAR(20) NOT NULL
+        CHECK (movement_type IN ('ENTRADA', 'SALIDA', 'AJUSTE', 'CONSUMO', 'SALDO_INICIAL')),
+    reference VARCHAR(100),
+    notes TEXT,
+    created_by INT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- Sin llaves foraneas: el historial no se modifica al borrar un producto o un usuario
+COMMENT ON TABLE stock_movements IS 'Append-only stock ledger, written by trigger_products_stock_movements';
+COMMENT ON COLUMN stock_movements.stock_after IS 'products.stock_quantity after the movement';
+
+-- Historial de un producto (y movimientos posteriores a su snapshot)
+CREATE INDEX IF NOT EXISTS idx_stock_movements_product
+    ON stock_movements(product_id, movement_id);
+
+-- Tabla de solo insercion: created_at crece con el movement_id, BRIN basta para rangos de fechas
+CREATE INDEX IF NOT EXISTS idx_stock_movements_created_at
+    ON stock_movements USING BRIN (created_at);
+
+-- Cada ejecucion del snapshot y el ultimo movimiento que incluye
+CREATE TABLE IF NOT EXISTS stock_snapshot_runs (
+    run_id SERIAL PRIMARY KEY,
+    taken_at TIMESTAMP NOT NULL,
+    last_movement_id BIGINT NOT NULL,
+    product_count INT NOT NULL
+);
+
+-- Stock de cada producto en un snapshot (solo los productos con movimientos desde el anterior)
+CREATE TABLE IF NOT EXISTS stock_snapshots (
+    product_id INT NOT NULL,
+    taken_at TIMESTAMP NOT NULL,
+    stock_quantity INT NOT NULL,
+    last_movement_id BIGINT NOT NULL,
+    PRIMARY KEY (product_id, taken_at)
+);
+
+-- Solo insercion: UPDATE, DELETE y TRUNCATE fallan
+CREATE OR REPLACE FUNCTION stock_movements_append_only()
+RETURNS TRIGGER AS $$
+BEGIN
+    RAISE EXCEPTION 'stock_movements is append-only';
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_stock_movements_append_only ON stock_movements;
+CREATE TRIGGER trigger_stock_movements_append_only
+BEFORE UPDATE OR DELETE ON stock_movements
+FOR EACH ROW
+EXECUTE FUNCTION stock_movements_append_only();
+
+DROP TRIGGER IF EXISTS trigger_stock_movements_no_truncate ON stock_movements;
+CREATE TRIGGER trigger_stock_movements_no_truncate
+BEFORE TRUNCATE ON stock_movements
+FOR EACH STATEMENT
+EXECUTE FUNCTION stock_movements_append_only();
+
+-- products: un INSERT por sentencia con todos los productos cuyo stock cambio
+CREATE OR REPLACE FUNCTION products_record_stock_movements()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_type VARCHAR(20) := COALESCE(NULLIF(current_setting('inventario.movement_type', true), ''), 'AJUSTE');
+    v_reference VARCHAR(100) := NULLIF(current_setting('inventario.movement_reference', true), '');
+    v_notes TEXT := NULLIF(current_setting('inventario.movement_notes', true), '');
+    v_user INT := NULLIF(current_setting('inventario.movement_user', true), '')::INT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO stock_movements
+            (product_id, quantity_change, stock_after, movement_type, reference, notes, created_by)
+        SELECT n.product_id, n.stock_quantity, n.stock_quantity, 'SALDO_INICIAL', v_reference, v_notes, v_user
+        FROM new_products n
+        WHERE COALESCE(n.stock_quantity, 0) <> 0
+        ORDER BY n.product_id;
+    ELSE
+        INSERT INTO stock_movements
+            (product_id, quantity_change, stock_after, movement_type, reference, notes, created_by)
+        SELECT n.product_id, COALESCE(n.stock_quantity, 0) - COALESCE(o.stock_quantity, 0),
+               n.stock_quantity, v_type, v_reference, v_notes, v_user
+        FROM new_products n
+        JOIN old_products o ON o.product_id = n.product_id
+        WHERE COALESCE(n.stock_quantity, 0) <> COALESCE(o.stock_quantity, 0)
+        ORDER BY n.product_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_products_stock_movements ON products;
+CREATE TRIGGER trigger_products_stock_movements
+AFTER UPDATE ON products
+REFERENCING OLD TABLE AS old_products NEW TABLE AS new_products
+FOR EACH STATEMENT
+EXECUTE FUNCTION products_record_stock_movements();
+
+DROP TRIGGER IF EXISTS trigger_products_stock_movements_insert ON products;
+CREATE TRIGGER trigger_products_stock_movements_insert
+AFTER INSERT ON products
+REFERENCING NEW TABLE AS new_products
+FOR EACH STATEMENT
+EXECUTE FUNCTION products_record_stock_movements();
+
+-- Snapshot de los productos con movimientos desde el anterior (todos en el primero).
+-- Devuelve los productos guardados, o NULL si el ultimo es mas reciente que p_min_age
+-- u otro proceso esta tomando uno.
+CREATE OR REPLACE FUNCTION take_stock_snapshot(p_min_age INTERVAL DEFAULT NULL)
+RETURNS INT AS $$
+DECLARE
+    v_previous stock_snapshot_runs%ROWTYPE;
+    v_taken_at TIMESTAMP;
+    v_watermark BIGINT;
+    v_count INT;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(hashtext('take_stock_snapshot')) THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT * INTO v_previous FROM stock_snapshot_runs ORDER BY run_id DESC LIMIT 1;
+    IF p_min_age IS NOT NULL AND v_previous.taken_at > clock_timestamp() - p_min_age THEN
+        RETURN NULL;
+    END IF;
+
+    -- Espera a que terminen las transacciones con movimientos sin confirmar: despues del
+    -- bloqueo, todo movimiento <= v_watermark ya esta reflejado en products.stock_quantity
+    LOCK TABLE stock_movements IN SHARE ROW EXCLUSIVE MODE;
+    v_taken_at := clock_timestamp();
+    SELECT COALESCE(MAX(movement_id), 0) INTO v_watermark FROM stock_movements;
+
+    INSERT INTO stock_snapshots (product_id, taken_at, stock_quantity, last_movement_id)
+    SELECT p.product_id, v_taken_at, COALESCE(p.stock_quantity, 0), v_watermark
+    FROM products p
+    WHERE v_previous.run_id IS NULL
+       OR p.product_id IN (
+            SELECT m.product_id FROM stock_movements m
+            WHERE m.movement_id > v_previous.last_movement_id
+       );
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+
+    INSERT INTO stock_snapshot_runs (taken_at, last_movement_id, product_count)
+    VALUES (v_taken_at, v_watermark, v_count);
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Snapshot base con el stock actual (solo si aun no hay ninguno)
+SELECT take_stock_snapshot() WHERE NOT EXISTS (SELECT 1 FROM stock_snapshot_runs);
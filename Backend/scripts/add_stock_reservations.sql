@@ -0,0 +1,46 @@
+-- =====================================================
+-- Stock Reservations (Inventario Service)
+-- Reserva atomica de insumos por receta de tratamiento
+-- =====================================================
+-- Ejecutar con: psql -d medical_db -f add_stock_reservations.sql
+
+-- Unidades apartadas por reservas activas; disponible = stock_quantity - reserved_quantity
+ALTER TABLE products
+ADD COLUMN IF NOT EXISTS reserved_quantity INT NOT NULL DEFAULT 0 CHECK (reserved_quantity >= 0);
+
+COMMENT ON COLUMN products.reserved_quantity IS 'Units held by RESERVED stock reservations';
+
+CREATE TABLE IF NOT EXISTS stock_reservations (
+    reservation_id SERIAL PRIMARY KEY,
+    reference VARCHAR(100),
+    status VARCHAR(20) NOT NULL DEFAULT 'RESERVED',
+    created_by INT REFERENCES users(user_id),
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    expires_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    CONSTRAINT chk_stock_reservations_status
+        CHECK (status IN ('RESERVED', 'COMMITTED', 'RELEASED', 'EXPIRED'))
+);
+
+COMMENT ON COLUMN stock_reservations.reference IS 'Caller reference, e.g. appointment:123 (one active reservation per reference)';
+COMMENT ON COLUMN stock_reservations.status IS 'RESERVED, COMMITTED (stock consumed), RELEASED or EXPIRED';
+
+CREATE TABLE IF NOT EXISTS stock_reservation_items (
+    reservation_id INT NOT NULL REFERENCES stock_reservations(reservation_id) ON DELETE CASCADE,
+    product_id INT NOT NULL REFERENCES products(product_id),
+    quantity INT NOT NULL CHECK (quantity > 0),
+    PRIMARY KEY (reservation_id, product_id)
+);
+
+-- Una sola reserva activa por referencia (reservar dos veces la misma cita es idempotente).
+-- Una referencia nueva que se consume directo (COMMITTED) queda cubierta por el advisory
+-- lock de la referencia que toma reserve_many
+CREATE UNIQUE INDEX IF NOT EXISTS idx_stock_reservations_active_reference
+    ON stock_reservations(reference) WHERE status = 'RESERVED' AND reference IS NOT NULL;
+
+-- Barrido de reservas vencidas
+CREATE INDEX IF NOT EXISTS idx_stock_reservations_expires
+    ON stock_reservations(expires_at) WHERE status = 'RESERVED';
+
+CREATE INDEX IF NOT EXISTS idx_stock_reservation_items_product
+    ON stock_reservation_items(product_id);
@@ -0,0 +1,140 @@
+-- =====================================================
+-- Treatment Availability (Inventario Service)
+-- Costo y cantidad maxima realizable por tratamiento, precalculados
+-- =====================================================
+-- Requiere add_stock_reservations.sql (products.reserved_quantity)
+-- Ejecutar con: psql -d medical_db -f add_treatment_availability.sql
+--
+-- Los triggers mantienen la tabla al cambiar stock, reservas, costo o estado de un
+-- producto y al cambiar una receta; solo se recalculan los tratamientos afectados.
+
+CREATE TABLE IF NOT EXISTS treatment_availability (
+    treatment_id INT PRIMARY KEY REFERENCES treatments(treatment_id) ON DELETE CASCADE,
+    ingredient_count INT NOT NULL DEFAULT 0,
+    total_cost DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    max_producible INT,
+    limiting_product_id INT REFERENCES products(product_id) ON DELETE SET NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+COMMENT ON COLUMN treatment_availability.total_cost IS 'SUM(quantity_needed * cost_price) of the recipe';
+COMMENT ON COLUMN treatment_availability.max_producible IS 'Times the recipe fits in unreserved stock (NULL = no recipe, no limit)';
+COMMENT ON COLUMN treatment_availability.limiting_product_id IS 'Product that sets max_producible';
+
+-- Consultas "que tratamientos se pueden realizar N veces"
+CREATE INDEX IF NOT EXISTS idx_treatment_availability_max_producible
+    ON treatment_availability(max_producible);
+
+-- Buscar los tratamientos que usan un producto (triggers de products)
+CREATE INDEX IF NOT EXISTS idx_treatment_recipes_product
+    ON treatment_recipes(product_id);
+
+-- Recalcula las filas de los tratamientos indicados
+CREATE OR REPLACE FUNCTION refresh_treatment_availability(p_treatment_ids INT[])
+RETURNS VOID AS $$
+BEGIN
+    IF p_treatment_ids IS NULL OR cardinality(p_treatment_ids) = 0 THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO treatment_availability
+        (treatment_id, ingredient_count, total_cost, max_producible, limiting_product_id, updated_at)
+    SELECT t.treatment_id,
+           COUNT(r.product_id),
+           COALESCE(SUM(r.quantity_needed * r.cost_price), 0),
+           MIN(r.times),
+           (ARRAY_AGG(r.product_id ORDER BY r.times, r.product_id) FILTER (WHERE r.product_id IS NOT NULL))[1],
+           NOW()
+    FROM treatments t
+    LEFT JOIN (
+        SELECT tr.treatment_id, tr.product_id, tr.quantity_needed, p.cost_price,
+               CASE WHEN p.is_active
+                    THEN GREATEST(COALESCE(p.stock_quantity, 0) - p.reserved_quantity, 0) / tr.quantity_needed
+                    ELSE 0
+               END AS times
+        FROM treatment_recipes tr
+        JOIN products p ON p.product_id = tr.product_id
+        WHERE tr.treatment_id = ANY(p_treatment_ids) AND tr.quantity_needed > 0
+    ) r ON r.treatment_id = t.treatment_id
+    WHERE t.treatment_id = ANY(p_treatment_ids)
+    GROUP BY t.treatment_id
+    ORDER BY t.treatment_id
+    ON CONFLICT (treatment_id) DO UPDATE SET
+        ingredient_count = EXCLUDED.ingredient_count,
+        total_cost = EXCLUDED.total_cost,
+        max_producible = EXCLUDED.max_producible,
+        limiting_product_id = EXCLUDED.limiting_product_id,
+        updated_at = EXCLUDED.updated_at;
+END;
+$$ LANGUAGE plpgsql;
+
+-- products: un solo recalculo por sentencia (las actualizaciones en lote tocan muchas filas)
+CREATE OR REPLACE FUNCTION products_refresh_treatment_availability()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_treatment_availability(ARRAY(
+        SELECT DISTINCT tr.treatment_id
+        FROM new_products n
+        JOIN old_products o ON o.product_id = n.product_id
+        JOIN treatment_recipes tr ON tr.product_id = n.product_id
+        WHERE (n.stock_quantity, n.reserved_quantity, n.cost_price, n.is_active)
+              IS DISTINCT FROM (o.stock_quantity, o.reserved_quantity, o.cost_price, o.is_active)
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_products_treatment_availability ON products;
+CREATE TRIGGER trigger_products_treatment_availability
+AFTER UPDATE ON products
+REFERENCING OLD TABLE AS old_products NEW TABLE AS new_products
+FOR EACH STATEMENT
+EXECUTE FUNCTION products_refresh_treatment_availability();
+
+-- treatment_recipes / treatments: recalcula los tratamientos de las filas cambiadas
+CREATE OR REPLACE FUNCTION recipes_refresh_treatment_availability()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM refresh_treatment_availability(ARRAY(SELECT DISTINCT treatment_id FROM old_rows));
+    ELSIF TG_OP = 'INSERT' THEN
+        PERFORM refresh_treatment_availability(ARRAY(SELECT DISTINCT treatment_id FROM new_rows));
+    ELSE
+        PERFORM refresh_treatment_availability(ARRAY(
+            SELECT treatment_id FROM old_rows UNION SELECT treatment_id FROM new_rows
+        ));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_recipes_availability_insert ON treatment_recipes;
+CREATE TRIGGER trigger_recipes_availability_insert
+AFTER INSERT ON treatment_recipes
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION recipes_refresh_treatment_availability();
+
+DROP TRIGGER IF EXISTS trigger_recipes_availability_update ON treatment_recipes;
+CREATE TRIGGER trigger_recipes_availability_update
+AFTER UPDATE ON treatment_recipes
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION recipes_refresh_treatment_availability();
+
+DROP TRIGGER IF EXISTS trigger_recipes_availability_delete ON treatment_recipes;
+CREATE TRIGGER trigger_recipes_availability_delete
+AFTER DELETE ON treatment_recipes
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION recipes_refresh_treatment_availability();
+
+DROP TRIGGER IF EXISTS trigger_treatments_availability_insert ON treatments;
+CREATE TRIGGER trigger_treatments_availability_insert
+AFTER INSERT ON treatments
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION recipes_refresh_treatment_availability();
+
+-- Carga inicial (volver a ejecutar el script reconstruye la tabla)
+SELECT refresh_treatment_availability(ARRAY(SELECT treatment_id FROM treatments));
@@ -0,0 +1,77 @@
+"""
+Benchmark de generacion y validacion de claves de acceso
+Compara el calculo clave por clave (strptime + bucle por digito) contra el lote
+con pesos precalculados (Python puro y NumPy)
+
+Uso:
+    python benchmark_access_keys.py [cantidad]
+"""
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'facturacion_service'))
+
+import access_keys
+from access_keys import default_codigo_numerico, generate_access_keys, validate_access_keys
+
+RUC = '0190329773001'
+
+
+def clave_por_clave(fecha_emision, secuencial):
+    """Calculo anterior: strptime y modulo 11 digito por digito"""
+    fecha = datetime.strptime(fecha_emision, '%d/%m/%Y')
+    base = (
+        f"{fecha.day:02d}{fecha.month:02d}{fecha.year:04d}01{RUC}1001001"
+        f"{int(secuencial):09d}{default_codigo_numerico(secuencial)}1"
+    )
+    factor = 2
+    total = 0
+    for digit in reversed(base):
+        total += int(digit) * factor
+        factor = 2 if factor == 7 else factor + 1
+    check_digit = 11 - total % 11
+    return base + str(0 if check_digit == 11 else 1 if check_digit == 10 else check_digit)
+
+
+def medir(funcion):
+    start = time.perf_counter()
+    resultado = funcion()
+    return time.perf_counter() - start, resultado
+
+
+def benchmark_access_keys(cantidad=100000):
+    fechas = [f"{1 + i % 28:02d}/{1 + i % 12:02d}/2025" for i in range(cantidad)]
+    secuenciales = list(range(1, cantidad + 1))
+
+    print("=" * 70)
+    print(f"BENCHMARK CLAVES DE ACCESO ({cantidad} claves)")
+    print("=" * 70)
+
+    t_anterior, referencia = medir(lambda: [clave_por_clave(f, s) for f, s in zip(fechas, secuenciales, strict=False)])
+    print(f"{'Clave por clave (strptime + bucle)':<46} {t_anterior:>8.3f}s {cantidad / t_anterior:>12,.0f}/s")
+
+    numpy = access_keys.numpy
+    modos = [('Lote Python (pesos precalculados)', None)]
+    if numpy is not None:
+        modos.append(('Lote NumPy', numpy))
+    else:
+        print("⚠️  numpy no instalado: solo ruta Python")
+
+    for nombre, modulo in modos:
+        access_keys.numpy = modulo
+        t_lote, claves = medir(lambda: generate_access_keys(fechas, secuenciales, RUC, punto_emision='001'))
+        assert claves == referencia, 'las claves no coinciden con el calculo clave por clave'
+        t_valida, motivos = medir(lambda claves=claves: validate_access_keys(claves))
+        assert not any(motivos)
+        print(f"{'Generar - ' + nombre:<46} {t_lote:>8.3f}s {cantidad / t_lote:>12,.0f}/s  ({t_anterior / t_lote:.1f}x)")
+        print(f"{'Validar - ' + nombre:<46} {t_valida:>8.3f}s {cantidad / t_valida:>12,.0f}/s")
+
+    access_keys.numpy = numpy
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    benchmark_access_keys(cantidad)
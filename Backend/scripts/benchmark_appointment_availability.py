@@ -0,0 +1,218 @@
+"""
+Benchmark de disponibilidad de medicos (Citas Service)
+Compara las consultas anteriores (conteo con tres rangos en OR y agenda con
+DATE(start_time) = fecha, con un indice btree (doctor_id, start_time)) contra el rango
+time_range con el indice GiST de appointments_no_overlap, y mide la busqueda de horarios
+libres en una sola consulta
+
+Crea medicos temporales con --citas citas en DATABASE_URL (INSERT ... SELECT) y al final
+los borra junto con sus citas y el indice btree. Requiere add_appointment_availability.sql.
+
+Uso:
+    python benchmark_appointment_availability.py [--citas 1000000] [--medicos 200] [--consultas 2000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Configurar encoding
+if sys.platform == 'win32':
+    import codecs
+    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+sys.path.append(os.path.join(BACKEND_DIR, 'citas_service'))
+
+import psycopg2.errors
+from availability import WORKING_HOURS
+from models import AppointmentModel
+
+from common.database import db
+
+# Citas en una grilla de 30 minutos, 09:00-13:00 y 15:00-19:00, 12 de 16 horarios ocupados
+INICIO = datetime(2031, 1, 6)
+CITAS_POR_DIA = 12
+
+
+def crear_agenda(citas, medicos, inicio=INICIO):
+    prefijo = f"bench-{uuid.uuid4().hex[:8]}"
+    dias = -(-citas // (medicos * CITAS_POR_DIA))
+    with db.get_cursor(commit=True) as cursor:
+        cursor.execute("""
+            INSERT INTO users (role_id, full_name, email, password_hash)
+            SELECT 2, %s, %s || '-' || n || '@bench.local', 'x' FROM generate_series(1, %s) n
+            RETURNING user_id
+        """, (prefijo, prefijo, medicos))
+        doctor_ids = sorted(fila['user_id'] for fila in cursor.fetchall())
+
+        cursor.execute("""
+            INSERT INTO appointments (doctor_id, start_time, end_time, status)
+            SELECT d.doctor_id, h.inicio, h.inicio + INTERVAL '30 minutes',
+                   CASE WHEN (d.n + dia + grilla) %% 20 = 0 THEN 'CANCELLED' ELSE 'CONFIRMED' END
+            FROM unnest(%s::int[]) WITH ORDINALITY as d(doctor_id, n)
+            CROSS JOIN generate_series(0, %s - 1) as dia
+            CROSS JOIN generate_series(0, 15) as grilla
+            CROSS JOIN LATERAL (
+                SELECT %s::timestamp + dia * INTERVAL '1 day'
+                       + CASE WHEN grilla < 8 THEN INTERVAL '9 hours' ELSE INTERVAL '11 hours' END
+                       + grilla * INTERVAL '30 minutes' as inicio
+            ) h
+            WHERE (d.n + dia + grilla) %% 4 <> 0
+        """, (doctor_ids, dias, inicio))
+        creadas = cursor.rowcount
+
+        # Indice que tendria la consulta anterior (create_indexes.sql, doctor_id + fecha)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_bench_appointments_doctor_start
+            ON appointments(doctor_id, start_time)
+        """)
+        cursor.execute("ANALYZE appointments")
+    return doctor_ids, dias, creadas
+
+
+def borrar_agenda(doctor_ids):
+    with db.get_cursor(commit=True) as cursor:
+        cursor.execute("DROP INDEX IF EXISTS idx_bench_appointments_doctor_start")
+        cursor.execute("DELETE FROM appointments WHERE doctor_id = ANY(%s)", (doctor_ids,))
+        cursor.execute("DELETE FROM users WHERE user_id = ANY(%s)", (doctor_ids,))
+
+
+def disponible_con_or(doctor_id, start_time, end_time):
+    """check_availability anterior"""
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT COUNT(*) as count
+            FROM appointments
+            WHERE doctor_id = %s
+            AND status NOT IN ('CANCELLED')
+            AND (
+                (start_time <= %s AND end_time > %s) OR
+                (start_time < %s AND end_time >= %s) OR
+                (start_time >= %s AND end_time <= %s)
+            )
+        """, (doctor_id, start_time, start_time, end_time, end_time, start_time, end_time))
+        return cursor.fetchone()['count'] == 0
+
+
+def agenda_con_date(doctor_id, fecha):
+    """Filtro de get_doctor_schedule anterior (sin el join a patients)"""
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT appointment_id, start_time, end_time, status
+            FROM appointments
+            WHERE doctor_id = %s AND DATE(start_time) = %s AND status NOT IN ('CANCELLED')
+            ORDER BY start_time
+        """, (doctor_id, fecha))
+        return cursor.fetchall()
+
+
+def medir(nombre, funcion, operaciones, unidad, repeticiones=1):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        resultado = funcion()
+    duracion = (time.perf_counter() - inicio) / repeticiones
+    print(f"{nombre:<46} {duracion:>8.3f}s {operaciones / duracion:>10,.0f} {unidad}/s")
+    return {'segundos': round(duracion, 4), f'{unidad}_por_segundo': round(operaciones / duracion)}, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de disponibilidad de medicos')
+    parser.add_argument('--citas', type=int, default=1000000, help='Citas a generar (default: 1000000)')
+    parser.add_argument('--medicos', type=int, default=200, help='Medicos temporales (default: 200)')
+    parser.add_argument('--consultas', type=int, default=2000, help='Consultas por medicion (default: 2000)')
+    parser.add_argument('--hilos', type=int, default=16, help='Hilos para el doble agendamiento (default: 16)')
+    args = parser.parse_args()
+
+    print("=" * 76)
+    print(f"BENCHMARK DISPONIBILIDAD DE MEDICOS ({args.citas:,} citas, {args.medicos} medicos)")
+    print("=" * 76)
+
+    inicio = time.perf_counter()
+    doctor_ids, dias, creadas = crear_agenda(args.citas, args.medicos)
+    metricas = {'citas': creadas, 'carga_segundos': round(time.perf_counter() - inicio, 1)}
+    print(f"{'Carga (INSERT ... SELECT con la exclusion)':<46} {metricas['carga_segundos']:>8.1f}s {creadas:>10,} citas")
+
+    aleatorio = random.Random(7)
+    consultas = [
+        (aleatorio.choice(doctor_ids),
+         INICIO + timedelta(days=aleatorio.randrange(dias), minutes=aleatorio.randrange(9 * 60, 19 * 60, 15)))
+        for _ in range(args.consultas)
+    ]
+
+    try:
+        metricas['disponibilidad_or'], anterior = medir(
+            'check_availability: tres rangos en OR (anterior)',
+            lambda: [disponible_con_or(d, t, t + timedelta(minutes=30)) for d, t in consultas],
+            len(consultas), 'consultas'
+        )
+        metricas['disponibilidad_gist'], nuevo = medir(
+            'check_availability: time_range && (GiST)',
+            lambda: [AppointmentModel.check_availability(d, t, t + timedelta(minutes=30)) for d, t in consultas],
+            len(consultas), 'consultas'
+        )
+        metricas['disponibilidad_identica'] = anterior == nuevo
+        print(f"{'Mismo resultado':<46} {str(anterior == nuevo):>8}")
+
+        dias_consulta = consultas[:args.consultas // 4]
+        metricas['agenda_date'], anterior = medir(
+            'Agenda del dia: DATE(start_time) = fecha',
+            lambda: [len(agenda_con_date(d, t.date())) for d, t in dias_consulta],
+            len(dias_consulta), 'consultas'
+        )
+        metricas['agenda_rango'], nuevo = medir(
+            'Agenda del dia: time_range && [dia, dia + 1)',
+            lambda: [len(AppointmentModel.get_doctor_schedule(d, t.date())) for d, t in dias_consulta],
+            len(dias_consulta), 'consultas'
+        )
+        metricas['agenda_identica'] = anterior == nuevo
+
+        # Busqueda de horarios libres en una consulta
+        desde = INICIO + timedelta(days=dias // 2)
+        busquedas = [
+            ('1 medico, 7 dias', doctor_ids[:1], 6),
+            ('20 medicos, 7 dias', doctor_ids[:20], 6),
+            (f'{len(doctor_ids)} medicos, 1 dia', doctor_ids, 0),
+        ]
+        for nombre, medicos, rango in busquedas:
+            clave = 'horarios_libres_' + nombre.replace(' ', '_').replace(',', '')
+            metricas[clave], filas = medir(
+                f'Horarios libres: {nombre}',
+                lambda medicos=medicos, rango=rango: AppointmentModel.find_free_slots(
+                    medicos, desde.date(), (desde + timedelta(days=rango)).date(),
+                    timedelta(minutes=30), timedelta(minutes=30), WORKING_HOURS, limit=100000
+                ),
+                1, 'busquedas', 20
+            )
+            metricas[clave]['horarios'] = len(filas)
+
+        # Doble agendamiento concurrente: la restriccion deja entrar a una sola cita
+        libre = filas[0]
+
+        def reservar(_):
+            try:
+                return AppointmentModel.create(None, libre['doctor_id'], libre['start_time'], libre['end_time'], 'BENCH')
+            except psycopg2.errors.ExclusionViolation:
+                return None
+
+        with ThreadPoolExecutor(max_workers=args.hilos) as executor:
+            creadas = [cita for cita in executor.map(reservar, range(args.hilos)) if cita]
+        metricas['doble_agendamiento'] = {'intentos': args.hilos, 'creadas': len(creadas)}
+        print(f"{'Intentos simultaneos en el mismo horario':<46} {args.hilos:>8} {len(creadas):>10} creada(s)")
+    finally:
+        borrar_agenda(doctor_ids)
+
+    print("-" * 76)
+    print(json.dumps(metricas, indent=2, ensure_ascii=False))
+    print("=" * 76)
+
+
+if __name__ == '__main__':
+    main()
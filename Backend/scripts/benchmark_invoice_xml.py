@@ -0,0 +1,90 @@
+"""
+Benchmark de generacion + firma del XML de facturas electronicas (1 a 500 items)
+Compara generar el XML como texto y re-parsearlo para firmar, contra entregar el arbol lxml al firmador
+
+Uso:
+    python benchmark_invoice_xml.py [repeticiones]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'facturacion_service'))
+
+from benchmark_signing import PASSWORD, crear_certificado
+from sri_electronic_invoice import SRIElectronicInvoice
+from sri_production import get_xml_signer, reset_xml_signers
+
+TAMANOS = [1, 10, 50, 100, 250, 500]
+
+
+def datos_factura(num_items):
+    item = {
+        'codigo': 'MED001', 'descripcion': 'Minoxidil 5% solucion topica 60ml', 'cantidad': 2.0,
+        'precio_unitario': 12.5, 'descuento': 0.0, 'precio_total_sin_impuesto': 25.0,
+        'codigo_iva': '3', 'tarifa_iva': 15.0, 'valor_iva': 3.75
+    }
+    return {
+        'secuencial': '1',
+        'fecha_emision': '15/12/2025',
+        'cliente': {'tipo_doc': '05', 'nombre': 'Paciente Prueba', 'identificacion': '1712345678'},
+        'items': [item] * num_items,
+        'totales': {
+            'subtotal_sin_impuestos': 25.0 * num_items, 'descuento_total': 0.0,
+            'subtotal_iva_15': 25.0 * num_items, 'iva_15': 3.75 * num_items,
+            'importe_total': 28.75 * num_items
+        },
+        'formas_pago': [{'codigo': '01', 'total': 28.75 * num_items}]
+    }
+
+
+def medir(funcion, repeticiones):
+    start = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion()
+    return (time.perf_counter() - start) / repeticiones * 1000
+
+
+def benchmark_invoice_xml(repeticiones=20):
+    generator = SRIElectronicInvoice(
+        ruc_emisor='0190329773001',
+        razon_social='CLINICA DE PRUEBAS S.A.',
+        nombre_comercial='Clinica Test',
+        direccion_matriz='Av. 10 de Agosto N37-185, Quito'
+    )
+
+    print("=" * 78)
+    print("BENCHMARK GENERACION + FIRMA XML (ms por factura)")
+    print("=" * 78)
+    print(f"{'items':>6} {'generar':>10} {'texto->firma':>14} {'arbol->firma':>14} {'mejora':>8}")
+    print("-" * 78)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert_path = os.path.join(tmp, 'firma.p12')
+        crear_certificado(cert_path)
+        signer = get_xml_signer(cert_path, PASSWORD)
+
+        for num_items in TAMANOS:
+            data = datos_factura(num_items)
+
+            generar = medir(lambda data=data: generator.generate_xml_tree(data), repeticiones)
+            texto = medir(
+                lambda data=data: signer.sign_xml(generator.generate_xml(data)['xml']),
+                repeticiones
+            )
+            arbol = medir(
+                lambda data=data: signer.sign_xml(generator.generate_xml_tree(data)[0]),
+                repeticiones
+            )
+
+            print(f"{num_items:>6} {generar:>9.2f} {texto:>13.2f} {arbol:>13.2f} {texto / arbol:>7.2f}x")
+
+        reset_xml_signers()
+
+    print("=" * 78)
+
+
+if __name__ == '__main__':
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    benchmark_invoice_xml(repeticiones)
@@ -0,0 +1,80 @@
+"""
+Benchmark de plantillas de recordatorios (renders por segundo)
+Compara el render uno a uno sin cache contra ReminderTemplates.render_batch con cache
+
+Uso:
+    python benchmark_reminder_templates.py [cantidad_recordatorios]
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.reminder_templates import ReminderTemplates
+
+MEDICOS = ['Ana Torres', 'Luis Paredes', 'Maria Cevallos', 'Jorge Andrade', "Sofia O'Neill"]
+MOTIVOS = ['Consulta general', 'Control', 'Limpieza dental', 'Ortodoncia', None]
+HORAS_ANTES = [24, 24, 24, 3, 48]
+
+
+def generar_recordatorios(cantidad):
+    """Citas de una semana cada 15 minutos, como las que arma ReminderManager.plan_reminders"""
+    inicio = datetime(2026, 3, 2, 8)
+    recordatorios = []
+    for i in range(cantidad):
+        cita = inicio + timedelta(days=(i // 200) % 7, minutes=15 * (i % 40))
+        recordatorios.append({
+            'hours_before': HORAS_ANTES[i % len(HORAS_ANTES)],
+            'appointment_data': {
+                'patient_name': f"Paciente {i}",
+                'doctor_name': MEDICOS[i % len(MEDICOS)],
+                'appointment_date': cita,
+                'appointment_time': cita.strftime('%H:%M'),
+                'reason': MOTIVOS[i % len(MOTIVOS)],
+                'clinic_address': 'Av. Principal 123, Quito',
+                'clinic_phone': '02-123-4567'
+            }
+        })
+    return recordatorios
+
+
+def medir(nombre, funcion, cantidad):
+    start = time.perf_counter()
+    funcion()
+    segundos = time.perf_counter() - start
+    print(f"{nombre:<36} {segundos:8.3f}s  {cantidad / segundos:10.0f} renders/s")
+    return segundos
+
+
+def benchmark_reminder_templates(cantidad=10000):
+    recordatorios = generar_recordatorios(cantidad)
+
+    print("=" * 70)
+    print("BENCHMARK PLANTILLAS DE RECORDATORIOS")
+    print("=" * 70)
+    print(f"Recordatorios: {cantidad}")
+
+    for canal in ('email', 'whatsapp'):
+        print("-" * 70)
+        sin_cache = ReminderTemplates(cache_size=0)
+        render = sin_cache.email if canal == 'email' else sin_cache.whatsapp
+        base = medir(f"{canal}: uno a uno sin cache", lambda render=render: [
+            render(r['appointment_data'], r['hours_before']) for r in recordatorios
+        ], cantidad)
+
+        plantillas = ReminderTemplates()
+        lote = medir(f"{canal}: render_batch con cache",
+                     lambda plantillas=plantillas, canal=canal: plantillas.render_batch(recordatorios, channel=canal),
+                     cantidad)
+        fechas = plantillas.cache_info()['when']
+        print(f"{'':<36} x{base / lote:.1f}  | fechas en cache: "
+              f"{fechas['hits'] / max(fechas['hits'] + fechas['misses'], 1):.0%}")
+
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    benchmark_reminder_templates(cantidad)
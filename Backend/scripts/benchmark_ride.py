@@ -0,0 +1,82 @@
+"""
+Benchmark de generacion de RIDE (paginas por segundo)
+Compara el renderizado secuencial contra RIDERenderer.render_many con pool de procesos
+
+Uso:
+    python benchmark_ride.py [cantidad_facturas] [procesos]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'facturacion_service'))
+
+from benchmark_invoice_xml import datos_factura
+from ride_renderer import RIDERenderer, render_ride_pages
+from sri_electronic_invoice import SRIElectronicInvoice
+from xml_storage import XMLStorageManager
+
+# Mezcla de facturas de cierre de mes: mayoria cortas, algunas largas
+ITEMS_POR_FACTURA = [3, 3, 5, 8, 12, 40, 120]
+
+
+def generar_jobs(cantidad):
+    generator = SRIElectronicInvoice(
+        ruc_emisor='0190329773001',
+        razon_social='CLINICA DE PRUEBAS S.A.',
+        nombre_comercial='Clinica Test',
+        direccion_matriz='Av. 10 de Agosto N37-185, Quito'
+    )
+    jobs = []
+    for secuencial in range(1, cantidad + 1):
+        data = datos_factura(ITEMS_POR_FACTURA[secuencial % len(ITEMS_POR_FACTURA)])
+        data['secuencial'] = str(secuencial)
+        jobs.append({
+            'invoice_number': f"001-001-{secuencial:09d}",
+            'xml': generator.generate_xml(data, pretty_print=False)['xml'],
+            'autorizacion': {'numero_autorizacion': 'BENCHMARK', 'fecha_autorizacion': '15/12/2025 10:00:00'}
+        })
+    return jobs
+
+
+def benchmark_ride(cantidad=200, procesos=None):
+    procesos = procesos or os.cpu_count() or 1
+    jobs = generar_jobs(cantidad)
+
+    print("=" * 70)
+    print("BENCHMARK RIDE (PDF)")
+    print("=" * 70)
+    print(f"Facturas: {cantidad} | Procesos: {procesos}")
+    print("-" * 70)
+
+    start = time.perf_counter()
+    paginas = sum(render_ride_pages(job['xml'], job['autorizacion'])[1] for job in jobs)
+    secuencial = time.perf_counter() - start
+    print(f"{'secuencial (hilo de la peticion)':<36} {secuencial:8.3f}s  {paginas / secuencial:8.1f} paginas/s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        renderer = RIDERenderer(XMLStorageManager(tmp), processes=procesos)
+        try:
+            # Arranque del pool fuera de la medicion
+            renderer.render_many(generar_jobs(procesos))
+
+            lote = renderer.render_many(jobs)['metricas']
+            print(f"{f'render_many ({procesos} procesos)':<36} {lote['duracion_segundos']:8.3f}s  "
+                  f"{lote['paginas_por_segundo']:8.1f} paginas/s")
+
+            cache = renderer.render_many(jobs)['metricas']
+            print(f"{'render_many (todo en cache)':<36} {cache['duracion_segundos']:8.3f}s  "
+                  f"{cache['en_cache']} PDFs reutilizados")
+        finally:
+            renderer.close()
+
+    print("-" * 70)
+    print(f"Paginas totales: {paginas} | Pool vs secuencial: x{secuencial / lote['duracion_segundos']:.1f}")
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    procesos = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    benchmark_ride(cantidad, procesos)
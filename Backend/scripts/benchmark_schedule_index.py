@@ -0,0 +1,127 @@
+"""
+Benchmark del indice de agenda en memoria (Citas Service)
+Compara check_availability y la busqueda de horarios libres en PostgreSQL (indice GiST)
+contra el indice de agenda del proceso, y mide la carga inicial y el costo de aplicar
+una escritura
+
+Crea medicos temporales con citas desde hoy (ver benchmark_appointment_availability.py)
+en DATABASE_URL y al final los borra. Requiere add_appointment_availability.sql.
+
+Uso:
+    python benchmark_schedule_index.py [--medicos 200] [--semanas 8] [--consultas 5000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+# Configurar encoding
+if sys.platform == 'win32':
+    import codecs
+    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+sys.path.append(os.path.join(BACKEND_DIR, 'citas_service'))
+
+from availability import WORKING_HOURS
+from benchmark_appointment_availability import CITAS_POR_DIA, borrar_agenda, crear_agenda
+from models import AppointmentModel
+from schedule_index import ScheduleIndex
+
+
+def medir(nombre, funcion, operaciones, unidad, repeticiones=1):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        resultado = funcion()
+    duracion = (time.perf_counter() - inicio) / repeticiones
+    por_operacion = duracion / operaciones * 1e6
+    print(f"{nombre:<46} {duracion:>8.3f}s {por_operacion:>10,.1f} us/{unidad}")
+    return {'segundos': round(duracion, 4), 'microsegundos_por_' + unidad: round(por_operacion, 1)}, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del indice de agenda en memoria')
+    parser.add_argument('--medicos', type=int, default=200, help='Medicos temporales (default: 200)')
+    parser.add_argument('--semanas', type=int, default=8, help='Semanas de citas e indice (default: 8)')
+    parser.add_argument('--consultas', type=int, default=5000, help='Consultas por medicion (default: 5000)')
+    args = parser.parse_args()
+
+    hoy = datetime.combine(date.today(), datetime.min.time())
+    dias = args.semanas * 7
+    doctor_ids, _, creadas = crear_agenda(args.medicos * dias * CITAS_POR_DIA, args.medicos, hoy)
+    indice = ScheduleIndex(weeks=args.semanas, ttl=3600, worker_id='benchmark')
+    metricas = {'citas': creadas}
+
+    print("=" * 76)
+    print(f"BENCHMARK INDICE DE AGENDA ({creadas:,} citas, {args.medicos} medicos, {args.semanas} semanas)")
+    print("=" * 76)
+
+    aleatorio = random.Random(7)
+    consultas = [
+        (aleatorio.choice(doctor_ids),
+         hoy + timedelta(days=aleatorio.randrange(1, dias - 1), minutes=aleatorio.randrange(9 * 60, 19 * 60, 15)))
+        for _ in range(args.consultas)
+    ]
+
+    try:
+        metricas['carga'], _ = medir(
+            f'Carga de {args.medicos} medicos (una consulta)',
+            lambda: indice._get(doctor_ids), args.medicos, 'medico'
+        )
+        metricas['disponibilidad_postgres'], anterior = medir(
+            'check_availability en PostgreSQL (GiST)',
+            lambda: [AppointmentModel.check_availability(d, t, t + timedelta(minutes=30)) for d, t in consultas],
+            len(consultas), 'consulta'
+        )
+        metricas['disponibilidad_indice'], nuevo = medir(
+            'check_availability en el indice',
+            lambda: [indice.check_availability(d, t, t + timedelta(minutes=30)) for d, t in consultas],
+            len(consultas), 'consulta'
+        )
+        metricas['disponibilidad_identica'] = anterior == nuevo
+        print(f"{'Mismo resultado':<46} {str(anterior == nuevo):>8}")
+
+        desde = (hoy + timedelta(days=dias // 2)).date()
+        busquedas = [
+            ('1 medico, 7 dias', doctor_ids[:1], 6),
+            ('20 medicos, 7 dias', doctor_ids[:20], 6),
+            (f'{len(doctor_ids)} medicos, 1 dia', doctor_ids, 0),
+        ]
+        for nombre, medicos, rango in busquedas:
+            parametros = (medicos, desde, desde + timedelta(days=rango),
+                          timedelta(minutes=30), timedelta(minutes=30), WORKING_HOURS)
+            clave = nombre.replace(' ', '_').replace(',', '')
+            metricas['horarios_postgres_' + clave], anterior = medir(
+                f'Horarios libres PostgreSQL: {nombre}',
+                lambda parametros=parametros: AppointmentModel.find_free_slots(*parametros, limit=100000), 1, 'busqueda', 20
+            )
+            metricas['horarios_indice_' + clave], nuevo = medir(
+                f'Horarios libres indice: {nombre}',
+                lambda parametros=parametros: indice.find_free_slots(*parametros, limit=100000), 1, 'busqueda', 20
+            )
+            metricas['horarios_identicos_' + clave] = anterior == nuevo
+
+        # Escritura: reemplaza la agenda del medico por una copia con la cita
+        cita = {'appointment_id': -1, 'doctor_id': doctor_ids[0], 'status': 'PENDING',
+                'start_time': hoy + timedelta(days=1, hours=7), 'end_time': hoy + timedelta(days=1, hours=8)}
+        metricas['aplicar_escritura'], _ = medir(
+            'Aplicar una escritura propia', lambda: indice.apply(cita), 1, 'escritura', 1000
+        )
+        print(f"{'Mismos horarios libres':<46} "
+              f"{str(all(v for k, v in metricas.items() if k.startswith('horarios_identicos'))):>8}")
+        metricas['estadisticas'] = indice.stats
+    finally:
+        borrar_agenda(doctor_ids)
+
+    print("-" * 76)
+    print(json.dumps(metricas, indent=2, ensure_ascii=False))
+    print("=" * 76)
+
+
+if __name__ == '__main__':
+    main()
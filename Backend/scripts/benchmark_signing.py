@@ -0,0 +1,130 @@
+"""
+Benchmark de firma XMLDSig de facturas electronicas (firmas por segundo)
+Compara la carga del .p12 por factura, el firmador en cache y sign_many con pool de procesos
+
+Uso:
+    python benchmark_signing.py [cantidad_facturas] [procesos]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import UTC, datetime, timedelta, timezone
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'facturacion_service'))
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import BestAvailableEncryption, pkcs12
+from cryptography.x509.oid import NameOID
+from sri_electronic_invoice import SRIElectronicInvoice
+from sri_production import XMLDigitalSigner, get_xml_signer, reset_xml_signers
+
+PASSWORD = 'benchmark'
+
+
+def crear_certificado(path):
+    """Certificado autofirmado RSA 2048 equivalente a una firma del Banco Central"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'BENCHMARK FIRMA')])
+    now = datetime.now(UTC)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=30))
+        .sign(key, hashes.SHA256())
+    )
+    with open(path, 'wb') as f:
+        f.write(pkcs12.serialize_key_and_certificates(
+            b'firma', key, cert, None, BestAvailableEncryption(PASSWORD.encode())
+        ))
+
+
+def generar_facturas(cantidad):
+    generator = SRIElectronicInvoice(
+        ruc_emisor='0190329773001',
+        razon_social='CLINICA DE PRUEBAS S.A.',
+        nombre_comercial='Clinica Test',
+        direccion_matriz='Av. 10 de Agosto N37-185, Quito'
+    )
+    item = {
+        'codigo': 'CONS001', 'descripcion': 'Consulta medica general', 'cantidad': 1.0,
+        'precio_unitario': 50.0, 'descuento': 0.0, 'precio_total_sin_impuesto': 50.0,
+        'codigo_iva': '3', 'tarifa_iva': 15.0, 'valor_iva': 7.5
+    }
+    facturas = []
+    for secuencial in range(1, cantidad + 1):
+        facturas.append(generator.generate_xml({
+            'secuencial': str(secuencial),
+            'fecha_emision': '15/12/2025',
+            'cliente': {'tipo_doc': '05', 'nombre': 'Paciente Prueba', 'identificacion': '1712345678'},
+            'items': [item] * 3,
+            'totales': {
+                'subtotal_sin_impuestos': 150.0, 'descuento_total': 0.0,
+                'subtotal_iva_15': 150.0, 'iva_15': 22.5, 'importe_total': 172.5
+            },
+            'formas_pago': [{'codigo': '01', 'total': 172.5}]
+        })['xml'])
+    return facturas
+
+
+def medir(nombre, funcion, cantidad):
+    start = time.perf_counter()
+    funcion()
+    elapsed = time.perf_counter() - start
+    print(f"{nombre:<40} {elapsed:8.3f}s  {cantidad / elapsed:10.1f} firmas/s")
+    return cantidad / elapsed
+
+
+def benchmark_signing(cantidad=200, procesos=None):
+    procesos = procesos or os.cpu_count() or 1
+
+    print("=" * 70)
+    print("BENCHMARK DE FIRMA XMLDSig")
+    print("=" * 70)
+    print(f"Facturas: {cantidad} | Procesos: {procesos}")
+    print("-" * 70)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert_path = os.path.join(tmp, 'firma.p12')
+        crear_certificado(cert_path)
+        facturas = generar_facturas(cantidad)
+
+        # Comportamiento anterior: abrir y descifrar el .p12 en cada factura
+        base = medir(
+            "p12 por factura",
+            lambda: [XMLDigitalSigner(cert_path, PASSWORD).sign_xml(xml) for xml in facturas],
+            cantidad
+        )
+
+        signer = get_xml_signer(cert_path, PASSWORD)
+        cache = medir(
+            "firmador en cache (secuencial)",
+            lambda: [signer.sign_xml(xml) for xml in facturas],
+            cantidad
+        )
+
+        # Arranque del pool fuera de la medicion
+        signer.sign_many(facturas[:procesos * 4], processes=procesos)
+        pool = medir(
+            f"sign_many ({procesos} procesos)",
+            lambda: signer.sign_many(facturas, processes=procesos),
+            cantidad
+        )
+
+        reset_xml_signers()
+
+    print("-" * 70)
+    print(f"Cache vs p12 por factura:     x{cache / base:.1f}")
+    print(f"sign_many vs p12 por factura: x{pool / base:.1f}")
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    procesos = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    benchmark_signing(cantidad, procesos)
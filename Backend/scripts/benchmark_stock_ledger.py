@@ -0,0 +1,153 @@
+"""
+Benchmark del libro de movimientos de stock (Inventario Service)
+Compara el ajuste anterior (un PATCH /products/<id>/stock por producto) contra un lote
+con un solo UPDATE ... FROM (VALUES ...), y el stock a una fecha sumando todo el libro
+contra el calculo desde snapshots
+
+Crea productos temporales en DATABASE_URL y al final los borra junto con sus
+movimientos y snapshots (desactiva el trigger de solo insercion en esa transaccion).
+Requiere add_stock_ledger.sql.
+
+Uso:
+    python benchmark_stock_ledger.py [--productos 500] [--lotes 200] [--hilos 8]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Configurar encoding
+if sys.platform == 'win32':
+    import codecs
+    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+sys.path.append(os.path.join(BACKEND_DIR, 'inventario_service'))
+
+from models import ProductModel, StockMovementModel
+from stock_ledger import AJUSTE, ENTRADA
+
+from common.database import db
+
+
+def crear_productos(productos):
+    prefijo = f"BENCH-{uuid.uuid4().hex[:8]}"
+    with db.get_cursor(commit=True) as cursor:
+        cursor.execute("""
+            INSERT INTO products (sku, name, cost_price, sale_price, stock_quantity)
+            SELECT %s || '-' || n, %s, 1, 2, 100000 FROM generate_series(1, %s) n
+            RETURNING product_id
+        """, (prefijo, prefijo, productos))
+        return sorted(fila['product_id'] for fila in cursor.fetchall())
+
+
+def borrar_productos(producto_ids):
+    with db.get_cursor(commit=True) as cursor:
+        cursor.execute("ALTER TABLE stock_movements DISABLE TRIGGER trigger_stock_movements_append_only")
+        cursor.execute("DELETE FROM stock_movements WHERE product_id = ANY(%s)", (producto_ids,))
+        cursor.execute("ALTER TABLE stock_movements ENABLE TRIGGER trigger_stock_movements_append_only")
+        cursor.execute("DELETE FROM stock_snapshots WHERE product_id = ANY(%s)", (producto_ids,))
+        cursor.execute("DELETE FROM products WHERE product_id = ANY(%s)", (producto_ids,))
+
+
+def stock_sumando_el_libro(fecha, producto_ids):
+    """Stock a una fecha sin snapshots: suma de todos los movimientos"""
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT product_id, SUM(quantity_change)::INT as stock_quantity
+            FROM stock_movements
+            WHERE product_id = ANY(%s) AND created_at <= %s
+            GROUP BY product_id
+        """, (producto_ids, fecha))
+        return {fila['product_id']: fila['stock_quantity'] for fila in cursor.fetchall()}
+
+
+def ahora():
+    with db.get_cursor() as cursor:
+        cursor.execute("SELECT clock_timestamp()::timestamp as ahora")
+        return cursor.fetchone()['ahora']
+
+
+def medir(nombre, funcion, operaciones, unidad, repeticiones=1):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        resultado = funcion()
+    duracion = (time.perf_counter() - inicio) / repeticiones
+    print(f"{nombre:<46} {duracion:>8.3f}s {operaciones / duracion:>10,.0f} {unidad}/s")
+    return {'segundos': round(duracion, 4), f'{unidad}_por_segundo': round(operaciones / duracion)}, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del libro de movimientos de stock')
+    parser.add_argument('--productos', type=int, default=500, help='Productos por lote (default: 500)')
+    parser.add_argument('--lotes', type=int, default=200, help='Lotes de historial (default: 200)')
+    parser.add_argument('--hilos', type=int, default=8, help='Hilos concurrentes (default: 8)')
+    args = parser.parse_args()
+
+    producto_ids = crear_productos(args.productos)
+    aleatorio = random.Random(7)
+    metricas = {}
+
+    print("=" * 76)
+    print(f"BENCHMARK LIBRO DE STOCK ({args.productos} productos, {args.lotes} lotes de historial)")
+    print("=" * 76)
+
+    try:
+        metricas['ajuste_por_producto'], _ = medir(
+            'update_stock por producto (anterior)',
+            lambda: [ProductModel.update_stock(product_id, 1) for product_id in producto_ids],
+            len(producto_ids), 'productos'
+        )
+        metricas['ajuste_en_lote'], _ = medir(
+            'Lote: un UPDATE ... FROM (VALUES ...)',
+            lambda: StockMovementModel.apply_many([(product_id, 1) for product_id in producto_ids], ENTRADA),
+            len(producto_ids), 'productos'
+        )
+
+        # Historial: lotes concurrentes con productos cruzados
+        def lote(_):
+            muestra = sorted(aleatorio.sample(producto_ids, max(len(producto_ids) // 2, 1)))
+            StockMovementModel.apply_many([(product_id, aleatorio.randint(-3, 3) or 1) for product_id in muestra], AJUSTE)
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.hilos) as executor:
+            list(executor.map(lote, range(args.lotes)))
+        duracion = time.perf_counter() - inicio
+        movimientos = args.lotes * max(len(producto_ids) // 2, 1)
+        print(f"{'Historial concurrente (' + str(args.hilos) + ' hilos)':<46} {duracion:>8.3f}s "
+              f"{movimientos / duracion:>10,.0f} movimientos/s")
+        metricas['historial_concurrente'] = {'segundos': round(duracion, 3), 'movimientos': movimientos}
+
+        fecha = ahora()
+        metricas['stock_a_fecha_sumando_libro'], esperado = medir(
+            'Stock a fecha: suma de todo el libro', lambda: stock_sumando_el_libro(fecha, producto_ids),
+            len(producto_ids), 'productos', 5
+        )
+
+        metricas['snapshot'], guardados = medir('Snapshot (productos con movimientos)',
+                                                StockMovementModel.take_snapshot, len(producto_ids), 'productos')
+        metricas['snapshot']['productos_guardados'] = guardados
+
+        metricas['stock_a_fecha_desde_snapshot'], filas = medir(
+            'Stock a fecha: snapshot + posteriores',
+            lambda: StockMovementModel.get_stock_at(ahora(), producto_ids), len(producto_ids), 'productos', 5
+        )
+        actual = {fila['product_id']: fila['stock_quantity'] for fila in filas}
+        metricas['resultado_identico'] = actual == esperado
+        print(f"{'Mismo resultado que sumando el libro':<46} {str(actual == esperado):>8}")
+    finally:
+        borrar_productos(producto_ids)
+
+    print("-" * 76)
+    print(json.dumps(metricas, indent=2, ensure_ascii=False))
+    print("=" * 76)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Benchmark de reservas de stock (Inventario Service)
+Compara el descuento anterior (un update_stock por insumo, sin verificar stock)
+contra la reserva de la receta completa en una transaccion y contra el lote
+
+Crea productos y un tratamiento temporales en DATABASE_URL y los borra al final.
+Requiere el esquema de add_stock_reservations.sql.
+
+Uso:
+    python benchmark_stock_reservations.py [--citas 2000] [--hilos 8] [--insumos 4] [--lote 50]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Configurar encoding
+if sys.platform == 'win32':
+    import codecs
+    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+sys.path.append(os.path.join(BACKEND_DIR, 'inventario_service'))
+
+from models import ProductModel, StockReservationModel
+from stock_reservations import COMMITTED, InsufficientStockError, normalize_request
+
+from common.database import db
+
+
+def crear_catalogo(insumos, stock):
+    prefijo = f"BENCH-{uuid.uuid4().hex[:8]}"
+    with db.get_cursor(commit=True) as cursor:
+        productos = []
+        for indice in range(insumos):
+            cursor.execute("""
+                INSERT INTO products (sku, name, cost_price, sale_price, stock_quantity)
+                VALUES (%s, %s, 1, 2, %s) RETURNING product_id
+            """, (f"{prefijo}-{indice}", prefijo, stock))
+            productos.append(cursor.fetchone()['product_id'])
+
+        cursor.execute("INSERT INTO treatments (name, base_price) VALUES (%s, 10) RETURNING treatment_id", (prefijo,))
+        treatment_id = cursor.fetchone()['treatment_id']
+        cursor.executemany("""
+            INSERT INTO treatment_recipes (treatment_id, product_id, quantity_needed) VALUES (%s, %s, 1)
+        """, [(treatment_id, product_id) for product_id in productos])
+    return productos, treatment_id
+
+
+def borrar_catalogo(productos, treatment_id):
+    with db.get_cursor(commit=True) as cursor:
+        cursor.execute("""
+            DELETE FROM stock_reservations WHERE reservation_id IN (
+                SELECT reservation_id FROM stock_reservation_items WHERE product_id = ANY(%s))
+        """, (productos,))
+        cursor.execute("DELETE FROM treatments WHERE treatment_id = %s", (treatment_id,))
+        cursor.execute("DELETE FROM products WHERE product_id = ANY(%s)", (productos,))
+
+
+def medir(nombre, trabajos, hilos, funcion, citas_por_trabajo=1):
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as executor:
+        resultados = list(executor.map(funcion, trabajos))
+    duracion = time.perf_counter() - inicio
+    citas = len(trabajos) * citas_por_trabajo
+    print(f"{nombre:<40} {duracion:>8.3f}s {citas / duracion:>10,.0f} citas/s")
+    return {'segundos': round(duracion, 3), 'citas_por_segundo': round(citas / duracion)}, resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de reservas de stock')
+    parser.add_argument('--citas', type=int, default=2000, help='Citas por escenario (default: 2000)')
+    parser.add_argument('--hilos', type=int, default=8, help='Hilos concurrentes (default: 8)')
+    parser.add_argument('--insumos', type=int, default=4, help='Insumos por receta (default: 4)')
+    parser.add_argument('--lote', type=int, default=50, help='Citas por llamada en lote (default: 50)')
+    args = parser.parse_args()
+
+    productos, treatment_id = crear_catalogo(args.insumos, args.citas * 3)
+    solicitud = normalize_request({'treatments': [{'treatment_id': treatment_id}]})
+    citas = list(range(args.citas))
+    metricas = {}
+
+    print("=" * 70)
+    print(f"BENCHMARK RESERVAS DE STOCK ({args.citas} citas, {args.insumos} insumos, {args.hilos} hilos)")
+    print("=" * 70)
+
+    try:
+        def por_insumo(_):
+            for product_id in productos:
+                ProductModel.update_stock(product_id, -1)
+
+        metricas['update_stock_por_insumo'], _ = medir('update_stock por insumo (anterior)', citas, args.hilos, por_insumo)
+
+        def por_receta(_):
+            try:
+                return StockReservationModel.reserve_many([solicitud], atomic=True)[0]['reservation_id']
+            except InsufficientStockError:
+                return None
+
+        metricas['reserva_por_receta'], ids = medir('Reserva de receta (FOR UPDATE)', citas, args.hilos, por_receta)
+
+        def confirmar(lote):
+            StockReservationModel.finish_many(COMMITTED, reservation_ids=lote)
+
+        lotes_ids = [ids[i:i + args.lote] for i in range(0, len(ids), args.lote)]
+        metricas['confirmar_en_lote'], _ = medir(
+            f'Confirmar reservas (lotes de {args.lote})', lotes_ids, args.hilos, confirmar, args.lote
+        )
+
+        lotes = [[solicitud] * args.lote for _ in range(args.citas // args.lote)]
+        metricas['reserva_en_lote'], _ = medir(
+            f'Reserva en lote ({args.lote} por llamada)', lotes, args.hilos,
+            StockReservationModel.reserve_many, args.lote
+        )
+
+        with db.get_cursor() as cursor:
+            cursor.execute("""
+                SELECT MIN(stock_quantity) as stock, MIN(reserved_quantity) as reservado
+                FROM products WHERE product_id = ANY(%s)
+            """, (productos,))
+            final = cursor.fetchone()
+        metricas['stock_final'] = {'stock': final['stock'], 'reservado': final['reservado']}
+    finally:
+        borrar_catalogo(productos, treatment_id)
+
+    print("-" * 70)
+    print(json.dumps(metricas, indent=2, ensure_ascii=False))
+    print("=" * 70)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Benchmark de disponibilidad de tratamientos (Inventario Service)
+Compara el calculo anterior (join treatment_recipes x products por tratamiento, costo y
+stock por separado) contra la lectura de treatment_availability para todo el catalogo,
+y mide el costo que agregan los triggers a las escrituras de stock
+
+Crea productos y tratamientos temporales en DATABASE_URL y los borra al final.
+Requiere add_stock_reservations.sql y add_treatment_availability.sql.
+
+Uso:
+    python benchmark_treatment_availability.py [--tratamientos 300] [--insumos 6] [--productos 500]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+# Configurar encoding
+if sys.platform == 'win32':
+    import codecs
+    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+sys.path.append(os.path.join(BACKEND_DIR, 'inventario_service'))
+
+from models import TreatmentRecipeModel
+
+from common.database import db
+
+
+def costo_con_join(treatment_id):
+    """calculate_treatment_cost anterior"""
+    with db.get_cursor() as cursor:
+        cursor.execute("""
+            SELECT SUM(tr.quantity_needed * p.cost_price) as total_cost
+            FROM treatment_recipes tr
+            JOIN products p ON tr.product_id = p.product_id
+            WHERE tr.treatment_id = %s
+        """, (treatment_id,))
+        return cursor.fetchone()
+
+
+def crear_catalogo(tratamientos, insumos, productos):
+    prefijo = f"BENCH-{uuid.uuid4().hex[:8]}"
+    aleatorio = random.Random(7)
+    with db.get_cursor(commit=True) as cursor:
+        cursor.execute("""
+            INSERT INTO products (sku, name, cost_price, sale_price, stock_quantity)
+            SELECT %s || '-' || n, %s, 1 + n %% 10, 20, 1000 FROM generate_series(1, %s) n
+            RETURNING product_id
+        """, (prefijo, prefijo, productos))
+        producto_ids = [fila['product_id'] for fila in cursor.fetchall()]
+
+        cursor.execute("""
+            INSERT INTO treatments (name, base_price)
+            SELECT %s, 50 FROM generate_series(1, %s)
+            RETURNING treatment_id
+        """, (prefijo, tratamientos))
+        tratamiento_ids = [fila['treatment_id'] for fila in cursor.fetchall()]
+
+        cursor.executemany("""
+            INSERT INTO treatment_recipes (treatment_id, product_id, quantity_needed) VALUES (%s, %s, %s)
+        """, [
+            (treatment_id, product_id, aleatorio.randint(1, 5))
+            for treatment_id in tratamiento_ids
+            for product_id in aleatorio.sample(producto_ids, insumos)
+        ])
+    return producto_ids, tratamiento_ids
+
+
+def borrar_catalogo(producto_ids, tratamiento_ids):
+    with db.get_cursor(commit=True) as cursor:
+        cursor.execute("DELETE FROM treatments WHERE treatment_id = ANY(%s)", (tratamiento_ids,))
+        cursor.execute("DELETE FROM products WHERE product_id = ANY(%s)", (producto_ids,))
+
+
+def medir(nombre, funcion, operaciones, unidad):
+    inicio = time.perf_counter()
+    funcion()
+    duracion = time.perf_counter() - inicio
+    print(f"{nombre:<46} {duracion:>8.3f}s {operaciones / duracion:>10,.0f} {unidad}/s")
+    return {'segundos': round(duracion, 4), f'{unidad}_por_segundo': round(operaciones / duracion)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de disponibilidad de tratamientos')
+    parser.add_argument('--tratamientos', type=int, default=300, help='Tratamientos (default: 300)')
+    parser.add_argument('--insumos', type=int, default=6, help='Insumos por receta (default: 6)')
+    parser.add_argument('--productos', type=int, default=500, help='Productos (default: 500)')
+    args = parser.parse_args()
+
+    producto_ids, tratamiento_ids = crear_catalogo(args.tratamientos, args.insumos, args.productos)
+    metricas = {}
+
+    print("=" * 76)
+    print(f"BENCHMARK DISPONIBILIDAD ({args.tratamientos} tratamientos, {args.insumos} insumos c/u)")
+    print("=" * 76)
+
+    try:
+        def catalogo_con_join():
+            for treatment_id in tratamiento_ids:
+                costo_con_join(treatment_id)
+                TreatmentRecipeModel.check_stock_availability(treatment_id)
+
+        metricas['catalogo_join_por_tratamiento'] = medir(
+            'Catalogo: join por tratamiento (anterior)', catalogo_con_join, len(tratamiento_ids), 'tratamientos'
+        )
+        metricas['catalogo_una_lectura'] = medir(
+            'Catalogo: treatment_availability (1 lectura)',
+            lambda: TreatmentRecipeModel.get_availability(tratamiento_ids, quantity=3),
+            len(tratamiento_ids), 'tratamientos'
+        )
+
+        # Costo de los triggers: mismas escrituras en una transaccion que se descarta
+        muestra = producto_ids[:200]
+        for nombre, con_trigger in (('UPDATE de stock con trigger', True), ('UPDATE de stock sin trigger', False)):
+            with db.get_cursor() as cursor:
+                if not con_trigger:
+                    cursor.execute("ALTER TABLE products DISABLE TRIGGER trigger_products_treatment_availability")
+
+                def escrituras():
+                    for product_id in muestra:
+                        cursor.execute("""
+                            UPDATE products SET stock_quantity = stock_quantity - 1 WHERE product_id = %s
+                        """, (product_id,))
+
+                clave = 'update_con_trigger' if con_trigger else 'update_sin_trigger'
+                metricas[clave] = medir(nombre, escrituras, len(muestra), 'escrituras')
+                cursor.connection.rollback()
+
+        print(f"{'Tratamientos por producto (promedio)':<46} {args.tratamientos * args.insumos / args.productos:>8.1f}")
+    finally:
+        borrar_catalogo(producto_ids, tratamiento_ids)
+
+    print("-" * 76)
+    print(json.dumps(metricas, indent=2, ensure_ascii=False))
+    print("=" * 76)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+Migrar XMLs planos del storage al almacen direccionado por contenido (blobs comprimidos + indice)
+
+Uso:
+    python migrate_xml_storage.py [ruta_storage]
+"""
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'facturacion_service'))
+
+from xml_storage import XMLStorageManager
+
+
+def main():
+    base_path = sys.argv[1] if len(sys.argv) > 1 else None
+    storage = XMLStorageManager(base_path)
+
+    print("=" * 60)
+    print(f"MIGRACION DE XML ({storage.base_path}, codec {storage.codec})")
+    print("=" * 60)
+
+    stats = storage.migrate_legacy()
+    antes = stats['bytes_before'] / (1024 * 1024)
+    despues = stats['bytes_after'] / (1024 * 1024)
+
+    print(f"Archivos migrados: {stats['migrated']}")
+    print(f"Tamaño anterior:   {antes:.2f} MB")
+    print(f"Tamaño en blobs:   {despues:.2f} MB")
+    if stats['bytes_before']:
+        print(f"Ahorro:            {100 * (1 - stats['bytes_after'] / stats['bytes_before']):.1f}%")
+    print("-" * 60)
+    print(storage.get_storage_stats())
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
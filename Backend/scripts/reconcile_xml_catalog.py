@@ -0,0 +1,39 @@
+"""
+Reconstruir el catalogo de metadatos del storage de XML desde el disco
+
+Uso:
+    python reconcile_xml_catalog.py [ruta_storage]
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'facturacion_service'))
+
+from xml_storage import XMLStorageManager
+
+
+def main():
+    base_path = sys.argv[1] if len(sys.argv) > 1 else None
+    storage = XMLStorageManager(base_path)
+
+    print("=" * 60)
+    print(f"RECONCILIAR CATALOGO ({storage.catalog.db_path})")
+    print("=" * 60)
+
+    start = time.perf_counter()
+    result = storage.reconcile()
+    elapsed = time.perf_counter() - start
+
+    print(f"Entradas indexadas: {result['entries']}")
+    print(f"Blobs indexados:    {result['blobs']}")
+    print(f"Agregadas:          {result['added']}")
+    print(f"Eliminadas:         {result['removed']}")
+    print(f"Tiempo:             {elapsed:.2f}s")
+    print("-" * 60)
+    print(storage.get_storage_stats())
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
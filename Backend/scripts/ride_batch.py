@@ -0,0 +1,87 @@
+"""
+Generacion de RIDE (PDF) en lote para las facturas autorizadas de un mes
+
+Uso:
+    python ride_batch.py <anio> <mes> [--procesos N] [--forzar]
+
+Ejemplo:
+    python ride_batch.py 2025 12 --procesos 8
+"""
+import argparse
+import json
+import os
+import sys
+
+# Configurar encoding
+if sys.platform == 'win32':
+    import codecs
+    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'facturacion_service'))
+
+from ride_renderer import RIDERenderer
+from sri_production import extraer_clave_acceso
+from xml_storage import XMLStorageManager
+
+
+def imprimir_progreso(metricas):
+    print(
+        f"\r{metricas['procesados']}/{metricas['total']} "
+        f"({metricas['paginas_por_segundo']} paginas/s, {metricas['en_cache']} en cache, "
+        f"{metricas['errores']} errores)",
+        end='',
+        flush=True
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RIDE en lote para un mes')
+    parser.add_argument('anio', type=int)
+    parser.add_argument('mes', type=int)
+    parser.add_argument('--procesos', type=int, help='Procesos de renderizado (default: RIDE_PROCESSES o CPUs)')
+    parser.add_argument('--forzar', action='store_true', help='Regenerar RIDE ya existentes')
+    parser.add_argument('--storage', help='Ruta del storage (default: backend/storage)')
+    args = parser.parse_args()
+
+    storage = XMLStorageManager(args.storage)
+    renderer = RIDERenderer(storage, processes=args.procesos)
+
+    jobs = []
+    for path in storage.list_xmls(args.anio, args.mes, 'AUTORIZADO'):
+        xml = storage.read_stored_file(path)
+        invoice_number = os.path.basename(path).split('_')[0]
+        autorizado = next(
+            (row for row in storage.catalog.find(invoice_number) if row['status_dir'] == 'autorizados'), {}
+        )
+        jobs.append({
+            'invoice_number': invoice_number,
+            'xml': xml,
+            # Modalidad offline: el numero de autorizacion es la clave de acceso
+            'autorizacion': {'numero_autorizacion': extraer_clave_acceso(xml),
+                             'fecha_autorizacion': autorizado.get('saved_at')}
+        })
+
+    print("=" * 60)
+    print(f"RIDE EN LOTE - {args.anio}/{args.mes:02d} ({renderer.processes} procesos)")
+    print("=" * 60)
+
+    if not jobs:
+        print("❌ No hay facturas autorizadas en el periodo")
+        return 1
+
+    try:
+        lote = renderer.render_many(jobs, force=args.forzar, progress_callback=imprimir_progreso)
+    finally:
+        renderer.close()
+
+    print()
+    print("-" * 60)
+    print(json.dumps(lote['metricas'], indent=2, ensure_ascii=False))
+    print("=" * 60)
+
+    return 1 if lote['metricas']['errores'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+Envio y consulta de autorizacion en lote al SRI (cierres de mes)
+
+Uso:
+    python sri_batch.py enviar <archivos.xml o directorios...> [opciones]
+    python sri_batch.py autorizar <claves... o archivo.txt> [opciones]
+
+Ejemplos:
+    python sri_batch.py enviar ../storage/xml/2025/12/facturas --workers 16
+    python sri_batch.py autorizar claves_pendientes.txt --intentos 10 --intervalo 5
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+# Configurar encoding
+if sys.platform == 'win32':
+    import codecs
+    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'facturacion_service'))
+
+from sri_production import SRISOAPClient
+from xml_storage import ENTRY_SUFFIX, XMLStorageManager
+
+
+def leer_comprobantes(rutas):
+    """Leer XMLs desde archivos o directorios (recursivo), incluidas entradas .ref del storage"""
+    archivos = []
+    for ruta in rutas:
+        path = Path(ruta)
+        if path.is_dir():
+            archivos.extend(sorted(
+                archivo for archivo in path.rglob('*')
+                if archivo.suffix in ('.xml', ENTRY_SUFFIX)
+            ))
+        elif path.is_file():
+            archivos.append(path)
+        else:
+            print(f"⚠️  No encontrado: {ruta}")
+
+    storage = None
+    comprobantes = []
+    for archivo in archivos:
+        if archivo.suffix == ENTRY_SUFFIX:
+            # Entrada de indice: el contenido vive en storage/objects
+            if storage is None:
+                base = next(p for p in archivo.resolve().parents if (p / 'objects').is_dir())
+                storage = XMLStorageManager(base)
+            comprobantes.append(storage.read_stored_file(archivo))
+        else:
+            comprobantes.append(archivo.read_text(encoding='utf-8'))
+
+    return archivos, comprobantes
+
+
+def leer_claves(valores):
+    """Aceptar claves de acceso directas o archivos con una clave por linea"""
+    claves = []
+    for valor in valores:
+        path = Path(valor)
+        if path.is_file():
+            claves.extend(line.strip() for line in path.read_text(encoding='utf-8').splitlines() if line.strip())
+        else:
+            claves.append(valor.strip())
+    return claves
+
+
+def imprimir_progreso(metricas):
+    """Callback de progreso: una linea por actualizacion"""
+    print(
+        f"\r[{metricas['operacion']}] {metricas['procesados']}/{metricas['total']} "
+        f"({metricas['por_segundo']}/s) {metricas['por_estado']}",
+        end='',
+        flush=True
+    )
+
+
+def imprimir_resumen(titulo, lote):
+    print()
+    print("-" * 60)
+    print(titulo)
+    print(json.dumps(lote['metricas'], indent=2, ensure_ascii=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Envio y autorizacion en lote al SRI')
+    parser.add_argument('accion', choices=['enviar', 'autorizar'])
+    parser.add_argument('entradas', nargs='+', help='XMLs/directorios (enviar) o claves/archivo (autorizar)')
+    parser.add_argument('--ambiente', default=os.getenv('SRI_AMBIENTE', '1'), help='1=Pruebas, 2=Produccion')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('SRI_BATCH_WORKERS', 8)), help='Llamadas concurrentes')
+    parser.add_argument('--intentos', type=int, default=5, help='Rondas maximas de consulta de autorizacion')
+    parser.add_argument('--intervalo', type=float, default=3.0, help='Segundos entre rondas de consulta')
+    parser.add_argument('--solo-envio', action='store_true', help='No consultar autorizacion tras enviar')
+    parser.add_argument('--recepcion-url', help='WSDL de recepcion alternativo (stand-in local)')
+    parser.add_argument('--autorizacion-url', help='WSDL de autorizacion alternativo (stand-in local)')
+    parser.add_argument('--salida', help='Guardar resultados completos en un archivo JSON')
+    args = parser.parse_args()
+
+    client = SRISOAPClient(
+        ambiente=args.ambiente,
+        url_recepcion=args.recepcion_url,
+        url_autorizacion=args.autorizacion_url,
+        max_workers=args.workers
+    )
+
+    print("=" * 60)
+    print(f"SRI LOTE - {args.accion.upper()} (ambiente {args.ambiente}, {args.workers} workers)")
+    print("=" * 60)
+
+    resultado = {}
+
+    if args.accion == 'enviar':
+        archivos, comprobantes = leer_comprobantes(args.entradas)
+        if not comprobantes:
+            print("❌ No hay comprobantes para enviar")
+            return 1
+
+        print(f"Comprobantes: {len(comprobantes)}")
+
+        if args.solo_envio:
+            resultado['recepcion'] = client.enviar_comprobantes_lote(
+                comprobantes, progress_callback=imprimir_progreso
+            )
+        else:
+            resultado = client.procesar_lote(
+                comprobantes,
+                max_intentos=args.intentos,
+                intervalo=args.intervalo,
+                progress_callback=imprimir_progreso
+            )
+
+        for archivo, res in zip(archivos, resultado['recepcion']['resultados'], strict=False):
+            res['archivo'] = str(archivo)
+    else:
+        claves = leer_claves(args.entradas)
+        if not claves:
+            print("❌ No hay claves de acceso para consultar")
+            return 1
+
+        print(f"Claves de acceso: {len(claves)}")
+        resultado['autorizacion'] = client.consultar_autorizaciones_lote(
+            claves,
+            max_intentos=args.intentos,
+            intervalo=args.intervalo,
+            progress_callback=imprimir_progreso
+        )
+
+    if 'recepcion' in resultado:
+        imprimir_resumen("RECEPCION", resultado['recepcion'])
+    if 'autorizacion' in resultado:
+        imprimir_resumen("AUTORIZACION", resultado['autorizacion'])
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False, default=str)
+        print(f"✅ Resultados guardados en {args.salida}")
+
+    print("=" * 60)
+
+    errores = sum(
+        lote['metricas']['por_estado'].get('ERROR', 0)
+        for lote in resultado.values()
+    )
+    return 1 if errores else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Validacion en lote de las claves de acceso guardadas en invoices.clave_acceso
+(o en un archivo con una clave por linea)
+
+Ademas del formato y el digito verificador, compara la fecha y el numero de la
+clave con issue_date e invoice_number de la factura.
+
+Uso:
+    python validate_access_keys.py [--lote 5000] [--csv invalidas.csv]
+    python validate_access_keys.py --archivo claves.txt
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+# Configurar encoding
+if sys.platform == 'win32':
+    import codecs
+    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+sys.path.append(os.path.join(BACKEND_DIR, 'facturacion_service'))
+
+from access_keys import validate_access_keys
+
+
+def comparar_con_factura(fila):
+    """Motivo si la clave no corresponde a la fecha/numero de la factura, o None"""
+    clave = fila['clave_acceso']
+    issue_date = fila.get('issue_date')
+    if issue_date and clave[:8] != issue_date.strftime('%d%m%Y'):
+        return 'fecha_no_coincide'
+
+    invoice_number = fila.get('invoice_number') or ''
+    partes = invoice_number.split('-')
+    if len(partes) == 3 and clave[24:39] != f"{partes[0]}{partes[1]}{int(partes[2]):09d}":
+        return 'numero_no_coincide'
+
+    return None
+
+
+def validar_lote(filas):
+    """Valida un lote de filas {clave_acceso, ...}; devuelve las invalidas con su motivo"""
+    motivos = validate_access_keys([fila['clave_acceso'] for fila in filas])
+    invalidas = []
+    for fila, motivo in zip(filas, motivos, strict=False):
+        motivo = motivo or (comparar_con_factura(fila) if 'invoice_number' in fila else None)
+        if motivo:
+            invalidas.append(dict(fila, motivo=motivo))
+    return invalidas
+
+
+def lotes_base_datos(tamano):
+    from electronic_invoice_models import ElectronicInvoiceModel
+
+    ultimo_id = 0
+    while True:
+        filas = ElectronicInvoiceModel.get_access_keys_page(ultimo_id, tamano)
+        if not filas:
+            return
+        yield filas
+        ultimo_id = filas[-1]['invoice_id']
+
+
+def lotes_archivo(ruta, tamano):
+    with open(ruta, encoding='utf-8') as f:
+        lote = []
+        for linea in f:
+            if linea.strip():
+                lote.append({'clave_acceso': linea.strip()})
+            if len(lote) == tamano:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Validar claves de acceso en lote')
+    parser.add_argument('--archivo', help='Archivo con una clave por linea (default: tabla invoices)')
+    parser.add_argument('--lote', type=int, default=5000, help='Claves por lote (default: 5000)')
+    parser.add_argument('--csv', help='Guardar las claves invalidas en un CSV')
+    args = parser.parse_args()
+
+    lotes = lotes_archivo(args.archivo, args.lote) if args.archivo else lotes_base_datos(args.lote)
+
+    print("=" * 60)
+    print(f"VALIDACION DE CLAVES DE ACCESO - {args.archivo or 'invoices.clave_acceso'}")
+    print("=" * 60)
+
+    total = 0
+    invalidas = []
+    inicio = time.perf_counter()
+    for lote in lotes:
+        total += len(lote)
+        invalidas.extend(validar_lote(lote))
+        print(f"\r{total} claves, {len(invalidas)} invalidas", end='', flush=True)
+    duracion = time.perf_counter() - inicio
+
+    print()
+    print("-" * 60)
+    print(json.dumps({
+        'total': total,
+        'validas': total - len(invalidas),
+        'invalidas': len(invalidas),
+        'por_motivo': dict(Counter(fila['motivo'] for fila in invalidas)),
+        'duracion_segundos': round(duracion, 3),
+        'claves_por_segundo': round(total / duracion) if duracion > 0 else 0
+    }, indent=2, ensure_ascii=False))
+
+    if args.csv and invalidas:
+        columnas = list(invalidas[0].keys())
+        with open(args.csv, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=columnas)
+            writer.writeheader()
+            writer.writerows(invalidas)
+        print(f"📄 Invalidas guardadas en {args.csv}")
+
+    print("=" * 60)
+    return 1 if invalidas else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -288,33 +288,31 @@ def check_xml_storage(invoice_number):
     year = str(today.year)
     month = f"{today.month:02d}"
 
-    # Check for pending XML
-    pending_path = storage_dir / year / month / 'facturas' / f"{invoice_number}.xml"
+    # Check for pending XML (index entries; content lives in storage/objects)
+    pending_path = storage_dir / year / month / 'facturas' / f"{invoice_number}.ref"
     # Check for authorized XML
-    authorized_path = storage_dir / year / month / 'autorizados' / f"{invoice_number}_AUTORIZADO.xml"
+    authorized_path = storage_dir / year / month / 'autorizados' / f"{invoice_number}_AUTORIZADO.ref"
     # Check for backup
     backup_dir = backend_dir / 'storage' / 'backup'
 
-    if pending_path.exists():
-        print_success(f"XML encontrado en: {pending_path}")
-        size = pending_path.stat().st_size
-        print_info(f"Tamaño: {size} bytes")
-
-    if authorized_path.exists():
-        print_success(f"XML autorizado encontrado en: {authorized_path}")
-        size = authorized_path.stat().st_size
-        print_info(f"Tamaño: {size} bytes")
+    for label, path in (("XML", pending_path), ("XML autorizado", authorized_path)):
+        if path.exists():
+            entry = json.loads(path.read_text(encoding='utf-8'))
+            print_success(f"{label} encontrado en: {path}")
+            print_info(f"Tamaño: {entry['size']} bytes ({entry['stored_size']} comprimido, {entry['codec']})")
+            print_info(f"SHA-256: {entry['checksum']}")
 
     # Check backups
-    backups = list(backup_dir.glob(f"{invoice_number}_*.xml"))
+    backups = list(backup_dir.glob(f"{invoice_number}_*.ref"))
     if backups:
         print_success(f"Backups encontrados: {len(backups)}")
         for backup in backups:
             print_info(f"  - {backup.name}")
 
     # Count total XMLs
-    total_xmls = len(list(storage_dir.rglob('*.xml')))
-    print_info(f"\nTotal de XMLs en storage: {total_xmls}")
+    total_xmls = len(list(storage_dir.rglob('*.ref')))
+    total_blobs = len([p for p in (backend_dir / 'storage' / 'objects').rglob('*') if p.is_file()])
+    print_info(f"\nTotal de XMLs en storage: {total_xmls} ({total_blobs} blobs)")
 
 def main():
     """Run complete test"""